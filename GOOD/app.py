@@ -1,12 +1,29 @@
-from flask import Flask, render_template, request, jsonify, make_response
+from flask import Flask, render_template, request, jsonify, make_response, Response, stream_with_context, g, send_file
 import os
 import json
-import logging
 import datetime
+import io
+import time
 from collections import OrderedDict
-from document_generator import DocumentGenerator
 from risk_assessment import RiskAssessmentService
-from document_generator.pdf_generator import PDFGenerator
+from document_generator.config_manager import ConfigManager
+from document_generator.client_rules import DEFAULT_RULES_DIR
+from document_generator.render_service import RenderServiceClient
+from document_generator.pdf_cache import PDFCache, make_cache_key
+from document_generator.pdf_jobs import PDFJobStore, PDFJobWorker
+from document_generator.utils import validate_pdf_form
+from document_generator.form import ApplicationForm
+from document_generator.bulk import BulkRenderer, BulkJobStore, BulkInputError, detect_format
+from document_generator.batch import BatchGenerator, iter_batch_forms
+from document_generator.incremental import IncrementalStore, TracedResult, apply_changes, diff_sections
+from document_generator.rule_trace import rule_tracer
+from document_generator.metrics import metrics, configure_from_env
+from document_generator.log_pipeline import setup_logging
+from document_generator.request_trace import request_tracer, span, RequestIdFilter
+from document_generator.assets import AssetPipeline, DEFAULT_BUILD_DIR, accepted_encoding
+import hmac
+import tempfile
+import threading
 import urllib.parse
 
 app = Flask(__name__)
@@ -15,92 +32,278 @@ app = Flask(__name__)
 app.config['ENV'] = 'production'
 app.config['DEBUG'] = False
 
-# 配置日志
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('app_log.txt')
-    ]
-)
+# 配置日志：请求线程只把日志放入队列，后台线程写入按大小或时间轮转的JSON日志文件
+# LOG_PROFILE=production 时只记录INFO以上，请求明细按类别抽样
+log_pipeline = setup_logging()
 logger = app.logger
 
-# 加载配置文件
-def load_config():
-    """加载材料配置文件"""
-    config_path = os.path.join(app.static_folder, 'js', 'document_config.json')
+# 请求追踪：每个请求带请求ID（日志中的request_id字段），各步骤的耗时通过Server-Timing响应头返回
+# 超过TRACE_SLOW_MS毫秒的请求连同完整的区段树写入日志，最近TRACE_SLOW_RECENT个可通过/admin/slow_requests查看
+request_tracer.configure(
+    os.environ.get('REQUEST_TRACE', '1') != '0',
+    slow_ms=float(os.environ.get('TRACE_SLOW_MS', '1000')),
+    recent_size=int(os.environ.get('TRACE_SLOW_RECENT', '20'))
+)
+log_pipeline.handler.addFilter(RequestIdFilter())
+
+# 材料配置：文件变化时校验、编译并整体切换到新版本，正在处理的请求在旧版本上完成
+# CONFIG_RELOAD_INTERVAL为检查文件变化的间隔秒数，0表示不热加载
+config_manager = ConfigManager(
+    os.path.join(app.static_folder, 'js', 'document_config.json'),
+    services={'risk_service': RiskAssessmentService},
+    interval=float(os.environ.get('CONFIG_RELOAD_INTERVAL', '2')),
+    rules_dir=os.environ.get('CLIENT_RULES_DIR', DEFAULT_RULES_DIR)
+)
+document_config = config_manager.current().config
+
+# 客户端规则：页面加载一次 /api/rules 后在本地计算单人申请的材料清单，CLIENT_RULES=0 时页面总是请求服务器
+# 导出规则需要遍历决策表，启动时和配置热加载后在后台线程中读取CLIENT_RULES_DIR中共享的规则文件，
+# 没有时由第一个进程导出并写入，其他工作进程等它写完后直接读取；导出完成前的请求不等待
+CLIENT_RULES = os.environ.get('CLIENT_RULES', '1') != '0'
+
+def warm_client_rules(generators):
+    if CLIENT_RULES:
+        threading.Thread(target=generators.client_rules, name='client-rules', daemon=True).start()
+
+warm_client_rules(config_manager.current())
+
+def current_generators():
+    """当前请求使用的配置版本，同一请求中只取一次"""
+    if 'generators' not in g:
+        g.generators = config_manager.current()
+    return g.generators
+
+@app.after_request
+def add_config_version_header(response):
+    """使用了材料配置的响应带上配置版本"""
+    if 'generators' in g:
+        response.headers['X-Config-Version'] = g.generators.version
+    return response
+
+@app.after_request
+def check_client_rules_version(response):
+    """页面提交的规则版本（X-Rules-Version请求头或PDF表单的rulesVersion字段）已过期时，返回当前版本，页面据此重新加载规则"""
+    client_version = request.headers.get('X-Rules-Version') or g.pop('client_rules_version', None)
+    if not client_version or not CLIENT_RULES:
+        return response
+    # 规则还在导出时不检查，不阻塞请求
+    rules = current_generators().client_rules(wait=False)
+    if rules is not None and rules.is_stale(client_version):
+        logger.info("页面规则版本已过期: %s -> %s", client_version, rules.version)
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.inc('good_client_rules_stale_total', route=route)
+        response.headers['X-Rules-Stale'] = '1'
+        response.headers['X-Rules-Version'] = rules.version
+    return response
+
+# 不统计请求数、不追踪的端点：静态文件和/metrics本身
+UNTRACKED_ENDPOINTS = ('static', 'hashed_asset', 'metrics_endpoint')
+
+@app.before_request
+def start_request_timer():
+    """记录请求开始时间，用于统计耗时"""
+    g.request_start = time.perf_counter()
+
+@app.before_request
+def start_request_trace():
+    """开始追踪请求（静态文件和/metrics不追踪）"""
+    if request_tracer.enabled and request.endpoint not in UNTRACKED_ENDPOINTS:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        g.request_trace = request_tracer.begin(route, request.headers.get('X-Request-ID'), method=request.method)
+
+# 管理接口（/admin/...）返回渲染HTML、请求明细等可能包含申请人信息的内容：
+# 只在设置了ADMIN_TOKEN时开启，请求必须带 Authorization: Bearer <ADMIN_TOKEN>
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN') or None
+
+@app.before_request
+def require_admin_token():
+    """未开启管理接口时返回404，令牌不正确时返回401"""
+    if not request.path.startswith('/admin/'):
+        return None
+    if ADMIN_TOKEN is None:
+        return jsonify({
+            "error": "管理接口未开启，请设置环境变量ADMIN_TOKEN"
+        }), 404
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode('utf-8'), ADMIN_TOKEN.encode('utf-8')):
+        logger.warning("管理接口令牌无效: %s %s", request.remote_addr, request.path)
+        response = jsonify({
+            "error": "管理接口令牌无效"
+        })
+        response.status_code = 401
+        response.headers['WWW-Authenticate'] = 'Bearer'
+        return response
+    return None
+
+@app.after_request
+def add_trace_headers(response):
+    """结束追踪，返回请求ID和各步骤耗时"""
+    trace = g.pop('request_trace', None)
+    if trace is not None:
+        request_tracer.end(trace, response.status_code)
+        response.headers['X-Request-ID'] = trace.request_id
+        response.headers['Server-Timing'] = trace.server_timing()
+    return response
+
+@app.teardown_request
+def end_request_trace(error=None):
+    """请求因异常没有经过after_request时也结束追踪"""
+    trace = g.pop('request_trace', None)
+    if trace is not None:
+        request_tracer.end(trace, 500)
+
+@app.after_request
+def record_request_metrics(response):
+    """按路由统计请求数和耗时（静态文件和/metrics本身不统计）"""
+    if request.endpoint in UNTRACKED_ENDPOINTS or 'request_start' not in g:
+        return response
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.inc('good_http_requests_total', route=route, method=request.method, status=response.status_code)
+    metrics.observe('good_http_request_duration_seconds', time.perf_counter() - g.request_start, route=route)
+    return response
+
+# 初始化PDF生成器：配置了渲染服务套接字时委托独立的渲染服务，Web工作进程不加载WeasyPrint
+PDF_RENDER_SOCKET = os.environ.get('PDF_RENDER_SOCKET')
+if PDF_RENDER_SOCKET:
+    pdf_generator = RenderServiceClient(PDF_RENDER_SOCKET)
+    logger.info("PDF生成委托渲染服务: %s", PDF_RENDER_SOCKET)
+else:
+    from document_generator.pdf_generator import PDFGenerator
+    # PDF_DEBUG_CAPTURE=N 时在内存中保留最近N份渲染HTML，设置了ADMIN_TOKEN时可通过/admin/pdf_debug查看
+    pdf_generator = PDFGenerator(document_config, debug_capture_size=int(os.environ.get('PDF_DEBUG_CAPTURE', '0')))
+    # 启动时预热字体和布局；WeasyPrint不可用或没有中文字体时记录错误并停用WeasyPrint，PDF由其他后端生成，其他接口不受影响
+    pdf_generator.warm_up()
+
+# PDF缓存：进程内LRU + 所有工作进程共享的磁盘缓存
+pdf_cache = PDFCache(
+    memory_max_bytes=int(os.environ.get('PDF_CACHE_MEMORY_MB', '64')) * 1024 * 1024,
+    disk_dir=os.environ.get('PDF_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'good_pdf_cache')),
+    disk_max_bytes=int(os.environ.get('PDF_CACHE_DISK_MB', '512')) * 1024 * 1024
+)
+
+# 材料清单响应缓存：按ETag保存已经序列化的JSON响应体（只使用进程内LRU）
+document_list_cache = PDFCache(
+    memory_max_bytes=int(os.environ.get('GENERATE_CACHE_MEMORY_MB', '16')) * 1024 * 1024,
+    disk_dir=None
+)
+
+# 运行指标：各进程的数据定期写入METRICS_DIR，由/metrics合并输出；缓存命中次数在写入时从缓存统计中读取
+configure_from_env()
+
+def cache_counters(cache_name, cache):
+    """把PDFCache自身累计的命中次数作为good_cache_requests_total采集"""
+    def collect():
+        stats = cache.stats()
+        return [('good_cache_requests_total', {'cache': cache_name, 'result': result}, stats[key])
+                for result, key in (('memory_hit', 'memory_hits'), ('disk_hit', 'disk_hits'), ('miss', 'misses'))]
+    return collect
+
+metrics.add_collector(cache_counters('pdf', pdf_cache))
+metrics.add_collector(cache_counters('document_list', document_list_cache))
+
+# 增量生成：结果令牌（与ETag相同）-> 表单或带读取集合的生成结果
+incremental_store = IncrementalStore(int(os.environ.get('INCREMENTAL_MAX_ENTRIES', '2048')))
+
+# 规则追踪：RULE_TRACE=N 时每N次材料清单生成追踪一次，统计可通过/admin/rule_trace查看
+rule_tracer.configure(int(os.environ.get('RULE_TRACE', '0')), int(os.environ.get('RULE_TRACE_RECENT', '20')))
+
+# 静态资源：压缩后按内容哈希命名并预先生成gzip/brotli版本，主页中的引用改写为带哈希的地址
+# 构建结果放在ASSET_BUILD_DIR（多个工作进程共享），源文件变化后启动时重新构建；ASSET_PIPELINE=0 时直接使用原始文件
+asset_pipeline = None
+if os.environ.get('ASSET_PIPELINE', '1') != '0':
     try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        logger.error("配置文件未找到: %s", config_path)
-        return {}
-    except json.JSONDecodeError:
-        logger.error("配置文件格式错误")
-        return {}
-
-# 全局配置对象和服务
-document_config = load_config()
-document_generator = DocumentGenerator(document_config)
-risk_service = RiskAssessmentService(document_config)
-pdf_generator = PDFGenerator(document_config)  # 初始化PDF生成器
+        asset_pipeline = AssetPipeline(app.static_folder, os.path.join(app.root_path, app.template_folder),
+                                       os.environ.get('ASSET_BUILD_DIR', DEFAULT_BUILD_DIR))
+        asset_pipeline.ensure_built()
+    except Exception as e:
+        logger.error("构建静态资源失败，使用原始文件: %s", str(e), exc_info=True)
+        asset_pipeline = None
 
 # 定义材料显示顺序
 section_order = ['基本信息', '基本材料', '学籍/学历证明', '学籍/学历证明及情况说明', '工作证明', '财力证明', '居住证明材料', '家属材料', '其他材料']
 
+def asset_response(asset, cache_control):
+    """返回预先压缩的资源文件，Content-Type为原始文件的类型"""
+    response = send_file(asset.path, mimetype=asset.mimetype, etag=asset.etag, conditional=True)
+    if asset.encoding is not None:
+        response.headers['Content-Encoding'] = asset.encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = cache_control
+    return response
+
 @app.route('/')
 def index():
-    """渲染主页"""
-    return render_template('index.html')
+    """渲染主页（有构建好的主页时直接返回，每次使用前重新验证）"""
+    page = asset_pipeline.index(request.accept_encodings) if asset_pipeline is not None else None
+    if page is None:
+        return render_template('index.html')
+    return asset_response(page, 'no-cache')
+
+@app.route('/assets/<path:filename>')
+def hashed_asset(filename):
+    """带内容哈希的静态资源：内容不会变化，浏览器可以长期缓存"""
+    asset = asset_pipeline.resolve(filename, request.accept_encodings) if asset_pipeline is not None else None
+    if asset is None:
+        return Response(status=404)
+    return asset_response(asset, 'public, max-age=31536000, immutable')
 
 @app.route('/api/generate', methods=['POST'])
 def generate_documents():
     """处理签证材料清单生成请求"""
     
     try:
-        form_data = request.json
-        if not form_data:
+        if not request.json:
             logger.warning("没有提交表单数据")
             return jsonify({
                 "error": "没有提交表单数据"
             }), 400
+        
+        # 解析一次表单，之后各生成器直接读取解析后的字段
+        with span('parse_form'):
+            form_data = ApplicationForm(request.json)
             
         # 检查居住地领区，如果选择了"其他领区"，返回错误
-        residence_consulate = form_data.get('residenceConsulate', '')
-        if residence_consulate == 'other':
+        consulate_error = check_consulate(form_data)
+        if consulate_error:
             logger.warning("用户选择了其他领区")
             return jsonify({
-                "error": "目前暂不支持在其他领区申请日本签证，请选择北京或上海领区。"
+                "error": consulate_error
             }), 400
             
-        # 记录请求数据，用于调试
-        logger.info("收到材料清单生成请求: %s", json.dumps({
-            'residence': form_data.get('residenceConsulate'),
-            'hukou': form_data.get('hukouConsulate'),
-            'applicationType': form_data.get('applicationType'),
-            'visaType': form_data.get('visaType'),
-            'processType': form_data.get('processType')
-        }, ensure_ascii=False))
-        
-        # 如果是家庭申请，记录家庭成员信息
-        if form_data.get('applicationType') == 'FAMILY':
-            family_members = form_data.get('familyMembers', [])
-            logger.info(f"家庭申请，家庭成员数量: {len(family_members)}")
-            for i, member in enumerate(family_members):
-                if isinstance(member, dict):
-                    logger.info(f"家庭成员{i+1}: 居住地={member.get('residenceConsulate')}, 户籍地={member.get('hukouConsulate')}")
+        # 材料清单只取决于规范化表单和配置版本：客户端已有相同结果时返回304，服务端缓存序列化后的响应体
+        etag = result_token(current_generators().version, form_data)
+        incremental_store.put(etag, form_data)
+        if request.if_none_match.contains(etag):
+            logger.debug("材料清单未变化: %s", etag)
+            return conditional_response(Response(status=304), etag)
+        body = document_list_cache.get(etag)
+        if body is not None:
+            logger.debug("材料清单缓存命中: %s", etag)
+            return conditional_response(Response(body, mimetype='application/json'), etag)
             
         # 生成材料清单
-        document_list = document_generator.generate_document_list(form_data)
+        document_list = current_generators().document_generator.generate_document_list(form_data)
         
-        # 记录生成的居住证明材料部分，便于调试
-        if '居住证明材料' in document_list:
-            logger.info("生成的居住证明材料:")
-            for item in document_list['居住证明材料']:
-                logger.info(f"  {item}")
+        # 每个请求记录一条摘要（包含生成的材料部分），用于调试和日志查询
+        summary = request_summary(form_data, document_list)
+        logger.info("收到材料清单生成请求: %s", json.dumps(summary, ensure_ascii=False))
         
-        return jsonify(document_list)
+        # 抽样记录家庭成员和生成的居住证明材料，便于调试
+        if log_pipeline.sample('generate_request'):
+            log_pipeline.dump('generate_request', "材料清单生成明细", {
+                'request': summary,
+                'sections': list(document_list),
+                'family_members': [
+                    {'residenceConsulate': member.residence_consulate, 'hukouConsulate': member.hukou_consulate}
+                    for member in form_data.family_profile.members
+                ] if form_data.application_type == 'FAMILY' else None,
+                'residence_materials': document_list.get('居住证明材料'),
+            })
+        
+        with span('serialize'):
+            response = jsonify(document_list)
+        document_list_cache.put(etag, response.get_data())
+        return conditional_response(response, etag)
         
     except Exception as e:
         app.logger.error("生成材料清单时出错: %s", str(e), exc_info=True)
@@ -108,11 +311,101 @@ def generate_documents():
             "error": f"生成材料清单时出错: {str(e)}"
         }), 500
 
+def result_token(config_version, form_data):
+    """材料清单结果令牌：配置版本 + 规范化表单哈希，同时用作ETag"""
+    return f"{config_version}-{form_data.canonical_hash()[:32]}"
+
+def conditional_response(response, etag):
+    """设置强ETag和结果令牌；浏览器可以保存响应，但每次使用前都要重新验证"""
+    response.set_etag(etag)
+    response.headers['X-Result-Token'] = etag
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def check_consulate(form_data):
+    """材料清单只支持北京和上海领区，选择了其他领区时返回错误信息"""
+    if form_data.residence_consulate == 'other':
+        return "目前暂不支持在其他领区申请日本签证，请选择北京或上海领区。"
+    return None
+
+@app.route('/api/generate/incremental', methods=['POST'])
+def generate_documents_incremental():
+    """
+    根据上一次结果的令牌和修改的字段增量生成材料清单
+    
+    请求体为 {"token": 上一次的X-Result-Token, "changes": {字段: 新值或null}}，
+    只重新执行读取了已修改字段的生成步骤，返回按材料部分计算的差异和新令牌。
+    令牌已过期（配置已更新或不在本进程缓存中）时返回410，页面应重新提交完整表单。
+    """
+    try:
+        payload = request.get_json(silent=True) or {}
+        token = payload.get('token')
+        changes = payload.get('changes')
+        if not isinstance(token, str) or not isinstance(changes, dict):
+            return jsonify({
+                "error": "请求必须包含token和changes"
+            }), 400
+        
+        generators = current_generators()
+        entry = incremental_store.get(token) if token.startswith(generators.version + '-') else None
+        if entry is None:
+            logger.info("增量生成令牌已过期: %s", token)
+            return jsonify({
+                "error": "结果令牌已过期，请重新提交完整表单"
+            }), 410
+        
+        document_generator = generators.document_generator
+        previous = entry if isinstance(entry, TracedResult) else document_generator.generate_traced(entry)
+        form_data = apply_changes(previous.form, changes)
+        consulate_error = check_consulate(form_data)
+        if consulate_error:
+            return jsonify({
+                "error": consulate_error
+            }), 400
+        
+        traced = document_generator.generate_traced(form_data, previous)
+        new_token = result_token(generators.version, form_data)
+        # 保存两次的追踪结果，之后基于任一结果的修改都可以增量生成
+        incremental_store.put(token, previous)
+        incremental_store.put(new_token, traced)
+        logger.debug("增量生成: %s -> %s, 重新执行的步骤: %s", token, new_token, traced.recomputed)
+        
+        response = jsonify({
+            "token": new_token,
+            "diff": diff_sections(previous.document_list, traced.document_list),
+            "recomputed": list(traced.recomputed)
+        })
+        response.headers['X-Result-Token'] = new_token
+        return response
+    except Exception as e:
+        app.logger.error("增量生成材料清单时出错: %s", str(e), exc_info=True)
+        return jsonify({
+            "error": f"增量生成材料清单时出错: {str(e)}"
+        }), 500
+
+@app.route('/api/generate_batch', methods=['POST'])
+def generate_documents_batch():
+    """
+    批量生成材料清单
+    
+    请求体为JSON数组（application/json）或NDJSON（application/x-ndjson），
+    响应为NDJSON，每个表单一行 {"index": 序号, "documents": 材料清单} 或 {"index": 序号, "error": 错误信息}，顺序与输入一致。
+    """
+    # 整个批量使用同一配置版本
+    generators = current_generators()
+    batch = BatchGenerator(generators.document_generator.generate_document_list, validate=check_consulate)
+    items = iter_batch_forms(request.stream, request.content_type)
+    
+    response = Response(stream_with_context(batch.stream(items)), mimetype='application/x-ndjson')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/risk_assessment_guide', methods=['GET'])
 def risk_assessment_guide():
     """获取风险评估指南"""
     try:
-        guide = risk_service.get_risk_assessment_guide()
+        guide = current_generators().services['risk_service'].get_risk_assessment_guide()
         return jsonify(guide)
     except Exception as e:
         logger.exception("获取风险评估指南时发生错误: %s", str(e))
@@ -121,19 +414,43 @@ def risk_assessment_guide():
             'error': f'服务器错误: {str(e)}'
         }), 500
 
-@app.route('/api/generate_pdf', methods=['POST'])
-def generate_pdf():
-    """生成PDF材料清单"""
-    try:
-        form_data = request.json if request.is_json else request.form.to_dict()
-        logger.debug("收到PDF生成请求，原始表单数据: %s", str(form_data))
-        
-        if not form_data:
-            logger.warning("没有提交表单数据")
-            return jsonify({
-                "error": "没有提交表单数据"
-            }), 400
-        
+def request_summary(form_data, document_list):
+    """请求摘要（debug_log_parser.py按这些字段建立索引，每个请求一条）"""
+    return {
+        'residence': form_data.get('residenceConsulate'),
+        'hukou': form_data.get('hukouConsulate'),
+        'applicationType': form_data.get('applicationType'),
+        'visaType': form_data.get('visaType'),
+        'processType': form_data.get('processType'),
+        'identityType': form_data.get('identityType'),
+        'familyIdentities': [member.identity_type for member in form_data.family_profile.members]
+                            if form_data.application_type == 'FAMILY' else [],
+        'sections': list(document_list),
+    }
+
+def prepare_pdf_request():
+    """
+    解析并校验PDF生成请求，生成材料清单
+    
+    Returns:
+        (form_data, document_list, None)，校验失败时返回(None, None, 错误响应)
+    """
+    form_data = request.json if request.is_json else request.form.to_dict()
+    # 是否记录本次请求的明细（原始表单、处理后的表单和材料清单）
+    dump = {} if log_pipeline.sample('pdf_request') else None
+    if dump is not None:
+        dump['raw_form'] = dict(form_data) if form_data else form_data
+    
+    if not form_data:
+        logger.warning("没有提交表单数据")
+        return None, None, (jsonify({
+            "error": "没有提交表单数据"
+        }), 400)
+    
+    # 页面本地计算材料清单时使用的规则版本，只用于检查是否过期，PDF中的材料清单总是由服务器重新生成
+    g.client_rules_version = form_data.pop('rulesVersion', None)
+    
+    with span('parse_form'):
         # 处理从表单传来的JSON字符串数据
         for key in form_data:
             if isinstance(form_data[key], str):
@@ -145,88 +462,169 @@ def generate_pdf():
                     # 如果不是有效的JSON，保持原样
                     pass
         
-        # 特殊处理家庭成员信息
-        if form_data.get('applicationType') == 'FAMILY':
-            family_members = form_data.get('familyMembers', [])
-            logger.debug(f"处理家庭申请: 家庭成员数据类型 {type(family_members)}")
-            
-            # 如果家庭成员是字符串，尝试解析
-            if isinstance(family_members, str):
-                try:
-                    family_members = json.loads(family_members)
-                    form_data['familyMembers'] = family_members
-                    logger.debug(f"成功解析家庭成员字符串: {family_members}")
-                except json.JSONDecodeError:
-                    logger.error(f"无法解析家庭成员字符串: {family_members}")
-            
-            # 记录家庭成员数量和信息
-            logger.debug(f"家庭成员数量: {len(family_members)}")
-            for i, member in enumerate(family_members):
-                logger.debug(f"家庭成员 {i+1}: {member}")
-        
-        # 检查并处理economicMaterial参数
-        economic_material = form_data.get('economicMaterial')
-        if economic_material:
-            logger.debug(f"检测到经济材料选项: {economic_material}")
-        
-        logger.debug("处理后的表单数据: %s", str(form_data))
-            
-        # 检查居住地领区
-        residence_consulate = form_data.get('residenceConsulate', '')
-        if residence_consulate == 'other':
-            logger.warning("用户选择了其他领区")
-            return jsonify({
-                "error": "目前暂不支持在其他领区申请日本签证，请选择北京或上海领区。"
-            }), 400
+        # 解析一次表单，之后校验、材料清单和PDF生成都使用解析后的表单
+        form_data = ApplicationForm(form_data)
+    
+    if dump is not None:
+        dump['form'] = form_data.to_dict()
+        dump['economic_material'] = form_data.economic_material
+    
+    # 检查居住地领区和必要的经济材料字段
+    validation_error = validate_pdf_form(form_data)
+    if validation_error:
+        logger.warning("PDF请求校验失败: %s", validation_error)
+        return None, None, (jsonify({
+            "error": validation_error
+        }), 400)
+    
+    try:
+        # 生成材料清单
+        document_list = current_generators().document_generator.generate_document_list(form_data)
+        logger.info("收到PDF生成请求: %s", json.dumps(request_summary(form_data, document_list), ensure_ascii=False))
         
-        # 检查必要的经济材料字段
-        process_type = form_data.get('processType', '')
-        application_type = form_data.get('applicationType', '')
-        if process_type == 'NORMAL' and application_type not in ['BINDING', 'ECONOMIC'] and not form_data.get('economicMaterial'):
-            logger.warning("PDF请求缺少经济材料类型字段")
+        # 记录生成的材料清单，便于调试
+        if dump is not None:
+            dump['document_list'] = document_list
+            log_pipeline.dump('pdf_request', "PDF生成明细", dump)
+    except Exception as e:
+        logger.error("生成材料清单时出错: %s", str(e), exc_info=True)
+        return None, None, (jsonify({
+            "error": f"生成材料清单时出错: {str(e)}"
+        }), 500)
+    
+    return form_data, document_list, None
+
+def render_pdf(document_list, form_data, config_version=None, cache_key=None):
+    """生成PDF，相同配置版本、材料清单和显示字段的PDF直接从缓存返回"""
+    if cache_key is None:
+        if config_version is None:
+            config_version = config_manager.version
+        cache_key = make_cache_key(document_list, form_data, config_version=config_version)
+    with span('pdf_cache'):
+        pdf_content = pdf_cache.get(cache_key)
+    if pdf_content is None:
+        with metrics.in_flight('good_pdf_renders_in_flight'), span('render_pdf'):
+            pdf_content = pdf_generator.generate_pdf(document_list, form_data)
+        pdf_cache.put(cache_key, pdf_content)
+    else:
+        logger.debug("PDF缓存命中: %s", cache_key)
+    metrics.observe('good_pdf_size_bytes', len(pdf_content))
+    return pdf_content
+
+def pdf_response(pdf_content, etag=None):
+    """构造PDF文件响应，提供etag时允许浏览器保存并通过If-None-Match重新验证"""
+    # 生成文件名
+    current_date = datetime.datetime.now().strftime('%Y%m%d')
+    
+    # 修复文件名编码问题 - 使用URL编码处理中文字符
+    filename = f"visa_document_list_{current_date}.pdf"
+    encoded_filename = urllib.parse.quote(f"日本签证材料清单_{current_date}.pdf")
+    
+    # 返回PDF文件
+    response = make_response(pdf_content)
+    response.headers['Content-Type'] = 'application/pdf'
+    # 使用不同的Content-Disposition格式支持多种浏览器
+    response.headers['Content-Disposition'] = f'inline; filename="{filename}"; filename*=UTF-8\'\'{encoded_filename}'
+    if etag is not None:
+        conditional_response(response, etag)
+    else:
+        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
+        response.headers['Pragma'] = 'no-cache'
+        response.headers['Expires'] = '0'
+    logger.debug("PDF生成成功，文件名: %s", filename)
+    return response
+
+# 异步PDF任务：任务表可以放在多个节点共享的目录中，PDF_JOB_WORKERS=0 时本进程只接收任务不渲染
+pdf_job_store = PDFJobStore(os.environ.get('PDF_JOB_DB', os.path.join(tempfile.gettempdir(), 'good_pdf_jobs.sqlite3')))
+pdf_job_worker = PDFJobWorker(pdf_job_store, render_pdf, threads=int(os.environ.get('PDF_JOB_WORKERS', '2')))
+if pdf_job_worker.threads > 0:
+    pdf_job_worker.start()
+
+# 批量生成：首次使用时才启动进程池，PDF_BULK_WORKERS默认为CPU核数；
+# 任务进度与异步PDF任务共用任务表，ZIP写入BULK_OUTPUT_DIR，任何工作进程都可以查询进度和下载
+bulk_renderer = BulkRenderer(
+    document_config,
+    BulkJobStore(pdf_job_store.db_path,
+                 os.environ.get('BULK_OUTPUT_DIR', os.path.join(tempfile.gettempdir(), 'good_bulk_jobs'))),
+    workers=int(os.environ.get('PDF_BULK_WORKERS', '0')) or None,
+    render_socket=PDF_RENDER_SOCKET
+)
+
+# 新配置生效后批量任务使用新的进程池，并预先导出新的客户端规则
+def on_config_reload(generators):
+    bulk_renderer.update_config(generators.config)
+    warm_client_rules(generators)
+
+config_manager.on_reload = on_config_reload
+config_manager.start()
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus格式的运行指标（合并所有工作进程和渲染进程）"""
+    try:
+        body = metrics.render()
+    except Exception as e:
+        logger.error("生成运行指标时出错: %s", str(e), exc_info=True)
+        return jsonify({
+            "error": f"生成运行指标时出错: {str(e)}"
+        }), 500
+    return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/config_version', methods=['GET'])
+def config_version():
+    """查询当前配置版本和最近一次热加载错误"""
+    return jsonify(config_manager.status())
+
+@app.route('/api/rules', methods=['GET'])
+def client_rules_endpoint():
+    """客户端规则文件（ETag为规则版本，页面每次使用缓存前重新验证）"""
+    if not CLIENT_RULES:
+        return jsonify({
+            "error": "客户端规则不可用"
+        }), 404
+    generators = current_generators()
+    rules = generators.client_rules(wait=False)
+    if rules is None:
+        if generators.document_generator.decision_table is None:
             return jsonify({
-                "error": "使用普通经济材料办理时，请选择一种经济材料类型"
-            }), 400
+                "error": "客户端规则不可用"
+            }), 404
+        # 正在导出，页面暂时由服务器计算材料清单
+        response = jsonify({
+            "error": "客户端规则正在生成，请稍后重试"
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    if request.if_none_match.contains(rules.version):
+        response = Response(status=304)
+    else:
+        encoding = accepted_encoding(rules.variants, request.accept_encodings)
+        response = Response(rules.variants[encoding] if encoding else rules.body, mimetype='application/json')
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(rules.version)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/generate_pdf', methods=['POST'])
+def generate_pdf():
+    """生成PDF材料清单"""
+    try:
+        form_data, document_list, error_response = prepare_pdf_request()
+        if error_response is not None:
+            return error_response
         
-        try:
-            # 生成材料清单
-            document_list = document_generator.generate_document_list(form_data)
-            
-            # 记录生成的材料清单，便于调试
-            logger.debug("为PDF生成的材料清单: %s", document_list)
-            # 详细记录生成的材料清单内容
-            logger.debug("详细材料清单内容:")
-            for section_name, materials in document_list.items():
-                logger.debug("部分: %s", section_name)
-                for item in materials:
-                    logger.debug("  - %s", item)
-        except Exception as e:
-            logger.error("生成材料清单时出错: %s", str(e), exc_info=True)
-            return jsonify({
-                "error": f"生成材料清单时出错: {str(e)}"
-            }), 500
+        # PDF缓存键包含配置版本、材料清单、显示字段和生成日期，直接作为ETag
+        cache_key = make_cache_key(document_list, form_data, config_version=current_generators().version)
+        if request.if_none_match.contains(cache_key):
+            logger.debug("PDF未变化: %s", cache_key)
+            return conditional_response(Response(status=304), cache_key)
         
         try:
-            # 生成PDF
-            pdf_content = pdf_generator.generate_pdf(document_list, form_data)
-            
-            # 生成文件名
-            current_date = datetime.datetime.now().strftime('%Y%m%d')
-            
-            # 修复文件名编码问题 - 使用URL编码处理中文字符
-            filename = f"visa_document_list_{current_date}.pdf"
-            encoded_filename = urllib.parse.quote(f"日本签证材料清单_{current_date}.pdf")
-            
-            # 返回PDF文件
-            response = make_response(pdf_content)
-            response.headers['Content-Type'] = 'application/pdf'
-            # 使用不同的Content-Disposition格式支持多种浏览器
-            response.headers['Content-Disposition'] = f'inline; filename="{filename}"; filename*=UTF-8\'\'{encoded_filename}'
-            response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-            response.headers['Pragma'] = 'no-cache'
-            response.headers['Expires'] = '0'
-            logger.debug("PDF生成成功，文件名: %s", filename)
-            return response
+            pdf_content = render_pdf(document_list, form_data, cache_key=cache_key)
+            return pdf_response(pdf_content, cache_key)
         except Exception as e:
             logger.error("生成PDF文件时出错: %s", str(e), exc_info=True)
             return jsonify({
@@ -237,4 +635,209 @@ def generate_pdf():
         app.logger.error("PDF生成过程中发生未知错误: %s", str(e), exc_info=True)
         return jsonify({
             "error": f"PDF生成过程中发生未知错误: {str(e)}"
-        }), 500
\ No newline at end of file
+        }), 500
+
+@app.route('/api/pdf_jobs', methods=['POST'])
+def create_pdf_job():
+    """创建异步PDF生成任务，立即返回任务ID"""
+    try:
+        form_data, document_list, error_response = prepare_pdf_request()
+        if error_response is not None:
+            return error_response
+        
+        job_id = pdf_job_store.create(document_list, form_data)
+        pdf_job_worker.notify()
+        logger.info("创建PDF任务: %s", job_id)
+        return jsonify({
+            "job_id": job_id,
+            "status": "pending",
+            "status_url": f"/api/pdf_jobs/{job_id}"
+        }), 202
+    except Exception as e:
+        app.logger.error("创建PDF任务时出错: %s", str(e), exc_info=True)
+        return jsonify({
+            "error": f"创建PDF任务时出错: {str(e)}"
+        }), 500
+
+@app.route('/api/pdf_jobs/<job_id>', methods=['GET'])
+def get_pdf_job(job_id):
+    """查询PDF任务状态，任务完成时直接返回PDF文件"""
+    try:
+        job = pdf_job_store.get(job_id, include_pdf=True)
+    except Exception as e:
+        app.logger.error("查询PDF任务时出错: %s", str(e), exc_info=True)
+        return jsonify({
+            "error": f"查询PDF任务时出错: {str(e)}"
+        }), 500
+    
+    if job is None:
+        return jsonify({
+            "error": f"未找到PDF任务: {job_id}"
+        }), 404
+    if job['status'] == 'done':
+        return pdf_response(job['pdf'])
+    if job['status'] == 'failed':
+        return jsonify({
+            "job_id": job_id,
+            "status": job['status'],
+            "error": f"生成PDF文件时出错: {job['error']}"
+        }), 500
+    return jsonify({
+        "job_id": job_id,
+        "status": job['status']
+    }), 202
+
+@app.route('/admin/pdf_debug', methods=['GET'])
+def pdf_debug_captures():
+    """列出调试模式下捕获的最近PDF HTML文档"""
+    try:
+        captures = pdf_generator.get_debug_captures()
+    except Exception as e:
+        logger.error("获取PDF调试捕获时出错: %s", str(e))
+        return jsonify({
+            "error": f"获取PDF调试捕获时出错: {str(e)}"
+        }), 500
+    if captures is None:
+        return jsonify({
+            "error": "PDF调试捕获未开启，请设置环境变量PDF_DEBUG_CAPTURE"
+        }), 404
+    return jsonify([
+        {key: value for key, value in capture.items() if key != 'html'}
+        for capture in captures
+    ])
+
+@app.route('/admin/pdf_debug/<int:capture_id>', methods=['GET'])
+def pdf_debug_capture(capture_id):
+    """查看调试模式下捕获的单份PDF HTML文档"""
+    try:
+        captures = pdf_generator.get_debug_captures() or []
+    except Exception as e:
+        logger.error("获取PDF调试捕获时出错: %s", str(e))
+        return jsonify({
+            "error": f"获取PDF调试捕获时出错: {str(e)}"
+        }), 500
+    for capture in captures:
+        if capture['id'] == capture_id:
+            response = make_response(capture['html'])
+            response.headers['Content-Type'] = 'text/html; charset=utf-8'
+            return response
+    return jsonify({
+        "error": f"未找到调试捕获记录: {capture_id}"
+    }), 404
+
+@app.route('/admin/rule_trace', methods=['GET'])
+def rule_trace_stats():
+    """查看规则追踪统计：各子生成器的耗时直方图、各分支产生的材料行数和最近几次追踪的逐行明细"""
+    if not rule_tracer.sample_every:
+        return jsonify({
+            "error": "规则追踪未开启，请设置环境变量RULE_TRACE"
+        }), 404
+    data = rule_tracer.snapshot(recent=request.args.get('recent') != '0')
+    if request.args.get('reset') == '1':
+        rule_tracer.reset()
+    return jsonify(data)
+
+@app.route('/admin/slow_requests', methods=['GET'])
+def slow_requests():
+    """查看最近的慢请求及其完整的区段树（保存在各工作进程内）"""
+    if not request_tracer.enabled or not request_tracer.slow_ms:
+        return jsonify({
+            "error": "慢请求记录未开启，请设置环境变量REQUEST_TRACE和TRACE_SLOW_MS"
+        }), 404
+    data = {'slow_ms': request_tracer.slow_ms, 'requests': request_tracer.slow_requests()}
+    if request.args.get('reset') == '1':
+        request_tracer.reset()
+    return jsonify(data)
+
+@app.route('/api/pdf_backends', methods=['GET'])
+def pdf_backend_status():
+    """获取PDF渲染后端的健康状态（成功率、耗时、熔断器状态），用于监控"""
+    try:
+        return jsonify(pdf_generator.get_backend_status())
+    except Exception as e:
+        logger.error("获取PDF渲染后端状态时出错: %s", str(e))
+        return jsonify({
+            "error": f"获取PDF渲染后端状态时出错: {str(e)}"
+        }), 500
+
+@app.route('/api/bulk_pdf', methods=['POST'])
+def create_bulk_pdf():
+    """上传CSV/JSONL格式的申请人表单，创建批量生成任务"""
+    try:
+        upload = request.files.get('file')
+        if upload is not None:
+            fmt = detect_format(upload.filename or '')
+            content = upload.read()
+        else:
+            fmt = 'csv' if 'csv' in (request.content_type or '') else 'jsonl'
+            content = request.get_data()
+        if not content:
+            return jsonify({
+                "error": "没有上传申请人表单文件"
+            }), 400
+        
+        job = bulk_renderer.create_job(io.StringIO(content.decode('utf-8-sig'), newline=''), fmt)
+        return jsonify({
+            "job_id": job.id,
+            "total": job.total,
+            "download_url": f"/api/bulk_pdf/{job.id}/download",
+            "progress_url": f"/api/bulk_pdf/{job.id}/progress"
+        }), 201
+    except (BulkInputError, UnicodeDecodeError) as e:
+        logger.warning("批量导入文件无效: %s", str(e))
+        return jsonify({
+            "error": f"批量导入文件无效: {str(e)}"
+        }), 400
+    except Exception as e:
+        app.logger.error("创建批量任务时出错: %s", str(e), exc_info=True)
+        return jsonify({
+            "error": f"创建批量任务时出错: {str(e)}"
+        }), 500
+
+@app.route('/api/bulk_pdf/<job_id>/download', methods=['GET'])
+def download_bulk_pdf(job_id):
+    """下载批量任务的ZIP；任务仍在进行时边生成边返回"""
+    progress = bulk_renderer.progress(job_id)
+    if progress is None:
+        return jsonify({
+            "error": f"未找到批量任务: {job_id}"
+        }), 404
+    if progress['status'] == 'failed':
+        return jsonify({
+            "error": f"批量任务失败: {progress.get('error', '')}"
+        }), 500
+    chunks = bulk_renderer.read_output(job_id)
+    
+    current_date = datetime.datetime.now().strftime('%Y%m%d')
+    response = Response(stream_with_context(chunks), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="visa_document_lists_{current_date}.zip"'
+    response.headers['Cache-Control'] = 'no-cache'
+    # 禁止反向代理缓冲，PDF完成后立即发送给客户端
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/bulk_pdf/<job_id>/progress', methods=['GET'])
+def bulk_pdf_progress(job_id):
+    """通过Server-Sent Events推送批量任务进度"""
+    progress = bulk_renderer.progress(job_id)
+    if progress is None:
+        return jsonify({
+            "error": f"未找到批量任务: {job_id}"
+        }), 404
+    
+    def events(progress):
+        yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+        while progress is not None and progress['status'] in ('pending', 'running'):
+            latest = bulk_renderer.wait_for_change(job_id, progress, timeout=15)
+            if latest == progress:
+                # 保持连接
+                yield ": keep-alive\n\n"
+                continue
+            progress = latest
+            yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+        yield f"event: end\ndata: {json.dumps(progress)}\n\n"
+    
+    response = Response(stream_with_context(events(progress)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+PDF渲染基准测试：对比系统中文字体和子集字体的PDF大小与渲染耗时
+
+用法：
+    python benchmark_pdf.py [--rounds 10]
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+from document_generator.main import DocumentGenerator
+from document_generator.pdf_generator import PDFGenerator
+from document_generator.font_subset import SUBSET_FONT_PATH
+
+logger = logging.getLogger(__name__)
+
+# 基准测试使用的典型表单
+SAMPLE_FORMS = [
+    {
+        'applicationType': 'SINGLE', 'visaType': 'SINGLE', 'identityType': 'EMPLOYED',
+        'residenceConsulate': 'beijing', 'hukouConsulate': 'beijing',
+        'processType': 'NORMAL', 'economicMaterial': 'deposit_single', 'previousVisit': 'false'
+    },
+    {
+        'applicationType': 'SINGLE', 'visaType': 'THREE', 'identityType': 'RETIRED',
+        'residenceConsulate': 'shanghai', 'hukouConsulate': 'other',
+        'processType': 'NORMAL', 'economicMaterial': 'deposit_three', 'previousVisit': 'true'
+    },
+    {
+        'applicationType': 'FAMILY', 'visaType': 'FIVE', 'identityType': 'EMPLOYED',
+        'residenceConsulate': 'beijing', 'hukouConsulate': 'shanghai',
+        'processType': 'TAX', 'orderNumber': 'BENCH-0001', 'isUrgent': 'true',
+        'familyMembers': [
+            {'relation': 'SPOUSE', 'identityType': 'EMPLOYED', 'residenceConsulate': 'beijing', 'hukouConsulate': 'beijing'},
+            {'relation': 'CHILD', 'identityType': 'STUDENT', 'residenceConsulate': 'beijing', 'hukouConsulate': 'beijing'}
+        ]
+    },
+]
+
+
+def load_config():
+    """加载材料配置文件"""
+    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'js', 'document_config.json')
+    with open(config_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def run(pdf_generator, documents, rounds):
+    """渲染所有样例若干轮，返回(每份PDF耗时列表, 平均PDF大小)"""
+    latencies = []
+    sizes = []
+    for _ in range(rounds):
+        for document_list, form_data in documents:
+            start = time.perf_counter()
+            pdf_content = pdf_generator.generate_pdf(document_list, dict(form_data))
+            latencies.append(time.perf_counter() - start)
+            sizes.append(len(pdf_content))
+    return latencies, statistics.mean(sizes)
+
+
+def report(label, latencies, size):
+    """输出一组结果"""
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"{label:<8} 平均大小: {size / 1024:8.1f} KB   "
+          f"平均耗时: {statistics.mean(latencies) * 1000:7.1f} ms   P95: {p95 * 1000:7.1f} ms")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='PDF渲染基准测试')
+    parser.add_argument('--rounds', type=int, default=10, help='每个样例渲染的轮数')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    config = load_config()
+    document_generator = DocumentGenerator(config)
+    documents = [(document_generator.generate_document_list(dict(form)), form) for form in SAMPLE_FORMS]
+
+    if not os.path.exists(SUBSET_FONT_PATH):
+        # 只有系统字体时得不到对比结果
+        print(f"未找到子集字体 {SUBSET_FONT_PATH}，请先运行 python -m document_generator.font_subset", file=sys.stderr)
+        return 1
+    variants = [('系统字体', None), ('子集字体', SUBSET_FONT_PATH)]
+
+    results = []
+    for label, font_path in variants:
+        pdf_generator = PDFGenerator(config, subset_font_path=font_path)
+        # 预热后再计时，排除字体查找等冷启动开销；WeasyPrint不可用时测试结果没有意义
+        if pdf_generator.warm_up() is None:
+            print(f"{label}: WeasyPrint预热失败，停止测试", file=sys.stderr)
+            return 1
+        latencies, size = run(pdf_generator, documents, args.rounds)
+        results.append((label, latencies, size))
+
+    print(f"样例数: {len(documents)}, 轮数: {args.rounds}")
+    for label, latencies, size in results:
+        report(label, latencies, size)
+
+    (_, base_latencies, base_size), (_, subset_latencies, subset_size) = results
+    print(f"大小变化: {(subset_size / base_size - 1) * 100:+.1f}%   "
+          f"耗时变化: {(statistics.mean(subset_latencies) / statistics.mean(base_latencies) - 1) * 100:+.1f}%")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,10 @@
+"""
+日本签证材料清单生成器 - 命令行入口（python -m document_generator）
+"""
+import sys
+
+from document_generator.cli import main
+
+# 进程池使用spawn/forkserver启动方式时子进程会重新导入__main__，只在直接运行时执行命令行
+if __name__ == '__main__':
+    sys.exit(main())
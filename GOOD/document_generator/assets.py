@@ -0,0 +1,542 @@
+"""
+日本签证材料清单生成器 - 静态资源构建模块
+
+把页面使用的CSS、JavaScript和主页模板压缩后按内容哈希命名，预先生成gzip和brotli版本，并写入清单文件：
+- 资源文件名包含内容哈希（如 js/main.3f2a9c1b7d04.js），可以设置长期不变的缓存头；
+- 主页中对资源的引用改写为带哈希的地址，主页本身每次使用前重新验证；
+- 服务时按 Accept-Encoding 选择预先压缩的版本，不在请求中压缩。
+
+压缩只做不改变语义的处理：去掉注释、缩进和多余空白，保留换行（JavaScript依赖换行自动插入分号），
+字符串、模板字符串和正则表达式原样保留。
+
+构建结果按源文件内容判断是否过期，应用启动时只在源文件变化后重新构建；部署时也可以预先构建：
+    python -m document_generator.assets --build-dir /tmp/good_assets
+"""
+from typing import Dict, List, Any, Optional, NamedTuple
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import sys
+import tempfile
+
+from document_generator.utils import write_atomic
+
+try:
+    import brotli
+except ImportError:  # 没有安装brotli时只生成gzip版本
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# 压缩规则变化时修改，使已有的构建结果失效
+PIPELINE_VERSION = '1'
+
+# 构建的资源（相对于static目录）和主页模板（相对于templates目录）
+ASSETS = ('css/style.css', 'js/main.js')
+INDEX_TEMPLATE = 'index.html'
+
+# 带哈希的资源的访问路径
+URL_PREFIX = '/assets/'
+
+# 按优先顺序排列的预压缩格式：编码名称 -> 文件扩展名
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+HASH_LENGTH = 12
+
+DEFAULT_BUILD_DIR = os.path.join(tempfile.gettempdir(), 'good_assets')
+
+# ---------------------------------------------------------------------------
+# 压缩
+# ---------------------------------------------------------------------------
+
+# 出现在这些字符之后的 / 是正则表达式的开始，而不是除号
+_REGEX_PRECEDERS = frozenset('(,=:[!&|?{};+-*%<>~^')
+_REGEX_KEYWORDS = frozenset(('return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void', 'throw',
+                             'case', 'do', 'else', 'yield', 'await'))
+_TRAILING_WORD = re.compile(r'[A-Za-z_$][\w$]*$')
+_JS_WHITESPACE = frozenset(' \t\r\n\f\v\u00a0\ufeff')
+
+
+def _is_word(char: str) -> bool:
+    return char.isalnum() or char in '_$\\' or ord(char) > 127
+
+
+def _needs_space(previous: str, char: str) -> bool:
+    """去掉空白后两个相邻字符会连成一个记号时保留一个空格"""
+    return (_is_word(previous) and _is_word(char)) or (previous in '+-/' and char == previous)
+
+
+def _skip_string(source: str, start: int) -> int:
+    """返回从start处的引号开始的字符串结束后的位置"""
+    quote = source[start]
+    i, n = start + 1, len(source)
+    while i < n:
+        char = source[i]
+        if char == '\\':
+            i += 2
+            continue
+        i += 1
+        if char == quote or char == '\n':
+            break
+    return i
+
+
+def _skip_regex(source: str, start: int) -> int:
+    """返回从start处的 / 开始的正则表达式（含标志）结束后的位置"""
+    i, n = start + 1, len(source)
+    in_class = False
+    while i < n:
+        char = source[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char == '\n':
+            return i
+        i += 1
+        if char == '[':
+            in_class = True
+        elif char == ']':
+            in_class = False
+        elif char == '/' and not in_class:
+            break
+    while i < n and source[i].isalpha():
+        i += 1
+    return i
+
+
+def minify_js(source: str) -> str:
+    """
+    去掉JavaScript中的注释和多余空白
+
+    空白中有换行时保留一个换行，其他空白只在两侧字符会连成一个记号时保留一个空格。
+
+    Args:
+        source: JavaScript源代码
+
+    Returns:
+        压缩后的代码
+    """
+    out: List[str] = []
+    n = len(source)
+    i = 0
+    pending = ''            # 待输出的空白：''、' ' 或 '\n'
+    depth = 0               # 大括号深度
+    templates: List[int] = []   # 模板字符串中每个 ${ 开始时的大括号深度
+    in_template = False
+
+    def last_char() -> str:
+        for piece in reversed(out):
+            if piece not in (' ', '\n'):
+                return piece[-1]
+        return ''
+
+    def flush(char: str) -> None:
+        nonlocal pending
+        if pending and out:
+            if pending == '\n':
+                out.append('\n')
+            elif _needs_space(out[-1][-1], char):
+                out.append(' ')
+        pending = ''
+
+    while i < n:
+        if in_template:
+            # 模板字符串原样保留，直到结束的反引号或 ${
+            j = i
+            while j < n:
+                char = source[j]
+                if char == '\\':
+                    j += 2
+                elif char == '`':
+                    j += 1
+                    in_template = False
+                    break
+                elif char == '$' and source.startswith('${', j):
+                    j += 2
+                    templates.append(depth)
+                    depth += 1
+                    in_template = False
+                    break
+                else:
+                    j += 1
+            out.append(source[i:j])
+            i = j
+            continue
+
+        char = source[i]
+        if char in _JS_WHITESPACE:
+            pending = '\n' if char == '\n' or pending == '\n' else ' '
+            i += 1
+            continue
+        if char == '/' and source.startswith('//', i):
+            end = source.find('\n', i)
+            i = n if end < 0 else end
+            continue
+        if char == '/' and source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            end = n if end < 0 else end + 2
+            pending = '\n' if pending == '\n' or '\n' in source[i:end] else ' '
+            i = end
+            continue
+
+        if char == '/':
+            previous = last_char()
+            is_regex = not previous or previous in _REGEX_PRECEDERS
+            if not is_regex and _is_word(previous):
+                word = _TRAILING_WORD.search(''.join(out[-12:]).rstrip())
+                is_regex = word is not None and word.group(0) in _REGEX_KEYWORDS
+            flush(char)
+            if is_regex:
+                end = _skip_regex(source, i)
+                out.append(source[i:end])
+                i = end
+                continue
+            out.append(char)
+        elif char in '\'"':
+            flush(char)
+            end = _skip_string(source, i)
+            out.append(source[i:end])
+            i = end
+            continue
+        elif char == '`':
+            flush(char)
+            out.append(char)
+            in_template = True
+        elif char == '{':
+            flush(char)
+            depth += 1
+            out.append(char)
+        elif char == '}':
+            flush(char)
+            depth -= 1
+            out.append(char)
+            if templates and depth == templates[-1]:
+                templates.pop()
+                in_template = True
+        else:
+            flush(char)
+            out.append(char)
+        i += 1
+    return ''.join(out)
+
+
+_CSS_TOKENS = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/', re.S)
+
+
+def _minify_css_code(code: str) -> str:
+    code = re.sub(r'\s+', ' ', code)
+    # 冒号前的空格在选择器中有意义（如 "a :hover"），只去掉冒号后的空格
+    code = re.sub(r' ?([{};,>]) ?', r'\1', code)
+    code = re.sub(r': ', ':', code)
+    return code
+
+
+def minify_css(source: str) -> str:
+    """
+    去掉CSS中的注释和多余空白（字符串原样保留）
+
+    Args:
+        source: CSS源代码
+
+    Returns:
+        压缩后的CSS
+    """
+    parts: List[str] = []
+    code: List[str] = []
+    position = 0
+    for match in _CSS_TOKENS.finditer(source):
+        code.append(source[position:match.start()])
+        position = match.end()
+        if match.group(1) is None:
+            # 注释替换为空格
+            code.append(' ')
+            continue
+        parts.append(_minify_css_code(''.join(code)))
+        parts.append(match.group(1))
+        code = []
+    code.append(source[position:])
+    parts.append(_minify_css_code(''.join(code)))
+    return ''.join(parts).replace(';}', '}').strip()
+
+
+_HTML_BLOCKS = re.compile(
+    r'(<script\b[^>]*>)(.*?)(</script\s*>)|(<style\b[^>]*>)(.*?)(</style\s*>)'
+    r'|<pre\b.*?</pre\s*>|<textarea\b.*?</textarea\s*>|<!--(.*?)-->',
+    re.S | re.I)
+_SCRIPT_TYPE = re.compile(r'\btype\s*=\s*["\']?([^"\'\s>]+)', re.I)
+
+
+def _minify_html_text(text: str) -> str:
+    text = re.sub(r'[ \t\r\f\v]*\n\s*', '\n', text)
+    return re.sub(r'[ \t\r\f\v]{2,}', ' ', text)
+
+
+def minify_html(source: str) -> str:
+    """
+    压缩HTML：内联脚本和样式分别压缩，去掉注释，空白合并为一个（有换行时保留换行），<pre>和<textarea>原样保留
+
+    Args:
+        source: HTML源代码
+
+    Returns:
+        压缩后的HTML
+    """
+    parts = []
+    position = 0
+    for match in _HTML_BLOCKS.finditer(source):
+        parts.append(_minify_html_text(source[position:match.start()]))
+        position = match.end()
+        if match.group(1) is not None:
+            script_type = _SCRIPT_TYPE.search(match.group(1))
+            is_js = script_type is None or script_type.group(1).lower() in (
+                'text/javascript', 'application/javascript', 'module')
+            body = minify_js(match.group(2)) if is_js else match.group(2)
+            parts.append(match.group(1) + body + match.group(3))
+        elif match.group(4) is not None:
+            parts.append(match.group(4) + minify_css(match.group(5)) + match.group(6))
+        elif match.group(7) is not None:
+            # 条件注释保留
+            if match.group(7).startswith('[if'):
+                parts.append(match.group(0))
+        else:
+            parts.append(match.group(0))
+    parts.append(_minify_html_text(source[position:]))
+    return ''.join(parts).strip() + '\n'
+
+
+MINIFIERS = {'.js': minify_js, '.css': minify_css, '.html': minify_html}
+
+# ---------------------------------------------------------------------------
+# 构建和服务
+# ---------------------------------------------------------------------------
+
+
+class ResolvedAsset(NamedTuple):
+    """按Accept-Encoding选出的资源文件"""
+    path: str
+    mimetype: str
+    encoding: Optional[str]
+    etag: str
+
+
+def _content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+
+
+def compressed_variants(data: bytes) -> Dict[str, bytes]:
+    """预压缩版本（只保留比原文件小的）"""
+    variants = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {encoding: body for encoding, body in variants.items() if len(body) < len(data)}
+
+
+def accepted_encoding(available, accept_encodings) -> Optional[str]:
+    """
+    按客户端的Accept-Encoding选择预压缩格式
+
+    Args:
+        available: 已有的预压缩格式
+        accept_encodings: werkzeug的Accept对象（request.accept_encodings）
+
+    Returns:
+        编码名称，没有可用的格式时返回None（使用未压缩的文件）
+    """
+    best, best_quality = None, 0
+    for encoding, _ in ENCODINGS:
+        if encoding in available:
+            quality = accept_encodings.quality(encoding)
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+    return best
+
+
+class AssetPipeline:
+    """构建带哈希的静态资源，并按请求选择预压缩版本"""
+
+    def __init__(self, static_dir: str, template_dir: str, build_dir: str,
+                 assets: tuple = ASSETS, index_template: str = INDEX_TEMPLATE):
+        """
+        Args:
+            static_dir: 静态文件目录
+            template_dir: 模板目录
+            build_dir: 构建结果目录（可以在多个工作进程之间共享）
+            assets: 构建的资源（相对于static_dir）
+            index_template: 改写资源引用的主页模板（相对于template_dir）
+        """
+        self.static_dir = static_dir
+        self.template_dir = template_dir
+        self.build_dir = build_dir
+        self.assets = tuple(assets)
+        self.index_template = index_template
+        self.manifest: Optional[Dict[str, Any]] = None
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.build_dir, 'manifest.json')
+
+    def _sources(self) -> List[str]:
+        return ([os.path.join(self.static_dir, name) for name in self.assets]
+                + [os.path.join(self.template_dir, self.index_template)])
+
+    def source_version(self) -> str:
+        """所有源文件内容和压缩规则版本的哈希，源文件变化后构建结果过期"""
+        digest = hashlib.sha256(PIPELINE_VERSION.encode('ascii'))
+        for path in self._sources():
+            with open(path, 'rb') as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+        return digest.hexdigest()[:HASH_LENGTH]
+
+    def _write_variants(self, name: str, data: bytes) -> List[str]:
+        path = os.path.join(self.build_dir, name)
+        write_atomic(path, data)
+        variants = compressed_variants(data)
+        for encoding, suffix in ENCODINGS:
+            if encoding in variants:
+                write_atomic(path + suffix, variants[encoding])
+        return [encoding for encoding, _ in ENCODINGS if encoding in variants]
+
+    def _build_file(self, source_path: str, name: str) -> Dict[str, Any]:
+        with open(source_path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        base, ext = os.path.splitext(name)
+        data = MINIFIERS[ext](text).encode('utf-8')
+        content_hash = _content_hash(data)
+        hashed_name = f"{base}.{content_hash}{ext}"
+        return {
+            'path': hashed_name,
+            'hash': content_hash,
+            'size': len(data),
+            'source_size': os.path.getsize(source_path),
+            'encodings': self._write_variants(hashed_name, data),
+        }
+
+    def _rewrite_references(self, html: str, urls: Dict[str, str]) -> str:
+        """把模板中对静态资源的引用（/static/... 或 url_for('static', ...)）改写为带哈希的地址"""
+        def replace_url_for(match):
+            return urls.get(match.group(1), match.group(0))
+
+        def replace_static(match):
+            return urls.get(match.group(1), match.group(0))
+
+        html = re.sub(r"\{\{\s*url_for\(\s*['\"]static['\"]\s*,\s*filename\s*=\s*['\"]([^'\"]+)['\"]\s*\)\s*\}\}",
+                      replace_url_for, html)
+        return re.sub(r'/static/([\w./-]+)', replace_static, html)
+
+    def build(self) -> Dict[str, Any]:
+        """
+        构建所有资源并写入清单
+
+        Returns:
+            清单：资源名称 -> 带哈希的文件名、大小和预压缩格式
+        """
+        version = self.source_version()
+        assets = {name: self._build_file(os.path.join(self.static_dir, name), name) for name in self.assets}
+        urls = {name: URL_PREFIX + entry['path'] for name, entry in assets.items()}
+
+        with open(os.path.join(self.template_dir, self.index_template), 'r', encoding='utf-8') as f:
+            html = self._rewrite_references(f.read(), urls)
+        index = None
+        if '{{' in html or '{%' in html:
+            # 还有其他模板语法时主页仍由模板渲染
+            logger.warning("主页模板中还有模板语法，不生成静态主页: %s", self.index_template)
+        else:
+            data = minify_html(html).encode('utf-8')
+            base, ext = os.path.splitext(self.index_template)
+            index_name = f"{base}.{_content_hash(data)}{ext}"
+            index = {'path': index_name, 'hash': _content_hash(data), 'size': len(data),
+                     'encodings': self._write_variants(index_name, data)}
+
+        manifest = {'version': version, 'assets': assets, 'urls': urls, 'index': index}
+        write_atomic(self.manifest_path, json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'))
+        self.manifest = manifest
+        logger.info("静态资源构建完成: %s", ', '.join(
+            f"{name} {entry['source_size']} -> {entry['size']}字节" for name, entry in assets.items()))
+        return manifest
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """读取与源文件一致的已有构建结果，没有或已过期时返回None"""
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get('version') != self.source_version():
+            return None
+        for entry in list(manifest['assets'].values()) + ([manifest['index']] if manifest.get('index') else []):
+            if not os.path.exists(os.path.join(self.build_dir, entry['path'])):
+                return None
+        self.manifest = manifest
+        return manifest
+
+    def ensure_built(self) -> Dict[str, Any]:
+        """使用已有的构建结果，源文件变化后重新构建"""
+        return self.load() or self.build()
+
+    def url(self, name: str) -> str:
+        """资源的访问地址（未构建的资源返回原始的静态文件地址）"""
+        if self.manifest is not None and name in self.manifest['urls']:
+            return self.manifest['urls'][name]
+        return f'/static/{name}'
+
+    def _resolve(self, entry: Dict[str, Any], accept_encodings) -> ResolvedAsset:
+        path = os.path.join(self.build_dir, entry['path'])
+        encoding = accepted_encoding(entry['encodings'], accept_encodings)
+        suffix = dict(ENCODINGS).get(encoding, '')
+        mimetype = mimetypes.guess_type(entry['path'])[0] or 'application/octet-stream'
+        return ResolvedAsset(path + suffix, mimetype, encoding, f"{entry['hash']}-{encoding or 'identity'}")
+
+    def resolve(self, filename: str, accept_encodings) -> Optional[ResolvedAsset]:
+        """
+        查找带哈希的资源文件
+
+        Args:
+            filename: 访问路径中URL_PREFIX之后的部分
+            accept_encodings: werkzeug的Accept对象
+
+        Returns:
+            选出的文件，不是本次构建的资源时返回None
+        """
+        if self.manifest is None:
+            return None
+        for entry in self.manifest['assets'].values():
+            if entry['path'] == filename:
+                return self._resolve(entry, accept_encodings)
+        return None
+
+    def index(self, accept_encodings) -> Optional[ResolvedAsset]:
+        """构建好的主页，没有时返回None（由模板渲染）"""
+        if self.manifest is None or not self.manifest.get('index'):
+            return None
+        return self._resolve(self.manifest['index'], accept_encodings)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行入口：构建静态资源"""
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description='压缩静态资源并生成带哈希的文件和预压缩版本')
+    parser.add_argument('--build-dir', default=os.environ.get('ASSET_BUILD_DIR', DEFAULT_BUILD_DIR),
+                        help='构建结果目录')
+    parser.add_argument('--static-dir', default=os.path.join(project_root, 'static'))
+    parser.add_argument('--template-dir', default=os.path.join(project_root, 'templates'))
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    pipeline = AssetPipeline(args.static_dir, args.template_dir, args.build_dir)
+    manifest = pipeline.build()
+    for name, entry in manifest['assets'].items():
+        print(f"{name} -> {entry['path']} ({entry['source_size']} -> {entry['size']}字节, {', '.join(entry['encodings'])})")
+    if manifest['index']:
+        print(f"{pipeline.index_template} -> {manifest['index']['path']} ({manifest['index']['size']}字节)")
+    if brotli is None:
+        print("未安装brotli，只生成了gzip版本", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
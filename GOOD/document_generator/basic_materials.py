@@ -4,6 +4,8 @@
 from typing import Dict, List, Any
 import logging
 
+from document_generator.form import as_form
+
 logger = logging.getLogger(__name__)
 
 class BasicMaterialsGenerator:
@@ -28,10 +30,12 @@ class BasicMaterialsGenerator:
         Returns:
             基本材料列表
         """
+        form = as_form(form_data)
+        
         # 获取居住地领区信息
-        residence_consulate = form_data.get('residenceConsulate', '').lower()
-        application_type = form_data.get('applicationType')
-        identity_type = form_data.get('identityType', '')
+        residence_consulate = form.residence_consulate
+        application_type = form.application_type
+        identity_type = form.identity_type
         
         # 上海领区特有的基本材料
         if residence_consulate == 'shanghai':
@@ -51,7 +55,7 @@ class BasicMaterialsGenerator:
                 basic_materials.append("签证持有人的护照首页复印件 + 签证页复印件")
                 
                 # 根据关系类型添加不同的关系证明材料
-                family_relation = form_data.get('familyRelation', '')
+                family_relation = form.family_relation
                 if family_relation == 'SPOUSE':
                     basic_materials.append("与签证持有人的关系证明材料（结婚证/户口本）")
                 elif family_relation == 'PARENT':
@@ -67,16 +71,14 @@ class BasicMaterialsGenerator:
         # 北京领区及其他领区使用默认的基本材料列表
         basic_materials = self.config.get('basicMaterials', {}).get('all', []).copy()
         
-        # 获取户口类型，默认为家庭户
-        hukou_type = form_data.get('hukouType', 'family')
-        if not hukou_type or hukou_type == 'auto':
-            hukou_type = 'family'
+        # 获取户口类型（未填写时为家庭户）
+        hukou_type = form.hukou_type
         
         # 获取户口材料详情
         hukou_details = None
-        if hukou_type == 'family' or hukou_type == 'FAMILY':
+        if hukou_type == 'family':
             hukou_details = self.config.get('basicMaterials', {}).get('details', {}).get('family', '')
-        elif hukou_type == 'collective' or hukou_type == 'COLLECTIVE':
+        elif hukou_type == 'collective':
             hukou_details = self.config.get('basicMaterials', {}).get('details', {}).get('collective', '')
         
         # 添加户口材料详情
@@ -92,7 +94,7 @@ class BasicMaterialsGenerator:
             basic_materials.append("签证持有人的护照首页复印件 + 签证页复印件")
             
             # 根据关系类型添加不同的关系证明材料
-            family_relation = form_data.get('familyRelation', '')
+            family_relation = form.family_relation
             if family_relation == 'SPOUSE':
                 basic_materials.append("与签证持有人的关系证明材料（结婚证/户口本）")
             elif family_relation == 'PARENT':
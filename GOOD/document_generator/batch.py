@@ -0,0 +1,246 @@
+"""
+日本签证材料清单生成器 - 批量材料清单模块
+
+/api/generate_batch 接收JSON数组或NDJSON格式的多个表单，逐个读取、逐个生成，结果按输入顺序以NDJSON逐行返回。
+请求体分块读取，不整体加载到内存；规范化哈希（ApplicationForm.canonical_hash）相同的表单只生成一次，
+已生成的结果保存在有上限的LRU中，内存占用与批量大小无关。单个表单出错时该行返回错误，不影响其他表单。
+"""
+from typing import Dict, List, Any, Optional, Iterator, Tuple, Callable, BinaryIO
+from collections import OrderedDict
+import json
+import logging
+import time
+
+from document_generator.form import ApplicationForm
+
+logger = logging.getLogger(__name__)
+
+# 单个表单的最大字节数
+MAX_ITEM_BYTES = 1024 * 1024
+
+# 去重时保留的最近结果数量
+DEFAULT_CACHE_SIZE = 4096
+
+# 每次从请求体读取的字节数
+_READ_SIZE = 64 * 1024
+
+_WHITESPACE = ' \t\r\n'
+
+
+class BatchInputError(ValueError):
+    """批量请求格式错误（之后的内容无法继续读取）"""
+
+
+def iter_ndjson(stream: BinaryIO, max_item_bytes: int = MAX_ITEM_BYTES) -> Iterator[Any]:
+    """
+    逐行读取NDJSON请求体
+
+    Args:
+        stream: 请求体（二进制流）
+        max_item_bytes: 单行最大字节数
+
+    Returns:
+        每个非空行解析后的对象；无法解析的行返回BatchInputError实例，由调用方作为该行的错误输出
+    """
+    while True:
+        line = stream.readline(max_item_bytes + 1)
+        if not line:
+            return
+        if len(line) > max_item_bytes and not line.endswith(b'\n'):
+            # 跳过超长行的剩余部分
+            while line and not line.endswith(b'\n'):
+                line = stream.readline(_READ_SIZE)
+            yield BatchInputError(f"表单超过{max_item_bytes}字节")
+            continue
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError) as e:
+            yield BatchInputError(f"不是有效的JSON: {str(e)}")
+
+
+def iter_json_array(stream: BinaryIO, max_item_bytes: int = MAX_ITEM_BYTES) -> Iterator[Any]:
+    """
+    增量读取JSON数组请求体，每读出一个完整元素就产出
+
+    Args:
+        stream: 请求体（二进制流）
+        max_item_bytes: 单个元素最大字节数
+
+    Raises:
+        BatchInputError: 不是JSON数组、结构错误或单个元素过大（之后的元素无法继续读取）
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+    started = False
+    expect_item = True
+
+    # 分块解码时一个UTF-8字符可能跨越两个块
+    pending = b''
+
+    def _decode(chunk: bytes) -> str:
+        nonlocal pending
+        data = pending + chunk
+        try:
+            text = data.decode('utf-8')
+            pending = b''
+        except UnicodeDecodeError as e:
+            if e.start < len(data) - 3:
+                raise BatchInputError("请求体不是有效的UTF-8")
+            text = data[:e.start].decode('utf-8')
+            pending = data[e.start:]
+        return text
+
+    def fill() -> bool:
+        nonlocal buffer, pos, eof
+        if eof:
+            return False
+        chunk = stream.read(_READ_SIZE)
+        if not chunk:
+            eof = True
+            return False
+        buffer = buffer[pos:] + _decode(chunk)
+        pos = 0
+        return True
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+            pos += 1
+        if pos >= len(buffer):
+            if fill():
+                continue
+            if not started:
+                raise BatchInputError("请求体为空")
+            raise BatchInputError("JSON数组不完整")
+
+        char = buffer[pos]
+        if not started:
+            if char != '[':
+                raise BatchInputError("请求体必须是JSON数组或NDJSON")
+            started = True
+            pos += 1
+            continue
+        if char == ']':
+            return
+        if not expect_item:
+            if char != ',':
+                raise BatchInputError(f"JSON数组格式错误: 位置{pos}")
+            expect_item = True
+            pos += 1
+            continue
+
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # 元素还没有读完整
+            if len(buffer) - pos > max_item_bytes:
+                raise BatchInputError(f"表单超过{max_item_bytes}字节")
+            if fill():
+                continue
+            raise BatchInputError("JSON数组不完整")
+        if end == len(buffer) and not eof and not isinstance(item, (dict, list, str)):
+            # 数字等元素可能在块边界处被截断，读取更多内容后重新解析
+            if fill():
+                continue
+        if end - pos > max_item_bytes:
+            raise BatchInputError(f"表单超过{max_item_bytes}字节")
+        pos = end
+        expect_item = False
+        yield item
+
+
+def iter_batch_forms(stream: BinaryIO, content_type: str) -> Iterator[Any]:
+    """
+    根据Content-Type读取批量表单
+
+    application/json 按JSON数组读取，其他类型（application/x-ndjson等）按NDJSON读取。
+    """
+    if 'application/json' in (content_type or ''):
+        return iter_json_array(stream)
+    return iter_ndjson(stream)
+
+
+class BatchGenerator:
+    """批量生成材料清单，相同的规范化表单只生成一次"""
+
+    def __init__(self, generate: Callable[[ApplicationForm], Dict[str, List[str]]],
+                 validate: Optional[Callable[[ApplicationForm], Optional[str]]] = None,
+                 cache_size: int = DEFAULT_CACHE_SIZE):
+        """
+        初始化批量生成器
+
+        Args:
+            generate: 材料清单生成函数
+            validate: 表单校验函数，返回错误信息或None
+            cache_size: 去重时保留的最近结果数量
+        """
+        self.generate = generate
+        self.validate = validate
+        self.cache_size = cache_size
+        self._results: 'OrderedDict[str, str]' = OrderedDict()
+        self.total = 0
+        self.distinct = 0
+        self.failed = 0
+
+    def _result_json(self, form: ApplicationForm) -> str:
+        """表单的结果（不含序号的JSON片段），按规范化哈希去重"""
+        key = form.canonical_hash()
+        cached = self._results.get(key)
+        if cached is not None:
+            self._results.move_to_end(key)
+            return cached
+
+        error = self.validate(form) if self.validate is not None else None
+        if error:
+            result = json.dumps({'error': error}, ensure_ascii=False)
+        else:
+            result = json.dumps({'documents': self.generate(form)}, ensure_ascii=False)
+        self.distinct += 1
+        self._results[key] = result
+        if len(self._results) > self.cache_size:
+            self._results.popitem(last=False)
+        return result
+
+    def _line(self, index: int, item: Any) -> Tuple[str, bool]:
+        if isinstance(item, BatchInputError):
+            return json.dumps({'index': index, 'error': str(item)}, ensure_ascii=False), False
+        if not isinstance(item, dict):
+            return json.dumps({'index': index, 'error': "表单必须是JSON对象"}, ensure_ascii=False), False
+        try:
+            form = ApplicationForm(item)
+            result = self._result_json(form)
+        except Exception as e:
+            logger.error("批量生成第%d个表单时出错: %s", index, str(e), exc_info=True)
+            return json.dumps({'index': index, 'error': f"生成材料清单时出错: {str(e)}"}, ensure_ascii=False), False
+        # 结果片段以'{'开头，插入序号后拼接
+        return f'{{"index": {index}, {result[1:]}', not result.startswith('{"error"')
+
+    def stream(self, items: Iterator[Any]) -> Iterator[bytes]:
+        """
+        逐个生成并产出NDJSON行
+
+        Args:
+            items: 表单迭代器（BatchInputError实例表示该项无法解析）
+
+        Returns:
+            每个表单一行，按输入顺序；请求体结构错误时最后一行为 {"index": n, "error": ..., "fatal": true}
+        """
+        start = time.perf_counter()
+        index = 0
+        try:
+            for item in items:
+                line, ok = self._line(index, item)
+                if not ok:
+                    self.failed += 1
+                index += 1
+                yield (line + '\n').encode('utf-8')
+        except BatchInputError as e:
+            self.failed += 1
+            yield (json.dumps({'index': index, 'error': str(e), 'fatal': True}, ensure_ascii=False) + '\n').encode('utf-8')
+        self.total = index
+        logger.info("批量材料清单完成: %d个表单, 去重后生成%d个, 失败%d个, 耗时%.3f秒",
+                    self.total, self.distinct, self.failed, time.perf_counter() - start)
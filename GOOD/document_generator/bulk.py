@@ -0,0 +1,601 @@
+"""
+日本签证材料清单生成器 - 批量生成模块
+
+读取CSV/JSONL格式的申请人表单（字段与前端collectFormData提交的一致），
+在进程池中并发生成材料清单和PDF，结果按完成顺序逐个写入流式ZIP，不在内存中缓存整个压缩包。
+
+Web服务中的批量任务创建后立即在后台线程中运行，不依赖下载请求：任务进度记录在SQLite任务表中，
+ZIP写入输出目录，共享任务表和输出目录的任何工作进程或节点都可以查询进度和下载（任务仍在进行时跟随文件增长）。
+"""
+from typing import Dict, List, Any, Optional, Iterable, Iterator, Tuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+import csv
+import datetime
+import io
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+
+from document_generator.form import as_form
+from document_generator.pdf_jobs import STATUS_PENDING, STATUS_RUNNING, STATUS_DONE, STATUS_FAILED
+from document_generator.utils import validate_pdf_form
+
+logger = logging.getLogger(__name__)
+
+# 单个批量任务最多包含的申请人数量
+MAX_BULK_FORMS = 1000
+
+# 文件名中不允许出现的字符
+_UNSAFE_FILENAME = re.compile(r'[\\/:*?"<>|\s]+')
+
+
+class BulkInputError(ValueError):
+    """批量导入文件格式错误"""
+
+
+# ----------------------------------------------------------------------
+# 输入解析
+# ----------------------------------------------------------------------
+
+def _parse_cell(value: str) -> Any:
+    """CSV单元格：JSON数组/对象（如familyMembers）解析为对象，其他保持字符串"""
+    value = value.strip()
+    if value.startswith('[') or value.startswith('{'):
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            pass
+    return value
+
+
+def read_forms(lines: Iterable[str], fmt: str) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """
+    逐行读取申请人表单
+
+    Args:
+        lines: 文本行
+        fmt: 'csv'（首行为字段名，空单元格忽略）或'jsonl'（每行一个JSON对象）
+
+    Returns:
+        (行号, 表单数据)迭代器
+
+    Raises:
+        BulkInputError: 文件格式错误
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            form = {key.strip(): _parse_cell(value) for key, value in row.items()
+                    if key and value is not None and value.strip()}
+            if form:
+                yield reader.line_num, form
+    elif fmt == 'jsonl':
+        for line_no, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                form = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise BulkInputError(f"第{line_no}行不是有效的JSON: {str(e)}")
+            if not isinstance(form, dict):
+                raise BulkInputError(f"第{line_no}行不是JSON对象")
+            yield line_no, form
+    else:
+        raise BulkInputError(f"不支持的文件格式: {fmt}")
+
+
+def detect_format(filename: str) -> str:
+    """根据文件扩展名判断格式（默认JSONL）"""
+    return 'csv' if filename.lower().endswith('.csv') else 'jsonl'
+
+
+def output_name(index: int, form_data: Dict[str, Any]) -> str:
+    """输出文件名（不含扩展名）：序号 + 申请人姓名或订单号"""
+    label = form_data.get('applicantName') or form_data.get('orderNumber') or 'applicant'
+    label = _UNSAFE_FILENAME.sub('_', str(label)).strip('._')[:60] or 'applicant'
+    return f"{index:04d}_{label}"
+
+
+# ----------------------------------------------------------------------
+# 进程池工作函数
+# ----------------------------------------------------------------------
+
+_worker_document_generator = None
+_worker_pdf_generator = None
+
+
+def init_worker(config: Dict[str, Any], render_socket: Optional[str] = None, with_pdf: bool = True,
+                 precompile: bool = False) -> None:
+    """
+    进程池初始化（BulkRenderer和离线命令行共用）：每个工作进程只创建一次生成器
+
+    Args:
+        config: 材料配置
+        render_socket: PDF渲染服务套接字
+        with_pdf: 是否生成PDF
+        precompile: 是否使用决策表。逐项生成一份材料清单不到0.1毫秒，批量任务最多MAX_BULK_FORMS份，
+            默认不在每个工作进程中读取或编译决策表
+    """
+    global _worker_document_generator, _worker_pdf_generator
+    from document_generator.main import DocumentGenerator
+    _worker_document_generator = DocumentGenerator(config, precompile=precompile)
+    if not with_pdf:
+        _worker_pdf_generator = None
+    elif render_socket:
+        from document_generator.render_service import RenderServiceClient
+        _worker_pdf_generator = RenderServiceClient(render_socket)
+    else:
+        from document_generator.pdf_generator import PDFGenerator
+        _worker_pdf_generator = PDFGenerator(config)
+
+
+def process_form(index: int, form_data: Dict[str, Any], with_pdf: bool = True) -> Dict[str, Any]:
+    """
+    在工作进程中处理一个申请人
+
+    Args:
+        index: 申请人序号
+        form_data: 表单数据
+        with_pdf: 是否生成PDF
+
+    Returns:
+        结果字典：index, name, document_list, pdf（生成失败时为error）
+    """
+    result = {'index': index, 'name': output_name(index, form_data)}
+    try:
+        form_data = as_form(form_data)
+        error = validate_pdf_form(form_data)
+        if error:
+            result['error'] = error
+            return result
+        document_list = _worker_document_generator.generate_document_list(form_data)
+        result['document_list'] = list(document_list.items())
+        if with_pdf:
+            result['pdf'] = _worker_pdf_generator.generate_pdf(document_list, form_data)
+    except Exception as e:
+        logger.error("批量生成第%d个申请人时出错: %s", index, str(e), exc_info=True)
+        result['error'] = str(e)
+    return result
+
+
+def run_pool(executor: ProcessPoolExecutor, forms: Iterable[Tuple[int, Dict[str, Any]]],
+             max_pending: int, with_pdf: bool = True) -> Iterator[Dict[str, Any]]:
+    """
+    把表单提交到进程池，按完成顺序返回结果；同时在途的任务不超过max_pending，内存占用有上限
+
+    Args:
+        executor: 进程池
+        forms: (序号, 表单数据)迭代器
+        max_pending: 最多同时在途的任务数
+        with_pdf: 是否生成PDF
+
+    Returns:
+        结果字典迭代器
+    """
+    pending = set()
+    for index, form_data in forms:
+        pending.add(executor.submit(process_form, index, form_data, with_pdf))
+        if len(pending) >= max_pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+
+# ----------------------------------------------------------------------
+# 流式ZIP
+# ----------------------------------------------------------------------
+
+class _ChunkWriter(io.RawIOBase):
+    """只能追加写入的文件对象，zipfile按不可寻址流写入（使用数据描述符），写入的数据由调用方取走"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries: Iterable[Tuple[str, bytes]]) -> Iterator[bytes]:
+    """
+    把(文件名, 内容)逐个写入ZIP并立即产出压缩包数据块
+
+    Args:
+        entries: (ZIP内文件名, 文件内容)迭代器
+
+    Returns:
+        ZIP数据块迭代器
+    """
+    writer = _ChunkWriter()
+    with zipfile.ZipFile(writer, mode='w') as archive:
+        for name, data in entries:
+            # PDF本身已经压缩，直接存储；JSON等文本使用deflate
+            compress_type = zipfile.ZIP_STORED if name.endswith('.pdf') else zipfile.ZIP_DEFLATED
+            info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+            info.compress_type = compress_type
+            archive.writestr(info, data)
+            chunk = writer.take()
+            if chunk:
+                yield chunk
+    chunk = writer.take()
+    if chunk:
+        yield chunk
+
+
+# ----------------------------------------------------------------------
+# 批量任务
+# ----------------------------------------------------------------------
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bulk_jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    completed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    worker TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_bulk_jobs_status ON bulk_jobs (status, updated_at);
+"""
+
+# 下载时每次读取的字节数
+_READ_SIZE = 256 * 1024
+
+
+class BulkJobStore:
+    """基于SQLite的批量任务表和ZIP输出目录"""
+
+    def __init__(self, db_path: str, output_dir: str, lease_timeout: float = 300.0):
+        """
+        初始化任务表
+
+        Args:
+            db_path: SQLite数据库文件路径（可以与PDFJobStore共用）
+            output_dir: ZIP输出目录
+            lease_timeout: 进行中的任务超过多少秒没有进展视为运行任务的进程已退出
+        """
+        self.db_path = db_path
+        self.output_dir = output_dir
+        self.lease_timeout = lease_timeout
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        os.makedirs(output_dir, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        """每次操作使用独立连接，连接不在线程之间共享"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def output_path(self, job_id: str, partial: bool = False) -> str:
+        """任务的ZIP文件路径；写入过程中使用.part文件，完成后改名"""
+        return os.path.join(self.output_dir, f"{job_id}.zip{'.part' if partial else ''}")
+
+    def create(self, job_id: str, total: int, worker: str) -> None:
+        """记录新任务"""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute('INSERT INTO bulk_jobs (id, status, total, worker, created_at, updated_at) '
+                         'VALUES (?, ?, ?, ?, ?, ?)', (job_id, STATUS_PENDING, total, worker, now, now))
+        finally:
+            conn.close()
+
+    def update(self, job_id: str, **changes) -> None:
+        """更新任务状态或计数，同时刷新最后进展时间"""
+        columns = ', '.join(f'{key} = ?' for key in changes)
+        conn = self._connect()
+        try:
+            conn.execute(f'UPDATE bulk_jobs SET {columns}, updated_at = ? WHERE id = ?',
+                         (*changes.values(), time.time(), job_id))
+        finally:
+            conn.close()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        查询任务进度
+
+        Args:
+            job_id: 任务ID
+
+        Returns:
+            进度字典（job_id, status, total, completed, failed，失败时包括error），任务不存在时返回None
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT id, status, total, completed, failed, error, updated_at '
+                               'FROM bulk_jobs WHERE id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        progress = {
+            'job_id': row['id'],
+            'status': row['status'],
+            'total': row['total'],
+            'completed': row['completed'],
+            'failed': row['failed'],
+        }
+        if row['status'] in (STATUS_PENDING, STATUS_RUNNING) and row['updated_at'] < time.time() - self.lease_timeout:
+            progress.update(status=STATUS_FAILED, error='运行批量任务的进程已退出')
+        elif row['error']:
+            progress['error'] = row['error']
+        return progress
+
+    def purge(self, max_age: float) -> int:
+        """
+        删除已结束且超过保留时间的任务及其ZIP文件
+
+        Args:
+            max_age: 保留秒数
+
+        Returns:
+            删除的任务数量
+        """
+        conn = self._connect()
+        try:
+            job_ids = [row['id'] for row in conn.execute(
+                'SELECT id FROM bulk_jobs WHERE status IN (?, ?) AND updated_at < ?',
+                (STATUS_DONE, STATUS_FAILED, time.time() - max_age))]
+            for job_id in job_ids:
+                conn.execute('DELETE FROM bulk_jobs WHERE id = ?', (job_id,))
+        finally:
+            conn.close()
+        for job_id in job_ids:
+            for partial in (False, True):
+                try:
+                    os.remove(self.output_path(job_id, partial))
+                except FileNotFoundError:
+                    pass
+        return len(job_ids)
+
+
+class BulkJob:
+    """本进程创建的批量任务（进度和输出见BulkJobStore）"""
+
+    def __init__(self, forms: List[Tuple[int, Dict[str, Any]]]):
+        self.id = uuid.uuid4().hex
+        self.forms = forms
+        self.total = len(forms)
+
+
+class BulkRenderer:
+    """批量生成服务：管理共用的进程池，在后台线程中运行本进程创建的批量任务"""
+
+    def __init__(self, config: Dict[str, Any], store: BulkJobStore, workers: Optional[int] = None,
+                 render_socket: Optional[str] = None, retention: float = 86400.0, precompile: bool = False,
+                 poll_interval: float = 0.5):
+        """
+        初始化批量生成服务
+
+        Args:
+            config: 材料配置
+            store: 批量任务表
+            workers: 进程池大小，默认为CPU核数
+            render_socket: PDF渲染服务套接字（设置时工作进程委托渲染服务生成PDF）
+            retention: 已结束任务及其ZIP文件的保留秒数
+            precompile: 工作进程是否使用决策表（见 init_worker）
+            poll_interval: 等待进度变化和跟随ZIP文件增长时轮询任务表的间隔秒数
+        """
+        self.config = config
+        self.store = store
+        self.workers = workers or os.cpu_count() or 1
+        self.render_socket = render_socket
+        self.retention = retention
+        self.precompile = precompile
+        self.poll_interval = poll_interval
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_users: Dict[ProcessPoolExecutor, int] = {}
+        self._lock = threading.Lock()
+
+    def _acquire_executor(self) -> ProcessPoolExecutor:
+        """首次批量任务时才创建进程池，返回的进程池在任务结束前不会被关闭"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, initializer=init_worker,
+                    initargs=(self.config, self.render_socket, True, self.precompile))
+                logger.info("批量生成进程池已启动: %d个进程", self.workers)
+            executor = self._executor
+            self._executor_users[executor] = self._executor_users.get(executor, 0) + 1
+            return executor
+
+    def _release_executor(self, executor: ProcessPoolExecutor) -> None:
+        """任务结束；配置更新后被替换的进程池在最后一个任务结束时关闭"""
+        with self._lock:
+            self._executor_users[executor] -= 1
+            if self._executor_users[executor] > 0:
+                return
+            del self._executor_users[executor]
+            retired = executor is not self._executor
+        if retired:
+            executor.shutdown(wait=False)
+
+    def _discard_executor(self, executor: ProcessPoolExecutor) -> None:
+        """工作进程异常退出（渲染崩溃或被OOM终止）后进程池不能再使用，之后的任务使用新的进程池"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+        logger.error("批量生成进程池中的工作进程异常退出，下一个任务将启动新的进程池")
+
+    def update_config(self, config: Dict[str, Any]) -> None:
+        """
+        切换到新配置：之后的批量任务使用新的进程池，正在进行的任务在原进程池中完成
+
+        Args:
+            config: 新的材料配置
+        """
+        with self._lock:
+            self.config = config
+            previous, self._executor = self._executor, None
+            idle = previous is not None and previous not in self._executor_users
+        if idle:
+            previous.shutdown(wait=False)
+
+    def create_job(self, lines: Iterable[str], fmt: str) -> BulkJob:
+        """
+        解析上传的表单文件，创建批量任务并在后台线程中开始运行
+
+        Raises:
+            BulkInputError: 文件格式错误、没有表单或表单数量超过上限
+        """
+        forms = []
+        for line_no, form_data in read_forms(lines, fmt):
+            forms.append((len(forms) + 1, form_data))
+            if len(forms) > MAX_BULK_FORMS:
+                raise BulkInputError(f"单次最多导入{MAX_BULK_FORMS}个申请人")
+        if not forms:
+            raise BulkInputError("文件中没有申请人表单")
+
+        removed = self.store.purge(self.retention)
+        if removed:
+            logger.debug("已清理过期批量任务: %d个", removed)
+
+        job = BulkJob(forms)
+        self.store.create(job.id, job.total, f"{os.getpid()}")
+        threading.Thread(target=self._run, args=(job,), name=f"bulk-{job.id[:8]}", daemon=True).start()
+        logger.info("创建批量任务: %s, 申请人数量: %d", job.id, job.total)
+        return job
+
+    def progress(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """任务进度（任何进程创建的任务），任务不存在时返回None"""
+        return self.store.get(job_id)
+
+    def wait_for_change(self, job_id: str, last: Dict[str, Any], timeout: float) -> Optional[Dict[str, Any]]:
+        """轮询任务表直到进度变化（或超时），返回最新进度"""
+        deadline = time.monotonic() + timeout
+        while True:
+            progress = self.store.get(job_id)
+            if progress != last or time.monotonic() >= deadline:
+                return progress
+            time.sleep(min(self.poll_interval, max(0.0, deadline - time.monotonic())))
+
+    def read_output(self, job_id: str) -> Iterator[bytes]:
+        """
+        读取任务的ZIP数据块；任务仍在进行时跟随文件增长直到任务结束，客户端断开不影响任务
+
+        Args:
+            job_id: 任务ID
+
+        Returns:
+            ZIP数据块迭代器（任务失败时在已写入的部分之后结束）
+        """
+        f = None
+        try:
+            while True:
+                # 先读取状态再读到文件末尾：任务完成前已经写完并改名，看到完成状态后读到末尾即为完整文件
+                progress = self.store.get(job_id)
+                if f is None:
+                    f = self._open_output(job_id)
+                if f is not None:
+                    while True:
+                        chunk = f.read(_READ_SIZE)
+                        if not chunk:
+                            break
+                        yield chunk
+                if progress is None or progress['status'] not in (STATUS_PENDING, STATUS_RUNNING):
+                    if progress is not None and progress['status'] == STATUS_FAILED:
+                        logger.warning("批量任务失败，下载内容不完整: %s", job_id)
+                    return
+                time.sleep(self.poll_interval)
+        finally:
+            if f is not None:
+                f.close()
+
+    def _open_output(self, job_id: str):
+        # 先找.part：在两次尝试之间完成改名时第二次能找到最终文件
+        for partial in (True, False):
+            try:
+                return open(self.store.output_path(job_id, partial), 'rb')
+            except FileNotFoundError:
+                continue
+        return None
+
+    def _run(self, job: BulkJob) -> None:
+        """在后台线程中渲染任务，ZIP写入.part文件，完成后改名并记录状态"""
+        part_path = self.store.output_path(job.id, partial=True)
+        try:
+            self.store.update(job.id, status=STATUS_RUNNING)
+            with open(part_path, 'wb') as f:
+                for chunk in stream_zip(self._entries(job)):
+                    f.write(chunk)
+                    # 其他进程的下载请求跟随文件增长读取
+                    f.flush()
+            os.replace(part_path, self.store.output_path(job.id))
+            self.store.update(job.id, status=STATUS_DONE)
+        except Exception as e:
+            self.store.update(job.id, status=STATUS_FAILED, error=str(e))
+            logger.error("批量任务失败: %s, 错误: %s", job.id, str(e), exc_info=True)
+
+    def _entries(self, job: BulkJob) -> Iterator[Tuple[str, bytes]]:
+        start = time.perf_counter()
+        results = []
+        completed = failed = 0
+        executor = self._acquire_executor()
+        try:
+            for result in run_pool(executor, job.forms, max_pending=self.workers * 2):
+                if 'error' in result:
+                    failed += 1
+                    self.store.update(job.id, failed=failed)
+                    results.append({'index': result['index'], 'name': result['name'], 'error': result['error']})
+                    continue
+                yield f"{result['name']}.pdf", result['pdf']
+                completed += 1
+                self.store.update(job.id, completed=completed)
+                results.append({'index': result['index'], 'name': result['name'], 'file': f"{result['name']}.pdf"})
+        except BrokenProcessPool:
+            self._discard_executor(executor)
+            raise
+        finally:
+            self._release_executor(executor)
+
+        summary = {
+            'total': job.total,
+            'completed': completed,
+            'failed': failed,
+            'elapsed_seconds': round(time.perf_counter() - start, 3),
+            'generated_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'results': sorted(results, key=lambda item: item['index']),
+        }
+        yield 'summary.json', json.dumps(summary, ensure_ascii=False, indent=2).encode('utf-8')
+        logger.info("批量任务完成: %s, 成功%d个, 失败%d个, 耗时%.3f秒",
+                    job.id, completed, failed, time.perf_counter() - start)
+
+    def shutdown(self) -> None:
+        """关闭进程池"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
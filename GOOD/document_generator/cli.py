@@ -0,0 +1,140 @@
+"""
+日本签证材料清单生成器 - 离线批量命令行工具
+
+读取JSONL（或CSV）格式的申请人表单，使用进程池生成材料清单JSON和/或PDF。
+输出文件按序号命名并原子写入，重复运行时跳过已经生成的记录，可以中断后继续。
+
+用法：
+    python -m document_generator forms.jsonl --output packs/ --format both --workers 8
+"""
+from typing import Dict, List, Any, Optional
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import datetime
+import io
+import json
+import logging
+import os
+import sys
+import time
+
+from document_generator.bulk import BulkInputError, detect_format, init_worker, output_name, read_forms, run_pool
+from document_generator.utils import write_atomic
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_CONFIG_PATH = os.path.join(PROJECT_ROOT, 'static', 'js', 'document_config.json')
+
+
+def _expected_outputs(output_dir: str, name: str, formats: List[str]) -> List[str]:
+    return [os.path.join(output_dir, f"{name}.{ext}") for ext in formats]
+
+
+def run(input_path: str, output_dir: str, formats: List[str], workers: int,
+        config_path: str = DEFAULT_CONFIG_PATH, fmt: Optional[str] = None) -> Dict[str, Any]:
+    """
+    批量生成材料清单
+
+    Args:
+        input_path: 表单文件路径（'-'表示标准输入）
+        output_dir: 输出目录
+        formats: 输出格式列表（'json'和/或'pdf'）
+        workers: 工作进程数
+        config_path: 材料配置文件路径
+        fmt: 输入格式（'jsonl'或'csv'），默认按扩展名判断
+
+    Returns:
+        运行摘要
+    """
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    os.makedirs(output_dir, exist_ok=True)
+
+    with_pdf = 'pdf' in formats
+    fmt = fmt or detect_format(input_path)
+    summary = {'total': 0, 'skipped': 0, 'succeeded': 0, 'failed': 0}
+    # 失败的记录每次运行都会重试，失败清单只保留本次运行的结果
+    failures_path = os.path.join(output_dir, 'failures.jsonl')
+    start = time.perf_counter()
+
+    def pending_forms(stream):
+        """跳过已经生成全部输出的记录"""
+        for index, (_, form_data) in enumerate(read_forms(stream, fmt), 1):
+            summary['total'] += 1
+            name = output_name(index, form_data)
+            if all(os.path.exists(path) for path in _expected_outputs(output_dir, name, formats)):
+                summary['skipped'] += 1
+                continue
+            yield index, form_data
+
+    if input_path == '-':
+        stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8-sig', newline='')
+    else:
+        stream = open(input_path, 'r', encoding='utf-8-sig', newline='')
+
+    with stream, open(failures_path, 'w', encoding='utf-8') as failures, \
+            ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                initargs=(config, os.environ.get('PDF_RENDER_SOCKET'), with_pdf)) as executor:
+        for result in run_pool(executor, pending_forms(stream), max_pending=workers * 2, with_pdf=with_pdf):
+            name = result['name']
+            if 'error' in result:
+                summary['failed'] += 1
+                failures.write(json.dumps({'index': result['index'], 'name': name, 'error': result['error']},
+                                          ensure_ascii=False) + '\n')
+                failures.flush()
+                logger.warning("生成失败: %s, 错误: %s", name, result['error'])
+                continue
+            if 'json' in formats:
+                document_list = dict(result['document_list'])
+                write_atomic(os.path.join(output_dir, f"{name}.json"),
+                              json.dumps(document_list, ensure_ascii=False, indent=2).encode('utf-8'))
+            if with_pdf:
+                write_atomic(os.path.join(output_dir, f"{name}.pdf"), result['pdf'])
+            summary['succeeded'] += 1
+            logger.debug("已生成: %s", name)
+
+    elapsed = time.perf_counter() - start
+    summary['elapsed_seconds'] = round(elapsed, 3)
+    summary['per_second'] = round(summary['succeeded'] / elapsed, 2) if elapsed > 0 else None
+    summary['finished_at'] = datetime.datetime.now().isoformat(timespec='seconds')
+    write_atomic(os.path.join(output_dir, 'summary.json'),
+                  json.dumps(summary, ensure_ascii=False, indent=2).encode('utf-8'))
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行入口"""
+    parser = argparse.ArgumentParser(prog='python -m document_generator', description='离线批量生成签证材料清单')
+    parser.add_argument('input', help='JSONL或CSV格式的申请人表单文件，"-"表示标准输入')
+    parser.add_argument('--output', '-o', required=True, help='输出目录')
+    parser.add_argument('--format', '-f', choices=['json', 'pdf', 'both'], default='json', help='输出格式')
+    parser.add_argument('--input-format', choices=['jsonl', 'csv'], help='输入格式，默认按扩展名判断')
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count() or 1, help='工作进程数')
+    parser.add_argument('--config', default=DEFAULT_CONFIG_PATH, help='材料配置文件路径')
+    parser.add_argument('--verbose', '-v', action='store_true', help='输出调试日志')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if not args.verbose:
+        # 生成器内部的调试日志量很大，批量运行时只保留警告
+        logging.getLogger('document_generator').setLevel(logging.WARNING)
+        logger.setLevel(logging.INFO)
+
+    formats = ['json', 'pdf'] if args.format == 'both' else [args.format]
+    try:
+        summary = run(args.input, args.output, formats, args.workers, args.config, args.input_format)
+    except (BulkInputError, OSError) as e:
+        logger.error("批量生成失败: %s", str(e))
+        return 2
+
+    print(f"总计: {summary['total']}  跳过(已生成): {summary['skipped']}  成功: {summary['succeeded']}  "
+          f"失败: {summary['failed']}  耗时: {summary['elapsed_seconds']}秒  吞吐: {summary['per_second']}份/秒")
+    if summary['failed']:
+        print(f"失败记录见: {os.path.join(args.output, 'failures.jsonl')}")
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
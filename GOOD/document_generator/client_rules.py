@@ -0,0 +1,354 @@
+"""
+日本签证材料清单生成器 - 客户端规则模块
+
+把编译好的决策表导出为带版本号的紧凑JSON规则文件，页面加载一次后在本地计算单人、绑签和经济材料申请的材料清单，
+不必每次修改表单都请求 /api/generate。家庭申请与家庭成员有关的部分不在决策表中，仍由服务器计算；PDF始终由服务器生成。
+
+决策表有数万个键，但每一部分材料只取决于其中几个字段（例如家属材料只取决于领区和是否有家属）。
+导出时为每一部分找出足以确定其内容的最少字段，只保存这些字段的取值组合 -> 内容编号，材料文本去重后按编号引用。
+
+规则文件结构（KEY_FORMAT 为键的编码格式，页面只使用格式相同的规则文件）：
+
+    format      键的编码格式
+    version     规则内容的摘要，同时用作ETag；页面请求时通过 X-Rules-Version 提交，服务器据此判断页面规则是否过期
+    fields      决策表键的字段名称
+    none        不计入键的字段的取值
+    enums       可以在本地计算的枚举取值
+    aliases     签证期限、经济材料和学历状态的别名
+    conditions  签证期限、经济材料和学历状态计入键的条件（两个字段的取值组合）
+    items       材料文本
+    contents    内容编号 -> 材料文本编号列表
+    sections    按顺序排列的 {name: 部分名称, fields: 字段序号, values: {取值组合: 内容编号}}，取值组合不在values中时没有该部分
+
+导出需要数秒CPU时间。导出结果（连同预压缩版本）按配置版本写入规则目录，由多个工作进程共享：
+同时启动的进程中只有一个导出，其余进程等它写完后直接读取；部署时也可以预先导出：
+    python -m document_generator.client_rules --rules-dir /tmp/good_assets/rules
+"""
+from typing import Dict, List, Any, Optional, Tuple
+from collections import OrderedDict
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from operator import itemgetter
+
+from document_generator.assets import DEFAULT_BUILD_DIR, ENCODINGS, compressed_variants
+from document_generator.decision_table import (
+    CONSULATES, IDENTITY_TYPES, PROCESS_TYPES, APPLICATION_TYPES, ECONOMIC_MATERIALS, FAMILY_RELATIONS,
+    DecisionKey, DecisionTable, Section, field_conditions,
+)
+from document_generator.form import ECONOMIC_MATERIAL_ALIASES, GRADUATE_STATUS_ALIASES
+from document_generator.utils import VISA_DURATION_ALIASES, file_lock, write_atomic
+
+logger = logging.getLogger(__name__)
+
+# 键的编码格式，decision_key 的字段或编码方式变化时递增，旧页面看到不认识的格式时回退到服务器计算
+KEY_FORMAT = 1
+
+# 导出方式变化时修改，使规则目录中已有的规则文件失效
+EXPORT_VERSION = '1'
+
+DEFAULT_RULES_DIR = os.path.join(DEFAULT_BUILD_DIR, 'rules')
+
+# 决策表键的字段名称（与 decision_key 返回的元组顺序相同）
+KEY_FIELDS = ('residence', 'hukou', 'identity', 'process', 'application',
+              'visa', 'economic', 'graduate', 'relation', 'familyVisa', 'hasFamily')
+
+# 不计入键的字段（decision_key 中为None）的编码
+NONE_VALUE = '~'
+
+# 取值组合中字段之间的分隔符
+SEPARATOR = '|'
+
+# 可以在本地计算的申请类型（家庭申请需要按家庭成员计算）
+LOCAL_APPLICATION_TYPES = tuple(application_type for application_type in APPLICATION_TYPES
+                                if application_type != 'FAMILY')
+
+
+def encode_value(value: Any) -> str:
+    """键中一个字段的编码：None为NONE_VALUE，布尔值为true/false（与JavaScript的String()相同）"""
+    if value is None:
+        return NONE_VALUE
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return str(value)
+
+
+def _project(key: DecisionKey, fields: Tuple[int, ...]) -> str:
+    return SEPARATOR.join(encode_value(key[index]) for index in fields)
+
+
+def _minimal_fields(keys: List[DecisionKey], contents: List[int]) -> Tuple[int, ...]:
+    """
+    逐个尝试去掉字段，保留仍能唯一确定内容的最少字段
+
+    Args:
+        keys: 决策表键
+        contents: 与keys对应的内容编号（-1表示没有该部分）
+
+    Returns:
+        字段序号
+    """
+    fields = list(range(len(KEY_FIELDS)))
+    # (已选字段的取值, 内容编号)，去掉字段后合并相同的行，之后的尝试只需检查更少的行
+    rows = set(zip(keys, contents))
+    for field in reversed(range(len(KEY_FIELDS))):
+        position = fields.index(field)
+        keep = [index for index in range(len(fields)) if index != position]
+        getter = itemgetter(*keep) if len(keep) > 1 else (lambda values, index=keep[0]: (values[index],))
+        projected = {(getter(values), content) for values, content in rows}
+        # 每个取值组合只对应一种内容时可以去掉该字段
+        if len(projected) == len({values for values, _ in projected}):
+            fields.pop(position)
+            rows = projected
+    return tuple(fields)
+
+
+def _section_order(entries: List[Tuple[Tuple[str, Section], ...]]) -> List[str]:
+    """
+    各部分在所有材料清单中的统一顺序（合并各材料清单中相邻部分的先后关系，同时可选时按首次出现的顺序）
+
+    Raises:
+        ValueError: 有材料清单的部分顺序互相矛盾
+    """
+    names: List[str] = []
+    after: Dict[str, set] = {}
+    for entry in entries:
+        previous = None
+        for name, _ in entry:
+            if name not in after:
+                names.append(name)
+                after[name] = set()
+            if previous is not None:
+                after[previous].add(name)
+            previous = name
+    pending = {name: 0 for name in names}
+    for followers in after.values():
+        for name in followers:
+            pending[name] += 1
+    order: List[str] = []
+    while len(order) < len(names):
+        ready = [name for name in names if pending[name] == 0 and name not in order]
+        if not ready:
+            raise ValueError(f"材料清单的部分顺序不一致: {[name for name in names if name not in order]}")
+        order.append(ready[0])
+        for name in after[ready[0]]:
+            pending[name] -= 1
+    return order
+
+
+def export_rules(table: DecisionTable) -> Dict[str, Any]:
+    """
+    导出决策表中可以在本地计算的部分
+
+    Args:
+        table: 编译好的决策表
+
+    Returns:
+        规则文件内容（可以JSON序列化的字典）
+    """
+    start = time.perf_counter()
+    keys: List[DecisionKey] = []
+    entries = []
+    for key, entry in table.items():
+        if key[4] in LOCAL_APPLICATION_TYPES:
+            keys.append(key)
+            entries.append(entry)
+
+    order = _section_order(entries)
+    entries = [dict(entry) for entry in entries]
+    items: Dict[str, int] = {}
+    contents: Dict[Tuple[int, ...], int] = {}
+    sections = []
+    for name in order:
+        section_contents = []
+        for entry in entries:
+            section = entry.get(name)
+            if section is None:
+                section_contents.append(-1)
+                continue
+            item_ids = tuple(items.setdefault(item, len(items)) for item in section)
+            section_contents.append(contents.setdefault(item_ids, len(contents)))
+
+        fields = _minimal_fields(keys, section_contents)
+        values = {}
+        for key, content in zip(keys, section_contents):
+            if content >= 0:
+                values[_project(key, fields)] = content
+        sections.append({'name': name, 'fields': list(fields), 'values': values})
+
+    conditions = {name: [SEPARATOR.join(pair) for pair in pairs] for name, pairs in field_conditions().items()}
+    artifact = {
+        'format': KEY_FORMAT,
+        'fields': list(KEY_FIELDS),
+        'none': NONE_VALUE,
+        'enums': {
+            'consulates': list(CONSULATES),
+            'identityTypes': list(IDENTITY_TYPES),
+            'processTypes': list(PROCESS_TYPES),
+            'applicationTypes': list(LOCAL_APPLICATION_TYPES),
+            'economicMaterials': list(ECONOMIC_MATERIALS),
+            'familyRelations': list(FAMILY_RELATIONS),
+        },
+        'aliases': {
+            'visaDuration': VISA_DURATION_ALIASES,
+            'economicMaterial': ECONOMIC_MATERIAL_ALIASES,
+            'graduateStatus': GRADUATE_STATUS_ALIASES,
+        },
+        'conditions': conditions,
+        'items': list(items),
+        'contents': [list(item_ids) for item_ids in contents],
+        'sections': sections,
+    }
+    artifact['version'] = hashlib.sha256(_dumps(artifact)).hexdigest()[:12]
+    logger.info("客户端规则导出完成: %d个键, %d种内容, 耗时%.3f秒",
+                len(keys), len(contents), time.perf_counter() - start)
+    return artifact
+
+
+def evaluate(artifact: Dict[str, Any], key: DecisionKey) -> Optional['OrderedDict[str, Section]']:
+    """
+    按规则文件计算材料清单（与页面中的计算方式相同，用于校验导出结果）
+
+    Args:
+        artifact: export_rules 的结果
+        key: 决策表键
+
+    Returns:
+        材料清单，申请类型不能在本地计算时返回None
+    """
+    if key[4] not in artifact['enums']['applicationTypes']:
+        return None
+    items = artifact['items']
+    document_list = OrderedDict()
+    for section in artifact['sections']:
+        content = section['values'].get(_project(key, section['fields']))
+        if content is not None:
+            document_list[section['name']] = tuple(items[index] for index in artifact['contents'][content])
+    return document_list
+
+
+def _dumps(artifact: Dict[str, Any]) -> bytes:
+    return json.dumps(artifact, ensure_ascii=False, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+
+class ClientRules:
+    """导出的规则文件和序列化、预压缩后的响应体"""
+
+    def __init__(self, version: str, body: bytes, variants: Dict[str, bytes]):
+        """
+        Args:
+            version: 规则版本
+            body: 序列化后的规则文件
+            variants: 预压缩版本，编码名称 -> 压缩后的内容
+        """
+        self.version = version
+        self.body = body
+        self.variants = variants
+
+    @classmethod
+    def from_artifact(cls, artifact: Dict[str, Any]) -> 'ClientRules':
+        body = _dumps(artifact)
+        return cls(artifact['version'], body, compressed_variants(body))
+
+    @classmethod
+    def from_table(cls, table: DecisionTable) -> 'ClientRules':
+        return cls.from_artifact(export_rules(table))
+
+    @classmethod
+    def load(cls, path: str) -> Optional['ClientRules']:
+        """
+        读取save写入的规则文件
+
+        Returns:
+            规则，文件不存在或无法解析时返回None
+        """
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+            version = json.loads(body)['version']
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        variants = {}
+        for encoding, suffix in ENCODINGS:
+            try:
+                with open(path + suffix, 'rb') as f:
+                    variants[encoding] = f.read()
+            except OSError:
+                continue
+        return cls(version, body, variants)
+
+    def save(self, path: str) -> None:
+        """写入规则文件和预压缩版本（预压缩版本先写，读到规则文件时它们已经完整）"""
+        suffixes = dict(ENCODINGS)
+        for encoding, body in self.variants.items():
+            write_atomic(path + suffixes[encoding], body)
+        write_atomic(path, self.body)
+
+    def is_stale(self, client_version: Optional[str]) -> bool:
+        """页面提交的规则版本是否已经过期（没有提交版本的请求不算过期）"""
+        return bool(client_version) and client_version != self.version
+
+
+def rules_path(rules_dir: str, config_version: str) -> str:
+    """某个配置版本的规则文件路径"""
+    return os.path.join(rules_dir, f"rules-{config_version}-{KEY_FORMAT}.{EXPORT_VERSION}.json")
+
+
+def shared_rules(path: str, table: Optional[DecisionTable]) -> Optional[ClientRules]:
+    """
+    读取已有的规则文件，没有时从决策表导出并写入，其他进程正在导出时等它写完
+
+    Args:
+        path: 规则文件路径（rules_path）
+        table: 编译好的决策表
+
+    Returns:
+        规则，没有规则文件且没有决策表时返回None
+    """
+    rules = ClientRules.load(path)
+    if rules is not None or table is None:
+        return rules
+    try:
+        with file_lock(path):
+            rules = ClientRules.load(path)
+            if rules is None:
+                rules = ClientRules.from_table(table)
+                rules.save(path)
+    except OSError as e:
+        # 规则目录不可写时仍然使用本进程导出的结果
+        logger.warning("无法写入客户端规则文件 %s: %s", path, str(e))
+        if rules is None:
+            rules = ClientRules.from_table(table)
+    return rules
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行入口：部署时预先导出客户端规则"""
+    from document_generator.config_manager import read_config
+    from document_generator.decision_table import config_fingerprint
+    from document_generator.main import DocumentGenerator
+
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description='从决策表导出客户端规则文件')
+    parser.add_argument('--rules-dir', default=os.environ.get('CLIENT_RULES_DIR', DEFAULT_RULES_DIR),
+                        help='规则目录')
+    parser.add_argument('--config', default=os.path.join(project_root, 'static', 'js', 'document_config.json'),
+                        help='材料配置文件')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    config = read_config(args.config)
+    path = rules_path(args.rules_dir, config_fingerprint(config)[:12])
+    rules = ClientRules.from_table(DocumentGenerator(config).decision_table)
+    rules.save(path)
+    print(f"{path} (版本{rules.version}, {len(rules.body)}字节, "
+          f"{', '.join(f'{encoding} {len(body)}字节' for encoding, body in rules.variants.items())})")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""
+日本签证材料清单生成器 - 配置热加载模块
+
+后台线程定期检查document_config.json的修改时间和大小，文件变化后读取、校验并编译新配置
+（创建生成器时会编译决策表，遍历所有枚举表单，生成器抛出的异常视为配置无效），
+成功后整体替换当前的 GeneratorSet。每个请求开始时取一次 current()，之后一直使用同一组生成器，
+替换时正在处理的请求在旧配置上完成。配置无效时记录错误并继续使用旧配置。
+
+版本号取配置内容摘要的前12位，同一份配置在各个工作进程中的版本号相同，
+响应头 X-Config-Version 和PDF缓存键都包含版本号，旧配置的缓存结果不会在新配置下返回。
+"""
+from typing import Dict, Any, Optional, Callable, Tuple
+import json
+import logging
+import os
+import threading
+import time
+
+from document_generator.main import DocumentGenerator
+from document_generator.client_rules import ClientRules, rules_path, shared_rules
+from document_generator.decision_table import config_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# 配置文件必须包含的部分（均为对象）
+REQUIRED_SECTIONS = (
+    'basicMaterials', 'identityMaterials', 'residenceMaterials', 'economicMaterials',
+    'visaRequirements', 'familyApplications', 'riskAssessment', 'consulateRequirements', 'processMethods',
+)
+
+
+class ConfigError(ValueError):
+    """配置文件无法读取或内容无效"""
+
+
+def validate_config(config: Any) -> None:
+    """
+    检查配置结构
+
+    Args:
+        config: 解析后的配置
+
+    Raises:
+        ConfigError: 配置不是对象、缺少必需部分或部分类型不正确
+    """
+    if not isinstance(config, dict):
+        raise ConfigError("配置文件顶层必须是对象")
+    missing = [section for section in REQUIRED_SECTIONS if section not in config]
+    if missing:
+        raise ConfigError(f"配置文件缺少: {', '.join(missing)}")
+    for section, value in config.items():
+        if not isinstance(value, dict):
+            raise ConfigError(f"配置项{section}必须是对象")
+
+
+def read_config(path: str) -> Dict[str, Any]:
+    """
+    读取并校验配置文件
+
+    Raises:
+        ConfigError: 文件不存在、JSON格式错误或结构无效
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        raise ConfigError(f"配置文件未找到: {path}")
+    except (OSError, UnicodeDecodeError) as e:
+        raise ConfigError(f"无法读取配置文件: {e}")
+    except json.JSONDecodeError as e:
+        raise ConfigError(f"配置文件格式错误: {e}")
+    validate_config(config)
+    return config
+
+
+class GeneratorSet:
+    """同一版本配置下的一组生成器，创建后不再修改"""
+
+    def __init__(self, config: Dict[str, Any], generation: int,
+                 services: Optional[Dict[str, Callable[[Dict[str, Any]], Any]]] = None,
+                 rules_dir: Optional[str] = None):
+        """
+        编译配置
+
+        Args:
+            config: 材料配置
+            generation: 本进程内的加载序号（从1开始）
+            services: 需要随配置一起替换的其他服务，名称 -> 工厂函数
+            rules_dir: 各工作进程共享的客户端规则目录，None表示每个进程分别导出
+        """
+        self.config = config
+        self.generation = generation
+        self.version = config_fingerprint(config)[:12]
+        self.loaded_at = time.time()
+        self.document_generator = DocumentGenerator(config)
+        self.services = {name: factory(config) for name, factory in (services or {}).items()}
+        self.rules_dir = rules_dir
+        self._client_rules: Optional[ClientRules] = None
+        self._client_rules_lock = threading.Lock()
+
+    def client_rules(self, wait: bool = True) -> Optional[ClientRules]:
+        """
+        页面使用的客户端规则（第一次调用时读取共享的规则文件或从决策表导出，之后直接返回）
+
+        Args:
+            wait: 其他线程正在读取或导出时是否等待，为False时立即返回None
+
+        Returns:
+            客户端规则，正在导出（wait为False）或生成器没有编译决策表时返回None
+        """
+        if self._client_rules is None:
+            if not self._client_rules_lock.acquire(blocking=wait):
+                return None
+            try:
+                if self._client_rules is None:
+                    table = self.document_generator.decision_table
+                    if self.rules_dir is not None:
+                        self._client_rules = shared_rules(rules_path(self.rules_dir, self.version), table)
+                    elif table is not None:
+                        self._client_rules = ClientRules.from_table(table)
+            finally:
+                self._client_rules_lock.release()
+        return self._client_rules
+
+    def __repr__(self) -> str:
+        return f"GeneratorSet(version={self.version!r}, generation={self.generation})"
+
+
+class ConfigManager:
+    """管理当前配置版本，文件变化时热加载"""
+
+    def __init__(self, path: str, services: Optional[Dict[str, Callable[[Dict[str, Any]], Any]]] = None,
+                 interval: float = 2.0, on_reload: Optional[Callable[[GeneratorSet], None]] = None,
+                 rules_dir: Optional[str] = None):
+        """
+        加载初始配置
+
+        初始配置无效时记录错误并使用空配置，与之前启动时的处理一致。
+
+        Args:
+            path: 配置文件路径
+            services: 需要随配置一起替换的其他服务，名称 -> 工厂函数
+            interval: 检查文件变化的间隔秒数，0表示不启动后台检查
+            on_reload: 新配置生效后的回调（在检查线程中调用）
+            rules_dir: 各工作进程共享的客户端规则目录，None表示每个进程分别导出
+        """
+        self.path = path
+        self.services = services or {}
+        self.interval = interval
+        self.on_reload = on_reload
+        self.rules_dir = rules_dir
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stat = self._file_stat()
+        self.last_error: Optional[str] = None
+
+        try:
+            config = read_config(path)
+        except ConfigError as e:
+            logger.error("加载配置失败，使用空配置: %s", str(e))
+            self.last_error = str(e)
+            config = {}
+        self._current = self._build(config)
+        logger.info("配置已加载: 版本%s", self._current.version)
+
+    def current(self) -> GeneratorSet:
+        """当前版本的生成器（请求开始时取一次，之后一直使用）"""
+        return self._current
+
+    @property
+    def version(self) -> str:
+        return self._current.version
+
+    def _build(self, config: Dict[str, Any]) -> GeneratorSet:
+        self._generation += 1
+        return GeneratorSet(config, self._generation, self.services, self.rules_dir)
+
+    def _file_stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def check(self) -> bool:
+        """
+        文件变化时重新加载
+
+        Returns:
+            是否切换到了新版本
+        """
+        stat = self._file_stat()
+        if stat is None or stat == self._stat:
+            return False
+        return self.reload(stat)
+
+    def reload(self, stat: Optional[Tuple[int, int]] = None) -> bool:
+        """
+        读取、校验并编译配置文件，成功后替换当前版本
+
+        Returns:
+            是否切换到了新版本（内容未变化或配置无效时返回False）
+        """
+        with self._lock:
+            self._stat = stat or self._file_stat()
+            start = time.perf_counter()
+            try:
+                config = read_config(self.path)
+                if config_fingerprint(config)[:12] == self._current.version:
+                    self.last_error = None
+                    return False
+                generators = self._build(config)
+            except Exception as e:
+                # 生成器编译决策表时的异常也视为配置无效，继续使用旧版本
+                self.last_error = str(e)
+                logger.error("配置热加载失败，继续使用版本%s: %s", self._current.version, str(e),
+                             exc_info=not isinstance(e, ConfigError))
+                return False
+            previous = self._current
+            self._current = generators
+            self.last_error = None
+        logger.info("配置已热加载: 版本%s -> %s, 耗时%.3f秒",
+                    previous.version, generators.version, time.perf_counter() - start)
+        if self.on_reload is not None:
+            try:
+                self.on_reload(generators)
+            except Exception as e:
+                logger.error("配置热加载回调出错: %s", str(e), exc_info=True)
+        return True
+
+    def start(self) -> None:
+        """启动后台检查线程"""
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='config-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """停止后台检查线程"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.error("检查配置文件时出错: %s", str(e), exc_info=True)
+
+    def status(self) -> Dict[str, Any]:
+        """当前配置版本信息"""
+        generators = self._current
+        return {
+            'version': generators.version,
+            'generation': generators.generation,
+            'loaded_at': generators.loaded_at,
+            'path': self.path,
+            'last_error': self.last_error,
+        }
@@ -0,0 +1,52 @@
+"""
+日本签证材料清单生成器 - PDF调试捕获模块
+
+可选的调试模式：在内存环形缓冲区中保留最近N份用于生成PDF的HTML，供管理页面查看。
+"""
+from typing import Dict, List, Any, Optional
+from collections import deque
+import datetime
+import itertools
+import threading
+
+
+class DebugCaptureBuffer:
+    """保存最近渲染的HTML文档的环形缓冲区"""
+
+    def __init__(self, size: int):
+        """
+        初始化调试捕获缓冲区
+
+        Args:
+            size: 最多保留的HTML文档数量
+        """
+        self.size = size
+        self._entries = deque(maxlen=size)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def add(self, html: str, captured_at: Optional[str] = None) -> int:
+        """
+        记录一份HTML文档
+
+        Args:
+            html: 渲染使用的HTML
+            captured_at: 捕获时间，默认为当前时间
+
+        Returns:
+            捕获编号
+        """
+        with self._lock:
+            capture_id = next(self._ids)
+            self._entries.append({
+                'id': capture_id,
+                'captured_at': captured_at or datetime.datetime.now().isoformat(timespec='seconds'),
+                'size': len(html),
+                'html': html,
+            })
+        return capture_id
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """返回所有捕获记录（最新的在前）"""
+        with self._lock:
+            return list(reversed(self._entries))
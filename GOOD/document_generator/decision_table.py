@@ -0,0 +1,341 @@
+"""
+日本签证材料清单生成器 - 决策表模块
+
+材料清单只取决于少数几个枚举字段（领区、身份、办理方式、签证期限、申请类型、经济材料、学历状态、绑签关系等）。
+加载配置时遍历这些字段所有可达的取值组合，用生成器生成一次材料清单并存入以规范化字段为键的查找表，
+之后单人申请只需一次字典查找。家庭申请中与家庭成员有关的部分仍在每次请求时计算。
+
+不在枚举范围内的取值（例如页面不会提交的户口类型、无法识别的经济材料）查不到结果，由调用方回退到生成器逐项生成。
+
+编译需要数秒CPU时间和几十MB内存。编译结果按配置内容和本包源代码的摘要写入 DECISION_TABLE_DIR（pickle文件），
+各工作进程和热加载共享：同时启动的进程中只有一个编译，其余等它写完后直接读取。DECISION_TABLE_DIR为空时不写入文件。
+"""
+from typing import Dict, List, Any, Optional, Tuple, Callable, Iterator
+from collections import OrderedDict
+import glob
+import hashlib
+import itertools
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+import weakref
+
+from document_generator.form import ECONOMIC_MATERIAL_ALIASES, as_form
+from document_generator.utils import file_lock, write_atomic
+
+logger = logging.getLogger(__name__)
+
+# 页面可以提交的枚举取值（空字符串表示未填写）
+CONSULATES = ('beijing', 'shanghai', 'other', '')
+IDENTITY_TYPES = ('EMPLOYED', 'STUDENT', 'RETIRED', 'FREELANCER', 'FREELANCE', 'CHILD', '')
+PROCESS_TYPES = ('TAX', 'STUDENT', 'NORMAL', 'SIMPLIFIED', '')
+APPLICATION_TYPES = ('SINGLE', 'FAMILY', 'BINDING', 'ECONOMIC', '')
+VISA_DURATIONS = ('SINGLE', 'THREE', 'FIVE')
+GRADUATE_STATUSES = ('graduate', 'current', 'other')
+FAMILY_RELATIONS = ('SPOUSE', 'PARENT', 'CHILD', '')
+FAMILY_VISA_TYPES = ('THREE', 'FIVE')
+
+# 经济材料规范取值，空字符串表示未选择（使用默认逻辑）
+ECONOMIC_MATERIALS = ('',) + tuple(sorted(set(ECONOMIC_MATERIAL_ALIASES.values())))
+
+# 家庭申请中需要按家庭成员逐次计算的部分，不存入决策表
+MEMBER_SECTIONS = ('居住证明材料', '家属材料', '其他材料')
+
+DecisionKey = Tuple[Any, ...]
+# 一部分材料（不可变，可以在决策表、缓存和并发请求之间直接共享）
+Section = Tuple[str, ...]
+SectionsEntry = Tuple[Tuple[str, Section], ...]
+
+# 按配置内容缓存已编译的决策表，同一进程中多次创建生成器时只编译一次。
+# 只强引用最近一次取得的决策表，其他决策表在使用它的生成器释放后随之释放（热加载后旧版本不会一直占用内存）
+_compiled_tables: 'weakref.WeakValueDictionary[str, DecisionTable]' = weakref.WeakValueDictionary()
+_latest_table: Optional['DecisionTable'] = None
+_compiled_lock = threading.Lock()
+
+DEFAULT_TABLE_DIR = os.path.join(tempfile.gettempdir(), 'good_decision_tables')
+
+# 编译结果目录中保留的文件数（每个文件十几MB）
+_MAX_TABLE_FILES = 2
+
+_code_version: Optional[str] = None
+
+
+def _uses_visa(process_type: str, application_type: str) -> bool:
+    """签证期限是否影响材料清单（基本信息和财力证明）"""
+    return application_type != 'BINDING' and process_type not in ('SIMPLIFIED', 'STUDENT')
+
+
+def _uses_economic(process_type: str, application_type: str) -> bool:
+    """经济材料是否影响材料清单（只有普通经济材料办理会读取）"""
+    return application_type not in ('BINDING', 'ECONOMIC') and process_type not in ('TAX', 'STUDENT', 'SIMPLIFIED')
+
+
+def _uses_graduate(identity_type: str, process_type: str) -> bool:
+    """学历状态是否影响材料清单（学生身份的学籍材料和在读学生免居住证明）"""
+    return identity_type == 'STUDENT' and process_type in ('STUDENT', 'NORMAL', 'SIMPLIFIED')
+
+
+def decision_key(form_data: Dict[str, Any]) -> Optional[DecisionKey]:
+    """
+    计算表单的决策表键
+
+    不影响结果的字段不计入键，例如绑签申请不关心签证期限，非学生身份不关心学历状态。
+
+    Args:
+        form_data: 用户提交的表单数据
+
+    Returns:
+        规范化字段组成的元组，有字段不在枚举范围内时返回None
+    """
+    form = as_form(form_data)
+    residence = form.residence_consulate
+    hukou = form.hukou_consulate
+    identity_type = form.identity_type
+    process_type = form.process_type
+    application_type = form.application_type
+    if (residence not in CONSULATES or hukou not in CONSULATES or identity_type not in IDENTITY_TYPES
+            or process_type not in PROCESS_TYPES or application_type not in APPLICATION_TYPES):
+        return None
+
+    # 页面不提交户口类型，只编译默认的家庭户，其他户口类型交给生成器
+    if residence != 'shanghai' and form.hukou_type != 'family':
+        return None
+
+    visa = form.visa_duration if _uses_visa(process_type, application_type) else None
+    economic = None
+    if _uses_economic(process_type, application_type):
+        # 无法识别的经济材料由生成器处理（会记录警告）
+        economic = form.economic_material
+        if economic not in ECONOMIC_MATERIALS:
+            return None
+    graduate = None
+    if _uses_graduate(identity_type, process_type):
+        graduate = form.graduate_status if form.graduate_status in ('graduate', 'current') else 'other'
+
+    relation = family_visa = has_family = None
+    if application_type == 'BINDING':
+        relation = form.family_relation if form.family_relation in FAMILY_RELATIONS else ''
+        family_visa = 'THREE' if form.family_visa_type == 'THREE' else 'FIVE'
+    elif application_type != 'FAMILY':
+        has_family = form.has_family
+
+    return (residence, hukou, identity_type, process_type, application_type,
+            visa, economic, graduate, relation, family_visa, has_family)
+
+
+def field_conditions() -> Dict[str, List[Tuple[str, str]]]:
+    """
+    计入决策表键的条件字段，按决定它们是否计入的两个字段列出所有取值组合
+
+    Returns:
+        visa、economic -> [(办理方式, 申请类型)]，graduate -> [(身份, 办理方式)]
+    """
+    return {
+        'visa': [(process_type, application_type) for process_type in PROCESS_TYPES
+                 for application_type in APPLICATION_TYPES if _uses_visa(process_type, application_type)],
+        'economic': [(process_type, application_type) for process_type in PROCESS_TYPES
+                     for application_type in APPLICATION_TYPES if _uses_economic(process_type, application_type)],
+        'graduate': [(identity_type, process_type) for identity_type in IDENTITY_TYPES
+                     for process_type in PROCESS_TYPES if _uses_graduate(identity_type, process_type)],
+    }
+
+
+def enumerate_forms() -> Iterator[Dict[str, Any]]:
+    """遍历可达的输入空间，每个决策表键生成一个代表表单"""
+    for residence, hukou, identity_type, process_type, application_type in itertools.product(
+            CONSULATES, CONSULATES, IDENTITY_TYPES, PROCESS_TYPES, APPLICATION_TYPES):
+        base = {
+            'residenceConsulate': residence,
+            'hukouConsulate': hukou,
+            'identityType': identity_type,
+            'processType': process_type,
+            'applicationType': application_type,
+        }
+        visas = VISA_DURATIONS if _uses_visa(process_type, application_type) else ('',)
+        economics = ECONOMIC_MATERIALS if _uses_economic(process_type, application_type) else ('',)
+        graduates = GRADUATE_STATUSES if _uses_graduate(identity_type, process_type) else ('',)
+        if application_type == 'BINDING':
+            family_options = [{'familyRelation': relation, 'familyVisaType': family_visa}
+                              for relation in FAMILY_RELATIONS for family_visa in FAMILY_VISA_TYPES]
+        elif application_type == 'FAMILY':
+            family_options = [{'familyMembers': []}]
+        else:
+            family_options = [{'hasFamily': True}, {'hasFamily': False}]
+
+        for visa, economic, graduate, family in itertools.product(visas, economics, graduates, family_options):
+            form_data = dict(base, visaType=visa, economicMaterial=economic, graduateStatus=graduate)
+            form_data.update(family)
+            yield form_data
+
+
+class DecisionTable:
+    """预先计算的材料清单查找表"""
+
+    def __init__(self, entries: Dict[DecisionKey, SectionsEntry]):
+        """
+        初始化决策表
+
+        Args:
+            entries: 决策表键 -> 按顺序排列的(部分名称, 材料元组)
+        """
+        self._entries = entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def items(self) -> Iterator[Tuple[DecisionKey, SectionsEntry]]:
+        """遍历决策表的(键, 材料清单)"""
+        return iter(self._entries.items())
+
+    @classmethod
+    def compile(cls, build: Callable[[Dict[str, Any]], Dict[str, List[str]]]) -> 'DecisionTable':
+        """
+        遍历输入空间编译决策表
+
+        Args:
+            build: 生成函数，参数为代表表单，返回该键对应的材料清单
+
+        Returns:
+            决策表
+        """
+        start = time.perf_counter()
+        entries: Dict[DecisionKey, SectionsEntry] = {}
+        # 编译时会调用生成器数万次，临时关闭生成器的调试日志
+        package_logger = logging.getLogger('document_generator')
+        previous_level = package_logger.level
+        package_logger.setLevel(logging.WARNING)
+        try:
+            for form_data in enumerate_forms():
+                form = as_form(form_data)
+                key = decision_key(form)
+                if key in entries:
+                    continue
+                sections = build(form)
+                entries[key] = tuple((section, tuple(items)) for section, items in sections.items())
+        finally:
+            package_logger.setLevel(previous_level)
+        logger.info("决策表编译完成: %d项, 耗时%.3f秒", len(entries), time.perf_counter() - start)
+        return cls(entries)
+
+    def lookup(self, form_data: Dict[str, Any]) -> Optional['OrderedDict[str, Section]']:
+        """
+        查找表单对应的材料清单
+
+        Args:
+            form_data: 用户提交的表单数据
+
+        Returns:
+            材料清单（有序字典每次新建，调用方可以增删部分；各部分是决策表中共享的元组），表单不在决策表范围内时返回None
+        """
+        key = decision_key(form_data)
+        if key is None:
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return OrderedDict(entry)
+
+
+def config_fingerprint(config: Dict[str, Any]) -> str:
+    """配置内容的摘要，用于识别相同的配置"""
+    payload = json.dumps(config, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def code_version() -> str:
+    """本包源代码的摘要（生成器代码变化后，已写入文件的决策表失效）"""
+    global _code_version
+    if _code_version is None:
+        package_dir = os.path.dirname(os.path.abspath(__file__))
+        digest = hashlib.sha1()
+        for path in sorted(glob.glob(os.path.join(package_dir, '**', '*.py'), recursive=True)):
+            digest.update(os.path.relpath(path, package_dir).encode('utf-8'))
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        _code_version = digest.hexdigest()[:12]
+    return _code_version
+
+
+def table_dir() -> Optional[str]:
+    """编译结果目录（DECISION_TABLE_DIR，为空时返回None）"""
+    return os.environ.get('DECISION_TABLE_DIR', DEFAULT_TABLE_DIR) or None
+
+
+def _load_table(path: str) -> Optional[DecisionTable]:
+    """读取编译结果文件，文件不存在、不属于当前用户或无法读取时返回None"""
+    try:
+        with open(path, 'rb') as f:
+            # 只读取当前用户写入的文件（pickle可以执行任意代码）
+            if os.fstat(f.fileno()).st_uid != os.getuid():
+                logger.warning("决策表文件不属于当前用户，忽略: %s", path)
+                return None
+            return DecisionTable(pickle.load(f))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning("读取决策表文件失败 %s: %s", path, str(e))
+        return None
+
+
+def _save_table(path: str, table: DecisionTable) -> None:
+    """写入编译结果文件，并删除较早的文件"""
+    write_atomic(path, pickle.dumps(table._entries, protocol=pickle.HIGHEST_PROTOCOL))
+    paths = sorted(glob.glob(os.path.join(os.path.dirname(path), 'table-*.pickle')), key=os.path.getmtime)
+    for old_path in paths[:-_MAX_TABLE_FILES]:
+        if old_path != path:
+            for stale in (old_path, old_path + '.lock'):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+
+
+def _shared_table(fingerprint: str, build: Callable[[Dict[str, Any]], Dict[str, List[str]]]) -> DecisionTable:
+    """读取其他进程已写入的编译结果，没有时编译并写入，其他进程正在编译时等它写完"""
+    directory = table_dir()
+    if directory is None:
+        return DecisionTable.compile(build)
+    path = os.path.join(directory, f"table-{fingerprint[:16]}-{code_version()}.pickle")
+    table = _load_table(path)
+    if table is not None:
+        return table
+    try:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        with file_lock(path):
+            table = _load_table(path)
+            if table is None:
+                table = DecisionTable.compile(build)
+                _save_table(path, table)
+    except OSError as e:
+        # 目录不可写时仍然使用本进程编译的结果
+        logger.warning("无法写入决策表文件 %s: %s", path, str(e))
+        if table is None:
+            table = DecisionTable.compile(build)
+    return table
+
+
+def get_decision_table(config: Dict[str, Any],
+                       build: Callable[[Dict[str, Any]], Dict[str, List[str]]]) -> DecisionTable:
+    """
+    获取配置对应的决策表，同一配置只编译一次（进程内和 DECISION_TABLE_DIR 中的编译结果）
+
+    Args:
+        config: 材料配置
+        build: 生成函数，见 DecisionTable.compile
+
+    Returns:
+        决策表
+    """
+    global _latest_table
+    fingerprint = config_fingerprint(config)
+    with _compiled_lock:
+        table = _compiled_tables.get(fingerprint)
+        if table is None:
+            table = _shared_table(fingerprint, build)
+            _compiled_tables[fingerprint] = table
+        _latest_table = table
+        return table
@@ -4,6 +4,8 @@
 from typing import Dict, List, Any, Optional
 import logging
 
+from document_generator.form import as_form
+
 logger = logging.getLogger(__name__)
 
 class FamilyMaterialsGenerator:
@@ -29,20 +31,21 @@ class FamilyMaterialsGenerator:
             家属材料列表
         """
         # 绑签申请不需要家属材料，直接返回空列表
-        application_type = form_data.get('applicationType', '')
+        form = as_form(form_data)
+        application_type = form.application_type
         if application_type == 'BINDING':
             return []
             
         # 检查是否有家属
-        has_family = self._check_has_family(form_data)
+        has_family = self._check_has_family(form)
         
         # 如果没有家属，返回空列表
         if not has_family:
             return []
         
         # 获取居住地和户籍地信息
-        residence_consulate = form_data.get('residenceConsulate', '').lower()
-        hukou_consulate = form_data.get('hukouConsulate', '').lower()
+        residence_consulate = form.residence_consulate
+        hukou_consulate = form.hukou_consulate
         
         # 检查是否需要居住证明
         residence_proof_needed = residence_consulate != hukou_consulate
@@ -51,12 +54,10 @@ class FamilyMaterialsGenerator:
         family_materials = []
         
         # 根据申请类型获取不同家属材料
-        application_type = form_data.get('applicationType', '')
-        
         if application_type == 'BINDING':
             # 绑签申请
-            family_relation = form_data.get('familyRelation', '')
-            family_visa_type = form_data.get('familyVisaType', '')
+            family_relation = form.family_relation
+            family_visa_type = form.family_visa_type
             
             # 获取绑签配置
             binding_config = self.config.get('familyApplications', {}).get('afterMainApplicant', {})
@@ -81,35 +82,15 @@ class FamilyMaterialsGenerator:
             family_materials.append("1.基本材料内的1、2、3、4项目")
             family_materials.append("2.与主申请人的关系证明")
             
-            # 获取家庭成员信息
-            family_members = form_data.get('familyMembers', [])
-            if family_members and isinstance(family_members, list) and len(family_members) > 0:
-                # 获取有特别要求的家庭成员
-                member_idx = 3  # 从第3点开始编号
-                
-                for i, member in enumerate(family_members, 1):
-                    if not member or not isinstance(member, dict):
-                        continue
-                        
-                    member_name = member.get('name', f'家庭成员{i}')
-                    member_identity = member.get('identityType', '')
-                    
-                    # 根据身份类型生成更详细和易读的说明
-                    if member_identity == 'STUDENT':
-                        family_materials.append(f"{member_idx}. {member_name}需要提供学信网在线学籍验证报告")
-                        member_idx += 1
-                    elif member_identity == 'CHILD':
-                        family_materials.append(f"{member_idx}. {member_name}需要由监护人陪同并提供监护关系证明")
-                        member_idx += 1
-                    elif member_identity == 'RETIRED':
-                        # 退休人员材料统一显示在其他材料部分，不再在家属材料中显示
-                        logger.debug(f"家庭成员 {member_name} 是退休人员({member_identity})，材料将在其他材料部分显示")
-                        pass
-                    elif member_identity == 'FREELANCER' or member_identity == 'FREELANCE':
-                        # 自由职业者的材料要求统一显示在其他材料部分
-                        # 不再在家属材料中显示
-                        logger.debug(f"家庭成员 {member_name} 是自由职业者({member_identity})，材料将在其他材料部分显示")
-                        pass
+            # 有特别要求的家庭成员（学生、未成年人）从家庭成员索引中读取
+            # 退休人员和自由职业者的材料统一显示在其他材料部分，不在家属材料中显示
+            member_idx = 3  # 从第3点开始编号
+            for member in form.family_profile.with_identity('STUDENT', 'CHILD'):
+                if member.identity_type == 'STUDENT':
+                    family_materials.append(f"{member_idx}. {member.name}需要提供学信网在线学籍验证报告")
+                else:
+                    family_materials.append(f"{member_idx}. {member.name}需要由监护人陪同并提供监护关系证明")
+                member_idx += 1
         
         else:
             # 一般家属材料（普通申请但有家属）
@@ -125,24 +106,10 @@ class FamilyMaterialsGenerator:
         """检查是否有家属"""
         # 如果是绑签申请，返回False（绑签申请自身就是作为家属申请，不需要家属材料）
         # 如果是家庭申请，返回True
-        application_type = form_data.get('applicationType', '')
-        if application_type == 'BINDING':
+        form = as_form(form_data)
+        if form.application_type == 'BINDING':
             return False
-        elif application_type == 'FAMILY':
-            return True
-        
-        # 检查其他家属相关字段
-        for field in ['hasFamily', 'has_family', 'familyMembers']:
-            if field in form_data:
-                value = form_data[field]
-                if isinstance(value, bool):
-                    return value
-                elif isinstance(value, list) and len(value) > 0:
-                    return True
-                elif value in ['true', 'True', '1', 1]:
-                    return True
-        
-        return False
+        return form.has_family
     
     def _get_relation_text(self, relation: str) -> str:
         """获取关系文本"""
@@ -4,6 +4,8 @@
 from typing import Dict, List, Any, Optional
 import logging
 
+from document_generator.form import as_form
+
 logger = logging.getLogger(__name__)
 
 class FinancialMaterialsGenerator:
@@ -29,10 +31,11 @@ class FinancialMaterialsGenerator:
             财力证明材料列表
         """
         # 提取表单数据
-        process_type = form_data.get('processType', '')
-        identity_type = form_data.get('identityType', '')
-        application_type = form_data.get('applicationType', '')
-        visa_duration = self._get_visa_duration(form_data)
+        form = as_form(form_data)
+        process_type = form.process_type
+        identity_type = form.identity_type
+        application_type = form.application_type
+        visa_duration = form.visa_duration
         
         # 初始化财力材料列表
         financial_materials = []
@@ -47,41 +50,23 @@ class FinancialMaterialsGenerator:
             financial_materials = self._generate_family_economic_materials()
         elif process_type == 'TAX':
             # 税单办理方式
-            financial_materials = self._generate_tax_materials(form_data, visa_duration)
+            financial_materials = self._generate_tax_materials(form, visa_duration)
         elif process_type == 'STUDENT':
             # 特定大学生办理
-            financial_materials = self._generate_student_materials(form_data)
+            financial_materials = self._generate_student_materials(form)
         elif process_type == 'SIMPLIFIED':
             # 新政简化三年办理
             financial_materials = self._generate_simplified_materials()
         else:
             # 普通经济材料办理
-            financial_materials = self._generate_normal_materials(form_data, visa_duration, identity_type)
+            financial_materials = self._generate_normal_materials(form, visa_duration, identity_type)
         
         logger.debug("生成财力证明材料: %s", financial_materials)
         return financial_materials
     
-    def _get_visa_duration(self, form_data: Dict[str, Any]) -> str:
-        """获取标准化的签证期限"""
-        visa_duration = None
-        for field in ['visaDuration', 'visaType']:
-            if field in form_data and form_data[field]:
-                visa_duration = form_data[field]
-                break
-        
-        # 标准化签证期限
-        if visa_duration in ['SINGLE', 'single', '单次']:
-            return 'SINGLE'
-        elif visa_duration in ['THREE', 'three', '三年多次']:
-            return 'THREE'
-        elif visa_duration in ['FIVE', 'five', '五年多次']:
-            return 'FIVE'
-        else:
-            return 'SINGLE'  # 默认为单次
-    
     def _generate_tax_materials(self, form_data: Dict[str, Any], visa_duration: str) -> List[str]:
         """生成税单办理的财力材料"""
-        residence_consulate = form_data.get('residenceConsulate', '').lower()
+        residence_consulate = as_form(form_data).residence_consulate
         
         # 获取领区特定的税单要求
         tax_requirements = self.config.get('processMethods', {}).get('TAX', {}).get('requirements', {})
@@ -99,12 +84,12 @@ class FinancialMaterialsGenerator:
     
     def _generate_student_materials(self, form_data: Dict[str, Any]) -> List[str]:
         """生成特定大学生的财力材料"""
-        graduate_status = form_data.get('graduateStatus', '')
+        graduate_status = as_form(form_data).graduate_status
         
         # 获取学生特定配置
         student_config = self.config.get('visaRequirements', {}).get('SINGLE', {}).get('education', {})
         
-        if graduate_status == 'graduate' or graduate_status == '已毕业':
+        if graduate_status == 'graduate':
             # 毕业生
             return [student_config.get('graduate', '提供学信网电子学历注册备案表（毕业三年内）')]
         else:
@@ -118,9 +103,10 @@ class FinancialMaterialsGenerator:
     
     def _generate_normal_materials(self, form_data: Dict[str, Any], visa_duration: str, identity_type: str) -> List[str]:
         """生成普通经济材料办理的财力材料"""
-        # 获取用户选择的经济材料类型
-        economic_material = form_data.get('economicMaterial', '')
-        residence_consulate = form_data.get('residenceConsulate', '').lower()
+        # 获取用户选择的经济材料类型（别名已在解析表单时统一）
+        form = as_form(form_data)
+        economic_material = form.economic_material
+        residence_consulate = form.residence_consulate
         
         # 详细记录经济材料类型，辅助诊断
         logger.debug("普通经济材料办理: 经济材料类型=%s, 类型=%s, 签证期限=%s", 
@@ -129,24 +115,24 @@ class FinancialMaterialsGenerator:
         # 根据经济材料类型返回对应的要求
         if economic_material:
             # 信用卡金卡
-            if economic_material in ['credit_card', 'creditCard']:
+            if economic_material == 'credit_card':
                 logger.debug("已选择信用卡金卡，生成对应材料清单")
                 return ["信用卡金卡及以上（自行遮挡CVV码）+有效性证明（近期三个月电子账单或pos机联）", 
                         "备注：账单联系信用卡客服索取，需体现姓名/卡号/额度/消费明细"]
             
             # 工资流水相关选项
-            elif economic_material in ['salary_single', 'salarySingle']:
+            elif economic_material == 'salary_single':
                 logger.debug("已选择工资流水10万，生成对应材料清单")
                 return ["年工资流水10万以上（需可以验证，并仅统计能确认是工资收入的项）"]
-            elif economic_material in ['salary_three', 'salaryThree']:
+            elif economic_material == 'salary_three':
                 logger.debug("已选择工资流水20万，生成对应材料清单")
                 return ["年工资流水20万以上（需可以验证，并仅统计能确认是工资收入的项）"]
-            elif economic_material in ['salary_five', 'salaryFive']:
+            elif economic_material == 'salary_five':
                 logger.debug("已选择工资流水50万，生成对应材料清单")
                 return ["年工资流水50万以上（需可以验证，并仅统计能确认是工资收入的项）"]
             
             # 存款/理财证明相关选项
-            elif economic_material in ['deposit_single', 'depositSingle']:
+            elif economic_material == 'deposit_single':
                 logger.debug("已选择存款证明10万，生成对应材料清单")
                 # 上海领区需要额外提供收入流水
                 if residence_consulate == 'shanghai':
@@ -154,7 +140,7 @@ class FinancialMaterialsGenerator:
                             f"近期一年的收入流水"]
                 else:
                     return [f"存款/理财证明：10万以上（需要提前确认是可验证银行开具的存款/理财证明）"]
-            elif economic_material in ['deposit_three', 'depositThree']:
+            elif economic_material == 'deposit_three':
                 logger.debug("已选择存款证明50万，生成对应材料清单")
                 # 上海领区需要额外提供收入流水
                 if residence_consulate == 'shanghai':
@@ -162,7 +148,7 @@ class FinancialMaterialsGenerator:
                             f"近期一年的收入流水"]
                 else:
                     return [f"存款/理财证明：50万以上（需要提前确认是可验证银行开具的存款/理财证明）"]
-            elif economic_material in ['deposit_five', 'depositFive']:
+            elif economic_material == 'deposit_five':
                 logger.debug("已选择存款证明100万，生成对应材料清单")
                 # 上海领区需要额外提供收入流水
                 if residence_consulate == 'shanghai':
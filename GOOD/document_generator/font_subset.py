@@ -0,0 +1,235 @@
+"""
+日本签证材料清单生成器 - PDF字体子集构建模块
+
+从系统中文字体中截取PDF实际会用到的字形，生成随项目发布的小字体文件：
+document_config.json中的全部文本、生成器和PDF模板中的字符串字面量，以及常用姓名用字（GB2312一级汉字）。
+PDF样式表通过文件路径引用该字体，子集之外的字形回退到系统中文字体。
+
+字体文件不随代码提交，部署时由构建步骤生成；--check 检查字体是否存在且覆盖当前的配置和生成器文本，
+不满足时以非零状态退出。设置环境变量 PDF_SUBSET_FONT_REQUIRED=1 时，缺少子集字体的进程拒绝启动，
+避免悄悄回退到系统字体。
+
+用法：
+    python -m document_generator.font_subset [--source 字体文件] [--output 输出路径]
+    python -m document_generator.font_subset --check
+"""
+from typing import Iterable, List, Optional, Set
+import argparse
+import ast
+import glob
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 随项目发布的子集字体，PDF样式表按路径引用
+SUBSET_FONT_PATH = os.path.join(PROJECT_ROOT, 'static', 'fonts', 'pdf-cjk-subset.otf')
+
+# 查找源字体时依次尝试的系统字体（与PDF样式表中local()的顺序一致）
+SOURCE_FONT_FAMILIES = (
+    'Noto Sans CJK SC', 'WenQuanYi Micro Hei', 'WenQuanYi Zen Hei',
+    'Microsoft YaHei', 'SimSun', 'SimHei', 'AR PL UMing CN'
+)
+
+# ASCII可打印字符和PDF中常见的全角标点
+EXTRA_CHARACTERS = ''.join(chr(code) for code in range(0x20, 0x7f)) + '，。、；：？！“”‘’（）【】《》—…·￥％＋－／ '
+
+
+def _config_strings(value) -> Iterable[str]:
+    """递归取出配置中的所有字符串（包括键名）"""
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for key, item in value.items():
+            yield str(key)
+            yield from _config_strings(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from _config_strings(item)
+
+
+def _source_literals(path: str) -> Iterable[str]:
+    """取出Python源文件中的所有字符串字面量（包括f-string中的常量部分）"""
+    with open(path, 'r', encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=path)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            yield node.value
+
+
+def gb2312_level1() -> str:
+    """GB2312一级汉字（3755个常用字），覆盖绝大多数姓名用字"""
+    chars = []
+    for high in range(0xB0, 0xD8):
+        for low in range(0xA1, 0xFF):
+            try:
+                chars.append(bytes([high, low]).decode('gb2312'))
+            except UnicodeDecodeError:
+                continue
+    return ''.join(chars)
+
+
+def subset_font_required() -> bool:
+    """是否要求使用子集字体（环境变量PDF_SUBSET_FONT_REQUIRED=1）"""
+    return os.environ.get('PDF_SUBSET_FONT_REQUIRED', '0') == '1'
+
+
+def collect_characters(config_path: Optional[str] = None) -> Set[str]:
+    """
+    收集PDF中可能出现的全部字符
+
+    Args:
+        config_path: 材料配置文件路径，默认使用static/js/document_config.json
+
+    Returns:
+        字符集合
+    """
+    return required_characters(config_path) | set(gb2312_level1())
+
+
+def required_characters(config_path: Optional[str] = None) -> Set[str]:
+    """
+    收集配置、生成器和PDF模板中的固定文本字符（不含姓名用字），子集字体必须全部覆盖
+
+    Args:
+        config_path: 材料配置文件路径，默认使用static/js/document_config.json
+
+    Returns:
+        字符集合
+    """
+    config_path = config_path or os.path.join(PROJECT_ROOT, 'static', 'js', 'document_config.json')
+    texts: List[str] = [EXTRA_CHARACTERS]
+
+    with open(config_path, 'r', encoding='utf-8') as f:
+        texts.extend(_config_strings(json.load(f)))
+
+    for path in sorted(glob.glob(os.path.join(PROJECT_ROOT, 'document_generator', '*.py'))):
+        texts.extend(_source_literals(path))
+
+    for path in sorted(glob.glob(os.path.join(PROJECT_ROOT, 'templates', 'pdf', '*.html'))):
+        with open(path, 'r', encoding='utf-8') as f:
+            texts.append(f.read())
+
+    return {char for text in texts for char in text if char.isprintable()}
+
+
+def missing_characters(font_path: str, config_path: Optional[str] = None) -> Set[str]:
+    """
+    子集字体没有覆盖的固定文本字符（修改配置或生成器文本后没有重新生成时不为空）
+
+    Args:
+        font_path: 子集字体路径
+        config_path: 材料配置文件路径
+
+    Returns:
+        缺少的字符集合
+
+    Raises:
+        FileNotFoundError: 子集字体不存在
+    """
+    from fontTools.ttLib import TTFont
+
+    if not os.path.exists(font_path):
+        raise FileNotFoundError(font_path)
+    cmap = TTFont(font_path, lazy=True).getBestCmap() or {}
+    # 空白字符不需要字形
+    return {char for char in required_characters(config_path) if ord(char) not in cmap and not char.isspace()}
+
+
+def find_source_font() -> Optional[str]:
+    """通过fontconfig查找系统中文字体文件"""
+    if not shutil.which('fc-match'):
+        return None
+    for family in SOURCE_FONT_FAMILIES:
+        result = subprocess.run(['fc-match', '-f', '%{family}|%{file}', family],
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        matched_family, _, path = result.stdout.partition('|')
+        # fc-match找不到时会返回一个不相关的默认字体，只接受名称匹配的结果
+        if family in matched_family.split(',') and os.path.exists(path):
+            return path
+    return None
+
+
+def build_subset(source_path: str, output_path: str, characters: Set[str], font_number: int = 0) -> int:
+    """
+    从源字体生成子集字体
+
+    Args:
+        source_path: 源字体文件（支持.ttc字体集合）
+        output_path: 输出路径
+        characters: 需要保留的字符
+        font_number: 字体集合中的字体序号
+
+    Returns:
+        子集字体实际包含的字符数
+    """
+    from fontTools import subset
+    from fontTools.ttLib import TTFont
+
+    options = subset.Options()
+    options.name_IDs = ['*']
+    options.notdef_outline = True
+    # PDF按矢量渲染，不需要hinting指令
+    options.hinting = False
+    options.desubroutinize = True
+    options.font_number = font_number
+
+    font = TTFont(source_path, fontNumber=font_number, lazy=False)
+    subsetter = subset.Subsetter(options=options)
+    subsetter.populate(unicodes=[ord(char) for char in characters])
+    subsetter.subset(font)
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    font.save(output_path)
+    return len(font.getBestCmap() or {})
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='构建PDF使用的中文子集字体')
+    parser.add_argument('--source', help='源字体文件，默认通过fontconfig查找系统中文字体')
+    parser.add_argument('--font-number', type=int, default=0, help='.ttc字体集合中的字体序号')
+    parser.add_argument('--output', default=SUBSET_FONT_PATH, help='输出路径')
+    parser.add_argument('--config', help='材料配置文件路径')
+    parser.add_argument('--check', action='store_true', help='只检查子集字体是否存在且覆盖当前文本')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    # fontTools会逐个表输出裁剪日志，缺失字形在最后统一汇总
+    logging.getLogger('fontTools').setLevel(logging.ERROR)
+
+    if args.check:
+        try:
+            missing = missing_characters(args.output, args.config)
+        except FileNotFoundError:
+            logger.error("子集字体不存在: %s，请运行python -m document_generator.font_subset生成", args.output)
+            return 1
+        if missing:
+            logger.error("子集字体缺少%d个字符，请重新生成: %s", len(missing), ''.join(sorted(missing))[:50])
+            return 1
+        logger.info("子集字体覆盖全部固定文本: %s (%d字节)", args.output, os.path.getsize(args.output))
+        return 0
+
+    source = args.source or find_source_font()
+    if not source:
+        logger.error("没有找到中文源字体，请通过--source指定字体文件")
+        return 1
+
+    characters = collect_characters(args.config)
+    covered = build_subset(source, args.output, characters, args.font_number)
+    logger.info("子集字体已生成: %s, 源字体: %s (%d字节), 子集: %d字节, 收集字符%d个, 覆盖%d个",
+                args.output, source, os.path.getsize(source), os.path.getsize(args.output),
+                len(characters), covered)
+    if covered < len(characters):
+        logger.warning("源字体缺少%d个字符的字形，这些字符渲染时回退到系统字体", len(characters) - covered)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
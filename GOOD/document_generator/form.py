@@ -0,0 +1,373 @@
+"""
+日本签证材料清单生成器 - 申请表单模块
+
+请求进入时把原始表单字典解析一次为不可变的 ApplicationForm：领区统一小写，别名字段（visaDuration/visaType、
+hasFamily/has_family、taxPayment/tax/tax_payment等）只解析一次，枚举取值驻留（intern）。
+各生成器、PDF生成器和风险评估服务直接读取解析后的属性；ApplicationForm 同时实现只读映射接口，
+读取PDF显示字段等原始字段的代码可以继续使用 form.get(...)。
+
+家庭成员列表在解析时遍历一次，生成 FamilyProfile（每个成员的姓名、身份、是否需要居住证明，以及按身份统计的人数），
+居住证明、家属材料、其他材料和PDF申请人信息表都读取同一个索引，不再各自遍历成员列表。
+"""
+from typing import Dict, Any, Iterator, Optional, Tuple, FrozenSet
+from collections import Counter
+from collections.abc import Mapping
+import hashlib
+import json
+import logging
+import sys
+
+from document_generator.utils import get_visa_duration, check_has_family, needs_residence_proof
+
+logger = logging.getLogger(__name__)
+
+# 经济材料别名 -> 规范取值
+ECONOMIC_MATERIAL_ALIASES = {
+    'credit_card': 'credit_card', 'creditCard': 'credit_card',
+    'salary_single': 'salary_single', 'salarySingle': 'salary_single',
+    'salary_three': 'salary_three', 'salaryThree': 'salary_three',
+    'salary_five': 'salary_five', 'salaryFive': 'salary_five',
+    'deposit_single': 'deposit_single', 'depositSingle': 'deposit_single',
+    'deposit_three': 'deposit_three', 'depositThree': 'deposit_three',
+    'deposit_five': 'deposit_five', 'depositFive': 'deposit_five',
+}
+
+# 学历状态别名 -> 规范取值
+GRADUATE_STATUS_ALIASES = {
+    'graduate': 'graduate', '已毕业': 'graduate',
+    'current': 'current', '在读': 'current',
+}
+
+
+def _first_value(data: Mapping, fields: Tuple[str, ...]) -> Any:
+    """按顺序返回第一个有值的别名字段"""
+    for field in fields:
+        if field in data and data[field]:
+            return data[field]
+    return None
+
+
+def _first_flag(data: Mapping, fields: Tuple[str, ...]) -> bool:
+    """按顺序读取第一个存在的布尔别名字段"""
+    for field in fields:
+        if field in data:
+            value = data[field]
+            if isinstance(value, bool):
+                return value
+            return value in ['true', 'True', '1', 1]
+    return False
+
+
+def _enum(value: Any) -> str:
+    """枚举字段取值：非字符串视为未填写，字符串驻留以便快速比较"""
+    return sys.intern(value) if isinstance(value, str) else ''
+
+
+def _parse_family_members(value: Any) -> Tuple[Any, ...]:
+    """解析家庭成员列表（表单提交时可能是JSON字符串）"""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except json.JSONDecodeError:
+            logger.error("无法解析家庭成员字符串: %s", value)
+            return ()
+    if not isinstance(value, (list, tuple)):
+        if value:
+            logger.warning("表单数据中的familyMembers不是列表类型")
+        return ()
+    return tuple(dict(member) if isinstance(member, dict) else member for member in value)
+
+
+def _member_text(member: Dict[str, Any], field: str) -> str:
+    """读取家庭成员的字符串字段，非字符串视为未填写"""
+    value = member.get(field, '')
+    return value if isinstance(value, str) else ''
+
+
+class FamilyMember:
+    """家庭成员的解析结果"""
+
+    __slots__ = ('index', 'name', 'relation', 'identity_type', 'residence_consulate', 'hukou_consulate',
+                 'needs_residence_proof', 'data')
+
+    def __init__(self, index: int, data: Dict[str, Any]):
+        """
+        解析家庭成员
+
+        Args:
+            index: 成员在列表中的序号（从1开始，用于默认名称）
+            data: 家庭成员原始数据
+        """
+        self.index = index
+        self.data = data
+        self.name = data.get('name', f'家庭成员{index}')
+        self.relation = _enum(data.get('relation', ''))
+        self.identity_type = _enum(data.get('identityType', ''))
+        self.residence_consulate = _enum(_member_text(data, 'residenceConsulate').lower())
+        self.hukou_consulate = _enum(_member_text(data, 'hukouConsulate').lower())
+        self.needs_residence_proof = needs_residence_proof(self.residence_consulate, self.hukou_consulate)
+
+    def __repr__(self) -> str:
+        return f"FamilyMember({self.index}, {self.name!r}, {self.identity_type!r})"
+
+
+class FamilyProfile:
+    """家庭成员索引：解析表单时遍历一次成员列表，供各生成器和PDF生成器共用"""
+
+    __slots__ = ('members', 'identity_counts', 'residence_proof_names')
+
+    def __init__(self, family_members: Tuple[Any, ...]):
+        """
+        遍历家庭成员列表生成索引
+
+        Args:
+            family_members: 解析后的家庭成员元组（可能包含格式不正确的项）
+        """
+        members = []
+        identity_counts: Counter = Counter()
+        residence_proof_names = []
+        for index, data in enumerate(family_members, 1):
+            if not isinstance(data, dict):
+                logger.warning("家庭成员数据格式不正确: %s", data)
+                continue
+            member = FamilyMember(index, data)
+            members.append(member)
+            if member.identity_type:
+                identity_counts[member.identity_type] += 1
+            if member.needs_residence_proof:
+                residence_proof_names.append(member.name)
+        self.members: Tuple[FamilyMember, ...] = tuple(members)
+        self.identity_counts = identity_counts
+        self.residence_proof_names: Tuple[Any, ...] = tuple(residence_proof_names)
+
+    def __len__(self) -> int:
+        return len(self.members)
+
+    def has_identity(self, *identity_types: str) -> bool:
+        """是否有家庭成员属于给定身份之一"""
+        return any(self.identity_counts[identity_type] for identity_type in identity_types)
+
+    def with_identity(self, *identity_types: str) -> Tuple[FamilyMember, ...]:
+        """按原顺序返回属于给定身份的家庭成员"""
+        if not self.has_identity(*identity_types):
+            return ()
+        return tuple(member for member in self.members if member.identity_type in identity_types)
+
+
+class ApplicationForm(Mapping):
+    """解析后的不可变申请表单"""
+
+    __slots__ = (
+        'residence_consulate', 'hukou_consulate', 'identity_type', 'process_type', 'application_type',
+        'visa_duration', 'economic_material', 'graduate_status', 'hukou_type', 'family_relation',
+        'family_visa_type', 'has_family', 'family_members', 'family_profile',
+        'education_level', 'tax_payment', 'social_insurance', 'passport_status', 'household_type',
+        'tax_stamped', 'frequent_job_change',
+        '_data', '_hash',
+    )
+
+    def __init__(self, data: Mapping):
+        """
+        解析原始表单
+
+        Args:
+            data: 用户提交的表单数据
+        """
+        data = dict(data)
+        members = _parse_family_members(data.get('familyMembers', []))
+        if 'familyMembers' in data:
+            data['familyMembers'] = members
+        has_family = check_has_family(data)
+
+        hukou_type = data.get('hukouType', 'family')
+        if not hukou_type or hukou_type == 'auto':
+            hukou_type = 'family'
+        elif hukou_type in ('FAMILY', 'COLLECTIVE'):
+            hukou_type = hukou_type.lower()
+
+        economic_material = data.get('economicMaterial', '')
+        economic_material = ECONOMIC_MATERIAL_ALIASES.get(economic_material, economic_material) \
+            if isinstance(economic_material, str) else economic_material or ''
+
+        graduate_status = _enum(data.get('graduateStatus', ''))
+
+        fields = {
+            'residence_consulate': _enum(data.get('residenceConsulate', '').lower()
+                                         if isinstance(data.get('residenceConsulate'), str) else ''),
+            'hukou_consulate': _enum(data.get('hukouConsulate', '').lower()
+                                     if isinstance(data.get('hukouConsulate'), str) else ''),
+            'identity_type': _enum(data.get('identityType', '')),
+            'process_type': _enum(data.get('processType', '')),
+            'application_type': _enum(data.get('applicationType', '')),
+            'visa_duration': get_visa_duration(data),
+            'economic_material': _enum(economic_material) if isinstance(economic_material, str) else economic_material,
+            'graduate_status': GRADUATE_STATUS_ALIASES.get(graduate_status, graduate_status),
+            'hukou_type': _enum(hukou_type) if isinstance(hukou_type, str) else hukou_type,
+            'family_relation': _enum(data.get('familyRelation', '')),
+            'family_visa_type': _enum(data.get('familyVisaType', '')),
+            'has_family': has_family,
+            'family_members': members,
+            'family_profile': FamilyProfile(members),
+            'education_level': _first_value(data, ('educationLevel', 'education', 'education_level')),
+            'tax_payment': _first_value(data, ('taxPayment', 'tax', 'tax_payment')),
+            'social_insurance': _first_value(data, ('socialInsurance', 'social_insurance', 'insurance')),
+            'passport_status': _first_value(data, ('passportStatus', 'passport_status', 'passport')),
+            'household_type': _first_value(data, ('hukouType', 'hukou_type', 'hukou')),
+            'tax_stamped': _first_flag(data, ('taxStamped', 'tax_stamped', 'has_tax_stamp')),
+            'frequent_job_change': _first_flag(data, ('frequentJobChange', 'frequent_job_change',
+                                                      'job_change_frequent')),
+            '_data': data,
+            '_hash': None,
+        }
+        for name, value in fields.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("ApplicationForm是不可变对象")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError("ApplicationForm是不可变对象")
+
+    # 只读映射接口：读取原始字段
+    def __getitem__(self, key: str) -> Any:
+        return self._data[key]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __repr__(self) -> str:
+        return f"ApplicationForm({self._data!r})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为可以JSON序列化的普通字典"""
+        data = dict(self._data)
+        if 'familyMembers' in data:
+            data['familyMembers'] = [dict(member) if isinstance(member, dict) else member
+                                     for member in self.family_members]
+        return data
+
+    def canonical_hash(self) -> str:
+        """
+        表单的规范化哈希，用于缓存键
+
+        别名字段、领区大小写不同但含义相同的表单得到相同的哈希。
+
+        Returns:
+            SHA-256十六进制字符串
+        """
+        if self._hash is None:
+            # family_profile由family_members推导，不计入哈希
+            parsed = {name: getattr(self, name) for name in FORM_FIELDS if name != 'family_profile'}
+            extra = {key: value for key, value in self._data.items() if key not in _PARSED_FIELDS}
+            canonical = json.dumps({'parsed': parsed, 'extra': extra}, sort_keys=True, ensure_ascii=False,
+                                   separators=(',', ':'), default=str)
+            object.__setattr__(self, '_hash', hashlib.sha256(canonical.encode('utf-8')).hexdigest())
+        return self._hash
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, ApplicationForm):
+            return self.canonical_hash() == other.canonical_hash()
+        return super().__eq__(other)
+
+    def __hash__(self) -> int:
+        return hash(self.canonical_hash())
+
+    def changed_fields(self, other: 'ApplicationForm') -> FrozenSet[str]:
+        """
+        与另一个表单相比取值不同的字段
+
+        Args:
+            other: 另一个表单
+
+        Returns:
+            解析后的属性名，以及取值不同的原始字段（带 RAW_FIELD_PREFIX 前缀）
+        """
+        changed = {name for name in FORM_FIELDS
+                   if name != 'family_profile' and getattr(self, name) != getattr(other, name)}
+        if 'family_members' in changed:
+            changed.add('family_profile')
+        for key in set(self._data) | set(other._data):
+            if self._data.get(key) != other._data.get(key):
+                changed.add(RAW_FIELD_PREFIX + key)
+        return frozenset(changed)
+
+
+# 解析后的表单属性
+FORM_FIELDS = tuple(name for name in ApplicationForm.__slots__ if not name.startswith('_'))
+
+# 通过映射接口读取的原始字段在读取集合中的前缀；遍历全部原始字段时记录 ALL_FIELDS
+RAW_FIELD_PREFIX = 'raw:'
+ALL_FIELDS = '*'
+
+_FORM_FIELD_SET = frozenset(FORM_FIELDS)
+
+
+class TrackingForm(ApplicationForm):
+    """
+    记录读取了哪些字段的表单视图
+
+    与原表单共用解析结果，不重新解析。各生成步骤使用各自的 TrackingForm，
+    执行后 reads 即该步骤结果所依赖的字段：这些字段不变时，步骤的分支和结果都不变。
+    """
+
+    __slots__ = ('reads',)
+
+    def __init__(self, form: ApplicationForm):
+        for name in ApplicationForm.__slots__:
+            object.__setattr__(self, name, object.__getattribute__(form, name))
+        object.__setattr__(self, 'reads', set())
+
+    def __getattribute__(self, name: str) -> Any:
+        if name in _FORM_FIELD_SET:
+            object.__getattribute__(self, 'reads').add(name)
+        return object.__getattribute__(self, name)
+
+    def __getitem__(self, key: str) -> Any:
+        self.reads.add(RAW_FIELD_PREFIX + key)
+        return self._data[key]
+
+    def __contains__(self, key: Any) -> bool:
+        self.reads.add(RAW_FIELD_PREFIX + str(key))
+        return key in self._data
+
+    def __iter__(self) -> Iterator[str]:
+        self.reads.add(ALL_FIELDS)
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        self.reads.add(ALL_FIELDS)
+        return len(self._data)
+
+    def to_dict(self) -> Dict[str, Any]:
+        self.reads.add(ALL_FIELDS)
+        return super().to_dict()
+
+
+# 已解析为属性的原始字段，规范化哈希中只计入解析后的取值
+_PARSED_FIELDS = frozenset((
+    'residenceConsulate', 'hukouConsulate', 'identityType', 'processType', 'applicationType',
+    'visaDuration', 'visaType', 'economicMaterial', 'graduateStatus', 'hukouType', 'familyRelation',
+    'familyVisaType', 'hasFamily', 'has_family', 'familyMembers',
+    'educationLevel', 'education', 'education_level', 'taxPayment', 'tax', 'tax_payment',
+    'socialInsurance', 'social_insurance', 'insurance', 'passportStatus', 'passport_status', 'passport',
+    'hukou_type', 'hukou', 'taxStamped', 'tax_stamped', 'has_tax_stamp',
+    'frequentJobChange', 'frequent_job_change', 'job_change_frequent',
+))
+
+
+def as_form(form_data: Optional[Mapping]) -> 'ApplicationForm':
+    """
+    获取表单对象，已经解析过的表单直接返回
+
+    Args:
+        form_data: ApplicationForm或原始表单字典
+
+    Returns:
+        ApplicationForm
+    """
+    if isinstance(form_data, ApplicationForm):
+        return form_data
+    return ApplicationForm(form_data or {})
@@ -0,0 +1,120 @@
+"""
+日本签证材料清单生成器 - 增量生成模块
+
+DocumentGenerator.generate_traced 逐步骤生成材料清单，每个步骤使用独立的 TrackingForm，
+记录该步骤读取了哪些表单字段。用户只修改了几个字段时，只有读取集合与修改字段有交集的步骤需要重新执行，
+其余步骤直接沿用上一次的结果；返回给页面的是按材料部分计算的差异，而不是整个清单。
+
+生成器在方法开头统一读取需要的字段，读取集合偏大（保守），不会漏掉真正的依赖。
+"""
+from typing import Dict, Any, Optional, Tuple, FrozenSet, Union
+from collections import OrderedDict
+import threading
+
+from document_generator.form import ApplicationForm, ALL_FIELDS
+from document_generator.decision_table import Section, SectionsEntry
+
+# 增量结果存储默认保留的条目数
+DEFAULT_MAX_ENTRIES = 2048
+
+class StepResult:
+    """一个生成步骤的结果和读取的字段"""
+
+    __slots__ = ('name', 'reads', 'sections')
+
+    def __init__(self, name: str, reads: FrozenSet[str], sections: SectionsEntry):
+        self.name = name
+        self.reads = reads
+        self.sections = sections
+
+    def depends_on(self, changed: FrozenSet[str]) -> bool:
+        """修改的字段是否可能影响该步骤的结果"""
+        if not changed:
+            return False
+        return ALL_FIELDS in self.reads or not self.reads.isdisjoint(changed)
+
+
+class TracedResult:
+    """带有每个步骤读取集合的材料清单"""
+
+    __slots__ = ('form', 'steps', 'document_list', 'recomputed')
+
+    def __init__(self, form: ApplicationForm, steps: Tuple[StepResult, ...],
+                 document_list: 'OrderedDict[str, Section]', recomputed: Tuple[str, ...]):
+        """
+        Args:
+            form: 生成时使用的表单
+            steps: 各步骤结果（按执行顺序）
+            document_list: 按显示顺序排列的材料清单
+            recomputed: 本次实际执行的步骤名称
+        """
+        self.form = form
+        self.steps = steps
+        self.document_list = document_list
+        self.recomputed = recomputed
+
+
+def apply_changes(form: ApplicationForm, changes: Dict[str, Any]) -> ApplicationForm:
+    """
+    在表单上应用字段修改
+
+    Args:
+        form: 原表单
+        changes: 字段名 -> 新值，值为None表示删除该字段
+
+    Returns:
+        新表单
+    """
+    data = form.to_dict()
+    for key, value in changes.items():
+        if value is None:
+            data.pop(key, None)
+        else:
+            data[key] = value
+    return ApplicationForm(data)
+
+
+def diff_sections(old: Dict[str, Section], new: Dict[str, Section]) -> Dict[str, Any]:
+    """
+    按材料部分比较两个材料清单
+
+    Returns:
+        {'changed': 新增或内容变化的部分 -> 材料列表, 'removed': 删除的部分, 'order': 新清单的部分顺序}
+    """
+    return {
+        'changed': OrderedDict((section, items) for section, items in new.items()
+                               if old.get(section) != items),
+        'removed': [section for section in old if section not in new],
+        'order': list(new),
+    }
+
+
+class IncrementalStore:
+    """结果令牌 -> 表单或已追踪的结果（进程内LRU）"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: 'OrderedDict[str, Union[ApplicationForm, TracedResult]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[Union[ApplicationForm, TracedResult]]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                self._entries.move_to_end(token)
+            return entry
+
+    def put(self, token: str, entry: Union[ApplicationForm, TracedResult]) -> None:
+        """保存令牌对应的表单；已经保存了追踪结果时不用表单覆盖"""
+        with self._lock:
+            current = self._entries.get(token)
+            if isinstance(current, TracedResult) and not isinstance(entry, TracedResult):
+                self._entries.move_to_end(token)
+                return
+            self._entries[token] = entry
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,555 @@
+"""
+日本签证材料清单生成器 - 日志索引模块
+
+逐行读取日志文件（不整体加载），把材料清单和PDF请求记录的位置、时间和请求字段写入SQLite索引，
+之后的查询只读索引，需要原文时按偏移量读取对应的行。再次运行时从上次读到的位置继续。
+
+已索引的文件按inode和开头内容（而不是路径）识别：轮转后改名的文件（app_log.txt -> app_log.txt.1）保留原有记录，
+改名后的路径在下次读取该文件或同名的新文件时更新；原地截断（inode不变、开头内容变化或文件变短）的文件重新建立索引。
+
+同时支持两种日志格式：
+- JSON行（log_pipeline）：每个请求一条请求摘要（"收到材料清单生成请求"/"收到PDF生成请求"，包含材料部分）
+  和抽样的请求明细（category为generate_request/pdf_request）；
+- 文本行（旧版 "时间 - 名称 - 级别 - 消息"）：请求摘要、"收到PDF生成请求，原始表单数据"，
+  之后的 "生成的材料清单"/"为PDF生成的材料清单" 记录补充到前一个请求的材料部分。
+
+每个请求只有一条索引记录：请求明细按请求ID（没有请求ID时按同一进程和线程中前一条摘要）合并到请求摘要的记录中，
+保存明细所在的位置；找不到对应摘要的明细（例如旧版日志中没有摘要的PDF请求）单独作为一条记录。
+"""
+from typing import Dict, List, Any, Optional, Iterator, Tuple
+import argparse
+import ast
+import datetime
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import sys
+
+logger = logging.getLogger(__name__)
+
+# 包含这些内容的行才需要解析
+_MARKERS = tuple(marker.encode('utf-8') for marker in (
+    '收到材料清单生成请求', '收到PDF生成请求', '生成的材料清单', '"category"',
+))
+
+# 请求明细类别 -> 对应的请求摘要类型
+DETAIL_KINDS = {'generate_request': 'generate', 'pdf_request': 'pdf'}
+
+# 索引结构版本，结构变化时重新建立索引
+SCHEMA_VERSION = 3
+
+_TEXT_LINE = re.compile(r'^(\d{4}-\d{2}-\d{2}) (\d{2}:\d{2}:\d{2}),(\d{3}) - (\S+) - ([A-Z]+) - (.*)$')
+_SECTION_NAME = re.compile(r"(?:\{|\], |\), )'([^']+)': [\[(]")
+
+# 判断文件是否被替换时比较的开头字节数
+_HEAD_BYTES = 4096
+
+# 每次提交的行数
+_BATCH_SIZE = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT,
+    inode INTEGER NOT NULL,
+    head TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    ts TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    application_type TEXT,
+    residence TEXT,
+    hukou TEXT,
+    identities TEXT,
+    sections TEXT,
+    request_id TEXT,
+    detail_offset INTEGER,
+    detail_length INTEGER
+);
+CREATE INDEX IF NOT EXISTS files_path ON files (path);
+CREATE INDEX IF NOT EXISTS files_inode ON files (inode);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+CREATE INDEX IF NOT EXISTS events_request ON events (request_id);
+CREATE INDEX IF NOT EXISTS events_kind_ts ON events (kind, ts);
+CREATE INDEX IF NOT EXISTS events_consulate ON events (residence, hukou, ts);
+"""
+
+
+def _joined(values) -> Optional[str]:
+    """多值字段保存为 |A|B| 形式，查询时用LIKE '%|A|%' 匹配"""
+    values = [str(value) for value in values if value]
+    return f"|{'|'.join(values)}|" if values else None
+
+
+def _lower(value: Any) -> Optional[str]:
+    return str(value).lower() if value else None
+
+
+def _form_fields(form: Dict[str, Any]) -> Dict[str, Any]:
+    """从原始表单中取出索引字段"""
+    members = form.get('familyMembers')
+    if isinstance(members, str):
+        try:
+            members = json.loads(members)
+        except json.JSONDecodeError:
+            members = []
+    identities = [form.get('identityType')]
+    if isinstance(members, list):
+        identities.extend(member.get('identityType') for member in members if isinstance(member, dict))
+    return {
+        'application_type': form.get('applicationType'),
+        'residence': _lower(form.get('residenceConsulate')),
+        'hukou': _lower(form.get('hukouConsulate')),
+        'identities': _joined(identities),
+    }
+
+
+def _summary_fields(summary: Dict[str, Any]) -> Dict[str, Any]:
+    """从请求摘要（"收到材料清单生成请求"/"收到PDF生成请求"）中取出索引字段"""
+    return {
+        'application_type': summary.get('applicationType'),
+        'residence': _lower(summary.get('residence')),
+        'hukou': _lower(summary.get('hukou')),
+        'identities': _joined([summary.get('identityType')] + list(summary.get('familyIdentities') or [])),
+        'sections': _joined(summary.get('sections') or []),
+    }
+
+
+def _parse_summary(ts: str, message: str) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+    """解析请求摘要，不是请求摘要时返回None"""
+    for prefix, kind in (('收到材料清单生成请求: ', 'generate'), ('收到PDF生成请求: ', 'pdf')):
+        summary = _after(message, prefix)
+        if summary is not None:
+            try:
+                return ts, kind, _summary_fields(json.loads(summary))
+            except (json.JSONDecodeError, AttributeError, TypeError):
+                return None
+    return None
+
+
+def _text_timestamp(match) -> str:
+    return f'{match.group(1)}T{match.group(2)}.{match.group(3)}'
+
+
+def _after(message: str, prefix: str) -> Optional[str]:
+    index = message.find(prefix)
+    return message[index + len(prefix):] if index >= 0 else None
+
+
+def parse_line(line: str) -> Optional[Tuple[str, str, Dict[str, Any]]]:
+    """
+    解析一行日志
+
+    Returns:
+        (时间, 类型, 字段)；类型为 generate、pdf（请求摘要）、generate_request、pdf_request（请求明细）
+        或 sections（补充前一个请求的材料部分），不需要索引的行返回None。
+        JSON日志的字段中还有request_id和thread（进程号:线程名），用于把明细合并到请求摘要
+    """
+    if line.startswith('{'):
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(record, dict):
+            return None
+        ts = record.get('ts', '')
+        data = record.get('data') if isinstance(record.get('data'), dict) else {}
+        category = record.get('category')
+        if category == 'generate_request':
+            parsed = ts, category, _summary_fields(data.get('request') or {})
+            parsed[2]['sections'] = _joined(data.get('sections') or [])
+        elif category == 'pdf_request':
+            parsed = ts, category, _form_fields(data.get('form') or data.get('raw_form') or {})
+            parsed[2]['sections'] = _joined(data.get('document_list') or {})
+        else:
+            parsed = _parse_summary(ts, str(record.get('message', '')))
+            if parsed is None:
+                return None
+        parsed[2]['request_id'] = record.get('request_id')
+        parsed[2]['thread'] = f"{record['pid']}:{record.get('thread')}" if record.get('pid') is not None else None
+        return parsed
+
+    match = _TEXT_LINE.match(line)
+    if match is None:
+        return None
+    ts, message = _text_timestamp(match), match.group(6)
+    parsed = _parse_summary(ts, message)
+    if parsed is not None:
+        return parsed
+    form = _after(message, '收到PDF生成请求，原始表单数据: ')
+    if form is not None:
+        try:
+            form = ast.literal_eval(form)
+        except (ValueError, SyntaxError):
+            return None
+        return (ts, 'pdf', _form_fields(form)) if isinstance(form, dict) else None
+    sections = _after(message, '生成的材料清单: ')
+    if sections is not None:
+        return ts, 'sections', {'sections': _joined(_SECTION_NAME.findall(sections))}
+    return None
+
+
+def _iter_lines(path: str, offset: int) -> Iterator[Tuple[int, bytes]]:
+    """从offset开始逐行读取完整的行（最后一行没有换行符时不读取，等待下次运行）"""
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while True:
+            line = f.readline()
+            if not line or not line.endswith(b'\n'):
+                return
+            yield offset, line
+            offset += len(line)
+
+
+def _file_head(path: str, length: int) -> str:
+    """文件开头（最多_HEAD_BYTES字节）的摘要，用于判断文件是否被替换"""
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read(min(length, _HEAD_BYTES))).hexdigest()
+
+
+class LogIndex:
+    """日志文件的偏移量索引"""
+
+    def __init__(self, index_path: str):
+        """
+        Args:
+            index_path: SQLite索引文件路径
+        """
+        self.index_path = index_path
+        self._conn = sqlite3.connect(index_path)
+        self._conn.row_factory = sqlite3.Row
+        version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            if self._conn.execute("SELECT name FROM sqlite_master WHERE name = 'events'").fetchone() is not None:
+                logger.info("索引结构已更新，重新建立索引: %s", index_path)
+            self._conn.executescript('DROP TABLE IF EXISTS events; DROP TABLE IF EXISTS files;')
+            self._conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        self._conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    @staticmethod
+    def _same_file(row: sqlite3.Row, path: str, stat: os.stat_result) -> bool:
+        """path处的文件是否就是索引中的文件（inode相同，已索引部分的开头内容相同）"""
+        return (row['inode'] == stat.st_ino and stat.st_size >= row['offset']
+                and row['head'] == _file_head(path, row['offset']))
+
+    def _assign_path(self, file_id: int, path: str) -> None:
+        """更新文件的路径；原来在该路径的文件（已被轮转）在同名的轮转文件中查找新路径"""
+        displaced = self._conn.execute('SELECT * FROM files WHERE path = ? AND id != ?', (path, file_id)).fetchall()
+        self._conn.execute('UPDATE files SET path = NULL WHERE path = ? AND id != ?', (path, file_id))
+        self._conn.execute('UPDATE files SET path = ? WHERE id = ?', (path, file_id))
+        for row in displaced:
+            self._relocate(row, path)
+
+    def _relocate(self, row: sqlite3.Row, base_path: str) -> None:
+        """在base_path的轮转文件（base_path.1、base_path.2025-05-01等）中查找被轮转的文件，找不到时路径为空"""
+        for candidate in sorted(glob.glob(glob.escape(base_path) + '.*')):
+            try:
+                stat = os.stat(candidate)
+                if self._same_file(row, candidate, stat):
+                    logger.info("日志文件已被轮转: %s -> %s", base_path, candidate)
+                    self._assign_path(row['id'], candidate)
+                    return
+            except OSError:
+                continue
+
+    def _open_file(self, path: str, stat: os.stat_result) -> Tuple[int, int]:
+        """
+        查找或登记日志文件
+
+        Returns:
+            (文件编号, 已索引到的偏移量)
+        """
+        for row in self._conn.execute('SELECT * FROM files WHERE inode = ? ORDER BY id DESC', (stat.st_ino,)):
+            if self._same_file(row, path, stat):
+                if row['path'] != path:
+                    self._assign_path(row['id'], path)
+                return row['id'], row['offset']
+
+        row = self._conn.execute('SELECT * FROM files WHERE path = ?', (path,)).fetchone()
+        if row is not None and row['inode'] == stat.st_ino:
+            # 原地截断后重写，原来的内容已经不存在
+            logger.info("日志文件已被截断，重新建立索引: %s", path)
+            self._conn.execute('DELETE FROM events WHERE file_id = ?', (row['id'],))
+            self._conn.execute('UPDATE files SET head = ?, offset = 0 WHERE id = ?', (_file_head(path, 0), row['id']))
+            return row['id'], 0
+        file_id = self._conn.execute(
+            'INSERT INTO files (path, inode, head, offset, indexed_at) VALUES (NULL, ?, ?, 0, 0)',
+            (stat.st_ino, _file_head(path, 0))).lastrowid
+        self._assign_path(file_id, path)
+        return file_id, 0
+
+    def update(self, path: str) -> int:
+        """
+        把日志文件中上次之后新增的内容加入索引
+
+        Args:
+            path: 日志文件路径
+
+        Returns:
+            新增的索引记录数
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self._conn:
+            file_id, offset = self._open_file(path, stat)
+        if stat.st_size == offset:
+            return 0
+
+        added = 0
+        last_event = None
+        batch: List[List[Any]] = []
+        # 尚未写入的记录（id）；明细：(明细记录, 对应的请求摘要记录或None)
+        unflushed = set()
+        details: List[Tuple[List[Any], Optional[List[Any]]]] = []
+        end = offset
+        # 每个线程最近的请求摘要（"进程号:线程名" -> 记录），明细总在同一线程中紧跟着请求摘要写入
+        summaries: Dict[str, List[Any]] = {}
+
+        def attach(detail: List[Any], summary: List[Any]) -> None:
+            """把明细合并到尚未写入的请求摘要记录"""
+            summary[9] = summary[9] or detail[9]
+            summary[11], summary[12] = detail[1], detail[2]
+
+        def flush(end_offset: int) -> int:
+            """写入记录和明细，返回单独作为记录写入的明细数量"""
+            orphans = 0
+            with self._conn:
+                self._conn.executemany(
+                    'INSERT INTO events (file_id, offset, length, ts, kind, application_type, residence, hukou, '
+                    'identities, sections, request_id, detail_offset, detail_length) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', batch)
+                for detail, summary in details:
+                    set_detail = ('UPDATE events SET sections = COALESCE(sections, ?), detail_offset = ?, '
+                                  'detail_length = ? WHERE ')
+                    if summary is not None:
+                        cursor = self._conn.execute(set_detail + 'file_id = ? AND offset = ?',
+                                                    (detail[9], detail[1], detail[2], summary[0], summary[1]))
+                    elif detail[10]:
+                        # 请求摘要在之前一次运行中已经写入
+                        cursor = self._conn.execute(
+                            set_detail + 'request_id = ? AND kind = ? AND detail_offset IS NULL',
+                            (detail[9], detail[1], detail[2], detail[10], DETAIL_KINDS[detail[4]]))
+                    else:
+                        cursor = None
+                    if cursor is None or cursor.rowcount == 0:
+                        self._conn.execute(
+                            'INSERT INTO events (file_id, offset, length, ts, kind, application_type, residence, '
+                            'hukou, identities, sections, request_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            detail[:11])
+                        orphans += 1
+                self._conn.execute(
+                    'UPDATE files SET inode = ?, head = ?, offset = ?, indexed_at = ? WHERE id = ?',
+                    (stat.st_ino, _file_head(path, end_offset), end_offset, datetime.datetime.now().timestamp(),
+                     file_id))
+            batch.clear()
+            details.clear()
+            unflushed.clear()
+            return orphans
+
+        for line_offset, raw in _iter_lines(path, offset):
+            end = line_offset + len(raw)
+            if not any(marker in raw for marker in _MARKERS):
+                continue
+            parsed = parse_line(raw.decode('utf-8', errors='replace').rstrip('\r\n'))
+            if parsed is None:
+                continue
+            ts, kind, fields = parsed
+            if kind == 'sections':
+                # 旧版文本日志中材料清单单独一行，补充到前一个请求
+                if last_event is not None and not last_event[9]:
+                    last_event[9] = fields['sections']
+                continue
+            event = [file_id, line_offset, len(raw), ts, kind, fields.get('application_type'),
+                     fields.get('residence'), fields.get('hukou'), fields.get('identities'), fields.get('sections'),
+                     fields.get('request_id'), None, None]
+            thread = fields.get('thread')
+            if kind in DETAIL_KINDS:
+                # 同一请求的明细只合并一次；类型或请求ID不同时不是同一个请求
+                summary = summaries.pop(thread, None) if thread else None
+                if summary is not None and (summary[4] != DETAIL_KINDS[kind]
+                                            or (event[10] and summary[10] and event[10] != summary[10])):
+                    summary = None
+                if summary is not None and id(summary) in unflushed:
+                    attach(event, summary)
+                else:
+                    details.append((event, summary))
+                continue
+            if thread:
+                summaries[thread] = event
+            last_event = event
+            batch.append(event)
+            unflushed.add(id(event))
+            added += 1
+            if len(batch) >= _BATCH_SIZE:
+                # 最后一条记录可能还会补充材料部分，留到下一批
+                pending = batch.pop()
+                added += flush(pending[1])
+                batch.append(pending)
+                unflushed.add(id(pending))
+        added += flush(end)
+        return added
+
+    def query(self, since: Optional[str] = None, until: Optional[str] = None, kind: Optional[str] = None,
+              application_type: Optional[str] = None, identity: Optional[str] = None,
+              residence: Optional[str] = None, hukou: Optional[str] = None, section: Optional[str] = None,
+              limit: Optional[int] = 20) -> List[Dict[str, Any]]:
+        """
+        查询索引
+
+        Args:
+            since/until: ISO格式时间范围
+            kind: generate、pdf（请求摘要，合并了抽样的明细）；generate_request、pdf_request（找不到请求摘要的明细）
+            identity: 主申请人或任一家庭成员的身份类型
+            section: 生成了该材料部分（只有记录了材料清单的请求可以匹配）
+            limit: 最多返回的记录数（None表示不限制），按时间倒序
+
+        Returns:
+            索引记录列表
+        """
+        clauses, params = [], []
+        for column, value in (('kind', kind), ('application_type', application_type),
+                              ('residence', _lower(residence)), ('hukou', _lower(hukou))):
+            if value:
+                clauses.append(f'e.{column} = ?')
+                params.append(value)
+        if since:
+            clauses.append('e.ts >= ?')
+            params.append(since)
+        if until:
+            clauses.append('e.ts < ?')
+            params.append(until)
+        if identity:
+            clauses.append('e.identities LIKE ?')
+            params.append(f'%|{identity}|%')
+        if section:
+            clauses.append('e.sections LIKE ?')
+            params.append(f'%|{section}|%')
+        sql = ('SELECT e.*, f.path FROM events e JOIN files f ON f.id = e.file_id'
+               + (' WHERE ' + ' AND '.join(clauses) if clauses else '') + ' ORDER BY e.ts DESC, e.id DESC')
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def stats(self) -> Dict[str, Any]:
+        """各文件的索引进度和各类记录数量"""
+        files = [dict(row) for row in self._conn.execute('SELECT path, offset, indexed_at FROM files')]
+        kinds = {row['kind']: row['count'] for row in self._conn.execute(
+            'SELECT kind, COUNT(*) AS count FROM events GROUP BY kind')}
+        span = self._conn.execute('SELECT MIN(ts) AS first, MAX(ts) AS last FROM events').fetchone()
+        return {'files': files, 'kinds': kinds, 'first': span['first'], 'last': span['last']}
+
+
+def read_record(event: Dict[str, Any], detail: bool = False) -> Optional[str]:
+    """
+    按索引中的偏移量读取原始日志行
+
+    Args:
+        event: 索引记录
+        detail: 读取合并进来的请求明细行
+
+    Returns:
+        日志行，读取明细而该请求没有明细、或日志文件已被删除时返回None
+    """
+    offset, length = (event['detail_offset'], event['detail_length']) if detail else (event['offset'], event['length'])
+    if offset is None or event['path'] is None:
+        return None
+    with open(event['path'], 'rb') as f:
+        f.seek(offset)
+        return f.read(length).decode('utf-8', errors='replace').rstrip('\r\n')
+
+
+def parse_time(text: Optional[str], now: Optional[datetime.datetime] = None) -> Optional[str]:
+    """
+    把命令行中的时间转换为索引使用的ISO格式
+
+    Args:
+        text: 相对时间（7d、12h、30m）或日期/时间（2025-04-28、2025-04-28T17:00）
+    """
+    if not text:
+        return None
+    match = re.fullmatch(r'(\d+)([dhm])', text)
+    if match:
+        unit = {'d': 'days', 'h': 'hours', 'm': 'minutes'}[match.group(2)]
+        moment = (now or datetime.datetime.now()) - datetime.timedelta(**{unit: int(match.group(1))})
+        return moment.isoformat(timespec='milliseconds')
+    return datetime.datetime.fromisoformat(text.replace(' ', 'T')).isoformat(timespec='milliseconds')
+
+
+def _format_event(event: Dict[str, Any]) -> str:
+    def values(field):
+        return (event[field] or '').strip('|').replace('|', ',')
+    return (f"{event['ts']} {event['kind']:<16} {event['application_type'] or '-':<8} "
+            f"{event['residence'] or '-'}→{event['hukou'] or '-'} 身份: {values('identities') or '-'} "
+            f"材料: {values('sections') or '-'}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行入口：更新索引并查询"""
+    parser = argparse.ArgumentParser(description='日本签证材料清单日志查询（增量索引）')
+    parser.add_argument('logs', nargs='*', default=['app_log.txt'], help='日志文件（可以包含轮转后的文件）')
+    parser.add_argument('--index', help='索引文件路径，默认为第一个日志文件加 .idx.sqlite3')
+    parser.add_argument('--since', help='开始时间：7d、12h或2025-04-28T17:00')
+    parser.add_argument('--until', help='结束时间')
+    parser.add_argument('--kind', choices=['generate', 'pdf', 'generate_request', 'pdf_request'], help='记录类型')
+    parser.add_argument('--application-type', help='申请类型，如FAMILY')
+    parser.add_argument('--identity', help='主申请人或家庭成员的身份类型，如FREELANCER')
+    parser.add_argument('--residence', help='居住地领区')
+    parser.add_argument('--hukou', help='户籍所在地领区')
+    parser.add_argument('--section', help='生成了该材料部分，如居住证明材料')
+    parser.add_argument('--limit', type=int, default=20, help='最多显示的记录数（0表示不限制）')
+    parser.add_argument('--count', action='store_true', help='只显示匹配数量')
+    parser.add_argument('--show', action='store_true', help='显示原始日志行')
+    parser.add_argument('--stats', action='store_true', help='显示索引统计')
+    parser.add_argument('--no-update', action='store_true', help='不读取新的日志内容，只查询已有索引')
+    args = parser.parse_args(argv)
+
+    index = LogIndex(args.index or f'{args.logs[0]}.idx.sqlite3')
+    try:
+        if not args.no_update:
+            for path in args.logs:
+                try:
+                    added = index.update(path)
+                except OSError as e:
+                    print(f"无法读取日志文件 {path}: {e}", file=sys.stderr)
+                    continue
+                print(f"{path}: 新增索引记录 {added} 条", file=sys.stderr)
+
+        if args.stats:
+            print(json.dumps(index.stats(), ensure_ascii=False, indent=2))
+            return 0
+
+        events = index.query(since=parse_time(args.since), until=parse_time(args.until), kind=args.kind,
+                             application_type=args.application_type, identity=args.identity,
+                             residence=args.residence, hukou=args.hukou, section=args.section,
+                             limit=None if args.count or args.limit == 0 else args.limit)
+        if args.count:
+            print(len(events))
+            return 0
+        for event in events:
+            print(_format_event(event))
+            if args.show:
+                print(f"    {read_record(event) or '（日志文件已不存在）'}")
+                detail = read_record(event, detail=True)
+                if detail is not None:
+                    print(f"    {detail}")
+        print(f"共 {len(events)} 条", file=sys.stderr)
+    finally:
+        index.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
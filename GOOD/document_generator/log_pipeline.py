@@ -0,0 +1,303 @@
+"""
+日本签证材料清单生成器 - 日志模块
+
+请求线程只把日志记录放入有界队列，后台线程格式化并写入文件：文件为每行一条的JSON，按大小或时间轮转。
+队列满时丢弃日志而不阻塞请求，恢复后补一条警告说明丢弃的数量。
+
+请求明细（原始表单、家庭成员、逐行材料等）按类别抽样：调用方先用 sample() 判断是否记录，
+抽中时把整份明细作为一条记录的data字段写入，未抽中时不做任何格式化。
+
+配置（LOG_PROFILE）：
+- development：DEBUG级别，控制台输出文本，文件输出JSON，明细全部记录；
+- production：INFO级别，控制台只输出WARNING以上，生成器的DEBUG日志在调用处直接跳过，明细每100个请求记录1个。
+"""
+from typing import Dict, Any, Optional, Tuple, Callable
+import atexit
+import datetime
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+# 请求明细使用的日志记录器，级别固定为DEBUG，由抽样决定是否记录
+DUMP_LOGGER = 'good.dump'
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# 各配置的默认值：日志级别、控制台级别、各类明细的抽样间隔（每N个记录1个）
+PROFILES: Dict[str, Dict[str, Any]] = {
+    'development': {
+        'level': logging.DEBUG,
+        'console_level': logging.DEBUG,
+        'sample_every': {},
+    },
+    'production': {
+        'level': logging.INFO,
+        'console_level': logging.WARNING,
+        'sample_every': {'generate_request': 100, 'pdf_request': 100},
+    },
+}
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_ROTATE_BYTES = 50 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 10
+
+# LogRecord的标准属性，其余属性（extra）作为JSON字段输出
+_RECORD_ATTRIBUTES = frozenset(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+_IMMUTABLE_TYPES = (str, int, float, bool, type(None), bytes, tuple, frozenset)
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志格式化为一行JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'ts': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            data['exc'] = record.exc_text
+        if record.stack_info:
+            data['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class CategorySampler:
+    """按类别抽样：每N次记录1次（N为1或未配置时全部记录，0表示不记录）"""
+
+    def __init__(self, sample_every: Optional[Dict[str, int]] = None):
+        self.sample_every = dict(sample_every or {})
+        self._counters: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def sample(self, category: str) -> bool:
+        """本次是否记录该类别的明细"""
+        every = self.sample_every.get(category, 1)
+        if every <= 1:
+            return every == 1
+        counter = self._counters.get(category)
+        if counter is None:
+            with self._lock:
+                counter = self._counters.setdefault(category, itertools.count())
+        return next(counter) % every == 0
+
+
+def parse_sample_every(text: str) -> Dict[str, int]:
+    """
+    解析抽样配置
+
+    Args:
+        text: 形如 "pdf_request=100,generate_request=10" 的字符串
+
+    Returns:
+        类别 -> 抽样间隔
+    """
+    result = {}
+    for part in (text or '').split(','):
+        if '=' not in part:
+            continue
+        category, value = part.split('=', 1)
+        try:
+            result[category.strip()] = int(value)
+        except ValueError:
+            continue
+    return result
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """只把日志记录放入队列的处理器，队列满时丢弃"""
+
+    def __init__(self, log_queue: 'queue.Queue'):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._dropped_lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 同一进程内由后台线程格式化，不需要像默认实现那样在请求线程中格式化消息；
+        # 参数中有可变对象时先格式化，避免写入前对象被修改
+        if record.args and not all(isinstance(arg, _IMMUTABLE_TYPES) for arg in
+                                   (record.args.values() if isinstance(record.args, dict) else record.args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._dropped_lock:
+                self.dropped += 1
+            return
+        if self.dropped:
+            with self._dropped_lock:
+                dropped, self.dropped = self.dropped, 0
+            if dropped:
+                warning = logging.LogRecord(__name__, logging.WARNING, __file__, 0,
+                                            "日志队列已满，丢弃了%d条日志", (dropped,), None)
+                try:
+                    self.queue.put_nowait(warning)
+                except queue.Full:
+                    with self._dropped_lock:
+                        self.dropped += dropped
+
+
+def _file_handler(path: str, rotate_bytes: int, rotate_when: Optional[str], backup_count: int) -> logging.Handler:
+    """按时间（rotate_when，例如midnight、H）或大小轮转的文件处理器"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    if rotate_when:
+        return logging.handlers.TimedRotatingFileHandler(path, when=rotate_when, backupCount=backup_count,
+                                                         encoding='utf-8', delay=True)
+    return logging.handlers.RotatingFileHandler(path, maxBytes=rotate_bytes, backupCount=backup_count,
+                                                encoding='utf-8', delay=True)
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    """停止时等待队列有空位再放入结束标记，队列满时也能写完剩余日志"""
+
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)
+
+
+def resolve_log_path(template: str, pid: int, own_file: bool = False) -> str:
+    """
+    日志文件路径：把{pid}替换为进程号
+
+    Args:
+        template: LOG_FILE的值
+        pid: 进程号
+        own_file: 是否必须使用本进程自己的文件（fork出的子进程），模板中没有{pid}时在扩展名前加上进程号
+
+    Returns:
+        日志文件路径
+    """
+    if '{pid}' in template:
+        return template.replace('{pid}', str(pid))
+    if not own_file:
+        return template
+    root, ext = os.path.splitext(template)
+    return f"{root}.{pid}{ext}"
+
+
+class LogPipeline:
+    """队列处理器、后台写入线程和明细抽样"""
+
+    def __init__(self, handlers: Tuple[logging.Handler, ...], sampler: CategorySampler,
+                 queue_size: int = DEFAULT_QUEUE_SIZE,
+                 child_handlers: Optional[Callable[[], Tuple[logging.Handler, ...]]] = None):
+        """
+        Args:
+            handlers: 后台线程使用的处理器
+            sampler: 明细抽样
+            queue_size: 队列长度
+            child_handlers: fork出的子进程中创建本进程的处理器（多个进程同时轮转同一个文件会互相覆盖），
+                None表示子进程继续使用父进程的处理器
+        """
+        self.handlers = handlers
+        self.sampler = sampler
+        self.queue_size = queue_size
+        self.child_handlers = child_handlers
+        self.handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+        self.listener = self._listener()
+        self.dump_logger = logging.getLogger(DUMP_LOGGER)
+
+    def _listener(self) -> logging.handlers.QueueListener:
+        return _QueueListener(self.handler.queue, *self.handlers, respect_handler_level=True)
+
+    def start(self) -> None:
+        self.listener.start()
+
+    def stop(self) -> None:
+        """写完队列中剩余的日志后停止后台线程"""
+        if self.listener._thread is not None:
+            self.listener.stop()
+        for handler in self.handlers:
+            handler.flush()
+
+    def restart_after_fork(self) -> None:
+        """fork出的子进程没有父进程的写入线程，使用新的队列和线程，并改为写入子进程自己的文件"""
+        if self.child_handlers is not None:
+            inherited, self.handlers = self.handlers, self.child_handlers()
+            for handler in inherited:
+                if handler not in self.handlers:
+                    handler.close()
+        self.handler.queue = queue.Queue(self.queue_size)
+        self.handler.dropped = 0
+        self.listener = self._listener()
+        self.listener.start()
+
+    def sample(self, category: str) -> bool:
+        """本次请求是否记录该类别的明细"""
+        return self.sampler.sample(category)
+
+    def dump(self, category: str, message: str, data: Dict[str, Any]) -> None:
+        """记录一份请求明细（调用前先用sample判断）"""
+        self.dump_logger.debug(message, extra={'category': category, 'data': data})
+
+
+def setup_logging(profile: Optional[str] = None, log_file: Optional[str] = None,
+                  sample_every: Optional[Dict[str, int]] = None) -> LogPipeline:
+    """
+    配置根日志记录器
+
+    未指定的参数读取环境变量：LOG_PROFILE（development或production）、LOG_FILE（默认app_log.txt，
+    可以包含{pid}，多进程部署时每个进程写自己的文件）、LOG_ROTATE_BYTES、LOG_ROTATE_WHEN（设置后按时间轮转）、
+    LOG_BACKUP_COUNT、LOG_QUEUE_SIZE、LOG_SAMPLE（例如 pdf_request=100）。
+    配置后fork出的子进程（例如预加载应用的gunicorn工作进程）按子进程的pid重新打开日志文件，见 resolve_log_path。
+
+    Returns:
+        日志管道，进程退出时自动写完剩余日志
+    """
+    profile = profile or os.environ.get('LOG_PROFILE', 'development')
+    settings = PROFILES.get(profile)
+    if settings is None:
+        raise ValueError(f"未知的日志配置: {profile}")
+    log_template = log_file or os.environ.get('LOG_FILE', 'app_log.txt')
+
+    if sample_every is None:
+        sample_every = dict(settings['sample_every'], **parse_sample_every(os.environ.get('LOG_SAMPLE', '')))
+
+    console = logging.StreamHandler()
+    console.setLevel(settings['console_level'])
+    console.setFormatter(logging.Formatter(TEXT_FORMAT))
+    rotate_bytes = int(os.environ.get('LOG_ROTATE_BYTES', DEFAULT_ROTATE_BYTES))
+    rotate_when = os.environ.get('LOG_ROTATE_WHEN') or None
+    backup_count = int(os.environ.get('LOG_BACKUP_COUNT', DEFAULT_BACKUP_COUNT))
+
+    def make_handlers(own_file: bool = False) -> Tuple[logging.Handler, ...]:
+        file_handler = _file_handler(resolve_log_path(log_template, os.getpid(), own_file),
+                                     rotate_bytes=rotate_bytes, rotate_when=rotate_when, backup_count=backup_count)
+        file_handler.setFormatter(JsonFormatter())
+        return console, file_handler
+
+    pipeline = LogPipeline(make_handlers(), CategorySampler(sample_every),
+                           queue_size=int(os.environ.get('LOG_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)),
+                           child_handlers=lambda: make_handlers(own_file=True))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(pipeline.handler)
+    root.setLevel(settings['level'])
+    # 明细由抽样控制，不受根日志级别影响
+    pipeline.dump_logger.setLevel(logging.DEBUG)
+
+    pipeline.start()
+    atexit.register(pipeline.stop)
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=pipeline.restart_after_fork)
+    return pipeline
@@ -1,7 +1,7 @@
 """
 日本签证材料清单生成器 - 主模块
 """
-from typing import Dict, List, Any, OrderedDict as OrderedDictType
+from typing import Dict, List, Any, Optional, Iterable, OrderedDict as OrderedDictType
 from collections import OrderedDict
 import logging
 
@@ -11,19 +11,40 @@ from document_generator.financial_materials import FinancialMaterialsGenerator
 from document_generator.residence_materials import ResidenceMaterialsGenerator
 from document_generator.family_materials import FamilyMaterialsGenerator
 from document_generator.other_materials import OtherMaterialsGenerator
-from document_generator.utils import get_visa_duration, get_consulate_text, check_has_family
+from document_generator.utils import get_consulate_text
+from document_generator.form import ApplicationForm, TrackingForm, as_form
+from document_generator.incremental import StepResult, TracedResult
+from document_generator.decision_table import MEMBER_SECTIONS, Section, get_decision_table
+from document_generator.rule_trace import rule_tracer
+from document_generator.request_trace import span
 
 logger = logging.getLogger(__name__)
 
+# 只取决于主申请人的步骤（结果存入决策表）和取决于家庭成员的步骤
+APPLICANT_STEPS = ('basic_info', 'basic_materials', 'identity', 'financial')
+MEMBER_STEPS = ('residence', 'family', 'other')
+
+
+def freeze_section(items: Optional[Iterable[str]]) -> Section:
+    """把子生成器返回的材料列表转换为元组（子生成器可能直接返回配置中的列表）"""
+    return tuple(items) if items else ()
+
+
 class DocumentGenerator:
-    """材料清单生成器主类"""
+    """
+    材料清单生成器主类
     
-    def __init__(self, config: Dict[str, Any]):
+    各部分材料都是不可变元组，决策表、增量结果和各缓存中的同一部分材料直接共享，不做防御性复制；
+    需要在某一部分后追加材料时拼接成新的元组。返回的有序字典本身是每次新建的。
+    """
+    
+    def __init__(self, config: Dict[str, Any], precompile: bool = True):
         """
         初始化生成器
         
         Args:
             config: JSON格式的配置数据
+            precompile: 是否预先编译决策表
         """
         self.config = config
         
@@ -38,139 +59,235 @@ class DocumentGenerator:
         # 定义材料显示顺序
         self.section_order = ['基本信息', '基本材料', '学籍/学历证明', '学籍/学历证明及情况说明', 
                              '工作证明', '财力证明', '居住证明材料', '家属材料', '其他材料']
+        
+        # 按顺序执行的生成步骤：(步骤名称, 生成函数)，每个步骤只读取表单并返回自己负责的材料部分
+        self.steps = tuple((name, getattr(self, f'_{name}_step')) for name in APPLICANT_STEPS + MEMBER_STEPS)
+        
+        # 预先计算所有枚举输入组合的材料清单
+        self.decision_table = get_decision_table(config, self._compile_entry) if precompile else None
     
-    def generate_document_list(self, form_data: Dict[str, Any]) -> OrderedDictType[str, List[str]]:
+    def generate_document_list(self, form_data: Dict[str, Any]) -> OrderedDictType[str, Section]:
         """
         根据表单数据生成所需证件列表
         
+        Args:
+            form_data: 用户提交的表单数据
+            
+        Returns:
+            有序字典，包含各类材料（材料为不可变元组）
+        """
+        form = as_form(form_data)
+        with span('generate_document_list'):
+            if rule_tracer.sample_every and rule_tracer.sample():
+                # 抽中追踪的请求由各生成器逐项生成，记录每一行材料来自哪个分支
+                return self._rule_traced_document_list(form)
+            with span('decision_table'):
+                document_list = self.decision_table.lookup(form) if self.decision_table is not None else None
+            if document_list is None:
+                # 不在决策表范围内的表单由各生成器逐项生成
+                return self.build_document_list(form)
+            
+            if form.application_type == 'FAMILY':
+                # 家庭申请中与家庭成员有关的部分逐次计算
+                self._add_member_sections(document_list, form)
+                document_list = self._order_sections(document_list)
+            
+            logger.debug("生成的材料清单: %s", document_list)
+            return document_list
+    
+    def build_document_list(self, form_data: Dict[str, Any]) -> OrderedDictType[str, Section]:
+        """
+        不使用决策表，由各生成器逐项生成材料清单
+        
         Args:
             form_data: 用户提交的表单数据
             
         Returns:
             有序字典，包含各类材料
         """
-        # 初始化结果字典
-        document_list: OrderedDictType[str, List[str]] = OrderedDict()
+        form = as_form(form_data)
+        document_list = self._applicant_sections(form)
+        self._add_member_sections(document_list, form)
+        ordered_list = self._order_sections(document_list)
         
-        # 获取主要表单数据
-        identity_type = form_data.get('identityType', '')
-        application_type = form_data.get('applicationType', '')
-        residence_consulate = form_data.get('residenceConsulate', '')
-        hukou_consulate = form_data.get('hukouConsulate', '')
-        process_type = form_data.get('processType', '')
-        visa_duration = get_visa_duration(form_data)
+        logger.debug("生成的材料清单: %s", ordered_list)
+        return ordered_list
+    
+    def generate_traced(self, form_data: Dict[str, Any], previous: Optional[TracedResult] = None) -> TracedResult:
+        """
+        逐步骤生成材料清单，并记录每个步骤读取的表单字段
         
-        # 1. 添加基本信息
-        document_list['基本信息'] = self._generate_basic_info(form_data)
+        Args:
+            form_data: 用户提交的表单数据
+            previous: 上一次的追踪结果；提供时只重新执行读取了已修改字段的步骤
+            
+        Returns:
+            追踪结果，document_list与generate_document_list的结果相同
+        """
+        form = as_form(form_data)
+        changed = previous.form.changed_fields(form) if previous is not None else None
+        steps = []
+        recomputed = []
+        for index, (name, step) in enumerate(self.steps):
+            if previous is not None and not previous.steps[index].depends_on(changed):
+                steps.append(previous.steps[index])
+                continue
+            tracking = TrackingForm(form)
+            sections = step(tracking)
+            steps.append(StepResult(name, frozenset(tracking.reads), tuple(sections.items())))
+            recomputed.append(name)
         
-        # 2. 添加基本材料
-        document_list['基本材料'] = self.basic_generator.get_materials(form_data)
+        document_list = OrderedDict()
+        for step_result in steps:
+            for section, items in step_result.sections:
+                document_list[section] = items
+        ordered_list = self._order_sections(document_list)
+        logger.debug("增量生成材料清单，重新执行的步骤: %s", recomputed)
+        return TracedResult(form, tuple(steps), ordered_list, tuple(recomputed))
+    
+    def _rule_traced_document_list(self, form: ApplicationForm) -> OrderedDictType[str, Section]:
+        """逐步骤生成材料清单并记录规则追踪，结果与build_document_list相同"""
+        trace = rule_tracer.request()
+        document_list = OrderedDict()
+        for name, step in self.steps:
+            document_list.update(trace.run_step(name, step, form))
+        ordered_list = self._order_sections(document_list)
+        trace.finish(ordered_list)
+        return ordered_list
+    
+    def _compile_entry(self, form_data: Dict[str, Any]) -> OrderedDictType[str, Section]:
+        """生成决策表中的一项，家庭申请只包含与家庭成员无关的部分"""
+        form = as_form(form_data)
+        if form.application_type == 'FAMILY':
+            document_list = self._applicant_sections(form)
+            for section in MEMBER_SECTIONS:
+                document_list.pop(section, None)
+            return document_list
+        return self.build_document_list(form)
+    
+    def _order_sections(self, document_list: Dict[str, Section]) -> OrderedDictType[str, Section]:
+        """按照指定顺序排列材料部分"""
+        ordered_list = OrderedDict()
+        for section in self.section_order:
+            if section in document_list:
+                ordered_list[section] = document_list[section]
+        return ordered_list
+    
+    def _applicant_sections(self, form: ApplicationForm) -> OrderedDictType[str, Section]:
+        """生成基本信息、基本材料、身份材料和财力证明（只取决于主申请人）"""
+        document_list: OrderedDictType[str, Section] = OrderedDict()
+        for name, step in self.steps[:len(APPLICANT_STEPS)]:
+            with span(f'step.{name}'):
+                document_list.update(step(form))
+        return document_list
+    
+    def _add_member_sections(self, document_list: Dict[str, Section], form: ApplicationForm) -> None:
+        """添加居住证明材料、家属材料和其他材料（家庭申请中取决于家庭成员）"""
+        for name, step in self.steps[len(APPLICANT_STEPS):]:
+            with span(f'step.{name}'):
+                document_list.update(step(form))
+    
+    def _basic_info_step(self, form: ApplicationForm) -> Dict[str, Section]:
+        """1. 基本信息"""
+        return {'基本信息': freeze_section(self._generate_basic_info(form))}
+    
+    def _basic_materials_step(self, form: ApplicationForm) -> Dict[str, Section]:
+        """2. 基本材料"""
+        return {'基本材料': freeze_section(self.basic_generator.get_materials(form))}
+    
+    def _identity_step(self, form: ApplicationForm) -> Dict[str, Section]:
+        """3. 身份特定材料（根据不同处理方式）"""
+        sections: Dict[str, Section] = {}
+        identity_type = form.identity_type
+        application_type = form.application_type
+        process_type = form.process_type
         
-        # 3. 添加身份特定材料（根据不同处理方式）
         if process_type == 'STUDENT':
             # 特定大学生单次办理不添加普通身份材料，但添加学籍材料
             if identity_type == 'STUDENT':
-                student_materials = self.financial_generator._generate_student_materials(form_data)
+                student_materials = self.financial_generator._generate_student_materials(form)
                 if student_materials:
-                    document_list['学籍/学历证明'] = student_materials
+                    sections['学籍/学历证明'] = freeze_section(student_materials)
             else:
                 # 非学生身份使用特定大学生办理方式
-                document_list['学籍/学历证明及情况说明'] = ["非在读学生使用特定大学生办理方式，提供学信网电子注册备案表"]
+                sections['学籍/学历证明及情况说明'] = ("非在读学生使用特定大学生办理方式，提供学信网电子注册备案表",)
         elif process_type in ['NORMAL', 'SIMPLIFIED'] and identity_type == 'STUDENT':
             # 学生使用普通经济材料办理时，添加学籍材料而不是普通身份材料
-            student_materials = self.financial_generator._generate_student_materials(form_data)
+            student_materials = self.financial_generator._generate_student_materials(form)
             if student_materials:
-                document_list['学籍/学历证明'] = student_materials
+                sections['学籍/学历证明'] = freeze_section(student_materials)
         elif application_type == 'ECONOMIC':
             # 使用家庭成员经济材料申请时，不添加身份特定材料
             pass
         else:
             # 其他情况添加身份特定材料
-            identity_materials = self.identity_generator.get_materials(identity_type, process_type)
+            identity_materials = freeze_section(self.identity_generator.get_materials(identity_type, process_type))
             if identity_materials:
                 if identity_type == 'STUDENT':
-                    document_list['学籍/学历证明'] = identity_materials
+                    sections['学籍/学历证明'] = identity_materials
                 elif identity_type == 'EMPLOYED':
-                    document_list['工作证明'] = identity_materials
+                    sections['工作证明'] = identity_materials
                 else:
-                    document_list[self._get_identity_section_name(identity_type)] = identity_materials
-        
-        # 4. 添加财力证明材料
+                    sections[self._get_identity_section_name(identity_type)] = identity_materials
+        return sections
+    
+    def _financial_step(self, form: ApplicationForm) -> Dict[str, Section]:
+        """4. 财力证明材料"""
         # 特定大学生单次办理不添加财力证明部分，学籍材料已经添加到学籍/学历证明部分
-        if process_type != 'STUDENT':
-            financial_materials = self.financial_generator.get_materials(form_data)
-            if financial_materials:
-                document_list['财力证明'] = financial_materials
-        
-        # 5. 添加居住证明材料
-        residence_materials = self.residence_generator.get_materials(form_data)
-        
-        # 处理家庭成员和家属的居住证明需求
-        has_family = check_has_family(form_data)
-        residence_proof_needed = self.residence_generator._check_residence_proof_needed(
-            residence_consulate, hukou_consulate)
-            
-        # 根据申请类型处理居住证明材料
-        if application_type == 'FAMILY':
-            # 对于家庭申请，居住证明材料已经在residence_generator.get_materials中处理
-            if residence_materials:
-                document_list['居住证明材料'] = residence_materials
-        else:
-            # 普通申请或绑签申请
-            if residence_materials:
-                document_list['居住证明材料'] = residence_materials
-                
-                # 如果有家属（非家庭申请），添加家属居住证明说明
-                if has_family and residence_proof_needed and application_type != 'BINDING':
-                    document_list['居住证明材料'].append("持签人家属需提供上述居住材料之一")
-        
-        # 6. 添加家属材料
-        family_materials = self.family_generator.get_materials(form_data)
-        if family_materials and application_type != 'BINDING':
-            document_list['家属材料'] = family_materials
-        
-        # 7. 添加其他材料
-        other_materials = self.other_generator.get_materials(form_data)
-        if other_materials:
-            document_list['其他材料'] = other_materials
-            
-        # 8. 为北京领区、在职人员、特定大学生单次办理方式添加必要的税单要求
-        if (process_type == 'STUDENT' and 
-            identity_type == 'EMPLOYED' and 
-            residence_consulate.lower() == 'beijing'):
-            
-            # 确保其他材料部分存在
-            if '其他材料' not in document_list:
-                document_list['其他材料'] = []
-                
+        if form.process_type == 'STUDENT':
+            return {}
+        financial_materials = freeze_section(self.financial_generator.get_materials(form))
+        return {'财力证明': financial_materials} if financial_materials else {}
+    
+    def _residence_step(self, form: ApplicationForm) -> Dict[str, Section]:
+        """5. 居住证明材料"""
+        residence_materials = freeze_section(self.residence_generator.get_materials(form))
+        if not residence_materials:
+            return {}
+        application_type = form.application_type
+        
+        # 对于家庭申请，家庭成员的居住证明已经在residence_generator.get_materials中处理
+        # 普通申请如果有家属，添加家属居住证明说明
+        if application_type not in ('FAMILY', 'BINDING') and form.has_family:
+            if self.residence_generator._check_residence_proof_needed(form.residence_consulate, form.hukou_consulate):
+                residence_materials += ("持签人家属需提供上述居住材料之一",)
+        return {'居住证明材料': residence_materials}
+    
+    def _family_step(self, form: ApplicationForm) -> Dict[str, Section]:
+        """6. 家属材料"""
+        family_materials = freeze_section(self.family_generator.get_materials(form))
+        if family_materials and form.application_type != 'BINDING':
+            return {'家属材料': family_materials}
+        return {}
+    
+    def _other_step(self, form: ApplicationForm) -> Dict[str, Section]:
+        """7. 其他材料，8. 北京领区在职人员特定大学生单次办理方式的税单要求"""
+        other_materials = freeze_section(self.other_generator.get_materials(form))
+        
+        if (form.process_type == 'STUDENT' and 
+            form.identity_type == 'EMPLOYED' and 
+            form.residence_consulate == 'beijing'):
             # 添加税单要求
-            document_list['其他材料'].append("2. 近一年的个人所得税税单（从去年到今年相同月份）")
-            document_list['其他材料'].append("3. 如果税单右下角盖章是在外领区，需要额外提供领区内的营业执照副本复印件")
+            other_materials += ("2. 近一年的个人所得税税单（从去年到今年相同月份）",
+                                "3. 如果税单右下角盖章是在外领区，需要额外提供领区内的营业执照副本复印件")
             
             # 记录添加的税单要求
             logger.debug("为北京领区在职人员特定大学生单次办理添加必要税单要求")
         
-        # 确保返回的材料按照指定顺序排列
-        ordered_list = OrderedDict()
-        for section in self.section_order:
-            if section in document_list:
-                ordered_list[section] = document_list[section]
-        
-        logger.debug("生成的材料清单: %s", ordered_list)
-        return ordered_list
+        return {'其他材料': other_materials} if other_materials else {}
     
-    def _generate_basic_info(self, form_data: Dict[str, Any]) -> List[str]:
+    def _generate_basic_info(self, form: ApplicationForm) -> List[str]:
         """生成基本信息部分"""
         # 获取领区信息
-        residence_consulate = form_data.get('residenceConsulate', '')
-        hukou_consulate = form_data.get('hukouConsulate', '')
+        residence_consulate = form.residence_consulate
+        hukou_consulate = form.hukou_consulate
         
         # 获取领区显示文本
         residence_text = get_consulate_text(residence_consulate)
         hukou_text = get_consulate_text(hukou_consulate)
         
         # 根据签证类型和申请类型获取显示文本
-        visa_type_text = self._get_visa_type_text(form_data)
+        visa_type_text = self._get_visa_type_text(form)
         
         # 构建基本信息
         basic_info = [
@@ -180,19 +297,19 @@ class DocumentGenerator:
         ]
         
         # 如果是绑签申请，添加家属签证信息
-        if form_data.get('applicationType') == 'BINDING':
-            family_visa_type = form_data.get('familyVisaType', '')
+        if form.application_type == 'BINDING':
+            family_visa_type = form.family_visa_type
             family_visa_text = "三年多次往返签证" if family_visa_type == 'THREE' else "五年多次往返签证"
             basic_info.append(f"家属签证类型: {family_visa_text}")
         
         return basic_info
     
-    def _get_visa_type_text(self, form_data: Dict[str, Any]) -> str:
+    def _get_visa_type_text(self, form: ApplicationForm) -> str:
         """获取签证类型显示文本"""
         # 获取签证类型和处理方式
-        visa_duration = get_visa_duration(form_data)
-        application_type = form_data.get('applicationType', '')
-        process_type = form_data.get('processType', '')
+        visa_duration = form.visa_duration
+        application_type = form.application_type
+        process_type = form.process_type
         
         # 基本签证类型文本
         visa_type_text = "单次签证"
@@ -203,7 +320,7 @@ class DocumentGenerator:
         
         # 根据申请类型修改签证类型显示文本
         if application_type == 'BINDING':
-            family_relation = form_data.get('familyRelation', '')
+            family_relation = form.family_relation
             relation_text = ''
             if family_relation == 'SPOUSE':
                 relation_text = '配偶'
@@ -213,7 +330,7 @@ class DocumentGenerator:
                 relation_text = '子女'
             
             # 使用家属签证类型值获取正确的显示文本
-            family_visa_type = form_data.get('familyVisaType', '')
+            family_visa_type = form.family_visa_type
             visa_type_display = "三年多次往返签证" if family_visa_type == 'THREE' else "五年多次往返签证"
             visa_type_text = f"申请人是{visa_type_display}持有人的{relation_text}"
         elif process_type == 'SIMPLIFIED':
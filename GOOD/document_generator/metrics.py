@@ -0,0 +1,432 @@
+"""
+日本签证材料清单生成器 - 运行指标模块
+
+每个进程在内存中累计计数器、直方图和仪表值，后台线程定期把本进程的数据写入共享目录
+（METRICS_DIR，默认为系统临时目录下的good_metrics）中以进程号和启动时间命名的JSON文件。
+/metrics 读取目录中所有进程的文件并合并后以Prometheus文本格式输出：
+计数器和直方图累加所有进程（包括已退出的进程，保证计数不减少），仪表值只统计仍在运行的进程。
+已退出进程（进程号不存在，或进程号已被启动时间不同的新进程使用）的计数器和直方图在读取时合并到
+EXITED_FILE 中并删除其文件，目录中的文件数不随进程重启增长。
+Web工作进程、渲染服务进程和批量生成进程使用同一目录即可汇总；部署新版本前可以清空该目录。
+"""
+from typing import Dict, List, Any, Optional, Tuple, Iterable, Callable
+import bisect
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from document_generator.utils import file_lock, write_atomic
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METRICS_DIR = os.path.join(tempfile.gettempdir(), 'good_metrics')
+
+# 已退出进程合并后的计数器和直方图
+EXITED_FILE = 'exited.json'
+
+# 耗时直方图的上界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# PDF大小直方图的上界（字节）
+SIZE_BUCKETS = (16 * 1024, 64 * 1024, 128 * 1024, 256 * 1024, 512 * 1024,
+                1024 * 1024, 2 * 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024)
+
+COUNTER = 'counter'
+HISTOGRAM = 'histogram'
+GAUGE = 'gauge'
+
+# 指标名称 -> (类型, 说明, 直方图上界)
+METRICS: Dict[str, Tuple[str, str, Tuple[float, ...]]] = {
+    'good_http_requests_total': (COUNTER, 'HTTP请求数', ()),
+    'good_http_request_duration_seconds': (HISTOGRAM, 'HTTP请求处理耗时（流式响应为返回响应头之前的耗时）', LATENCY_BUCKETS),
+    'good_pdf_render_duration_seconds': (HISTOGRAM, '各PDF渲染后端的渲染耗时', LATENCY_BUCKETS),
+    'good_pdf_size_bytes': (HISTOGRAM, '返回的PDF文件大小', SIZE_BUCKETS),
+    'good_cache_requests_total': (COUNTER, '缓存查询次数（result为memory_hit、disk_hit或miss）', ()),
+    'good_cache_hit_ratio': (GAUGE, '缓存命中率（由所有进程的缓存查询次数计算）', ()),
+    'good_pdf_renders_in_flight': (GAUGE, '正在渲染的PDF数量', ()),
+    'good_process_resident_memory_bytes': (GAUGE, '进程常驻内存（RSS）', ()),
+    'good_client_rules_stale_total': (COUNTER, '页面提交了过期客户端规则版本的请求数', ()),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    text = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return f'{{{text}}}' if text else ''
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # 没有权限发送信号，进程仍然存在
+        return True
+    return True
+
+
+def _process_start(pid: int) -> Optional[int]:
+    """进程的启动时间（/proc/<pid>/stat中开机后的时钟周期数），不是Linux或进程不存在时返回None"""
+    try:
+        with open(f'/proc/{pid}/stat', 'rb') as f:
+            stat = f.read()
+        # 进程名可能包含空格和括号，从最后一个右括号之后开始数字段（第22个字段为启动时间）
+        return int(stat[stat.rindex(b')') + 2:].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _process_alive(pid: int, start: Optional[int]) -> bool:
+    """写入数据的进程是否仍在运行：进程号存在，且（能读取时）启动时间相同，进程号被新进程重用时视为已退出"""
+    if not pid or not _pid_alive(pid):
+        return False
+    if start is None:
+        return True
+    current = _process_start(pid)
+    return current is None or current == start
+
+
+def _fold(target: Dict[str, Any], snapshot: Dict[str, Any]) -> None:
+    """把一个进程的计数器和直方图累加到target（EXITED_FILE的内容）"""
+    counters = {(name, tuple(map(tuple, labels))): value for name, labels, value in target['counters']}
+    for name, labels, value in snapshot['counters']:
+        key = (name, tuple(map(tuple, labels)))
+        counters[key] = counters.get(key, 0) + value
+    histograms = {(name, tuple(map(tuple, labels))): (buckets, total, count)
+                  for name, labels, buckets, total, count in target['histograms']}
+    for name, labels, buckets, total, count in snapshot['histograms']:
+        key = (name, tuple(map(tuple, labels)))
+        current = histograms.get(key)
+        if current is None or len(current[0]) != len(buckets):
+            histograms[key] = (list(buckets), total, count)
+        else:
+            histograms[key] = ([a + b for a, b in zip(current[0], buckets)], current[1] + total, current[2] + count)
+    target['counters'] = [[name, [list(pair) for pair in labels], value] for (name, labels), value in counters.items()]
+    target['histograms'] = [[name, [list(pair) for pair in labels], buckets, total, count]
+                            for (name, labels), (buckets, total, count) in histograms.items()]
+
+
+def resident_memory_bytes() -> Optional[int]:
+    """当前进程的常驻内存字节数，无法读取时返回None"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # 非Linux系统只能取得峰值
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except (ImportError, OSError):
+        return None
+
+
+class MetricsRegistry:
+    """本进程的指标数据，定期写入共享目录"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._directory: Optional[str] = None
+        self._interval = 5.0
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._collectors: List[Callable[[], Iterable[Tuple[str, Dict[str, Any], float]]]] = []
+        self._collector_baseline: Dict[Tuple[str, Labels], float] = {}
+        self._fork_baseline: Dict[Tuple[str, Labels], float] = {}
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(before=self._before_fork, after_in_child=self._after_fork)
+
+    def _reset(self) -> None:
+        self._pid = os.getpid()
+        self._process_start = _process_start(self._pid)
+        self._started = time.time()
+        self._counters: Dict[Tuple[str, Labels], float] = {}
+        self._histograms: Dict[Tuple[str, Labels], List[Any]] = {}
+        self._gauges: Dict[Tuple[str, Labels], float] = {}
+
+    def _before_fork(self) -> None:
+        # 在父进程中读取采集函数的累计值（子进程中其他线程持有的锁无法释放，不能在子进程中读取）
+        self._fork_baseline = dict(self._collected()) if self._collectors else {}
+
+    def _after_fork(self) -> None:
+        # 子进程不继承父进程的计数，也没有父进程的写入线程；采集函数的累计值从fork时开始计算
+        self._lock = threading.Lock()
+        self._reset()
+        self._collector_baseline = self._fork_baseline
+        self._thread = None
+        self._stop = threading.Event()
+        if self._directory is not None:
+            self.start()
+
+    @property
+    def path(self) -> Optional[str]:
+        """本进程的数据文件路径，未配置共享目录时为None"""
+        if self._directory is None:
+            return None
+        return os.path.join(self._directory, f'{self._pid}-{int(self._started * 1000)}.json')
+
+    def configure(self, directory: Optional[str], interval: float = 5.0) -> None:
+        """
+        设置共享目录并启动定期写入线程
+
+        Args:
+            directory: 共享目录，None表示只使用本进程的数据
+            interval: 写入间隔秒数
+        """
+        if directory is not None:
+            try:
+                os.makedirs(directory, exist_ok=True)
+            except OSError as e:
+                logger.error("无法创建指标目录，只统计本进程: %s, 错误: %s", directory, str(e))
+                directory = None
+        self._directory = directory
+        self._interval = interval
+        if directory is not None:
+            self.start()
+
+    def add_collector(self, collector: Callable[[], Iterable[Tuple[str, Dict[str, Any], float]]]) -> None:
+        """
+        注册计数器采集函数，写入文件时调用
+
+        用于已经自行累计的计数（例如PDFCache.stats()），请求处理时不需要额外记录。
+        采集函数返回(指标名称, 标签, 累计值)序列。
+        """
+        self._collectors.append(collector)
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        """计数器加value"""
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        """直方图记录一个值"""
+        key = (name, _labels(labels))
+        buckets = METRICS[name][2]
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            histogram[0][bisect.bisect_left(buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def add_gauge(self, name: str, delta: float, **labels: Any) -> None:
+        """仪表值加delta"""
+        key = (name, _labels(labels))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + delta
+
+    @contextlib.contextmanager
+    def in_flight(self, name: str, **labels: Any):
+        """执行期间仪表值加1"""
+        self.add_gauge(name, 1, **labels)
+        try:
+            yield
+        finally:
+            self.add_gauge(name, -1, **labels)
+
+    def _collected(self) -> List[Tuple[Tuple[str, Labels], float]]:
+        values = []
+        for collector in self._collectors:
+            try:
+                values.extend(((name, _labels(labels)), value) for name, labels, value in collector())
+            except Exception as e:
+                logger.error("指标采集函数出错: %s", str(e), exc_info=True)
+        return values
+
+    def snapshot(self) -> Dict[str, Any]:
+        """本进程的数据（可序列化为JSON）"""
+        counters = [[name, list(labels), value - self._collector_baseline.get((name, labels), 0)]
+                    for (name, labels), value in self._collected()]
+        gauges = []
+        rss = resident_memory_bytes()
+        if rss is not None:
+            gauges.append(['good_process_resident_memory_bytes', [['pid', str(self._pid)]], rss])
+        with self._lock:
+            counters.extend([name, list(labels), value] for (name, labels), value in self._counters.items())
+            histograms = [[name, list(labels), list(buckets), total, count]
+                          for (name, labels), (buckets, total, count) in self._histograms.items()]
+            gauges.extend([name, list(labels), value] for (name, labels), value in self._gauges.items())
+        return {'pid': self._pid, 'start': self._process_start, 'written_at': time.time(),
+                'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+    def flush(self) -> None:
+        """把本进程的数据写入共享目录（先写临时文件再替换，读取方不会读到写了一半的文件）"""
+        path = self.path
+        if path is None:
+            return
+        try:
+            write_atomic(path, json.dumps(self.snapshot(), ensure_ascii=False).encode('utf-8'))
+        except OSError as e:
+            logger.error("写入指标文件失败: %s, 错误: %s", path, str(e))
+
+    def start(self) -> None:
+        """启动定期写入线程"""
+        if self._thread is not None or self._interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._run, name='metrics-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止写入线程并写入最后一次数据"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            self.flush()
+
+    def _snapshots(self) -> List[Dict[str, Any]]:
+        """所有进程的数据，本进程使用内存中的最新数据；已退出进程的文件合并到EXITED_FILE后删除"""
+        own = self.snapshot()
+        if self._directory is None:
+            return [own]
+        self.flush()
+        own_path = os.path.basename(self.path)
+        exited_path = os.path.join(self._directory, EXITED_FILE)
+        snapshots = [own]
+        # 多个进程同时读取时只有一个合并，合并和删除之间读取的进程不会重复计入或漏掉已退出的进程
+        try:
+            with file_lock(exited_path):
+                names = os.listdir(self._directory)
+                exited = self._read_snapshot(exited_path) or {'counters': [], 'histograms': []}
+                folded = []
+                for name in names:
+                    if not name.endswith('.json') or name in (own_path, EXITED_FILE):
+                        continue
+                    snapshot = self._read_snapshot(os.path.join(self._directory, name))
+                    if snapshot is None:
+                        continue
+                    if _process_alive(snapshot.get('pid', 0), snapshot.get('start')):
+                        snapshots.append(snapshot)
+                    else:
+                        _fold(exited, snapshot)
+                        folded.append(name)
+                if folded:
+                    self._write_exited(exited_path, exited, folded)
+        except OSError as e:
+            logger.error("读取指标目录失败: %s, 错误: %s", self._directory, str(e))
+            return snapshots
+        snapshots.append(dict(exited, gauges=[]))
+        return snapshots
+
+    @staticmethod
+    def _read_snapshot(path: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("跳过无法读取的指标文件: %s, 错误: %s", os.path.basename(path), str(e))
+            return None
+
+    @staticmethod
+    def _write_exited(path: str, exited: Dict[str, Any], folded: List[str]) -> None:
+        """先写入合并结果再删除已合并的文件（写入失败时保留原文件，下次再合并）"""
+        write_atomic(path, json.dumps(exited, ensure_ascii=False).encode('utf-8'))
+        directory = os.path.dirname(path)
+        for name in folded:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+        logger.info("已合并%d个已退出进程的指标文件", len(folded))
+
+    def collect(self) -> Dict[str, Dict[Labels, Any]]:
+        """
+        合并所有进程的数据
+
+        Returns:
+            指标名称 -> {标签: 值}，直方图的值为(各桶数量, 总和, 次数)
+        """
+        merged: Dict[str, Dict[Labels, Any]] = {}
+        for snapshot in self._snapshots():
+            for name, labels, value in snapshot['counters'] + snapshot['gauges']:
+                series = merged.setdefault(name, {})
+                key = tuple(tuple(pair) for pair in labels)
+                series[key] = series.get(key, 0) + value
+            for name, labels, buckets, total, count in snapshot['histograms']:
+                series = merged.setdefault(name, {})
+                key = tuple(tuple(pair) for pair in labels)
+                current = series.get(key)
+                if current is None or len(current[0]) != len(buckets):
+                    series[key] = (list(buckets), total, count)
+                else:
+                    series[key] = ([a + b for a, b in zip(current[0], buckets)], current[1] + total, current[2] + count)
+
+        # 由合并后的缓存查询次数计算命中率
+        ratios: Dict[Labels, float] = {}
+        lookups: Dict[str, List[float]] = {}
+        for labels, value in merged.get('good_cache_requests_total', {}).items():
+            label_map = dict(labels)
+            counts = lookups.setdefault(label_map.get('cache', ''), [0, 0])
+            counts[1] += value
+            if label_map.get('result') != 'miss':
+                counts[0] += value
+        for cache, (hits, total) in lookups.items():
+            ratios[(('cache', cache),)] = hits / total if total else 0.0
+        if ratios:
+            merged['good_cache_hit_ratio'] = ratios
+        return merged
+
+    def render(self) -> str:
+        """所有进程合并后的Prometheus文本格式"""
+        merged = self.collect()
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            series = merged.get(name)
+            if not series:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels in sorted(series):
+                value = series[labels]
+                if kind != HISTOGRAM:
+                    lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    lines.append(f'{name}_bucket{_format_labels(labels + (("le", _format_value(bound)),))} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+                lines.append(f'{name}_count{_format_labels(labels)} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+# 进程内共享的指标数据
+metrics = MetricsRegistry()
+
+
+def configure_from_env() -> None:
+    """按环境变量METRICS_DIR（设为空字符串时只统计本进程）和METRICS_FLUSH_INTERVAL启动指标写入"""
+    directory = os.environ.get('METRICS_DIR', DEFAULT_METRICS_DIR)
+    metrics.configure(directory or None, float(os.environ.get('METRICS_FLUSH_INTERVAL', '5')))
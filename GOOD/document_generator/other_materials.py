@@ -4,6 +4,8 @@
 from typing import Dict, List, Any, Optional
 import logging
 
+from document_generator.form import as_form
+
 logger = logging.getLogger(__name__)
 
 class OtherMaterialsGenerator:
@@ -29,10 +31,11 @@ class OtherMaterialsGenerator:
             其他材料列表
         """
         # 获取必要的表单数据
-        residence_consulate = form_data.get('residenceConsulate', '').lower()
-        identity_type = form_data.get('identityType', '')
-        process_type = form_data.get('processType', '')
-        application_type = form_data.get('applicationType', '')
+        form = as_form(form_data)
+        residence_consulate = form.residence_consulate
+        identity_type = form.identity_type
+        process_type = form.process_type
+        application_type = form.application_type
         
         # 初始化其他材料列表
         other_materials = ["1. 和纸质照片一致的电子版照片"]
@@ -51,11 +54,7 @@ class OtherMaterialsGenerator:
         family_has_retired = False
         
         if application_type == 'FAMILY':
-            family_members = form_data.get('familyMembers', [])
-            for i, member in enumerate(family_members, 1):
-                if isinstance(member, dict) and member.get('identityType') == 'RETIRED':
-                    family_has_retired = True
-                    break
+            family_has_retired = form.family_profile.has_identity('RETIRED')
         
         # 根据领区和退休人员情况添加退休证明要求
         if residence_consulate == 'shanghai':
@@ -86,19 +85,12 @@ class OtherMaterialsGenerator:
         # 检查主申请人是否为自由职业者
         if identity_type == 'FREELANCER' or identity_type == 'FREELANCE':
             has_freelancer = True
-            logger.debug(f"主申请人是自由职业者: {identity_type}")
+            logger.debug("主申请人是自由职业者: %s", identity_type)
         
         # 检查家属申请中是否有自由职业者
-        if application_type == 'FAMILY':
-            family_members = form_data.get('familyMembers', [])
-            for member in family_members:
-                if isinstance(member, dict):
-                    # 检查多种可能的标识
-                    member_identity = member.get('identityType')
-                    if member_identity == 'FREELANCER' or member_identity == 'FREELANCE':
-                        has_freelancer = True
-                        logger.debug(f"家庭成员中发现自由职业者: {member.get('name', '')} {member.get('number', '')}, 身份类型: {member_identity}")
-                        break
+        if application_type == 'FAMILY' and form.family_profile.has_identity('FREELANCER', 'FREELANCE'):
+            has_freelancer = True
+            logger.debug("家庭成员中有自由职业者")
         
         # 如果有自由职业者，添加相关说明
         if has_freelancer:
@@ -0,0 +1,292 @@
+"""
+日本签证材料清单生成器 - PDF渲染后端模块
+
+渲染后端注册表：启动时对每个后端探测一次，记录每个后端的成功率和耗时，
+连续失败的后端打开熔断器，请求直接路由到健康的后端。
+
+available() 只列出候选后端，不改变状态；真正尝试某个后端之前调用 acquire()：
+熔断冷却时间已过的后端在这时才转为半开（只允许一次试探请求），探测时不可用的后端每隔一段时间在这时重新探测。
+"""
+from typing import Dict, List, Any, Optional, Callable
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+from document_generator.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 探测渲染使用的最小HTML
+PROBE_HTML = '<!DOCTYPE html><html><head><meta charset="UTF-8"></head><body><p>probe</p></body></html>'
+
+# 熔断器状态
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+STATE_UNAVAILABLE = 'unavailable'
+
+
+class PDFBackend:
+    """PDF渲染后端基类"""
+
+    name = ''
+    # 是否需要先把HTML写入文件
+    needs_file = False
+
+    def probe(self) -> None:
+        """探测后端是否可用，不可用时抛出异常"""
+        raise NotImplementedError
+
+    def render(self, html_content: str, html_path: Optional[str] = None) -> bytes:
+        """
+        渲染PDF
+
+        Args:
+            html_content: HTML内容
+            html_path: HTML文件路径（仅needs_file为True的后端使用）
+
+        Returns:
+            PDF内容
+        """
+        raise NotImplementedError
+
+
+class WeasyPrintBackend(PDFBackend):
+    """WeasyPrint直接从内存中的HTML字符串渲染"""
+
+    name = 'weasyprint'
+
+    def __init__(self, write_pdf: Callable[[Any], bytes]):
+        """
+        Args:
+            write_pdf: 使用共用字体配置和样式表渲染WeasyPrint HTML对象的函数
+        """
+        self._write_pdf = write_pdf
+
+    def probe(self) -> None:
+        from weasyprint import HTML
+        self._write_pdf(HTML(string=PROBE_HTML))
+
+    def render(self, html_content: str, html_path: Optional[str] = None) -> bytes:
+        from weasyprint import HTML
+        return self._write_pdf(HTML(string=html_content))
+
+
+class WeasyPrintFileBackend(WeasyPrintBackend):
+    """WeasyPrint从HTML文件渲染"""
+
+    name = 'weasyprint_file'
+    needs_file = True
+
+    def render(self, html_content: str, html_path: Optional[str] = None) -> bytes:
+        from weasyprint import HTML
+        return self._write_pdf(HTML(filename=html_path))
+
+
+class WkhtmltopdfBackend(PDFBackend):
+    """调用wkhtmltopdf命令行渲染"""
+
+    name = 'wkhtmltopdf'
+    needs_file = True
+
+    def __init__(self, executable: str = 'wkhtmltopdf', timeout: float = 60.0):
+        self.executable = executable
+        self.timeout = timeout
+        self._path = None
+
+    def probe(self) -> None:
+        # 只检查可执行文件是否存在，不在启动时启动子进程
+        self._path = shutil.which(self.executable)
+        if not self._path:
+            raise FileNotFoundError(f"未找到{self.executable}，请手动安装")
+
+    def render(self, html_content: str, html_path: Optional[str] = None) -> bytes:
+        output_pdf = os.path.splitext(html_path)[0] + '.pdf'
+        subprocess.run([self._path or self.executable, html_path, output_pdf],
+                       stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, timeout=self.timeout)
+        with open(output_pdf, 'rb') as f:
+            return f.read()
+
+
+class _BackendStats:
+    """单个后端的统计数据和熔断器状态"""
+
+    def __init__(self):
+        self.state = STATE_CLOSED
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.total_latency = 0.0
+        self.last_latency = None
+        self.last_error = None
+        self.opened_at = None
+        # 半开状态下试探请求的开始时间
+        self.trial_started_at = None
+        # 最近一次探测的时间
+        self.probed_at = None
+        # 不可用时是否定期重新探测（问题需要重启进程才能解决时为False）
+        self.reprobe = True
+
+
+class BackendRegistry:
+    """PDF渲染后端注册表（按注册顺序确定优先级）"""
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0, reprobe_interval: float = 300.0):
+        """
+        初始化后端注册表
+
+        Args:
+            failure_threshold: 连续失败多少次后打开熔断器
+            reset_timeout: 熔断器打开多少秒后允许一次试探请求；试探请求超过这个时间没有结果时允许新的试探
+            reprobe_interval: 探测时不可用的后端每隔多少秒重新探测（0表示不重新探测）
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.reprobe_interval = reprobe_interval
+        self._backends: List[PDFBackend] = []
+        self._stats: Dict[str, _BackendStats] = {}
+        self._lock = threading.Lock()
+
+    def register(self, backend: PDFBackend) -> None:
+        """注册一个渲染后端"""
+        self._backends.append(backend)
+        self._stats[backend.name] = _BackendStats()
+
+    def probe_all(self) -> None:
+        """启动时探测所有后端，探测失败的后端标记为不可用"""
+        for backend in self._backends:
+            stats = self._stats[backend.name]
+            stats.probed_at = time.monotonic()
+            start = time.perf_counter()
+            try:
+                backend.probe()
+                stats.state = STATE_CLOSED
+                logger.info("PDF渲染后端可用: %s, 探测耗时%.3f秒", backend.name, time.perf_counter() - start)
+            except Exception as e:
+                stats.state = STATE_UNAVAILABLE
+                stats.last_error = str(e)
+                logger.warning("PDF渲染后端不可用: %s, 错误: %s", backend.name, str(e))
+
+    def mark_unavailable(self, name: str, error: str, reprobe: bool = True) -> None:
+        """
+        把后端标记为不可用（例如预热时发现的问题）
+
+        Args:
+            name: 后端名称
+            error: 不可用的原因
+            reprobe: 是否定期重新探测；探测无法发现的问题（如缺少中文字体）应为False
+        """
+        with self._lock:
+            stats = self._stats[name]
+            stats.state = STATE_UNAVAILABLE
+            stats.last_error = error
+            stats.probed_at = time.monotonic()
+            stats.reprobe = reprobe
+        logger.warning("PDF渲染后端已停用: %s, 原因: %s", name, error)
+
+    def _eligible(self, stats: _BackendStats, now: float) -> bool:
+        """后端当前是否可以尝试（调用方需持有锁）"""
+        if stats.state == STATE_CLOSED:
+            return True
+        if stats.state == STATE_OPEN:
+            return now - stats.opened_at >= self.reset_timeout
+        if stats.state == STATE_HALF_OPEN:
+            # 已有一次试探请求正在进行；试探请求一直没有结果（例如线程异常退出）时允许新的试探
+            return now - stats.trial_started_at >= self.reset_timeout
+        return stats.reprobe and bool(self.reprobe_interval) and now - stats.probed_at >= self.reprobe_interval
+
+    def available(self) -> List[PDFBackend]:
+        """返回当前可以尝试的后端（按优先级排列），不改变熔断器状态"""
+        now = time.monotonic()
+        with self._lock:
+            return [backend for backend in self._backends if self._eligible(self._stats[backend.name], now)]
+
+    def acquire(self, backend: PDFBackend) -> bool:
+        """
+        尝试使用后端之前调用：冷却时间已过的后端转为半开，不可用的后端到时间后重新探测
+
+        Args:
+            backend: available() 返回的后端
+
+        Returns:
+            是否可以使用该后端渲染（其他请求已经占用试探机会或重新探测失败时返回False）
+        """
+        now = time.monotonic()
+        with self._lock:
+            stats = self._stats[backend.name]
+            if not self._eligible(stats, now):
+                return False
+            if stats.state == STATE_CLOSED:
+                return True
+            if stats.state in (STATE_OPEN, STATE_HALF_OPEN):
+                stats.state = STATE_HALF_OPEN
+                stats.trial_started_at = now
+                logger.info("PDF渲染后端熔断器半开，尝试恢复: %s", backend.name)
+                return True
+            # 不可用的后端：本次请求负责重新探测，其他请求在下一个间隔之前不再探测
+            stats.probed_at = now
+
+        try:
+            backend.probe()
+        except Exception as e:
+            with self._lock:
+                stats.last_error = str(e)
+            logger.debug("PDF渲染后端仍不可用: %s, 错误: %s", backend.name, str(e))
+            return False
+        with self._lock:
+            stats.state = STATE_CLOSED
+            stats.consecutive_failures = 0
+        logger.info("PDF渲染后端重新探测成功，恢复使用: %s", backend.name)
+        return True
+
+    def record_success(self, name: str, latency: float) -> None:
+        """记录一次渲染成功"""
+        metrics.observe('good_pdf_render_duration_seconds', latency, backend=name, outcome='success')
+        with self._lock:
+            stats = self._stats[name]
+            if stats.state == STATE_HALF_OPEN:
+                logger.info("PDF渲染后端已恢复: %s", name)
+            stats.state = STATE_CLOSED
+            stats.successes += 1
+            stats.consecutive_failures = 0
+            stats.total_latency += latency
+            stats.last_latency = latency
+
+    def record_failure(self, name: str, latency: float, error: str) -> None:
+        """记录一次渲染失败，连续失败达到阈值时打开熔断器"""
+        metrics.observe('good_pdf_render_duration_seconds', latency, backend=name, outcome='failure')
+        with self._lock:
+            stats = self._stats[name]
+            stats.failures += 1
+            stats.consecutive_failures += 1
+            stats.total_latency += latency
+            stats.last_latency = latency
+            stats.last_error = error
+            if stats.state == STATE_HALF_OPEN or stats.consecutive_failures >= self.failure_threshold:
+                if stats.state != STATE_OPEN:
+                    logger.warning("PDF渲染后端熔断器打开: %s, 连续失败%d次", name, stats.consecutive_failures)
+                stats.state = STATE_OPEN
+                stats.opened_at = time.monotonic()
+
+    def status(self) -> List[Dict[str, Any]]:
+        """返回所有后端的状态，用于监控"""
+        with self._lock:
+            result = []
+            for backend in self._backends:
+                stats = self._stats[backend.name]
+                total = stats.successes + stats.failures
+                result.append({
+                    'name': backend.name,
+                    'state': stats.state,
+                    'successes': stats.successes,
+                    'failures': stats.failures,
+                    'consecutive_failures': stats.consecutive_failures,
+                    'success_rate': round(stats.successes / total, 4) if total else None,
+                    'avg_latency_ms': round(stats.total_latency / total * 1000, 2) if total else None,
+                    'last_latency_ms': round(stats.last_latency * 1000, 2) if stats.last_latency is not None else None,
+                    'last_error': stats.last_error,
+                })
+            return result
@@ -0,0 +1,268 @@
+"""
+日本签证材料清单生成器 - PDF缓存模块
+
+两级内容寻址缓存：进程内LRU + 所有工作进程共享的磁盘缓存，两级都按总字节数淘汰。
+缓存键是材料清单和PDF中显示的表单字段的规范化哈希。
+"""
+from typing import Dict, List, Any, Optional
+from collections import OrderedDict
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from document_generator.utils import write_atomic
+
+logger = logging.getLogger(__name__)
+
+# PDF中实际显示的表单字段（templates/pdf中的PDF模板读取的字段）
+PDF_DISPLAY_FIELDS = (
+    'visaType', 'visaDuration', 'identityType', 'residenceConsulate', 'hukouConsulate', 'applicationType',
+    'processType', 'orderNumber', 'isUrgent', 'previousVisit'
+)
+# 家庭成员在PDF中显示的字段
+PDF_MEMBER_FIELDS = ('relation', 'residenceConsulate', 'hukouConsulate', 'identityType')
+
+# 重新扫描磁盘缓存总大小的间隔（秒）：其他工作进程也会写入同一目录，本进程的计数只在两次扫描之间累加自己的写入
+DISK_RESCAN_INTERVAL = 10.0
+
+
+def _normalize_family_members(family_members: Any) -> List[Dict[str, Any]]:
+    """把家庭成员规范化为只包含显示字段的列表"""
+    if isinstance(family_members, str):
+        try:
+            family_members = json.loads(family_members)
+        except json.JSONDecodeError:
+            return []
+    if not isinstance(family_members, (list, tuple)):
+        return []
+    return [
+        {field: member.get(field) for field in PDF_MEMBER_FIELDS}
+        for member in family_members if isinstance(member, dict)
+    ]
+
+
+def make_cache_key(document_list: Dict[str, List[str]], form_data: Dict[str, Any],
+                   generated_date: Optional[str] = None, config_version: Optional[str] = None) -> str:
+    """
+    计算PDF缓存键
+
+    Args:
+        document_list: 材料清单字典
+        form_data: 用户表单数据
+        generated_date: PDF中显示的生成日期，默认使用当天日期
+        config_version: 生成材料清单时的配置版本，配置热加载后旧版本的缓存不再命中
+
+    Returns:
+        SHA-256十六进制缓存键
+    """
+    if generated_date is None:
+        generated_date = datetime.datetime.now().strftime('%Y年%m月%d日')
+
+    display = {field: form_data.get(field) for field in PDF_DISPLAY_FIELDS}
+    if form_data.get('applicationType') == 'FAMILY':
+        display['familyMembers'] = _normalize_family_members(form_data.get('familyMembers', []))
+
+    canonical = json.dumps({
+        'document_list': [[section, list(items)] for section, items in document_list.items()],
+        'display': display,
+        'date': generated_date,
+        'config': config_version,
+    }, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class PDFCache:
+    """两级PDF缓存：进程内LRU + 共享磁盘目录"""
+
+    def __init__(self, memory_max_bytes: int = 64 * 1024 * 1024, disk_dir: Optional[str] = None,
+                 disk_max_bytes: int = 512 * 1024 * 1024, disk_rescan_interval: float = DISK_RESCAN_INTERVAL):
+        """
+        初始化PDF缓存
+
+        Args:
+            memory_max_bytes: 进程内缓存的最大总字节数（0表示禁用内存缓存）
+            disk_dir: 共享磁盘缓存目录（None表示禁用磁盘缓存）
+            disk_max_bytes: 磁盘缓存的最大总字节数（所有共享该目录的进程合计）
+            disk_rescan_interval: 重新扫描磁盘缓存总大小的间隔秒数
+        """
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.disk_rescan_interval = disk_rescan_interval
+
+        self._memory: 'OrderedDict[str, bytes]' = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+        self._disk_bytes = 0
+        self._disk_scanned_at = 0.0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._rescan_disk()
+
+    # ------------------------------------------------------------------
+    # 公共接口
+    # ------------------------------------------------------------------
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        读取缓存的PDF
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            PDF内容，未命中时返回None
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return data
+
+        data = self._disk_get(key)
+        with self._lock:
+            if data is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['disk_hits'] += 1
+            self._memory_put(key, data)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """
+        写入缓存
+
+        Args:
+            key: 缓存键
+            data: PDF内容
+        """
+        with self._lock:
+            self._memory_put(key, data)
+        self._disk_put(key, data)
+
+    def stats(self) -> Dict[str, int]:
+        """返回缓存命中统计"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+            stats['memory_bytes'] = self._memory_bytes
+        stats['disk_bytes'] = self._disk_bytes
+        return stats
+
+    # ------------------------------------------------------------------
+    # 内存层
+    # ------------------------------------------------------------------
+
+    def _memory_put(self, key: str, data: bytes) -> None:
+        """写入内存LRU（调用方需持有锁）"""
+        if len(data) > self.memory_max_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    # ------------------------------------------------------------------
+    # 磁盘层
+    # ------------------------------------------------------------------
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.pdf")
+
+    def _disk_get(self, key: str) -> Optional[bytes]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # 更新访问时间，磁盘淘汰按最近使用时间进行
+            os.utime(path, None)
+            return data
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning("读取PDF磁盘缓存失败: %s, 错误: %s", path, str(e))
+            return None
+
+    def _disk_put(self, key: str, data: bytes) -> None:
+        if not self.disk_dir or len(data) > self.disk_max_bytes:
+            return
+        path = self._disk_path(key)
+        try:
+            # 覆盖已有文件时只计入大小的差值
+            old_size = os.stat(path).st_size
+        except OSError:
+            old_size = 0
+        try:
+            # 其他工作进程不会读到写了一半的文件
+            write_atomic(path, data)
+        except OSError as e:
+            logger.warning("写入PDF磁盘缓存失败: %s, 错误: %s", path, str(e))
+            return
+
+        with self._lock:
+            self._disk_bytes += len(data) - old_size
+            rescan = time.monotonic() - self._disk_scanned_at >= self.disk_rescan_interval
+        if rescan:
+            # 按目录中的实际大小计算，包含其他工作进程写入的文件
+            self._rescan_disk()
+        with self._lock:
+            over_limit = self._disk_bytes > self.disk_max_bytes
+        if over_limit:
+            self._evict_disk()
+
+    def _rescan_disk(self) -> int:
+        """扫描目录重新计算磁盘缓存总大小"""
+        total = sum(size for _, size, _ in self._scan_disk())
+        with self._lock:
+            self._disk_bytes = total
+            self._disk_scanned_at = time.monotonic()
+        return total
+
+    def _scan_disk(self):
+        """列出磁盘缓存中的文件：(路径, 大小, 最近使用时间)"""
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if not name.endswith('.pdf'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def _evict_disk(self) -> None:
+        """淘汰最久未使用的磁盘缓存，直到总大小降到上限的90%"""
+        entries = self._scan_disk()
+        total = sum(size for _, size, _ in entries)
+        target = int(self.disk_max_bytes * 0.9)
+        for path, size, _ in sorted(entries, key=lambda entry: entry[2]):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                # 其他工作进程已经删除
+                total -= size
+            except OSError as e:
+                logger.warning("删除PDF磁盘缓存失败: %s, 错误: %s", path, str(e))
+        with self._lock:
+            self._disk_bytes = total
+            self._disk_scanned_at = time.monotonic()
+        logger.debug("PDF磁盘缓存淘汰完成，当前大小: %d字节", total)
@@ -2,29 +2,359 @@
 日本签证材料清单生成器 - PDF生成模块
 """
 from weasyprint import HTML, CSS
-from jinja2 import Environment, FileSystemLoader
+from weasyprint.text.fonts import FontConfiguration
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, select_autoescape
+from markupsafe import Markup
+from collections import OrderedDict
+from fontTools.ttLib import TTFont
+from document_generator.debug_capture import DebugCaptureBuffer
+from document_generator.font_subset import SUBSET_FONT_PATH, subset_font_required
+from document_generator.form import as_form
+from document_generator.request_trace import span
+from document_generator.pdf_backends import (
+    BackendRegistry, WeasyPrintBackend, WeasyPrintFileBackend, WkhtmltopdfBackend
+)
 import tempfile
+import contextlib
+import functools
+import pathlib
+import io
+import threading
+import time
 import os
 import datetime
 import logging
 import platform
 import base64
-import subprocess
 import sys
 
 logger = logging.getLogger(__name__)
 
+# PDF基础样式表：在PDFGenerator初始化时解析一次，所有渲染共用
+PDF_BASE_CSS = """
+/* 定义多种字体，优先使用中文字体 */
+@font-face {
+    font-family: 'CustomFont';
+    src: local('WenQuanYi Micro Hei'),
+         local('WenQuanYi Zen Hei'),
+         local('Noto Sans CJK SC'),
+         local('Microsoft YaHei'),
+         local('SimSun'),
+         local('SimHei'),
+         local('AR PL UMing CN'),
+         local('AR PL UKai CN');
+}
+@page {
+    size: A4;
+    margin: 2cm 1.5cm;
+}
+html, body {
+    font-family: 'CustomFont', sans-serif;
+    font-size: 16px;
+    margin: 0;
+    padding: 0;
+}
+body {
+    padding: 20px;
+    line-height: 1.6;
+    color: #333;
+    background-color: white;
+}
+* {
+    font-family: 'CustomFont', sans-serif !important;
+}
+h1 {
+    text-align: center;
+    font-size: 26px;
+    margin-bottom: 25px;
+    color: #333;
+    padding-bottom: 10px;
+    border-bottom: 2px solid #666;
+    position: relative;
+}
+h2 {
+    font-size: 20px;
+    color: #333;
+    margin-top: 25px;
+    padding-bottom: 5px;
+}
+h3 {
+    font-size: 18px;
+    color: #444;
+    margin-top: 15px;
+    margin-bottom: 10px;
+    padding-bottom: 3px;
+    border-bottom: 1px solid #eee;
+}
+p, li {
+    font-size: 16px;
+    line-height: 1.6;
+    margin-bottom: 10px;
+}
+strong {
+    font-weight: bold;
+}
+/* 顶部信息区域 */
+.document-header {
+    display: flex;
+    flex-wrap: wrap;
+    background-color: #f5f5f5;
+    border: 1px solid #ddd;
+    padding: 15px 20px;
+    margin-bottom: 25px;
+    border-radius: 5px;
+    box-shadow: 0 2px 5px rgba(0,0,0,0.1);
+}
+.header-item {
+    flex: 1 0 50%;
+    margin: 5px 0;
+    min-width: 250px;
+}
+/* 申请详情区域 */
+.details-box {
+    background-color: #f9f9f9;
+    border: 1px solid #ddd;
+    padding: 15px 20px;
+    margin: 25px 0;
+    border-radius: 5px;
+    box-shadow: 0 2px 5px rgba(0,0,0,0.1);
+}
+/* 材料清单区域 */
+.materials-container {
+    display: flex;
+    flex-wrap: wrap;
+}
+.material-section {
+    flex: 1 0 100%;
+    padding-right: 15px;
+}
+@media print {
+    .material-section {
+        flex: 0 0 100%;
+        break-inside: avoid;
+    }
+}
+.footer {
+    margin-top: 40px;
+    text-align: center;
+    font-size: 14px;
+    color: #666;
+    border-top: 1px solid #ccc;
+    padding-top: 15px;
+}
+table {
+    width: 100%;
+    border-collapse: collapse;
+    margin: 15px 0;
+}
+td {
+    padding: 8px 12px;
+    vertical-align: top;
+    border-bottom: 1px solid #eee;
+}
+tr:nth-child(even) {
+    background-color: #f9f9f9;
+}
+ul {
+    padding-left: 20px;
+    margin: 15px 0;
+}
+li {
+    margin-bottom: 10px;
+    padding-left: 5px;
+}
+.details-section {
+    margin-bottom: 20px;
+}
+.family-member {
+    margin: 15px 0;
+    padding: 10px;
+    border: 1px solid #eee;
+    border-radius: 4px;
+    background-color: #fafafa;
+}
+.family-member h4 {
+    margin: 0 0 10px 0;
+    color: #555;
+    font-size: 16px;
+}
+.member-detail {
+    margin: 8px 0;
+}
+.member-detail strong {
+    display: inline-block;
+    width: 80px;
+}
+/* 两栏布局 */
+.two-column {
+    display: flex;
+    flex-wrap: wrap;
+}
+.column {
+    flex: 1 0 50%;
+    min-width: 300px;
+    padding: 0 10px;
+}
+/* 强调颜色 */
+.highlight {
+    color: #2C73D2;
+    font-weight: 500;
+}
+.text-warning {
+    color: #FFA500;
+}
+/* 订单号样式 */
+.order-number {
+    font-size: 18px;
+    padding: 5px 0;
+    margin-bottom: 10px;
+    border-bottom: 1px solid #ddd;
+    flex: 1 0 100%;
+    width: 100%;
+    text-align: center;
+}
+/* 供打印后手写填写的下划线 */
+.blank-line {
+    display: inline-block;
+    min-width: 200px;
+    border-bottom: 1px solid #000;
+}
+.blank-line.short {
+    min-width: 30px;
+}
+/* 加急印章 */
+.urgent-stamp {
+    position: absolute;
+    top: 10px;
+    right: 30px;
+    width: 100px;
+    height: 100px;
+    border: 3px solid #f44336;
+    border-radius: 50%;
+    transform: rotate(20deg);
+    display: flex;
+    align-items: center;
+    justify-content: center;
+    color: #f44336;
+    font-size: 28px;
+    font-weight: bold;
+    opacity: 0.85;
+    text-align: center;
+    line-height: 1;
+    box-shadow: 0 0 5px rgba(0,0,0,0.2);
+    z-index: 100;
+}
+/* 材料清单部分 */
+.material-section h2 {
+    border-bottom: 1px solid #ccc;
+    padding-bottom: 5px;
+    margin-top: 25px;
+}
+.material-section ul {
+    margin: 15px 0 25px 20px;
+    padding-left: 20px;
+}
+.material-section li {
+    margin-bottom: 12px;
+}
+/* 申请人信息确认表格 */
+.details-box h2 {
+    margin-top: 0;
+}
+.family-table {
+    margin-top: 20px;
+}
+.family-table th,
+.family-table td {
+    border: 1px solid #ddd;
+    padding: 10px;
+    text-align: center;
+}
+.family-table th {
+    background-color: #f5f5f5;
+}
+.family-table th:first-child {
+    text-align: left;
+}
+.family-table td.row-label {
+    font-weight: bold;
+    text-align: left;
+    background-color: #f9f9f9;
+}
+/* 申请详情 */
+.application-summary {
+    margin-top: 25px;
+    background-color: #f8f8f8;
+    border-radius: 8px;
+    padding: 15px;
+}
+.application-summary h3 {
+    margin-top: 0;
+    border-bottom: 1px solid #e0e0e0;
+    padding-bottom: 8px;
+    margin-bottom: 15px;
+}
+.summary-table td {
+    width: 50%;
+    vertical-align: top;
+}
+.summary-table td.summary-left {
+    padding-right: 15px;
+}
+.summary-table td.summary-right {
+    padding-left: 15px;
+    border-left: 1px dashed #ddd;
+}
+.family-warning {
+    clear: both;
+    padding-top: 15px;
+}
+"""
+
+# 随项目发布的子集字体：放在字体列表最前面，子集之外的字形回退到系统字体
+SUBSET_FONT_CSS = """
+@font-face {
+    font-family: 'GoodSubset';
+    src: url('%s');
+}
+html, body, * {
+    font-family: 'GoodSubset', 'CustomFont', sans-serif !important;
+}
+"""
+
+# 预热渲染使用的中文文本
+WARM_UP_TEXT = '日本签证申请材料清单'
+
+# Jinja2模板字节码缓存目录，多个工作进程和重启之间共用编译结果
+TEMPLATE_BYTECODE_DIR = os.path.join(tempfile.gettempdir(), 'good_pdf_templates')
+
 class PDFGenerator:
     """PDF生成器类"""
     
-    def __init__(self, config):
+    def __init__(self, config, debug_capture_size=0, subset_font_path=SUBSET_FONT_PATH):
         """
         初始化PDF生成器
         
         Args:
             config: 配置数据字典
+            debug_capture_size: 调试模式下在内存中保留的最近HTML文档数量（0表示关闭）
+            subset_font_path: 子集字体路径（文件不存在或为None时只使用系统字体）
+
+        Raises:
+            FileNotFoundError: 设置了PDF_SUBSET_FONT_REQUIRED=1但子集字体不存在
         """
         self.config = config
+        self.subset_font_path = subset_font_path if subset_font_path and os.path.exists(subset_font_path) else None
+        if self.subset_font_path:
+            logger.info("PDF使用子集字体: %s", self.subset_font_path)
+        elif subset_font_path and subset_font_required():
+            logger.error("PDF子集字体不存在: %s（PDF_SUBSET_FONT_REQUIRED=1）", subset_font_path)
+            raise FileNotFoundError(f"PDF子集字体不存在: {subset_font_path}，请运行python -m document_generator.font_subset生成")
+        else:
+            logger.warning("未找到PDF子集字体，使用系统中文字体，PDF更大更慢（可运行python -m document_generator.font_subset生成）")
+        self.debug_capture = DebugCaptureBuffer(debug_capture_size) if debug_capture_size > 0 else None
+        # 回退方法需要的临时文件优先放在tmpfs上，避免磁盘写入
+        self._fallback_dir = '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK) else None
         # 确保PDF模板目录存在
         template_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'templates', 'pdf')
         if not os.path.exists(template_dir):
@@ -37,23 +367,134 @@ class PDFGenerator:
             os.makedirs(css_dir, exist_ok=True)
             logger.info("创建CSS目录: %s", css_dir)
         
-        self.env = Environment(loader=FileSystemLoader(template_dir))
+        # PDF模板启动时编译一次：开启自动转义，编译结果写入字节码缓存，运行中不再检查模板文件是否修改
+        os.makedirs(TEMPLATE_BYTECODE_DIR, exist_ok=True)
+        self.env = Environment(
+            loader=FileSystemLoader(template_dir),
+            autoescape=select_autoescape(['html']),
+            bytecode_cache=FileSystemBytecodeCache(TEMPLATE_BYTECODE_DIR),
+            auto_reload=False,
+            trim_blocks=True,
+            lstrip_blocks=True
+        )
+        self.template = self.env.get_template('document_list.html')
+        # 标题和页脚等静态片段按参数缓存渲染结果
+        self._render_fragment = functools.lru_cache(maxsize=32)(self._render_fragment_uncached)
         self.css_path = os.path.join(css_dir, 'pdf_style.css')
         
-        # 检查wkhtmltopdf是否已安装
-        self._check_wkhtmltopdf()
+        # 字体配置和样式表在每个渲染线程中只构建一次，之后该线程的渲染一直复用，避免每次渲染重新解析@font-face和CSS；
+        # FontConfiguration底层的Pango字体映射不是线程安全的，按线程各建一份，不同线程的渲染不必互相等待
+        self._thread_resources = threading.local()
+        
+        # 注册渲染后端（按优先级），启动时探测一次，运行中按成功率和熔断器状态路由
+        self.backends = BackendRegistry()
+        self.backends.register(WeasyPrintBackend(self._write_pdf))
+        self.backends.register(WeasyPrintFileBackend(self._write_pdf))
+        self.backends.register(WkhtmltopdfBackend())
+        self.backends.probe_all()
+        
+    def _render_resources(self):
+        """当前线程的(字体配置, 样式表)，第一次使用时构建"""
+        resources = getattr(self._thread_resources, 'resources', None)
+        if resources is None:
+            font_config = FontConfiguration()
+            resources = self._thread_resources.resources = (font_config, self._load_stylesheets(font_config))
+        return resources
+    
+    def _load_stylesheets(self, font_config):
+        """解析PDF样式表（pdf_style.css在前，基础样式在后，后者优先）"""
+        stylesheets = []
+        if os.path.exists(self.css_path):
+            stylesheets.append(CSS(filename=self.css_path, font_config=font_config))
+        stylesheets.append(CSS(string=self._base_css(), font_config=font_config))
+        return stylesheets
+    
+    def _base_css(self):
+        """基础样式表，存在子集字体时追加引用子集字体的规则"""
+        if not self.subset_font_path:
+            return PDF_BASE_CSS
+        return PDF_BASE_CSS + SUBSET_FONT_CSS % pathlib.Path(self.subset_font_path).as_uri()
+    
+    def _inline_stylesheets(self, html_content):
+        """把样式表内联到HTML中，供无法使用预解析CSS对象的wkhtmltopdf使用"""
+        css_text = ''
+        if os.path.exists(self.css_path):
+            with open(self.css_path, 'r', encoding='utf-8') as f:
+                css_text = f.read()
+        css_text += self._base_css()
+        return html_content.replace('</head>', f'<style>{css_text}</style>\n</head>', 1)
+    
+    def _write_pdf(self, html):
+        """使用当前线程的字体配置和样式表渲染WeasyPrint文档"""
+        font_config, stylesheets = self._render_resources()
+        return html.write_pdf(stylesheets=stylesheets, font_config=font_config)
+    
+    def warm_up(self):
+        """
+        预热渲染：提前完成字体查找和布局初始化，避免第一个用户承担冷启动开销
         
-    def _check_wkhtmltopdf(self):
-        """检查wkhtmltopdf是否已安装"""
-        try:
-            # 检查wkhtmltopdf是否已安装
-            subprocess.run(['which', 'wkhtmltopdf'], 
-                          stdout=subprocess.PIPE, 
-                          stderr=subprocess.PIPE)
-            logger.debug("wkhtmltopdf已安装")
-        except FileNotFoundError:
-            logger.warning("wkhtmltopdf未安装，请手动安装")
+        WeasyPrint无法渲染或没有找到可以显示中文的字体时记录错误，并停用WeasyPrint渲染后端，
+        PDF由其他后端（wkhtmltopdf）生成，不影响不需要PDF的接口。
+        
+        Returns:
+            预热渲染耗时（秒），预热失败时返回None
+        """
+        start = time.perf_counter()
+        document_list = OrderedDict([('基本材料', (WARM_UP_TEXT,))])
+        form_data = {'applicationType': 'SINGLE', 'residenceConsulate': 'beijing', 'hukouConsulate': 'beijing'}
+        generated_date = datetime.datetime.now().strftime('%Y年%m月%d日')
+        html_content = self._generate_enhanced_html(
+            document_list, '', self._get_visa_type_display('SINGLE'), self._get_identity_type_display(''),
+            self._get_consulate_display('beijing'), generated_date, form_data)
         
+        try:
+            font_config, stylesheets = self._render_resources()
+            document = HTML(string=html_content).render(stylesheets=stylesheets, font_config=font_config)
+            document.write_pdf()
+        except Exception as e:
+            # 渲染失败可能是暂时的，之后由后端注册表定期重新探测
+            logger.error("PDF预热失败，停用WeasyPrint: %s", str(e), exc_info=True)
+            self._disable_weasyprint(f"预热渲染失败: {e}", reprobe=True)
+            return None
+        
+        if not self._has_cjk_font(document):
+            # 安装字体后需要重启进程，重新探测无法发现这个问题
+            logger.error("PDF预热失败：没有找到可以显示中文的字体，请安装Noto Sans CJK或文泉驿字体；停用WeasyPrint")
+            self._disable_weasyprint("没有找到可以显示中文的字体", reprobe=False)
+            return None
+        
+        elapsed = time.perf_counter() - start
+        logger.info("PDF渲染预热完成，耗时%.3f秒", elapsed)
+        return elapsed
+    
+    def _disable_weasyprint(self, error, reprobe):
+        for name in (WeasyPrintBackend.name, WeasyPrintFileBackend.name):
+            self.backends.mark_unavailable(name, error, reprobe=reprobe)
+    
+    def _has_cjk_font(self, document):
+        """检查渲染结果中是否有字体包含预热文本的中文字形"""
+        for font in document.fonts.values():
+            try:
+                ttfont = TTFont(io.BytesIO(font.file_content), fontNumber=font.index, lazy=True)
+                cmap = ttfont.getBestCmap() or {}
+            except Exception as e:
+                logger.debug("无法读取字体字符映射: %s", str(e))
+                continue
+            if all(ord(char) in cmap for char in WARM_UP_TEXT):
+                logger.debug("找到中文字体: %s", font.family)
+                return True
+        return False
+    
+    def get_debug_captures(self):
+        """返回调试模式下捕获的最近HTML文档（最新的在前），未开启调试模式时返回None"""
+        if self.debug_capture is None:
+            return None
+        return self.debug_capture.entries()
+    
+    def get_backend_status(self):
+        """返回各渲染后端的状态（成功率、耗时、熔断器状态）"""
+        return self.backends.status()
+    
     def generate_pdf(self, document_list, form_data):
         """
         生成PDF签证材料清单
@@ -67,124 +508,109 @@ class PDFGenerator:
         """
         try:
             # 准备模板数据
+            form_data = as_form(form_data)
             applicant_name = form_data.get('applicantName', '未命名申请人')
-            visa_type = self._get_visa_type_display(form_data.get('visaType', ''))
-            identity_type = self._get_identity_type_display(form_data.get('identityType', ''))
-            consulate = self._get_consulate_display(form_data.get('residenceConsulate', ''))
+            visa_type = self._get_visa_type_display(form_data.visa_duration)
+            identity_type = self._get_identity_type_display(form_data.identity_type)
+            consulate = self._get_consulate_display(form_data.residence_consulate)
             generated_date = datetime.datetime.now().strftime('%Y年%m月%d日')
             
             logger.debug("PDF模板数据: 申请人=%s, 签证类型=%s, 身份=%s, 领区=%s", 
                         applicant_name, visa_type, identity_type, consulate)
             
-            # 确保familyMembers正确处理
-            application_type = form_data.get('applicationType', '')
-            if application_type == 'FAMILY':
-                family_members = form_data.get('familyMembers', [])
-                # 记录家庭成员信息
-                logger.debug("家庭申请: 找到家庭成员数量: %s", len(family_members))
-                logger.debug("家庭成员数据类型: %s", type(family_members))
-                
-                # 如果familyMembers是字符串，尝试解析为JSON
-                if isinstance(family_members, str):
-                    try:
-                        import json
-                        family_members = json.loads(family_members)
-                        form_data['familyMembers'] = family_members
-                        logger.debug("已将家庭成员字符串解析为对象: %s", family_members)
-                    except Exception as e:
-                        logger.error("无法解析家庭成员字符串: %s, 错误: %s", family_members, str(e))
+            # 逐项记录家庭成员和材料清单（未开启DEBUG时跳过整个循环）
+            if logger.isEnabledFor(logging.DEBUG):
+                # 字符串形式的familyMembers已在解析表单时处理
+                if form_data.application_type == 'FAMILY':
+                    family_members = form_data.family_members
+                    logger.debug("家庭申请: 找到家庭成员数量: %s", len(family_members))
+                    
+                    for i, member in enumerate(family_members):
+                        logger.debug("家庭成员 %d: %s", i+1, member)
                 
-                for i, member in enumerate(family_members):
-                    logger.debug("家庭成员 %d: %s", i+1, member)
-            
-            # 显式打印document_list以便调试
-            logger.debug("生成PDF的材料清单详情:")
-            for section, items in document_list.items():
-                logger.debug("部分: %s", section)
-                for item in items:
-                    logger.debug("  - %s", item)
+                logger.debug("生成PDF的材料清单详情:")
+                for section, items in document_list.items():
+                    logger.debug("部分: %s", section)
+                    for item in items:
+                        logger.debug("  - %s", item)
             
             # 生成多种格式的HTML，尝试不同的方法
-            html_content = self._generate_enhanced_html(document_list, applicant_name, visa_type, identity_type, consulate, generated_date, form_data)
-            
-            # 保存HTML到临时文件用于调试
-            with tempfile.NamedTemporaryFile(suffix='.html', delete=False, mode='w', encoding='utf-8') as f:
-                f.write(html_content)
-                debug_html_path = f.name
-                logger.debug("已保存HTML到临时文件: %s", debug_html_path)
+            with span('pdf_html'):
+                html_content = self._generate_enhanced_html(document_list, applicant_name, visa_type, identity_type, consulate, generated_date, form_data)
             
-            # 尝试多种方法生成PDF
-            pdf_content = None
+            # 调试模式下在内存中保留最近的HTML，不再写入临时文件
+            if self.debug_capture is not None:
+                self.debug_capture.add(html_content)
             
-            # 方法1: 使用WeasyPrint直接生成
-            try:
-                logger.debug("尝试使用WeasyPrint直接生成PDF")
-                html = HTML(string=html_content)
-                pdf_content = html.write_pdf()
-                logger.debug("WeasyPrint直接生成PDF成功")
-                return pdf_content
-            except Exception as e:
-                logger.error("WeasyPrint直接生成PDF失败: %s", str(e))
-                
-                # 方法2: 尝试使用临时文件
-                try:
-                    logger.debug("尝试使用WeasyPrint从文件生成PDF")
-                    pdf_content = HTML(filename=debug_html_path).write_pdf()
-                    logger.debug("WeasyPrint从文件生成PDF成功")
-                    return pdf_content
-                except Exception as e2:
-                    logger.error("WeasyPrint从文件生成PDF失败: %s", str(e2))
+            # 按优先级尝试可用的渲染后端，熔断中的后端直接跳过
+            with contextlib.ExitStack() as stack:
+                html_path = None
+                for backend in self.backends.available():
+                    if not self.backends.acquire(backend):
+                        # 其他请求正在试探该后端，或者重新探测仍然失败
+                        continue
+                    if backend.needs_file and html_path is None:
+                        # 只有需要文件的后端才把HTML写入tmpfs上的临时目录，用完即删除
+                        work_dir = stack.enter_context(
+                            tempfile.TemporaryDirectory(prefix='good_pdf_', dir=self._fallback_dir))
+                        html_path = os.path.join(work_dir, 'document.html')
+                        with open(html_path, 'w', encoding='utf-8') as f:
+                            f.write(self._inline_stylesheets(html_content))
                     
-                    # 方法3: 尝试使用wkhtmltopdf
+                    start = time.perf_counter()
                     try:
-                        logger.debug("尝试使用wkhtmltopdf生成PDF")
-                        output_pdf = debug_html_path.replace('.html', '.pdf')
-                        subprocess.run(['wkhtmltopdf', debug_html_path, output_pdf], 
-                                      stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
-                        
-                        with open(output_pdf, 'rb') as f:
-                            pdf_content = f.read()
-                        logger.debug("wkhtmltopdf生成PDF成功")
-                        return pdf_content
-                    except Exception as e3:
-                        logger.error("wkhtmltopdf生成PDF失败: %s", str(e3))
-                        
-                        # 所有方法都失败，抛出异常
-                        raise Exception("所有PDF生成方法都失败")
+                        logger.debug("尝试使用%s生成PDF", backend.name)
+                        with span('pdf_write', backend=backend.name):
+                            pdf_content = backend.render(html_content, html_path)
+                    except Exception as e:
+                        self.backends.record_failure(backend.name, time.perf_counter() - start, str(e))
+                        logger.error("%s生成PDF失败: %s", backend.name, str(e))
+                        continue
+                    self.backends.record_success(backend.name, time.perf_counter() - start)
+                    logger.debug("%s生成PDF成功", backend.name)
+                    return pdf_content
+            
+            # 所有方法都失败，抛出异常
+            raise Exception("所有PDF生成方法都失败")
                 
         except Exception as e:
             logger.error("生成PDF时出错: %s", str(e), exc_info=True)
             raise
     
+    def _render_fragment_uncached(self, template_name, **context):
+        """渲染静态模板片段（通过self._render_fragment调用，结果按参数缓存）"""
+        return Markup(self.env.get_template(template_name).render(**context))
+    
     def _generate_enhanced_html(self, document_list, applicant_name, visa_type, identity_type, consulate, generated_date, form_data=None):
-        """生成增强的HTML版本，确保中文正确显示"""
-        document_items = []
+        """使用编译好的Jinja2模板生成HTML，确保中文正确显示"""
+        if form_data:
+            form_data = as_form(form_data)
         
         # 记录表单数据中的经济材料选项和实际生成的财力证明内容
-        application_type = form_data.get('applicationType') if form_data else None
+        application_type = form_data.application_type if form_data else None
         # 对于绑签申请和经济材料申请，不需要经济材料选项
         if application_type not in ['BINDING', 'ECONOMIC']:
-            logger.debug("PDF生成的经济材料选项: %s", form_data.get('economicMaterial') if form_data else None)
+            logger.debug("PDF生成的经济材料选项: %s", form_data.economic_material if form_data else None)
         else:
             logger.debug("%s申请不需要经济材料选项", "绑签" if application_type == 'BINDING' else "经济材料")
-        logger.debug("PDF生成的处理方式: %s", form_data.get('processType') if form_data else None)
+        logger.debug("PDF生成的处理方式: %s", form_data.process_type if form_data else None)
         
         # 如果document_list中有财力证明部分，记录它的实际内容
-        if '财力证明' in document_list:
+        if '财力证明' in document_list and logger.isEnabledFor(logging.DEBUG):
             logger.debug("实际PDF财力证明内容:")
             for item in document_list.get('财力证明', []):
                 logger.debug("  - %s", item)
         
+        process_type = form_data.process_type if form_data else None
+        resident_identity = form_data.identity_type if form_data else None
+        residence_consulate = form_data.residence_consulate if form_data else ''
+        
         # 处理所有材料清单部分，但跳过基本信息部分（已经在申请人信息确认中展示）
+        sections = []
         for section_name, materials in document_list.items():
             if not materials or section_name == '基本信息':  # 跳过空部分和基本信息部分
                 continue
             
-            # 对于特定大学生单次办理方式，跳过财力证明部分
-            process_type = form_data.get('processType') if form_data else None
-            resident_identity = form_data.get('identityType') if form_data else None
-            residence_consulate = form_data.get('residenceConsulate', '').lower() if form_data else ''
-            
             # 对于特定大学生单次办理方式，跳过财力证明部分，除非是北京领区+在职人员的特殊情况
             if process_type == 'STUDENT' and section_name == '财力证明':
                 # 特殊情况：北京领区的在职人员需要税单
@@ -192,28 +618,8 @@ class PDFGenerator:
                     logger.debug("特定大学生单次办理方式：跳过财力证明部分")
                     continue
             
-            # 创建材料清单部分
-            document_items.append(f'<div class="material-section">')
-            document_items.append(f'<h2 style="border-bottom: 1px solid #ccc; padding-bottom: 5px; margin-top: 25px;">{section_name}</h2>')
-            document_items.append('<ul style="margin: 15px 0 25px 20px; padding-left: 20px;">')
-            
             # 使用document_list中的实际材料列表，确保与页面显示一致
-            for material in materials:
-                document_items.append(f'<li style="margin-bottom: 12px;">{material}</li>')
-                
-            document_items.append('</ul>')
-            document_items.append('</div>')
-        
-        # 生成申请人详细信息确认部分
-        applicant_details = self._generate_applicant_details(form_data)
-        
-        # 获取订单号，如果不存在则显示下划线供手写
-        order_number = ""
-        if form_data and form_data.get('orderNumber'):
-            order_number = form_data.get('orderNumber')
-        else:
-            # 显示下划线，供打印后手写填写
-            order_number = '<span style="display: inline-block; min-width: 200px; border-bottom: 1px solid #000;">&nbsp;</span>'
+            sections.append((section_name, materials))
         
         # 检查是否加急
         is_urgent = False
@@ -224,253 +630,25 @@ class PDFGenerator:
             elif isinstance(is_urgent_value, str):
                 is_urgent = is_urgent_value.lower() == 'true'
         
-        # 现在制作顶部信息部分（不再单独显示基本信息部分）
-        # 订单号单独一行，其他信息左右分布
-        header_items = [
-            f'<div class="order-number" style="flex: 1 0 100%; width: 100%; text-align: center; margin-bottom: 10px;"><strong>订单号：</strong>{order_number}</div>',
-            f'<div class="header-item"><strong>签证类型：</strong>{visa_type}</div>',
-            f'<div class="header-item"><strong>申请人身份：</strong>{identity_type}</div>',
-            f'<div class="header-item"><strong>申请领区：</strong>{consulate}</div>',
-            f'<div class="header-item"><strong>生成日期：</strong>{generated_date}</div>'
-        ]
-        
-        # 创建加急印章样式
-        urgent_stamp = """
-        <div class="urgent-stamp" style="
-            position: absolute;
-            top: 10px;
-            right: 30px;
-            width: 100px;
-            height: 100px;
-            border: 3px solid #f44336;
-            border-radius: 50%;
-            transform: rotate(20deg);
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            color: #f44336;
-            font-size: 28px;
-            font-weight: bold;
-            opacity: 0.85;
-            text-align: center;
-            line-height: 1;
-            box-shadow: 0 0 5px rgba(0,0,0,0.2);
-            z-index: 100;
-        ">
-        加急<br>处理
-        </div>
-        """ if is_urgent else ""
-        
-        html = f"""<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <meta http-equiv="Content-Type" content="text/html; charset=utf-8"/>
-    <title>日本签证申请材料清单</title>
-    <style>
-        /* 定义多种字体，优先使用中文字体 */
-        @font-face {{
-            font-family: 'CustomFont';
-            src: local('WenQuanYi Micro Hei'),
-                 local('WenQuanYi Zen Hei'),
-                 local('Noto Sans CJK SC'),
-                 local('Microsoft YaHei'),
-                 local('SimSun'),
-                 local('SimHei'),
-                 local('AR PL UMing CN'),
-                 local('AR PL UKai CN');
-        }}
-        @page {{
-            size: A4;
-            margin: 2cm 1.5cm;
-        }}
-        html, body {{
-            font-family: 'CustomFont', sans-serif;
-            font-size: 16px;
-            margin: 0;
-            padding: 0;
-        }}
-        body {{
-            padding: 20px;
-            line-height: 1.6;
-            color: #333;
-            background-color: white;
-        }}
-        * {{
-            font-family: 'CustomFont', sans-serif !important;
-        }}
-        h1 {{
-            text-align: center;
-            font-size: 26px;
-            margin-bottom: 25px;
-            color: #333;
-            padding-bottom: 10px;
-            border-bottom: 2px solid #666;
-        }}
-        h2 {{
-            font-size: 20px;
-            color: #333;
-            margin-top: 25px;
-            padding-bottom: 5px;
-        }}
-        h3 {{
-            font-size: 18px;
-            color: #444;
-            margin-top: 15px;
-            margin-bottom: 10px;
-            padding-bottom: 3px;
-            border-bottom: 1px solid #eee;
-        }}
-        p, li {{
-            font-size: 16px;
-            line-height: 1.6;
-            margin-bottom: 10px;
-        }}
-        strong {{
-            font-weight: bold;
-        }}
-        /* 顶部信息区域 */
-        .document-header {{
-            display: flex;
-            flex-wrap: wrap;
-            background-color: #f5f5f5;
-            border: 1px solid #ddd;
-            padding: 15px 20px;
-            margin-bottom: 25px;
-            border-radius: 5px;
-            box-shadow: 0 2px 5px rgba(0,0,0,0.1);
-        }}
-        .header-item {{
-            flex: 1 0 50%;
-            margin: 5px 0;
-            min-width: 250px;
-        }}
-        /* 申请详情区域 */
-        .details-box {{
-            background-color: #f9f9f9;
-            border: 1px solid #ddd;
-            padding: 15px 20px;
-            margin: 25px 0;
-            border-radius: 5px;
-            box-shadow: 0 2px 5px rgba(0,0,0,0.1);
-        }}
-        /* 材料清单区域 */
-        .materials-container {{
-            display: flex;
-            flex-wrap: wrap;
-        }}
-        .material-section {{
-            flex: 1 0 100%;
-            padding-right: 15px;
-        }}
-        @media print {{
-            .material-section {{
-                flex: 0 0 100%;
-                break-inside: avoid;
-            }}
-        }}
-        .footer {{
-            margin-top: 40px;
-            text-align: center;
-            font-size: 14px;
-            color: #666;
-            border-top: 1px solid #ccc;
-            padding-top: 15px;
-        }}
-        table {{
-            width: 100%;
-            border-collapse: collapse;
-            margin: 15px 0;
-        }}
-        td {{
-            padding: 8px 12px;
-            vertical-align: top;
-            border-bottom: 1px solid #eee;
-        }}
-        tr:nth-child(even) {{
-            background-color: #f9f9f9;
-        }}
-        ul {{
-            padding-left: 20px;
-            margin: 15px 0;
-        }}
-        li {{
-            margin-bottom: 10px;
-            padding-left: 5px;
-        }}
-        .details-section {{
-            margin-bottom: 20px;
-        }}
-        .family-member {{
-            margin: 15px 0;
-            padding: 10px;
-            border: 1px solid #eee;
-            border-radius: 4px;
-            background-color: #fafafa;
-        }}
-        .family-member h4 {{
-            margin: 0 0 10px 0;
-            color: #555;
-            font-size: 16px;
-        }}
-        .member-detail {{
-            margin: 5px 0;
-        }}
-        /* 两栏布局 */
-        .two-column {{
-            display: flex;
-            flex-wrap: wrap;
-        }}
-        .column {{
-            flex: 1 0 50%;
-            min-width: 300px;
-            padding: 0 10px;
-        }}
-        /* 强调颜色 */
-        .highlight {{
-            color: #2C73D2;
-        }}
-        .text-warning {{
-            color: #FFA500;
-        }}
-        /* 订单号样式 */
-        .order-number {{
-            font-size: 18px;
-            padding: 5px 0;
-            margin-bottom: 10px;
-            border-bottom: 1px solid #ddd;
-        }}
-    </style>
-</head>
-<body>
-    <h1 style="position: relative;">日本签证申请材料清单{urgent_stamp}</h1>
-    
-    <div class="document-header">
-        {"".join(header_items)}
-    </div>
-    
-    {applicant_details}
-    
-    <div class="materials-container">
-        {"".join(document_items)}
-    </div>
-    
-    <div class="footer">
-        <p>本材料清单仅供参考。旅行社保留材料审核和提出补充材料的权力。</p>
-        <p>Generated by GOOD System on {generated_date}</p>
-    </div>
-</body>
-</html>"""
-        
-        return html
-        
-    def _generate_applicant_details(self, form_data):
-        """生成申请人详细信息部分"""
+        return self.template.render(
+            title=self._render_fragment('_title.html', is_urgent=is_urgent),
+            footer=self._render_fragment('_footer.html', generated_date=generated_date),
+            # 订单号不存在时模板显示下划线，供打印后手写填写
+            order_number=form_data.get('orderNumber') if form_data else None,
+            visa_type=visa_type,
+            identity_type=identity_type,
+            consulate=consulate,
+            generated_date=generated_date,
+            details=self._applicant_details_context(form_data),
+            sections=sections
+        )
+        
+    def _applicant_details_context(self, form_data):
+        """准备申请人详细信息部分的模板数据"""
         if not form_data:
-            return ""
+            return None
+        form_data = as_form(form_data)
         
-        # 记录接收到的form_data类型和内容
-        logger.debug("_generate_applicant_details接收到的form_data类型: %s", type(form_data))
         logger.debug("访问日本状态: %s, 类型: %s", form_data.get('previousVisit'), type(form_data.get('previousVisit')))
         
         # 处理previousVisit的布尔值转换
@@ -484,174 +662,37 @@ class PDFGenerator:
         # 获取并转换主申请人的访问状态
         visited_japan = convert_to_bool(form_data.get('previousVisit', False))
         
-        details = ['<div class="details-box">']
-        details.append('<h2 style="margin-top: 0;">申请人信息确认</h2>')
-        details.append('<p>请确认以下申请人信息正确无误。</p>')
-        
         # 获取申请类型
-        application_type = form_data.get('applicationType', '')
-        family_members = form_data.get('familyMembers', [])
-        
-        # 如果familyMembers是字符串，尝试解析
-        if isinstance(family_members, str):
-            try:
-                import json
-                family_members = json.loads(family_members)
-                logger.debug("已将字符串解析为家庭成员对象: %s", family_members)
-            except Exception as e:
-                logger.error("无法解析家庭成员字符串: %s, 错误: %s", family_members, str(e))
-        
-        # 创建表格布局 - 无论是单人还是家庭申请都使用表格
-        # 获取主要表单数据
-        identity_type = form_data.get('identityType', '')
-        residence_consulate = form_data.get('residenceConsulate', '')
-        hukou_consulate = form_data.get('hukouConsulate', '')
-        identity_text = self._get_identity_type_display(identity_type)
-        residence_text = self._get_consulate_display(residence_consulate)
-        hukou_text = self._get_consulate_display(hukou_consulate)
-        
-        # 创建表格布局
-        details.append('<table class="family-table" style="width:100%; border-collapse: collapse; margin-top:20px;">')
-        
-        # 表头
-        details.append('<tr>')
-        details.append('<th style="border:1px solid #ddd; padding:10px; text-align:left; background-color:#f5f5f5;"></th>')
-        details.append('<th style="border:1px solid #ddd; padding:10px; text-align:center; background-color:#f5f5f5;">主申请人</th>')
-        
-        # 如果是家庭申请且有家庭成员，添加家庭成员表头
-        if application_type == 'FAMILY' and family_members and len(family_members) > 0:
-            for i in range(len(family_members)):
-                details.append(f'<th style="border:1px solid #ddd; padding:10px; text-align:center; background-color:#f5f5f5;">家庭成员{i+1}</th>')
-        
-        details.append('</tr>')
-        
-        # 与主申请人关系行
-        details.append('<tr>')
-        details.append('<td style="border:1px solid #ddd; padding:10px; font-weight:bold; background-color:#f9f9f9;">与主申请人关系</td>')
-        details.append('<td style="border:1px solid #ddd; padding:10px; text-align:center;">本人</td>')
-        
-        # 如果是家庭申请且有家庭成员，添加与主申请人的关系
-        if application_type == 'FAMILY' and family_members and len(family_members) > 0:
-            for member in family_members:
-                relation = member.get('relation', '')
-                relation_text = self._get_relation_display(relation)
-                details.append(f'<td style="border:1px solid #ddd; padding:10px; text-align:center;">{relation_text}</td>')
-        
-        details.append('</tr>')
-        
-        # 居住地领区行
-        details.append('<tr>')
-        details.append('<td style="border:1px solid #ddd; padding:10px; font-weight:bold; background-color:#f9f9f9;">居住地领区</td>')
-        details.append(f'<td style="border:1px solid #ddd; padding:10px; text-align:center;">{residence_text}</td>')
-        
-        # 如果是家庭申请且有家庭成员，添加居住地领区
-        if application_type == 'FAMILY' and family_members and len(family_members) > 0:
-            for member in family_members:
-                member_residence = member.get('residenceConsulate', '')
-                member_residence_text = self._get_consulate_display(member_residence)
-                details.append(f'<td style="border:1px solid #ddd; padding:10px; text-align:center;">{member_residence_text}</td>')
-        
-        details.append('</tr>')
-        
-        # 户籍所在地领区行
-        details.append('<tr>')
-        details.append('<td style="border:1px solid #ddd; padding:10px; font-weight:bold; background-color:#f9f9f9;">户籍所在地领区</td>')
-        details.append(f'<td style="border:1px solid #ddd; padding:10px; text-align:center;">{hukou_text}</td>')
-        
-        # 如果是家庭申请且有家庭成员，添加户籍所在地领区
-        if application_type == 'FAMILY' and family_members and len(family_members) > 0:
-            for member in family_members:
-                member_hukou = member.get('hukouConsulate', '')
-                member_hukou_text = self._get_consulate_display(member_hukou)
-                details.append(f'<td style="border:1px solid #ddd; padding:10px; text-align:center;">{member_hukou_text}</td>')
-        
-        details.append('</tr>')
-        
-        # 申请人身份行
-        details.append('<tr>')
-        details.append('<td style="border:1px solid #ddd; padding:10px; font-weight:bold; background-color:#f9f9f9;">申请人身份</td>')
-        details.append(f'<td style="border:1px solid #ddd; padding:10px; text-align:center;">{identity_text}</td>')
-        
-        # 如果是家庭申请且有家庭成员，添加申请人身份
-        if application_type == 'FAMILY' and family_members and len(family_members) > 0:
-            for member in family_members:
-                member_identity = member.get('identityType', '')
-                member_identity_text = self._get_identity_type_display(member_identity)
-                details.append(f'<td style="border:1px solid #ddd; padding:10px; text-align:center;">{member_identity_text}</td>')
-        
-        details.append('</tr>')
-        
-        # 是否曾经访问日本行
-        details.append('<tr>')
-        details.append('<td style="border:1px solid #ddd; padding:10px; font-weight:bold; background-color:#f9f9f9;">是否曾经访问日本</td>')
-        
-        # 主申请人的访问状态
-        visited_text = "是" if visited_japan else "否"
-        details.append(f'<td style="border:1px solid #ddd; padding:10px; text-align:center;">{visited_text}</td>')
-        
-        # 如果是家庭申请且有家庭成员，添加访问状态
-        if application_type == 'FAMILY' and family_members and len(family_members) > 0:
+        application_type = form_data.application_type
+        family_members = form_data.family_members
+        
+        # 只有家庭申请才在表格中显示家庭成员列（使用解析表单时生成的家庭成员索引）
+        members = [member.data for member in form_data.family_profile.members] if application_type == 'FAMILY' else []
+        
+        # 表格每一行：第一个值是主申请人，后面依次是家庭成员；None表示留空下划线
+        rows = [
+            ('与主申请人关系', ['本人'] + [
+                self._get_relation_display(member.get('relation', '')) for member in members]),
+            ('居住地领区', [self._get_consulate_display(form_data.residence_consulate)] + [
+                self._get_consulate_display(member.get('residenceConsulate', '')) for member in members]),
+            ('户籍所在地领区', [self._get_consulate_display(form_data.hukou_consulate)] + [
+                self._get_consulate_display(member.get('hukouConsulate', '')) for member in members]),
+            ('申请人身份', [self._get_identity_type_display(form_data.identity_type)] + [
+                self._get_identity_type_display(member.get('identityType', '')) for member in members]),
             # 家庭成员的访问状态留空，添加下划线
-            for _ in family_members:
-                details.append('<td style="border:1px solid #ddd; padding:10px; text-align:center;">')
-                details.append('<div style="display:inline-block; min-width:30px; border-bottom:1px solid #000;">&nbsp;</div>')
-                details.append('</td>')
-        
-        details.append('</tr>')
-        
-        details.append('</table>')
-        
-        # 添加申请详情部分，使用美观的左右布局
-        details.append('<div class="details-section" style="margin-top:25px; background-color:#f8f8f8; border-radius:8px; padding:15px;">')
-        details.append('<h3 style="margin-top:0; border-bottom:1px solid #e0e0e0; padding-bottom:8px; margin-bottom:15px;">申请详情</h3>')
-        
-        # 计算申请人数
-        applicant_count = 1 + (len(family_members) if application_type == 'FAMILY' and family_members else 0)
-        
-        # 使用表格布局确保左右对齐美观
-        details.append('<table style="width:100%; border-collapse:collapse;">')
-        details.append('<tr>')
-        
-        # 左侧栏
-        details.append('<td style="width:50%; padding-right:15px; vertical-align:top;">')
-        
-        # 申请类型
-        application_text = self._get_application_type_display(application_type)
-        details.append(f'<p class="member-detail" style="margin:8px 0;"><strong style="display:inline-block; width:80px;">申请类型: </strong>{application_text}</p>')
-        
-        # 申请人数
-        details.append(f'<p class="member-detail" style="margin:8px 0;"><strong style="display:inline-block; width:80px;">申请人数: </strong><span style="color:#2C73D2; font-weight:500;">{applicant_count}人</span></p>')
-        
-        details.append('</td>')  # 结束左侧栏
-        
-        # 右侧栏
-        details.append('<td style="width:50%; padding-left:15px; vertical-align:top; border-left:1px dashed #ddd;">')
-        
-        # 办理方式
-        process_type = form_data.get('processType', '')
-        process_text = self._get_process_type_display(process_type)
-        details.append(f'<p class="member-detail" style="margin:8px 0;"><strong style="display:inline-block; width:80px;">办理方式: </strong>{process_text}</p>')
-        
-        # 签证类型
-        visa_type = form_data.get('visaType', '')
-        visa_text = self._get_visa_type_display(visa_type)
-        details.append(f'<p class="member-detail" style="margin:8px 0;"><strong style="display:inline-block; width:80px;">签证类型: </strong><span style="color:#2C73D2; font-weight:500;">{visa_text}</span></p>')
-        
-        details.append('</td>')  # 结束右侧栏
-        details.append('</tr>')  # 结束行
-        details.append('</table>')  # 结束表格
-        
-        details.append('</div>')  # 结束申请详情section
-        
-        # 家庭申请但无家庭成员的情况
-        if application_type == 'FAMILY' and (not family_members or len(family_members) == 0):
-            details.append('<div class="details-section" style="clear: both; padding-top: 15px;">')
-            details.append('<h3>家庭成员信息</h3>')
-            details.append('<p class="text-warning"><i class="bi bi-exclamation-triangle-fill me-1"></i> 您选择了家庭申请，但未添加任何家庭成员。请确认是否需要添加家庭成员信息。</p>')
-            details.append('</div>')  # 结束家庭成员section
+            ('是否曾经访问日本', ["是" if visited_japan else "否"] + [None] * len(members)),
+        ]
         
-        details.append('</div>')  # 结束details-box
-        return ''.join(details)
+        return {
+            'members': members,
+            'rows': rows,
+            'application_text': self._get_application_type_display(application_type),
+            'applicant_count': 1 + len(members),
+            'process_text': self._get_process_type_display(form_data.process_type),
+            'visa_text': self._get_visa_type_display(form_data.visa_duration),
+            # 家庭申请但无家庭成员的情况
+            'missing_family_members': application_type == 'FAMILY' and not family_members
+        }
         
     def _get_relation_display(self, relation):
         """获取与主申请人关系显示名称"""
@@ -0,0 +1,284 @@
+"""
+日本签证材料清单生成器 - 异步PDF任务模块
+
+SQLite（WAL模式）任务表记录PDF生成任务的状态和结果，后台工作线程从任务表中领取任务渲染。
+共享同一个数据库文件的任何工作进程或节点都可以领取任务和提供下载。
+"""
+from typing import Dict, List, Any, Optional, Callable
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from document_generator.form import as_form
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pdf_jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    document_list TEXT NOT NULL,
+    form_data TEXT NOT NULL,
+    pdf BLOB,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_pdf_jobs_status ON pdf_jobs (status, created_at);
+"""
+
+
+class PDFJobStore:
+    """基于SQLite的PDF任务表"""
+
+    def __init__(self, db_path: str, lease_timeout: float = 300.0, max_attempts: int = 3):
+        """
+        初始化任务表
+
+        Args:
+            db_path: SQLite数据库文件路径
+            lease_timeout: 处理中的任务超过多少秒没有完成视为工作进程已退出，可以被重新领取
+            max_attempts: 每个任务最多尝试渲染的次数
+        """
+        self.db_path = db_path
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            # WAL模式下读取不阻塞写入，多个进程可以同时查询任务状态
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        """每次操作使用独立连接，连接不在线程之间共享"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def create(self, document_list: Dict[str, List[str]], form_data: Dict[str, Any]) -> str:
+        """
+        创建任务
+
+        Args:
+            document_list: 材料清单字典
+            form_data: 用户表单数据
+
+        Returns:
+            任务ID
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                'INSERT INTO pdf_jobs (id, status, document_list, form_data, created_at, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (job_id, STATUS_PENDING,
+                 json.dumps(list(document_list.items()), ensure_ascii=False),
+                 json.dumps(as_form(form_data).to_dict(), ensure_ascii=False, default=str), now, now))
+        finally:
+            conn.close()
+        return job_id
+
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """
+        领取最早的待处理任务（包括租约已过期的处理中任务）
+
+        Args:
+            worker: 工作线程标识
+
+        Returns:
+            任务数据（document_list保持原有顺序），没有任务时返回None
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE获取写锁，保证同一任务只会被一个工作线程领取
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                'SELECT id, document_list, form_data, attempts FROM pdf_jobs '
+                'WHERE status = ? OR (status = ? AND updated_at < ?) '
+                'ORDER BY created_at LIMIT 1',
+                (STATUS_PENDING, STATUS_RUNNING, now - self.lease_timeout)).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            if row['attempts'] >= self.max_attempts:
+                conn.execute('UPDATE pdf_jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?',
+                             (STATUS_FAILED, '超过最大重试次数', now, row['id']))
+                conn.execute('COMMIT')
+                logger.warning("PDF任务超过最大重试次数: %s", row['id'])
+                return None
+            conn.execute('UPDATE pdf_jobs SET status = ?, worker = ?, attempts = attempts + 1, updated_at = ? '
+                         'WHERE id = ?', (STATUS_RUNNING, worker, now, row['id']))
+            conn.execute('COMMIT')
+        except Exception:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+
+        return {
+            'id': row['id'],
+            'document_list': dict(json.loads(row['document_list'])),
+            'form_data': json.loads(row['form_data']),
+        }
+
+    def complete(self, job_id: str, pdf_content: bytes) -> None:
+        """记录任务完成，保存PDF内容"""
+        self._finish(job_id, STATUS_DONE, pdf=pdf_content)
+
+    def fail(self, job_id: str, error: str) -> None:
+        """记录任务失败"""
+        self._finish(job_id, STATUS_FAILED, error=error)
+
+    def _finish(self, job_id: str, status: str, pdf: Optional[bytes] = None, error: Optional[str] = None) -> None:
+        conn = self._connect()
+        try:
+            conn.execute('UPDATE pdf_jobs SET status = ?, pdf = ?, error = ?, updated_at = ? WHERE id = ?',
+                         (status, pdf, error, time.time(), job_id))
+        finally:
+            conn.close()
+
+    def get(self, job_id: str, include_pdf: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        查询任务
+
+        Args:
+            job_id: 任务ID
+            include_pdf: 是否读取PDF内容
+
+        Returns:
+            任务状态字典，任务不存在时返回None
+        """
+        columns = 'id, status, error, attempts, created_at, updated_at'
+        if include_pdf:
+            columns += ', pdf'
+        conn = self._connect()
+        try:
+            row = conn.execute(f'SELECT {columns} FROM pdf_jobs WHERE id = ?', (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return dict(row) if row is not None else None
+
+    def purge(self, max_age: float) -> int:
+        """
+        删除已结束且超过保留时间的任务
+
+        Args:
+            max_age: 保留秒数
+
+        Returns:
+            删除的任务数量
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.execute('DELETE FROM pdf_jobs WHERE status IN (?, ?) AND updated_at < ?',
+                                  (STATUS_DONE, STATUS_FAILED, time.time() - max_age))
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+
+class PDFJobWorker:
+    """从任务表领取任务并渲染PDF的后台工作线程"""
+
+    def __init__(self, store: PDFJobStore, render: Callable[[Dict[str, List[str]], Dict[str, Any]], bytes],
+                 threads: int = 2, poll_interval: float = 1.0, retention: float = 3600.0):
+        """
+        初始化后台工作线程
+
+        Args:
+            store: 任务表
+            render: 渲染函数，参数为材料清单和表单数据，返回PDF内容
+            threads: 工作线程数量
+            poll_interval: 没有任务时轮询任务表的间隔秒数
+            retention: 已结束任务的保留秒数
+        """
+        self.store = store
+        self.render = render
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._last_purge = 0.0
+
+    def start(self) -> None:
+        """启动工作线程"""
+        for i in range(self.threads):
+            name = f"pdf-job-{os.getpid()}-{i + 1}"
+            thread = threading.Thread(target=self._run, args=(name,), name=name, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info("PDF任务工作线程已启动: %d个", self.threads)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """停止工作线程（当前任务完成后退出）"""
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def notify(self) -> None:
+        """本进程创建了新任务，唤醒空闲的工作线程（其他进程创建的任务通过轮询发现）"""
+        self._wakeup.set()
+
+    def _run(self, name: str) -> None:
+        while not self._stopping.is_set():
+            try:
+                self._maybe_purge()
+                job = self.store.claim(name)
+            except Exception as e:
+                logger.error("领取PDF任务时出错: %s", str(e), exc_info=True)
+                job = None
+
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            self.process(job)
+
+    def process(self, job: Dict[str, Any]) -> None:
+        """渲染一个已领取的任务并记录结果"""
+        start = time.perf_counter()
+        try:
+            pdf_content = self.render(job['document_list'], job['form_data'])
+        except Exception as e:
+            logger.error("PDF任务渲染失败: %s, 错误: %s", job['id'], str(e), exc_info=True)
+            self.store.fail(job['id'], str(e))
+            return
+        self.store.complete(job['id'], pdf_content)
+        logger.info("PDF任务完成: %s, 耗时%.3f秒", job['id'], time.perf_counter() - start)
+
+    def _maybe_purge(self) -> None:
+        """定期清理过期任务"""
+        now = time.time()
+        if now - self._last_purge < 60:
+            return
+        self._last_purge = now
+        removed = self.store.purge(self.retention)
+        if removed:
+            logger.debug("已清理过期PDF任务: %d个", removed)
@@ -0,0 +1,366 @@
+"""
+日本签证材料清单生成器 - PDF渲染服务模块
+
+独立的本地渲染服务：主进程监听Unix套接字，把渲染请求分发给固定数量的常驻渲染进程。
+Web工作进程通过RenderServiceClient委托渲染，自身无需加载WeasyPrint。
+
+启动方式:
+    python -m document_generator.render_service --socket /tmp/good_pdf_render.sock --workers 4
+"""
+from typing import Dict, List, Any, Optional, Tuple
+from collections import OrderedDict
+import argparse
+import contextlib
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import socketserver
+import struct
+
+from document_generator.debug_capture import DebugCaptureBuffer
+from document_generator.form import as_form
+from document_generator.metrics import configure_from_env
+from document_generator.request_trace import span, collect, attach, current_trace
+
+logger = logging.getLogger(__name__)
+
+# 默认套接字路径和配置文件路径
+DEFAULT_SOCKET_PATH = '/tmp/good_pdf_render.sock'
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'static', 'js', 'document_config.json')
+
+# 消息格式：8字节头部（JSON头长度 + 负载长度），随后是JSON头和二进制负载
+_FRAME = struct.Struct('!II')
+MAX_HEADER_SIZE = 16 * 1024 * 1024
+MAX_PAYLOAD_SIZE = 64 * 1024 * 1024
+
+# 单次渲染的最长等待时间（秒），小于客户端的默认超时，渲染进程崩溃时客户端收到明确的错误
+DEFAULT_RENDER_TIMEOUT = 30.0
+
+
+class RenderServiceError(Exception):
+    """渲染服务返回错误或通信失败"""
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    """从套接字读取指定长度的数据"""
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = sock.recv(min(remaining, 1024 * 1024))
+        if not chunk:
+            raise RenderServiceError("连接在消息完整接收前被关闭")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def send_message(sock: socket.socket, header: Dict[str, Any], payload: bytes = b'') -> None:
+    """
+    发送一条渲染服务消息
+
+    Args:
+        sock: 已连接的套接字
+        header: JSON可序列化的消息头
+        payload: 二进制负载（例如PDF内容）
+    """
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    sock.sendall(_FRAME.pack(len(header_bytes), len(payload)) + header_bytes)
+    if payload:
+        sock.sendall(payload)
+
+
+def recv_message(sock: socket.socket) -> Tuple[Dict[str, Any], bytes]:
+    """
+    接收一条渲染服务消息
+
+    Args:
+        sock: 已连接的套接字
+
+    Returns:
+        (消息头, 二进制负载)
+    """
+    header_size, payload_size = _FRAME.unpack(_recv_exact(sock, _FRAME.size))
+    if header_size > MAX_HEADER_SIZE or payload_size > MAX_PAYLOAD_SIZE:
+        raise RenderServiceError(f"消息过大: header={header_size}, payload={payload_size}")
+    header = json.loads(_recv_exact(sock, header_size).decode('utf-8'))
+    payload = _recv_exact(sock, payload_size) if payload_size else b''
+    return header, payload
+
+
+# ---------------------------------------------------------------------------
+# 渲染进程（在进程池的子进程中运行）
+# ---------------------------------------------------------------------------
+
+_worker_pdf_generator = None
+_worker_init_error = None
+
+
+def _init_worker(config_path: str, debug_capture: bool = False) -> None:
+    """渲染进程初始化：加载配置、创建常驻的PDF生成器并预热字体"""
+    global _worker_pdf_generator, _worker_init_error
+    # 渲染耗时等指标写入与Web工作进程相同的共享目录
+    configure_from_env()
+    try:
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        logger.error("渲染进程加载配置失败: %s, 错误: %s", config_path, str(e))
+        config = {}
+
+    try:
+        # 只在渲染进程中导入WeasyPrint，API工作进程保持轻量
+        from document_generator.pdf_generator import PDFGenerator
+        # 调试捕获时渲染进程只保留最近一份HTML，随渲染结果返回给服务主进程汇总
+        pdf_generator = PDFGenerator(config, debug_capture_size=1 if debug_capture else 0)
+        pdf_generator.warm_up()
+    except Exception as e:
+        # 初始化失败时不抛出异常，避免进程池反复重启子进程；由服务启动检查和请求返回错误
+        logger.error("渲染进程初始化失败: %s", str(e), exc_info=True)
+        _worker_init_error = str(e)
+        return
+    _worker_pdf_generator = pdf_generator
+    logger.info("渲染进程已就绪: pid=%s", os.getpid())
+
+
+def _worker_init_status() -> Optional[str]:
+    """返回渲染进程初始化错误，成功时返回None"""
+    return _worker_init_error
+
+
+def _render_in_worker(document_list: List[List[Any]], form_data: Dict[str, Any],
+                      trace: bool = False) -> Tuple[bytes, Optional[str], Dict[str, Any], Optional[List[Dict[str, Any]]]]:
+    """
+    在渲染进程中生成PDF（保留PDFGenerator内部的WeasyPrint → wkhtmltopdf回退链）
+
+    Args:
+        trace: 请求方正在追踪请求时记录渲染过程的区段
+
+    Returns:
+        (PDF内容, 调试捕获的HTML（未开启调试捕获时为None）, 本进程的渲染后端状态, 区段（未追踪时为None）)
+    """
+    if _worker_pdf_generator is None:
+        raise RuntimeError(f"渲染进程未就绪: {_worker_init_error}")
+    with (collect('render_worker') if trace else contextlib.nullcontext()) as spans:
+        pdf_content = _worker_pdf_generator.generate_pdf(OrderedDict(document_list), form_data)
+    captures = _worker_pdf_generator.get_debug_captures()
+    backend_status = {'pid': os.getpid(), 'backends': _worker_pdf_generator.get_backend_status()}
+    return pdf_content, captures[0]['html'] if captures else None, backend_status, spans
+
+
+# ---------------------------------------------------------------------------
+# 服务端
+# ---------------------------------------------------------------------------
+
+class _RenderRequestHandler(socketserver.BaseRequestHandler):
+    """处理单个客户端连接"""
+
+    def handle(self):
+        try:
+            header, _ = recv_message(self.request)
+        except (RenderServiceError, ValueError, struct.error) as e:
+            logger.warning("无法解析渲染请求: %s", str(e))
+            return
+
+        op = header.get('op', 'render')
+        if op == 'ping':
+            send_message(self.request, {'ok': True, 'workers': self.server.workers})
+            return
+        if op == 'status':
+            send_message(self.request, {'ok': True, 'workers': list(self.server.backend_status.values())})
+            return
+        if op == 'debug':
+            captures = self.server.debug_capture.entries() if self.server.debug_capture else None
+            send_message(self.request, {'ok': True, 'captures': captures})
+            return
+        if op != 'render':
+            send_message(self.request, {'ok': False, 'error': f"未知操作: {op}"})
+            return
+
+        try:
+            # 渲染进程在渲染中途退出时进程池会补充新进程，但这个任务的结果永远不会返回，必须限时等待
+            pdf_content, html_content, backend_status, spans = self.server.pool.apply_async(
+                _render_in_worker, (header.get('document_list', []), header.get('form_data', {}),
+                                    bool(header.get('trace')))).get(timeout=self.server.render_timeout)
+        except multiprocessing.TimeoutError:
+            logger.error("渲染进程在%.0f秒内没有返回结果（可能已崩溃）", self.server.render_timeout)
+            send_message(self.request, {'ok': False,
+                                        'error': f"PDF渲染超时（{self.server.render_timeout:.0f}秒），渲染进程可能已崩溃"})
+            return
+        except Exception as e:
+            logger.error("渲染进程生成PDF失败: %s", str(e))
+            send_message(self.request, {'ok': False, 'error': str(e)})
+            return
+
+        # 各渲染进程的后端状态随渲染结果返回，按进程保存最新一份
+        self.server.backend_status[backend_status['pid']] = backend_status
+        if html_content is not None and self.server.debug_capture is not None:
+            self.server.debug_capture.add(html_content)
+        send_message(self.request, {'ok': True, 'spans': spans} if spans else {'ok': True}, pdf_content)
+
+
+class RenderServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """PDF渲染服务：监听Unix套接字，使用固定大小的常驻进程池渲染"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, workers: int, config_path: str = DEFAULT_CONFIG_PATH,
+                 max_tasks_per_child: Optional[int] = None, check_workers: bool = True,
+                 debug_capture_size: int = 0, render_timeout: float = DEFAULT_RENDER_TIMEOUT):
+        """
+        初始化渲染服务
+
+        Args:
+            socket_path: Unix套接字路径
+            workers: 常驻渲染进程数量
+            config_path: 材料配置文件路径
+            max_tasks_per_child: 渲染进程处理多少个任务后重启（None表示不重启）
+            check_workers: 启动时检查渲染进程是否初始化成功（包括中文字体预热）
+            debug_capture_size: 调试模式下保留的最近HTML文档数量（0表示关闭）
+            render_timeout: 单次渲染的最长等待时间（秒）
+
+        Raises:
+            RuntimeError: 渲染进程初始化失败
+        """
+        self.socket_path = socket_path
+        self.workers = workers
+        self.render_timeout = render_timeout
+        self.debug_capture = DebugCaptureBuffer(debug_capture_size) if debug_capture_size > 0 else None
+        self.backend_status: Dict[int, Dict[str, Any]] = {}
+        # 先创建进程池再启动监听线程，避免在多线程状态下fork
+        self.pool = multiprocessing.Pool(
+            processes=workers,
+            initializer=_init_worker,
+            initargs=(config_path, self.debug_capture is not None),
+            maxtasksperchild=max_tasks_per_child)
+        if check_workers:
+            init_error = self.pool.apply(_worker_init_status)
+            if init_error:
+                self.pool.terminate()
+                raise RuntimeError(f"渲染进程初始化失败: {init_error}")
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _RenderRequestHandler)
+        os.chmod(socket_path, 0o660)
+        logger.info("PDF渲染服务已启动: socket=%s, workers=%d", socket_path, workers)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.terminate()
+        self.pool.join()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+
+# ---------------------------------------------------------------------------
+# 客户端（在Web工作进程中使用）
+# ---------------------------------------------------------------------------
+
+class RenderServiceClient:
+    """渲染服务客户端，接口与PDFGenerator.generate_pdf保持一致"""
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH, timeout: float = 60.0):
+        """
+        初始化渲染服务客户端
+
+        Args:
+            socket_path: 渲染服务的Unix套接字路径
+            timeout: 单次请求超时时间（秒）
+        """
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def _request(self, header: Dict[str, Any]) -> Tuple[Dict[str, Any], bytes]:
+        """向渲染服务发送一次请求并返回响应"""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+            send_message(sock, header)
+            response, payload = recv_message(sock)
+        except OSError as e:
+            raise RenderServiceError(f"无法连接PDF渲染服务 {self.socket_path}: {str(e)}") from e
+        finally:
+            sock.close()
+
+        if not response.get('ok'):
+            raise RenderServiceError(response.get('error', '渲染服务返回未知错误'))
+        return response, payload
+
+    def generate_pdf(self, document_list, form_data):
+        """
+        通过渲染服务生成PDF签证材料清单
+
+        Args:
+            document_list: 材料清单字典
+            form_data: 用户表单数据
+
+        Returns:
+            生成的PDF内容
+        """
+        with span('render_service'):
+            response, pdf_content = self._request({
+                'op': 'render',
+                'document_list': [[section, list(items)] for section, items in document_list.items()],
+                'form_data': as_form(form_data).to_dict(),
+                'trace': current_trace() is not None,
+            })
+            # 渲染进程中的区段接到本请求的区段树上
+            attach(response.get('spans'))
+        return pdf_content
+
+    def get_backend_status(self) -> List[Dict[str, Any]]:
+        """返回各渲染进程最近一次上报的渲染后端状态"""
+        response, _ = self._request({'op': 'status'})
+        return response.get('workers', [])
+
+    def get_debug_captures(self) -> Optional[List[Dict[str, Any]]]:
+        """返回渲染服务捕获的最近HTML文档（最新的在前），未开启调试模式时返回None"""
+        response, _ = self._request({'op': 'debug'})
+        return response.get('captures')
+
+    def ping(self) -> bool:
+        """检查渲染服务是否可用"""
+        try:
+            self._request({'op': 'ping'})
+            return True
+        except RenderServiceError:
+            return False
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """命令行入口：启动PDF渲染服务"""
+    parser = argparse.ArgumentParser(description='日本签证材料清单PDF渲染服务')
+    parser.add_argument('--socket', default=os.environ.get('PDF_RENDER_SOCKET', DEFAULT_SOCKET_PATH),
+                        help='Unix套接字路径')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('PDF_RENDER_WORKERS', os.cpu_count() or 2)),
+                        help='常驻渲染进程数量')
+    parser.add_argument('--config', default=DEFAULT_CONFIG_PATH, help='材料配置文件路径')
+    parser.add_argument('--max-tasks-per-child', type=int, default=None,
+                        help='渲染进程处理多少个任务后重启，用于回收内存')
+    parser.add_argument('--debug-capture', type=int, default=int(os.environ.get('PDF_DEBUG_CAPTURE', '0')),
+                        help='调试模式下在内存中保留的最近HTML文档数量（0表示关闭）')
+    parser.add_argument('--render-timeout', type=float,
+                        default=float(os.environ.get('PDF_RENDER_TIMEOUT', DEFAULT_RENDER_TIMEOUT)),
+                        help='单次渲染的最长等待时间（秒），渲染进程崩溃时请求在此之后返回错误')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    server = RenderServer(args.socket, args.workers, args.config, args.max_tasks_per_child,
+                          debug_capture_size=args.debug_capture, render_timeout=args.render_timeout)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("PDF渲染服务正在退出")
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+"""
+日本签证材料清单生成器 - 请求追踪模块
+
+每个请求有一个请求ID和一棵计时区段树：路由、表单解析、材料清单生成、HTML生成和PDF渲染等步骤用 span() 包裹，
+区段通过contextvars挂到当前请求下，没有正在追踪的请求时（批量任务、异步PDF任务线程等）span() 不做任何记录。
+
+请求结束时：
+- 各区段按名称汇总为 Server-Timing 响应头，浏览器开发者工具中可以直接看到耗时分布；
+- 完整的区段树以DEBUG级别写入 good.trace 日志；
+- 超过阈值的慢请求以WARNING级别写入日志，并在内存中保留最近几次，可通过管理接口查看。
+
+渲染服务进程中的区段由 collect() 记录，随渲染结果返回后用 attach() 接到请求的区段树上。
+"""
+from typing import Dict, List, Any, Optional
+from collections import deque
+from contextvars import ContextVar
+import contextlib
+import datetime
+import logging
+import re
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# 区段树和慢请求写入的日志记录器
+trace_logger = logging.getLogger('good.trace')
+
+# Server-Timing中的名称只能使用token字符
+_TOKEN_INVALID = re.compile(r"[^!#$%&'*+\-.^_`|~0-9A-Za-z]")
+
+# 客户端提供的请求ID只接受这些字符，避免写入日志和响应头时混入换行等内容
+_REQUEST_ID = re.compile(r'^[0-9A-Za-z._-]{1,64}$')
+
+# Server-Timing最多列出的区段名称数量
+SERVER_TIMING_LIMIT = 20
+
+
+class Span:
+    """一个计时区段"""
+
+    __slots__ = ('name', 'attrs', 'start', 'end', 'children')
+
+    def __init__(self, name: str, attrs: Optional[Dict[str, Any]] = None, start: Optional[int] = None):
+        self.name = name
+        self.attrs = attrs or None
+        self.start = time.perf_counter_ns() if start is None else start
+        self.end: Optional[int] = None
+        self.children: List['Span'] = []
+
+    def finish(self) -> None:
+        self.end = time.perf_counter_ns()
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end if self.end is not None else time.perf_counter_ns()
+        return (end - self.start) / 1e6
+
+    def to_dict(self, origin: Optional[int] = None) -> Dict[str, Any]:
+        """
+        转换为可以JSON序列化的字典
+
+        Args:
+            origin: 计算相对开始时间的基准（perf_counter_ns），默认为本区段的开始时间
+        """
+        origin = self.start if origin is None else origin
+        data = {
+            'name': self.name,
+            'start_ms': round((self.start - origin) / 1e6, 3),
+            'duration_ms': round(self.duration_ms, 3),
+        }
+        if self.attrs:
+            data['attrs'] = self.attrs
+        if self.children:
+            data['children'] = [child.to_dict(origin) for child in self.children]
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], origin: int) -> 'Span':
+        """由to_dict的结果还原区段，开始时间相对于origin"""
+        span = cls(data['name'], data.get('attrs'), start=origin + int(data.get('start_ms', 0) * 1e6))
+        span.end = span.start + int(data.get('duration_ms', 0) * 1e6)
+        span.children = [cls.from_dict(child, origin) for child in data.get('children', ())]
+        return span
+
+    def walk(self):
+        """深度优先遍历本区段和所有子区段"""
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+
+class RequestTrace:
+    """一个请求的追踪记录"""
+
+    def __init__(self, request_id: str, name: str, attrs: Optional[Dict[str, Any]] = None):
+        self.request_id = request_id
+        self.started_at = datetime.datetime.now().isoformat(timespec='milliseconds')
+        self.root = Span(name, attrs)
+        self._tokens = None
+
+    @property
+    def duration_ms(self) -> float:
+        return self.root.duration_ms
+
+    def totals(self) -> Dict[str, float]:
+        """各区段名称的累计耗时（毫秒），按首次出现的顺序"""
+        totals: Dict[str, float] = {}
+        for span in self.root.walk():
+            if span is not self.root:
+                totals[span.name] = totals.get(span.name, 0.0) + span.duration_ms
+        return totals
+
+    def server_timing(self) -> str:
+        """Server-Timing响应头：总耗时和各区段名称的累计耗时"""
+        entries = [f'total;dur={self.duration_ms:.1f}']
+        for name, duration in list(self.totals().items())[:SERVER_TIMING_LIMIT]:
+            entries.append(f'{_TOKEN_INVALID.sub("_", name)};dur={duration:.1f}')
+        return ', '.join(entries)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'request_id': self.request_id,
+            'started_at': self.started_at,
+            'duration_ms': round(self.duration_ms, 3),
+            'spans': self.root.to_dict(),
+        }
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar('good_request_trace', default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar('good_request_span', default=None)
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs):
+    """
+    在当前区段下记录一个子区段，没有正在追踪的请求时不做任何记录
+
+    Args:
+        name: 区段名称（同名区段在Server-Timing中累计）
+        attrs: 附加信息，写入日志中的区段树
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, attrs)
+    parent.children.append(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    finally:
+        child.finish()
+        _current_span.reset(token)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def current_request_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace.request_id if trace is not None else None
+
+
+def attach(spans: List[Dict[str, Any]]) -> None:
+    """
+    把其他进程记录的区段（collect的结果）接到当前区段下
+
+    其他进程的时钟与本进程不同，子区段的开始时间按当前区段的开始时间对齐
+    """
+    parent = _current_span.get()
+    if parent is None or not spans:
+        return
+    for data in spans:
+        parent.children.append(Span.from_dict(data, parent.start))
+
+
+@contextlib.contextmanager
+def collect(name: str):
+    """
+    在没有请求上下文的进程（如渲染服务进程）中记录区段树
+
+    Yields:
+        列表，结束后包含一个区段（to_dict的结果），可以随结果返回给请求所在进程后用attach接上
+    """
+    result: List[Dict[str, Any]] = []
+    root = Span(name)
+    token = _current_span.set(root)
+    try:
+        yield result
+    finally:
+        root.finish()
+        _current_span.reset(token)
+        result.append(root.to_dict())
+
+
+class RequestIdFilter(logging.Filter):
+    """在日志记录中加入当前请求ID（JSON日志中的request_id字段）"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, 'request_id'):
+            request_id = current_request_id()
+            if request_id is not None:
+                record.request_id = request_id
+        return True
+
+
+class RequestTracer:
+    """开始和结束请求追踪，保留最近的慢请求"""
+
+    def __init__(self, enabled: bool = True, slow_ms: float = 1000.0, recent_size: int = 20):
+        self._lock = threading.Lock()
+        self.configure(enabled, slow_ms, recent_size)
+
+    def configure(self, enabled: bool, slow_ms: float, recent_size: int) -> None:
+        """
+        Args:
+            enabled: 是否追踪请求
+            slow_ms: 慢请求阈值（毫秒），0表示不记录慢请求
+            recent_size: 内存中保留的最近慢请求数量
+        """
+        self.enabled = enabled
+        self.slow_ms = slow_ms
+        with self._lock:
+            self._slow = deque(maxlen=max(recent_size, 1))
+
+    def begin(self, name: str, request_id: Optional[str] = None, **attrs) -> RequestTrace:
+        """
+        开始追踪当前请求
+
+        Args:
+            name: 根区段名称（一般为路由）
+            request_id: 客户端提供的请求ID（X-Request-ID），格式不合法时生成新的ID
+        """
+        if not request_id or not _REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex[:16]
+        trace = RequestTrace(request_id, name, attrs)
+        trace._tokens = (_current_trace.set(trace), _current_span.set(trace.root))
+        return trace
+
+    def end(self, trace: RequestTrace, status: Optional[int] = None) -> None:
+        """结束追踪：写入区段树，超过阈值时记录为慢请求（同一请求重复调用时只处理一次）"""
+        if trace._tokens is None:
+            return
+        trace.root.finish()
+        if status is not None:
+            trace.root.attrs = dict(trace.root.attrs or {}, status=status)
+        trace_token, span_token = trace._tokens
+        trace._tokens = None
+        try:
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+        except ValueError:
+            # 在其他上下文中结束（例如流式响应结束时），当前上下文不需要恢复
+            pass
+
+        if trace_logger.isEnabledFor(logging.DEBUG):
+            trace_logger.debug("请求追踪 %s %s: %.1fms", trace.request_id, trace.root.name, trace.duration_ms,
+                               extra={'category': 'request_trace', 'request_id': trace.request_id,
+                                      'data': trace.to_dict()})
+        if self.slow_ms and trace.duration_ms >= self.slow_ms:
+            data = trace.to_dict()
+            with self._lock:
+                self._slow.append(data)
+            trace_logger.warning("慢请求 %s %s: %.1fms", trace.request_id, trace.root.name, trace.duration_ms,
+                                 extra={'category': 'slow_request', 'request_id': trace.request_id, 'data': data})
+
+    def slow_requests(self) -> List[Dict[str, Any]]:
+        """最近的慢请求（最新的在前）"""
+        with self._lock:
+            return list(reversed(self._slow))
+
+    def reset(self) -> None:
+        with self._lock:
+            self._slow.clear()
+
+
+# 全局请求追踪器，由app.py根据环境变量配置
+request_tracer = RequestTracer()
@@ -4,6 +4,9 @@
 from typing import Dict, List, Any, Optional, Union, Tuple
 import logging
 
+from document_generator.form import as_form
+from document_generator.utils import needs_residence_proof
+
 logger = logging.getLogger(__name__)
 
 class ResidenceMaterialsGenerator:
@@ -29,22 +32,22 @@ class ResidenceMaterialsGenerator:
             居住证明材料列表
         """
         # 获取关键数据
-        residence_consulate = form_data.get('residenceConsulate', '').lower()
-        hukou_consulate = form_data.get('hukouConsulate', '').lower()
-        process_type = form_data.get('processType', '')
-        identity_type = form_data.get('identityType', '')
-        application_type = form_data.get('applicationType', '')
+        form = as_form(form_data)
+        residence_consulate = form.residence_consulate
+        hukou_consulate = form.hukou_consulate
+        process_type = form.process_type
+        identity_type = form.identity_type
+        application_type = form.application_type
         
         # 日志记录输入数据，便于调试
-        logger.debug(f"处理居住证明材料: residence={residence_consulate}, hukou={hukou_consulate}, type={application_type}")
+        logger.debug("处理居住证明材料: residence=%s, hukou=%s, type=%s", residence_consulate, hukou_consulate, application_type)
         
         # 检查是否需要居住证明
         residence_proof_needed = self._check_residence_proof_needed(residence_consulate, hukou_consulate)
         
         # 特定大学生单次办理且为在读状态时，不需要居住证明
         if process_type == 'STUDENT' and identity_type == 'STUDENT':
-            graduate_status = form_data.get('graduateStatus', 'auto')
-            if graduate_status == 'current' or graduate_status == '在读':
+            if form.graduate_status == 'current':
                 residence_proof_needed = False
                 logger.info("在读大学生不需要额外的居住证明")
         
@@ -94,36 +97,10 @@ class ResidenceMaterialsGenerator:
             if main_applicant_needs_proof:
                 applicants_needing_proof.append("主申请人")
             
-            # 处理家庭成员
-            family_members_needing_proof = []
-            family_members = form_data.get('familyMembers', [])
-            
-            # 确保family_members是列表类型
-            if not isinstance(family_members, list):
-                family_members = []
-                logger.warning("表单数据中的familyMembers不是列表类型")
-            
-            # 遍历家庭成员
-            for i, member in enumerate(family_members, 1):
-                if not isinstance(member, dict):
-                    logger.warning(f"家庭成员数据格式不正确: {member}")
-                    continue
-                
-                # 获取家庭成员信息
-                member_name = member.get('name', f'家庭成员{i}')
-                member_residence = member.get('residenceConsulate', '').lower()
-                member_hukou = member.get('hukouConsulate', '').lower()
-                
-                # 记录家庭成员数据
-                logger.debug(f"处理家庭成员: {member_name}, residence={member_residence}, hukou={member_hukou}")
-                
-                # 检查家庭成员是否需要居住证明
-                if member_residence and member_hukou:
-                    member_needs_proof = self._check_residence_proof_needed(member_residence, member_hukou)
-                    
-                    if member_needs_proof:
-                        family_members_needing_proof.append(member_name)
-                        logger.info(f"家庭成员需要居住证明: {member_name}")
+            # 需要居住证明的家庭成员在解析表单时已经计算
+            family_members_needing_proof = form.family_profile.residence_proof_names
+            if family_members_needing_proof:
+                logger.info("家庭成员需要居住证明: %s", ', '.join(map(str, family_members_needing_proof)))
             
             # 合并所有需要提供居住证明的人员
             applicants_needing_proof.extend(family_members_needing_proof)
@@ -145,7 +122,7 @@ class ResidenceMaterialsGenerator:
             residence_materials.append(f"{i}. {option}")
         
         # 记录最终生成的材料清单
-        logger.debug(f"生成的居住证明材料: {residence_materials}")
+        logger.debug("生成的居住证明材料: %s", residence_materials)
         return residence_materials
     
     def process_family_members_residence_proof(self, form_data: Dict[str, Any], main_applicant_needs_proof: bool = False) -> List[str]:
@@ -164,28 +141,13 @@ class ResidenceMaterialsGenerator:
         family_residence_notes = []
         
         # 检查是否是家庭申请
-        if form_data.get('applicationType') != 'FAMILY':
-            return family_residence_notes
-        
-        # 获取家庭成员信息
-        family_members = form_data.get('familyMembers', [])
-        if not family_members or not isinstance(family_members, list):
+        form = as_form(form_data)
+        if form.application_type != 'FAMILY':
             return family_residence_notes
         
-        # 处理每个家庭成员
-        for i, member in enumerate(family_members, 1):
-            if not member or not isinstance(member, dict):
-                continue
-                
-            member_name = member.get('name', f'家庭成员{i}')
-            member_residence = member.get('residenceConsulate', '').lower()
-            member_hukou = member.get('hukouConsulate', '').lower()
-            
-            # 检查家庭成员是否需要居住证明
-            member_needs_proof = self._check_residence_proof_needed(member_residence, member_hukou)
-            
-            if member_needs_proof:
-                family_residence_notes.append(f"{member_name} 需要提供居住证明材料")
+        # 需要居住证明的家庭成员在解析表单时已经计算
+        for member_name in form.family_profile.residence_proof_names:
+            family_residence_notes.append(f"{member_name} 需要提供居住证明材料")
         
         return family_residence_notes
     
@@ -200,8 +162,5 @@ class ResidenceMaterialsGenerator:
         Returns:
             是否需要居住证明
         """
-        # 如果居住地领区和户籍所在地领区不同，则需要居住证明
-        if not residence_consulate or not hukou_consulate:
-            return False
-            
-        return residence_consulate.lower() != hukou_consulate.lower() 
\ No newline at end of file
+        # 如果居住地领区和户籍所在地领区不同，则需要居住证明（与家庭成员索引使用同一判断）
+        return needs_residence_proof(residence_consulate, hukou_consulate) 
\ No newline at end of file
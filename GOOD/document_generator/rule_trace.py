@@ -0,0 +1,244 @@
+"""
+日本签证材料清单生成器 - 规则追踪模块
+
+可选的追踪模式（环境变量RULE_TRACE=N，每N个材料清单请求追踪一个，0表示关闭）。
+被抽中的请求不查决策表，由各子生成器逐项生成，生成期间用 sys.setprofile 只记录子生成器模块中的事件：
+- 每次子生成器方法调用的耗时（纳秒）；
+- 每一行材料由哪个方法的哪一行产生：list.append/extend 所在的行，或返回材料列表的return语句所在的行，
+  同一方法中不同的行即不同的分支。
+
+汇总后的调用次数、耗时直方图和分支命中次数保存在内存中，最近的若干次追踪保留逐行明细，
+通过 /admin/rule_trace 查看。未开启时生成器只多一次属性判断。
+追踪期间的耗时包含追踪本身的开销，只适合比较各分支的相对耗时。
+"""
+from typing import Dict, List, Any, Optional, Tuple
+from collections import deque, Counter
+import bisect
+import datetime
+import itertools
+import os
+import sys
+import threading
+import time
+
+# 记录事件的子生成器模块
+TRACED_MODULES = ('basic_materials', 'identity_materials', 'financial_materials',
+                  'residence_materials', 'family_materials', 'other_materials')
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+_TRACED_FILES = frozenset(os.path.join(_PACKAGE_DIR, f'{module}.py') for module in TRACED_MODULES)
+
+# 耗时直方图的上界（纳秒），最后一个桶统计超过最大上界的调用
+HISTOGRAM_BOUNDS_NS = (1_000, 2_000, 5_000, 10_000, 20_000, 50_000, 100_000, 200_000,
+                       500_000, 1_000_000, 2_000_000, 5_000_000, 10_000_000)
+
+# 默认保留逐行明细的最近追踪数量
+DEFAULT_RECENT_SIZE = 20
+
+
+def _function_name(code) -> str:
+    return getattr(code, 'co_qualname', code.co_name)
+
+
+class LatencyStats:
+    """调用次数、总耗时和耗时直方图"""
+
+    __slots__ = ('count', 'total_ns', 'max_ns', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.histogram = [0] * (len(HISTOGRAM_BOUNDS_NS) + 1)
+
+    def add(self, elapsed_ns: int) -> None:
+        self.count += 1
+        self.total_ns += elapsed_ns
+        if elapsed_ns > self.max_ns:
+            self.max_ns = elapsed_ns
+        self.histogram[bisect.bisect_left(HISTOGRAM_BOUNDS_NS, elapsed_ns)] += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'count': self.count,
+            'total_ns': self.total_ns,
+            'mean_ns': self.total_ns // self.count if self.count else 0,
+            'max_ns': self.max_ns,
+            'histogram': list(self.histogram),
+        }
+
+
+class _Collector:
+    """一次请求中的profile事件回调（只在追踪的线程中安装）"""
+
+    def __init__(self):
+        self.calls: List[Tuple[str, int, int]] = []
+        self.origins: Dict[int, str] = {}
+        # 保持材料字符串的引用，避免追踪期间id被复用
+        self._objects: List[str] = []
+        self._stack: List[Tuple[Any, int]] = []
+        self._extend_lengths: Dict[int, int] = {}
+
+    def _record(self, item: Any, branch: str) -> None:
+        if isinstance(item, str) and id(item) not in self.origins:
+            self.origins[id(item)] = branch
+            self._objects.append(item)
+
+    def __call__(self, frame, event: str, arg: Any) -> None:
+        code = frame.f_code
+        if code.co_filename not in _TRACED_FILES:
+            return
+        if event == 'call':
+            self._stack.append((frame, time.perf_counter_ns()))
+        elif event == 'return':
+            if not self._stack or self._stack[-1][0] is not frame:
+                return
+            _, start = self._stack.pop()
+            name = _function_name(code)
+            self.calls.append((name, len(self._stack), time.perf_counter_ns() - start))
+            branch = f'{name}:{frame.f_lineno}'
+            if isinstance(arg, (list, tuple)):
+                for item in arg:
+                    self._record(item, branch)
+            else:
+                self._record(arg, branch)
+        elif event == 'c_call' and isinstance(getattr(arg, '__self__', None), list):
+            if arg.__name__ == 'extend':
+                self._extend_lengths[id(arg.__self__)] = len(arg.__self__)
+        elif event == 'c_return' and isinstance(getattr(arg, '__self__', None), list):
+            target = arg.__self__
+            branch = f'{_function_name(code)}:{frame.f_lineno}'
+            if arg.__name__ == 'append' and target:
+                self._record(target[-1], branch)
+            elif arg.__name__ == 'extend':
+                for item in target[self._extend_lengths.pop(id(target), len(target)):]:
+                    self._record(item, branch)
+
+
+class RequestTrace:
+    """一次请求的追踪记录，由RuleTracer.request创建"""
+
+    def __init__(self, tracer: 'RuleTracer'):
+        self.tracer = tracer
+        self.collector = _Collector()
+        self.steps: List[Tuple[str, int]] = []
+        self.start_ns = time.perf_counter_ns()
+
+    def run_step(self, name: str, step, form) -> Dict[str, Any]:
+        """执行一个生成步骤并记录其中的子生成器事件"""
+        previous = sys.getprofile()
+        start = time.perf_counter_ns()
+        sys.setprofile(self.collector)
+        try:
+            sections = step(form)
+        finally:
+            sys.setprofile(previous)
+            self.steps.append((name, time.perf_counter_ns() - start))
+        # 由DocumentGenerator自身产生的行（基本信息、追加的说明等）归属到步骤
+        for items in sections.values():
+            for item in items:
+                self.collector._record(item, f'DocumentGenerator.{name}')
+        return sections
+
+    def finish(self, document_list: Dict[str, Any]) -> None:
+        """生成完成后按材料清单中的每一行归属分支并汇总"""
+        origins = self.collector.origins
+        lines = []
+        for section, items in document_list.items():
+            for item in items:
+                lines.append((section, item, origins.get(id(item), 'DocumentGenerator')))
+        self.tracer._add(self, lines, time.perf_counter_ns() - self.start_ns)
+
+
+class RuleTracer:
+    """按采样间隔追踪材料清单生成，汇总各子生成器和分支的统计"""
+
+    def __init__(self, sample_every: int = 0, recent_size: int = DEFAULT_RECENT_SIZE):
+        """
+        Args:
+            sample_every: 每N个请求追踪一个，0表示关闭
+            recent_size: 保留逐行明细的最近追踪数量
+        """
+        self.sample_every = sample_every
+        self._counter = itertools.count()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=recent_size)
+        self.reset()
+
+    def configure(self, sample_every: int, recent_size: Optional[int] = None) -> None:
+        """修改采样间隔（0表示关闭）和保留的最近追踪数量"""
+        with self._lock:
+            self.sample_every = max(0, sample_every)
+            if recent_size is not None:
+                self._recent = deque(self._recent, maxlen=recent_size)
+
+    def sample(self) -> bool:
+        """当前请求是否需要追踪"""
+        every = self.sample_every
+        return every > 0 and next(self._counter) % every == 0
+
+    def request(self) -> RequestTrace:
+        return RequestTrace(self)
+
+    def reset(self) -> None:
+        """清空汇总数据"""
+        with self._lock:
+            self.traced = 0
+            self._steps: Dict[str, LatencyStats] = {}
+            self._calls: Dict[str, LatencyStats] = {}
+            self._requests = LatencyStats()
+            self._branch_lines: Counter = Counter()
+            self._branch_requests: Counter = Counter()
+            self._recent.clear()
+
+    def _add(self, trace: RequestTrace, lines: List[Tuple[str, str, str]], total_ns: int) -> None:
+        with self._lock:
+            self.traced += 1
+            self._requests.add(total_ns)
+            for name, elapsed in trace.steps:
+                self._steps.setdefault(name, LatencyStats()).add(elapsed)
+            for name, _, elapsed in trace.collector.calls:
+                self._calls.setdefault(name, LatencyStats()).add(elapsed)
+            branches = [branch for _, _, branch in lines]
+            self._branch_lines.update(branches)
+            self._branch_requests.update(set(branches))
+            self._recent.append({
+                'id': next(self._ids),
+                'traced_at': datetime.datetime.now().isoformat(timespec='seconds'),
+                'total_ns': total_ns,
+                'steps': [{'name': name, 'elapsed_ns': elapsed} for name, elapsed in trace.steps],
+                'calls': [{'function': name, 'depth': depth, 'elapsed_ns': elapsed}
+                          for name, depth, elapsed in trace.collector.calls],
+                'lines': [{'section': section, 'item': item, 'branch': branch} for section, item, branch in lines],
+            })
+
+    def snapshot(self, recent: bool = True) -> Dict[str, Any]:
+        """
+        汇总数据
+
+        Args:
+            recent: 是否包含最近追踪的逐行明细
+
+        Returns:
+            采样间隔、追踪次数、各步骤和子生成器方法的耗时统计（按总耗时降序）、各分支产生的材料行数
+        """
+        with self._lock:
+            data = {
+                'sample_every': self.sample_every,
+                'traced': self.traced,
+                'histogram_bounds_ns': list(HISTOGRAM_BOUNDS_NS),
+                'requests': self._requests.to_dict(),
+                'steps': {name: stats.to_dict() for name, stats in self._steps.items()},
+                'functions': [dict(stats.to_dict(), function=name) for name, stats in
+                              sorted(self._calls.items(), key=lambda pair: -pair[1].total_ns)],
+                'branches': [{'branch': branch, 'lines': lines, 'requests': self._branch_requests[branch]}
+                             for branch, lines in self._branch_lines.most_common()],
+            }
+            if recent:
+                data['recent'] = list(reversed(self._recent))
+        return data
+
+
+# 进程内共享的追踪器，默认关闭，由应用启动时根据配置开启
+rule_tracer = RuleTracer()
@@ -2,10 +2,75 @@
 日本签证材料清单生成器 - 工具函数模块
 """
 from typing import Dict, List, Any, Optional
+from contextlib import contextmanager
 import logging
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # 没有文件锁时各进程分别构建（结果相同，写入是原子的）
+    fcntl = None
 
 logger = logging.getLogger(__name__)
 
+
+def write_atomic(path: str, data: bytes) -> None:
+    """
+    先写同目录下的临时文件再重命名：其他进程不会读到写了一半的文件，中断时也不会留下不完整的输出
+
+    Args:
+        path: 目标文件路径（所在目录不存在时创建）
+        data: 文件内容
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # 临时文件名包含进程和线程，同时写入同一路径的进程或线程互不干扰
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    跨进程的排他锁（锁文件为path.lock），用于多个进程中只有一个构建或改写path；没有fcntl时不加锁
+
+    Args:
+        path: 受保护的文件路径（所在目录不存在时创建）
+
+    Raises:
+        OSError: 无法创建锁文件
+    """
+    if fcntl is None:
+        yield
+        return
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+# 签证期限别名 -> 规范取值
+VISA_DURATION_ALIASES = {
+    'SINGLE': 'SINGLE', 'single': 'SINGLE', '单次': 'SINGLE',
+    'THREE': 'THREE', 'three': 'THREE', '三年多次': 'THREE',
+    'FIVE': 'FIVE', 'five': 'FIVE', '五年多次': 'FIVE',
+}
+
 def get_visa_duration(form_data: Dict[str, Any]) -> str:
     """
     从表单数据中获取标准化的签证期限
@@ -22,15 +87,10 @@ def get_visa_duration(form_data: Dict[str, Any]) -> str:
             visa_duration = form_data[field]
             break
     
-    # 标准化签证期限
-    if visa_duration in ['SINGLE', 'single', '单次']:
-        return 'SINGLE'
-    elif visa_duration in ['THREE', 'three', '三年多次']:
-        return 'THREE'
-    elif visa_duration in ['FIVE', 'five', '五年多次']:
-        return 'FIVE'
-    else:
-        return 'SINGLE'  # 默认为单次
+    # 标准化签证期限，无法识别时默认为单次
+    if isinstance(visa_duration, str):
+        return VISA_DURATION_ALIASES.get(visa_duration, 'SINGLE')
+    return 'SINGLE'
 
 def get_consulate_text(consulate_code: str) -> str:
     """
@@ -84,6 +144,21 @@ def get_consulate_text(consulate_code: str) -> str:
     
     return consulate_texts.get(consulate_code.lower(), '未指定')
 
+def needs_residence_proof(residence_consulate: str, hukou_consulate: str) -> bool:
+    """
+    检查是否需要居住证明
+    
+    Args:
+        residence_consulate: 居住地领区
+        hukou_consulate: 户籍所在地领区
+        
+    Returns:
+        居住地领区和户籍所在地领区都已填写且不同时返回True
+    """
+    if not residence_consulate or not hukou_consulate:
+        return False
+    return residence_consulate.lower() != hukou_consulate.lower()
+
 def check_has_family(form_data: Dict[str, Any]) -> bool:
     """
     检查是否有家属
@@ -105,9 +180,31 @@ def check_has_family(form_data: Dict[str, Any]) -> bool:
             value = form_data[field]
             if isinstance(value, bool):
                 return value
-            elif isinstance(value, list) and len(value) > 0:
+            elif isinstance(value, (list, tuple)) and len(value) > 0:
                 return True
             elif value in ['true', 'True', '1', 1]:
                 return True
     
-    return False 
\ No newline at end of file
+    return False
+
+def validate_pdf_form(form_data: Dict[str, Any]) -> Optional[str]:
+    """
+    检查表单是否可以生成PDF材料清单
+    
+    Args:
+        form_data: 用户提交的表单数据
+        
+    Returns:
+        错误信息，表单有效时返回None
+    """
+    # 检查居住地领区
+    if form_data.get('residenceConsulate', '') == 'other':
+        return "目前暂不支持在其他领区申请日本签证，请选择北京或上海领区。"
+    
+    # 检查必要的经济材料字段
+    process_type = form_data.get('processType', '')
+    application_type = form_data.get('applicationType', '')
+    if process_type == 'NORMAL' and application_type not in ['BINDING', 'ECONOMIC'] and not form_data.get('economicMaterial'):
+        return "使用普通经济材料办理时，请选择一种经济材料类型"
+    
+    return None
@@ -3,6 +3,8 @@
 """
 import logging
 
+from document_generator.form import as_form
+
 logger = logging.getLogger(__name__)
 
 class RiskAssessmentService:
@@ -30,6 +32,7 @@ class RiskAssessmentService:
         """
         logger.info("开始风险评估")
         logger.debug("评估的表单数据: %s", form_data)
+        form = as_form(form_data)
         
         risk_result = {
             'is_high_risk': False,
@@ -38,43 +41,13 @@ class RiskAssessmentService:
             'notes': []
         }
         
-        # 获取关键数据，处理可能的不同字段名和格式
-        identity_type = form_data.get('identityType')
-        
-        # 处理教育程度，可能有多种字段名
-        education_level = None
-        for field in ['educationLevel', 'education', 'education_level']:
-            if field in form_data and form_data[field]:
-                education_level = form_data[field]
-                break
-        
-        # 处理纳税信息，可能有多种字段名
-        tax_payment = None
-        for field in ['taxPayment', 'tax', 'tax_payment']:
-            if field in form_data and form_data[field]:
-                tax_payment = form_data[field]
-                break
-        
-        # 处理社保信息，可能有多种字段名
-        social_insurance = None
-        for field in ['socialInsurance', 'social_insurance', 'insurance']:
-            if field in form_data and form_data[field]:
-                social_insurance = form_data[field]
-                break
-        
-        # 处理护照状态，可能有多种字段名
-        passport_status = None
-        for field in ['passportStatus', 'passport_status', 'passport']:
-            if field in form_data and form_data[field]:
-                passport_status = form_data[field]
-                break
-        
-        # 处理户口类型，可能有多种字段名
-        hukou_type = None
-        for field in ['hukouType', 'hukou_type', 'hukou']:
-            if field in form_data and form_data[field]:
-                hukou_type = form_data[field]
-                break
+        # 获取关键数据（不同字段名的别名已在解析表单时统一）
+        identity_type = form.identity_type
+        education_level = form.education_level
+        tax_payment = form.tax_payment
+        social_insurance = form.social_insurance
+        passport_status = form.passport_status
+        hukou_type = form.household_type
         
         logger.debug("处理后的关键数据: identity_type=%s, education_level=%s, tax_payment=%s, social_insurance=%s, passport_status=%s, hukou_type=%s", 
                    identity_type, education_level, tax_payment, social_insurance, passport_status, hukou_type)
@@ -94,33 +67,13 @@ class RiskAssessmentService:
             risk_result['additional_materials'].extend(self._get_additional_materials())
         
         # 检查税单盖章情况
-        tax_stamped = False
-        for field in ['taxStamped', 'tax_stamped', 'has_tax_stamp']:
-            if field in form_data:
-                value = form_data[field]
-                if isinstance(value, bool):
-                    tax_stamped = value
-                elif value in ['true', 'True', '1', 1]:
-                    tax_stamped = True
-                break
-        
-        if tax_payment and tax_stamped:
+        if tax_payment and form.tax_stamped:
             risk_result['notes'].append('税单有盖章，需要补充社保+营业执照确认居住条件。')
             risk_result['additional_materials'].append('社保缴纳证明')
             risk_result['additional_materials'].append('营业执照复印件')
         
         # 检查社保变更频繁情况
-        frequent_job_change = False
-        for field in ['frequentJobChange', 'frequent_job_change', 'job_change_frequent']:
-            if field in form_data:
-                value = form_data[field]
-                if isinstance(value, bool):
-                    frequent_job_change = value
-                elif value in ['true', 'True', '1', 1]:
-                    frequent_job_change = True
-                break
-        
-        if social_insurance and frequent_job_change:
+        if social_insurance and form.frequent_job_change:
             risk_result['notes'].append('过去五年社保缴纳单位变更频繁，需通过滞留风险评估方案。')
             risk_result['is_high_risk'] = True
         
@@ -6,6 +6,128 @@ const noticeItems = [
     "领馆可能会要求提供补充材料"
 ];
 
+// 客户端规则（/api/rules）：与服务器决策表键的计算方式相同，只支持格式相同的规则文件
+const CLIENT_RULES_FORMAT = 1;
+
+// 服务器决策表中字符串类型的表单字段，取值不是字符串时交给服务器计算
+const RULE_STRING_FIELDS = [
+    'residenceConsulate', 'hukouConsulate', 'identityType', 'processType', 'applicationType',
+    'visaDuration', 'visaType', 'economicMaterial', 'graduateStatus', 'hukouType', 'familyRelation', 'familyVisaType'
+];
+
+function hasOwn(object, key) {
+    return Object.prototype.hasOwnProperty.call(object, key);
+}
+
+function ruleAlias(aliases, value, fallback) {
+    return hasOwn(aliases, value) ? aliases[value] : fallback;
+}
+
+// 与服务器check_has_family相同：按顺序读取第一个存在的家属字段
+function ruleHasFamily(data) {
+    for (const field of ['hasFamily', 'has_family', 'familyMembers']) {
+        if (!hasOwn(data, field)) {
+            continue;
+        }
+        let value = data[field];
+        if (field === 'familyMembers') {
+            if (typeof value === 'string') {
+                try {
+                    value = JSON.parse(value);
+                } catch (e) {
+                    value = [];
+                }
+            }
+            if (!Array.isArray(value)) {
+                value = [];
+            }
+        }
+        if (typeof value === 'boolean') {
+            return value;
+        } else if (Array.isArray(value) && value.length > 0) {
+            return true;
+        } else if (['true', 'True', '1', 1].includes(value)) {
+            return true;
+        }
+    }
+    return false;
+}
+
+// 计算表单的决策表键，表单不能在本地计算时返回null（家庭申请、其他领区、不在枚举范围内的取值等）
+function clientRulesKey(rules, data) {
+    if (RULE_STRING_FIELDS.some(field => data[field] !== undefined && data[field] !== null && typeof data[field] !== 'string')) {
+        return null;
+    }
+    const text = value => typeof value === 'string' ? value : '';
+    const residence = text(data.residenceConsulate).toLowerCase();
+    const hukou = text(data.hukouConsulate).toLowerCase();
+    const identity = text(data.identityType);
+    const process = text(data.processType);
+    const application = text(data.applicationType);
+    const enums = rules.enums;
+    if (residence === 'other' || !enums.consulates.includes(residence) || !enums.consulates.includes(hukou)
+            || !enums.identityTypes.includes(identity) || !enums.processTypes.includes(process)
+            || !enums.applicationTypes.includes(application)) {
+        return null;
+    }
+    
+    let hukouType = data.hukouType;
+    if (!hukouType || hukouType === 'auto') {
+        hukouType = 'family';
+    } else if (hukouType === 'FAMILY' || hukouType === 'COLLECTIVE') {
+        hukouType = hukouType.toLowerCase();
+    }
+    if (residence !== 'shanghai' && hukouType !== 'family') {
+        return null;
+    }
+    
+    const uses = (condition, first, second) => rules.conditions[condition].includes(first + '|' + second);
+    let visa = null;
+    if (uses('visa', process, application)) {
+        visa = ruleAlias(rules.aliases.visaDuration, data.visaDuration || data.visaType, 'SINGLE');
+    }
+    let economic = null;
+    if (uses('economic', process, application)) {
+        economic = data.economicMaterial ? ruleAlias(rules.aliases.economicMaterial, data.economicMaterial, data.economicMaterial) : '';
+        if (!enums.economicMaterials.includes(economic)) {
+            return null;
+        }
+    }
+    let graduate = null;
+    if (uses('graduate', identity, process)) {
+        const status = ruleAlias(rules.aliases.graduateStatus, text(data.graduateStatus), text(data.graduateStatus));
+        graduate = status === 'graduate' || status === 'current' ? status : 'other';
+    }
+    
+    let relation = null;
+    let familyVisa = null;
+    let hasFamily = null;
+    if (application === 'BINDING') {
+        relation = enums.familyRelations.includes(text(data.familyRelation)) ? text(data.familyRelation) : '';
+        familyVisa = data.familyVisaType === 'THREE' ? 'THREE' : 'FIVE';
+    } else {
+        hasFamily = ruleHasFamily(data);
+    }
+    return [residence, hukou, identity, process, application, visa, economic, graduate, relation, familyVisa, hasFamily];
+}
+
+// 按客户端规则计算材料清单，不能在本地计算时返回null
+function evaluateClientRules(rules, data) {
+    const key = clientRulesKey(rules, data);
+    if (!key) {
+        return null;
+    }
+    const encode = value => value === null ? rules.none : String(value);
+    const documentList = {};
+    rules.sections.forEach(section => {
+        const values = section.fields.map(index => encode(key[index])).join('|');
+        if (hasOwn(section.values, values)) {
+            documentList[section.name] = rules.contents[section.values[values]].map(index => rules.items[index]);
+        }
+    });
+    return documentList;
+}
+
 // 等待DOM加载完成
 document.addEventListener('DOMContentLoaded', function() {
     console.log('页面加载完成');
@@ -747,6 +869,135 @@ document.addEventListener('DOMContentLoaded', function() {
         return formData;
     }
     
+    // 材料清单结果缓存（sessionStorage），按提交的表单内容保存最近的ETag和结果
+    const RESULT_CACHE_KEY = 'documentListCache';
+    const RESULT_CACHE_SIZE = 20;
+    
+    function readResultCache() {
+        try {
+            return JSON.parse(sessionStorage.getItem(RESULT_CACHE_KEY)) || [];
+        } catch (e) {
+            return [];
+        }
+    }
+    
+    function getCachedResult(body) {
+        return readResultCache().find(entry => entry.body === body) || null;
+    }
+    
+    function setCachedResult(body, etag, result) {
+        const entries = readResultCache().filter(entry => entry.body !== body);
+        entries.unshift({ body: body, etag: etag, result: result });
+        try {
+            sessionStorage.setItem(RESULT_CACHE_KEY, JSON.stringify(entries.slice(0, RESULT_CACHE_SIZE)));
+        } catch (e) {
+            // 存储空间不足或被禁用时不缓存
+            console.warn('无法保存材料清单缓存:', e);
+        }
+    }
+    
+    // 上一次生成的结果：{token: 结果令牌, data: 提交的表单, documentList: 材料清单}
+    let lastResult = null;
+    
+    // 客户端规则：页面加载时请求一次，之后在本地计算单人申请的材料清单；家庭申请和PDF仍由服务器生成
+    // 本地计算后最多每隔CLIENT_RULES_CHECK_INTERVAL毫秒重新验证一次（ETag为规则版本，未变化时服务器返回304）
+    const CLIENT_RULES_CHECK_INTERVAL = 60000;
+    let clientRules = null;
+    let clientRulesCheckedAt = 0;
+    let clientRulesLoading = null;
+    
+    function loadClientRules() {
+        if (clientRulesLoading) {
+            return clientRulesLoading;
+        }
+        clientRulesCheckedAt = Date.now();
+        clientRulesLoading = fetch('/api/rules')
+            .then(response => response.ok ? response.json() : null)
+            .then(rules => {
+                // 不认识的规则格式不使用，全部交给服务器计算
+                clientRules = rules && rules.format === CLIENT_RULES_FORMAT ? rules : null;
+                window.clientRulesVersion = clientRules ? clientRules.version : undefined;
+                console.log('客户端规则版本:', window.clientRulesVersion);
+            })
+            .catch(error => {
+                console.warn('加载客户端规则失败，材料清单由服务器生成:', error);
+            })
+            .finally(() => {
+                clientRulesLoading = null;
+            });
+        return clientRulesLoading;
+    }
+    
+    function refreshClientRules() {
+        if (Date.now() - clientRulesCheckedAt > CLIENT_RULES_CHECK_INTERVAL) {
+            loadClientRules();
+        }
+    }
+    
+    // 请求服务器时带上规则版本，服务器发现版本已过期时重新加载规则
+    function addClientRulesHeader(headers) {
+        if (clientRules) {
+            headers['X-Rules-Version'] = clientRules.version;
+        }
+        return headers;
+    }
+    
+    function checkClientRulesResponse(response) {
+        if (response.headers.get('X-Rules-Stale') === '1') {
+            console.log('客户端规则已过期，重新加载:', response.headers.get('X-Rules-Version'));
+            loadClientRules();
+        }
+    }
+    
+    loadClientRules();
+    
+    // 只提交修改的字段，按服务器返回的差异更新上一次的材料清单；不可用时返回null，由调用方提交完整表单
+    async function submitIncremental(data) {
+        const changes = {};
+        const keys = new Set([...Object.keys(lastResult.data), ...Object.keys(data)]);
+        keys.forEach(key => {
+            if (JSON.stringify(lastResult.data[key]) !== JSON.stringify(data[key])) {
+                changes[key] = data[key] === undefined ? null : data[key];
+            }
+        });
+        
+        try {
+            const response = await fetch('/api/generate/incremental', {
+                method: 'POST',
+                headers: addClientRulesHeader({
+                    'Content-Type': 'application/json',
+                }),
+                body: JSON.stringify({ token: lastResult.token, changes: changes })
+            });
+            checkClientRulesResponse(response);
+            if (!response.ok) {
+                console.log('增量生成不可用，提交完整表单:', response.status);
+                return null;
+            }
+            
+            const payload = await response.json();
+            console.log('增量生成，重新计算的步骤:', payload.recomputed);
+            const documentList = {};
+            payload.diff.order.forEach(section => {
+                documentList[section] = section in payload.diff.changed
+                    ? payload.diff.changed[section]
+                    : lastResult.documentList[section];
+            });
+            lastResult = { token: payload.token, data: data, documentList: documentList };
+            return documentList;
+        } catch (error) {
+            console.warn('增量生成出错，提交完整表单:', error);
+            return null;
+        }
+    }
+    
+    // 材料显示顺序
+    const CLIENT_SECTION_ORDER = [
+        '基本信息', '基本材料', '学籍/学历证明', 
+        '学籍/学历证明及情况说明', '工作证明', '财力证明', 
+        '居住证明材料', '家属材料', '其他材料'
+    ];
+    
     // 提交表单数据到服务器
     async function submitFormData(data) {
         try {
@@ -760,21 +1011,62 @@ document.addEventListener('DOMContentLoaded', function() {
             
             console.log('提交表单数据:', data);
             
-            const response = await fetch('/api/generate', {
-            method: 'POST',
-            headers: {
-                    'Content-Type': 'application/json',
-            },
-            body: JSON.stringify(data)
-            });
+            // 规则已加载且表单可以在本地计算时直接返回，不请求服务器
+            const localResult = clientRules ? evaluateClientRules(clientRules, data) : null;
+            if (localResult) {
+                console.log('本地计算材料清单，规则版本:', clientRules.version);
+                refreshClientRules();
+                return {
+                    status: 'success',
+                    document_list: localResult,
+                    ordered_sections: CLIENT_SECTION_ORDER
+                };
+            }
             
-            console.log('服务器响应状态码:', response.status);
+            const body = JSON.stringify(data);
+            const cached = getCachedResult(body);
             
-            if (!response.ok) {
-                throw new Error(`服务器响应错误: ${response.status}`);
+            // 在上一次结果的基础上只修改了部分字段时，先尝试增量生成
+            let result = null;
+            if (!cached && lastResult) {
+                result = await submitIncremental(data);
             }
             
-            const result = await response.json();
+            if (!result) {
+                const headers = addClientRulesHeader({
+                    'Content-Type': 'application/json',
+                });
+                // 重复提交相同的表单时带上ETag，服务器返回304则直接使用保存的结果
+                if (cached) {
+                    headers['If-None-Match'] = cached.etag;
+                }
+                
+                const response = await fetch('/api/generate', {
+                    method: 'POST',
+                    headers: headers,
+                    body: body
+                });
+                
+                console.log('服务器响应状态码:', response.status);
+                checkClientRulesResponse(response);
+                
+                if (response.status === 304 && cached) {
+                    result = cached.result;
+                } else {
+                    if (!response.ok) {
+                        throw new Error(`服务器响应错误: ${response.status}`);
+                    }
+                    
+                    result = await response.json();
+                    const etag = response.headers.get('ETag');
+                    if (etag && !result.error) {
+                        setCachedResult(body, etag, result);
+                    }
+                }
+                
+                const token = response.headers.get('X-Result-Token');
+                lastResult = token && !result.error ? { token: token, data: data, documentList: result } : null;
+            }
             console.log('服务器响应数据:', result);
             
             // 检查是否有错误
@@ -788,11 +1080,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 return {
                     status: 'success',
                     document_list: result,
-                    ordered_sections: [
-                        '基本信息', '基本材料', '学籍/学历证明', 
-                        '学籍/学历证明及情况说明', '工作证明', '财力证明', 
-                        '居住证明材料', '家属材料', '其他材料'
-                    ]
+                    ordered_sections: CLIENT_SECTION_ORDER
                 };
             }
             
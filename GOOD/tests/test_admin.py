@@ -0,0 +1,116 @@
+"""
+测试管理接口的访问控制和PDF调试捕获接口
+"""
+import unittest
+import atexit
+import logging
+import os
+import sys
+import tempfile
+from unittest import mock
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from document_generator.debug_capture import DebugCaptureBuffer
+
+# 委托（不存在的）渲染服务，导入应用时不加载WeasyPrint，也不启动后台线程
+_TEST_ENV = {
+    'PDF_RENDER_SOCKET': os.path.join(tempfile.gettempdir(), 'good_test_no_render.sock'),
+    'PDF_JOB_DB': os.path.join(tempfile.gettempdir(), 'good_test_admin_jobs.sqlite3'),
+    'PDF_JOB_WORKERS': '0',
+    'CONFIG_RELOAD_INTERVAL': '0',
+    'CLIENT_RULES': '0',
+    'ASSET_PIPELINE': '0',
+    'LOG_FILE': os.path.join(tempfile.gettempdir(), 'good_test_admin_log.txt'),
+}
+
+
+class FakeCaptureGenerator:
+    """只提供调试捕获的PDF生成器"""
+
+    def __init__(self, buffer):
+        self.debug_capture = buffer
+
+    def get_debug_captures(self):
+        return self.debug_capture.entries() if self.debug_capture is not None else None
+
+
+class TestAdminRoutes(unittest.TestCase):
+    """测试/admin接口"""
+
+    @classmethod
+    def setUpClass(cls):
+        root = logging.getLogger()
+        cls.root_handlers, cls.root_level = list(root.handlers), root.level
+        with mock.patch.dict(os.environ, _TEST_ENV):
+            import app as app_module
+        cls.app_module = app_module
+
+    @classmethod
+    def tearDownClass(cls):
+        # 应用导入时替换了根日志记录器的处理器，恢复后其他测试的日志不经过应用的日志管道
+        pipeline = cls.app_module.log_pipeline
+        pipeline.stop()
+        atexit.unregister(pipeline.stop)
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        for handler in cls.root_handlers:
+            root.addHandler(handler)
+        root.setLevel(cls.root_level)
+
+    def setUp(self):
+        self.client = self.app_module.app.test_client()
+        self.buffer = DebugCaptureBuffer(2)
+        for index in range(3):
+            self.buffer.add(f"<html>申请人{index}</html>")
+        patches = [
+            mock.patch.object(self.app_module, 'ADMIN_TOKEN', 'secret'),
+            mock.patch.object(self.app_module, 'pdf_generator', FakeCaptureGenerator(self.buffer)),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def get(self, path, token='secret'):
+        headers = {'Authorization': f'Bearer {token}'} if token is not None else {}
+        return self.client.get(path, headers=headers)
+
+    def test_disabled_without_token(self):
+        """没有设置ADMIN_TOKEN时管理接口不可用"""
+        with mock.patch.object(self.app_module, 'ADMIN_TOKEN', None):
+            for path in ('/admin/pdf_debug', '/admin/pdf_debug/3', '/admin/slow_requests'):
+                self.assertEqual(self.get(path).status_code, 404, path)
+
+    def test_requires_token(self):
+        """没有令牌或令牌不正确时返回401，不返回捕获的HTML"""
+        for token in (None, 'wrong'):
+            for path in ('/admin/pdf_debug', '/admin/pdf_debug/3'):
+                response = self.get(path, token=token)
+                self.assertEqual(response.status_code, 401, (path, token))
+                self.assertEqual(response.headers['WWW-Authenticate'], 'Bearer')
+                self.assertNotIn('申请人', response.get_data(as_text=True))
+
+    def test_list_and_view_captures(self):
+        """列表不包含HTML，最新的在前；已淘汰的记录返回404"""
+        response = self.get('/admin/pdf_debug')
+        self.assertEqual(response.status_code, 200)
+        captures = response.get_json()
+        self.assertEqual([capture['id'] for capture in captures], [3, 2])
+        self.assertTrue(all('html' not in capture for capture in captures))
+
+        response = self.get('/admin/pdf_debug/3')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers['Content-Type'], 'text/html; charset=utf-8')
+        self.assertEqual(response.get_data(as_text=True), '<html>申请人2</html>')
+        self.assertEqual(self.get('/admin/pdf_debug/1').status_code, 404)
+
+    def test_capture_disabled(self):
+        """未开启调试捕获时返回404"""
+        with mock.patch.object(self.app_module, 'pdf_generator', FakeCaptureGenerator(None)):
+            self.assertEqual(self.get('/admin/pdf_debug').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+"""
+测试静态资源构建
+"""
+import unittest
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+
+from werkzeug.http import parse_accept_header
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from document_generator.assets import AssetPipeline, minify_js, minify_css, minify_html
+
+
+class TestMinify(unittest.TestCase):
+    """测试压缩"""
+
+    def test_minify_js(self):
+        """去掉注释和缩进，保留换行；字符串、模板字符串和正则表达式原样保留"""
+        source = (
+            "// 注释\n"
+            "const a = 'x  // 不是注释', b = \"/* 也不是 */\";\n"
+            "    /* 块注释 */\n"
+            "const html = `\n    <div>${ items.map(i => `<b>${i}</b>`).join('') }</div>\n`;\n"
+            "const re = /[/*]+\\/ x/g, half = total / 2 / count;\n"
+            "return typeof x === 'string'\n"
+            "    ? x.replace(/  +/g, ' ') : a + +b - -c\n"
+        )
+        self.assertEqual(minify_js(source), (
+            "const a='x  // 不是注释',b=\"/* 也不是 */\";\n"
+            "const html=`\n    <div>${items.map(i=>`<b>${i}</b>`).join('')}</div>\n`;\n"
+            "const re=/[/*]+\\/ x/g,half=total/2/count;\n"
+            "return typeof x==='string'\n"
+            "?x.replace(/  +/g,' '):a+ +b- -c"
+        ))
+
+    def test_minify_css_and_html(self):
+        """CSS去掉注释和空白但保留选择器中冒号前的空格；HTML中<pre>原样保留"""
+        css = "/* 注释 */\n.a :hover , .b > p {\n  content: \"a  b\";\n  margin: 0 auto;\n}\n"
+        self.assertEqual(minify_css(css), '.a :hover,.b>p{content:"a  b";margin:0 auto}')
+        html = ("<!-- 注释 -->\n<div>\n    <span>a</span>   <span>b</span>\n</div>\n"
+                "<pre>  保留\n    缩进</pre>\n<style>\n  p { color: red; }\n</style>\n"
+                "<script>\n    // 注释\n    var x = 1;\n</script>\n")
+        self.assertEqual(minify_html(html), (
+            "<div>\n<span>a</span> <span>b</span>\n</div>\n<pre>  保留\n    缩进</pre>\n"
+            "<style>p{color:red}</style>\n<script>var x=1;</script>\n"))
+
+
+class TestAssetPipeline(unittest.TestCase):
+    """测试AssetPipeline"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.static_dir = os.path.join(self.tmpdir, 'static')
+        self.template_dir = os.path.join(self.tmpdir, 'templates')
+        self.build_dir = os.path.join(self.tmpdir, 'build')
+        self._write(os.path.join(self.static_dir, 'css', 'style.css'), 'body {\n  color: red;\n}\n' * 50)
+        self._write(os.path.join(self.static_dir, 'js', 'main.js'), 'var a = 1;\n' * 100)
+        self._write(os.path.join(self.template_dir, 'index.html'),
+                    '<link href="/static/css/style.css" rel="stylesheet">\n'
+                    '<script src="{{ url_for(\'static\', filename=\'js/main.js\') }}"></script>\n')
+        self.pipeline = AssetPipeline(self.static_dir, self.template_dir, self.build_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _write(self, path, text):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def test_build_and_rewrite(self):
+        """带哈希的文件名、预压缩版本和改写后的主页"""
+        manifest = self.pipeline.build()
+        css_url = self.pipeline.url('css/style.css')
+        self.assertRegex(css_url, r'^/assets/css/style\.[0-9a-f]{12}\.css$')
+        index = self.pipeline.index(parse_accept_header('gzip'))
+        self.assertEqual(index.encoding, 'gzip')
+        with open(index.path, 'rb') as f:
+            html = gzip.decompress(f.read()).decode('utf-8')
+        self.assertIn(f'href="{css_url}"', html)
+        self.assertIn(f'src="{self.pipeline.url("js/main.js")}"', html)
+        self.assertIn('gzip', manifest['assets']['js/main.js']['encodings'])
+
+        # 已有的构建结果在源文件不变时直接使用，源文件变化后过期
+        self.assertEqual(AssetPipeline(self.static_dir, self.template_dir, self.build_dir).load(), manifest)
+        self._write(os.path.join(self.static_dir, 'js', 'main.js'), 'var b = 2;\n' * 100)
+        reloaded = AssetPipeline(self.static_dir, self.template_dir, self.build_dir)
+        self.assertIsNone(reloaded.load())
+        self.assertNotEqual(reloaded.ensure_built()['urls']['js/main.js'], manifest['urls']['js/main.js'])
+
+    def test_resolve_encoding(self):
+        """按Accept-Encoding的优先级选择预压缩版本，不接受压缩时返回原文件"""
+        self.pipeline.build()
+        name = self.pipeline.url('js/main.js')[len('/assets/'):]
+        asset = self.pipeline.resolve(name, parse_accept_header('gzip, br;q=0.5'))
+        self.assertEqual((asset.encoding, asset.mimetype), ('gzip', 'text/javascript'))
+        self.assertTrue(asset.path.endswith('.js.gz'))
+        self.assertIsNone(self.pipeline.resolve(name, parse_accept_header('identity')).encoding)
+        self.assertIsNone(self.pipeline.resolve(name, parse_accept_header('gzip;q=0')).encoding)
+        self.assertIsNone(self.pipeline.resolve('js/main.js', parse_accept_header('gzip')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""
+测试批量材料清单
+"""
+import unittest
+import io
+import json
+import os
+import sys
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from document_generator.batch import BatchGenerator, BatchInputError, iter_json_array, iter_ndjson
+
+
+class TrickleStream(io.BytesIO):
+    """每次最多读取3个字节，模拟分块到达的请求体"""
+
+    def read(self, size=-1):
+        return super().read(3)
+
+
+class TestBatch(unittest.TestCase):
+    """测试批量读取和生成"""
+
+    def setUp(self):
+        self.calls = []
+
+        def generate(form):
+            self.calls.append(form.identity_type)
+            return {'基本材料': [f"{form.identity_type}材料"]}
+
+        self.generate = generate
+
+    def _lines(self, batch, items):
+        return [json.loads(line) for line in b''.join(batch.stream(items)).decode('utf-8').splitlines()]
+
+    def test_json_array_incremental(self):
+        """JSON数组分块到达时逐个元素产出，UTF-8字符可以跨越数据块"""
+        body = json.dumps([{'applicantName': '张三', 'n': 12345}, [1], 67890, {'b': '李四'}], ensure_ascii=False)
+        items = list(iter_json_array(TrickleStream(body.encode('utf-8'))))
+        self.assertEqual(items, [{'applicantName': '张三', 'n': 12345}, [1], 67890, {'b': '李四'}])
+        self.assertEqual(list(iter_json_array(io.BytesIO(b' [ ] '))), [])
+
+        with self.assertRaises(BatchInputError):
+            list(iter_json_array(io.BytesIO(b'{"a": 1}')))
+        with self.assertRaises(BatchInputError):
+            list(iter_json_array(io.BytesIO(b'[{"a": 1} {"b": 2}]')))
+        with self.assertRaises(BatchInputError):
+            list(iter_json_array(io.BytesIO(b'[{"a": "' + b'x' * 100 + b'"}]'), max_item_bytes=50))
+
+    def test_ndjson_errors_per_line(self):
+        """NDJSON中无法解析或过长的行作为该行的错误，不影响后续行"""
+        body = b'{"a": 1}\n\n{bad\n{"c": "' + b'x' * 100 + b'"}\n{"d": 4}\n'
+        items = list(iter_ndjson(io.BytesIO(body), max_item_bytes=50))
+        self.assertEqual(items[0], {'a': 1})
+        self.assertIsInstance(items[1], BatchInputError)
+        self.assertIsInstance(items[2], BatchInputError)
+        self.assertEqual(items[3], {'d': 4})
+
+    def test_deduplicates_canonical_forms(self):
+        """规范化后相同的表单只生成一次，结果按输入顺序输出"""
+        batch = BatchGenerator(self.generate)
+        forms = [{'identityType': 'EMPLOYED', 'residenceConsulate': 'beijing'},
+                 {'identityType': 'STUDENT'},
+                 {'identityType': 'EMPLOYED', 'residenceConsulate': 'BEIJING'},
+                 'not-a-form']
+        lines = self._lines(batch, iter(forms))
+        self.assertEqual([line['index'] for line in lines], [0, 1, 2, 3])
+        self.assertEqual(lines[2]['documents'], {'基本材料': ['EMPLOYED材料']})
+        self.assertIn('error', lines[3])
+        self.assertEqual(self.calls, ['EMPLOYED', 'STUDENT'])
+        self.assertEqual((batch.total, batch.distinct, batch.failed), (4, 2, 1))
+
+    def test_bounded_cache_and_fatal_error(self):
+        """去重缓存有上限；请求体结构错误时以fatal行结束"""
+        batch = BatchGenerator(self.generate, validate=lambda form: '不支持' if form.identity_type == 'CHILD' else None,
+                               cache_size=1)
+        forms = [{'identityType': 'EMPLOYED'}, {'identityType': 'STUDENT'}, {'identityType': 'EMPLOYED'},
+                 {'identityType': 'CHILD'}]
+        body = json.dumps(forms).encode('utf-8')[:-1]
+        lines = self._lines(batch, iter_json_array(io.BytesIO(body)))
+        self.assertEqual(self.calls, ['EMPLOYED', 'STUDENT', 'EMPLOYED'])
+        self.assertEqual(lines[3], {'index': 3, 'error': '不支持'})
+        self.assertEqual(lines[4], {'index': 4, 'error': 'JSON数组不完整', 'fatal': True})
+        self.assertLessEqual(len(batch._results), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+"""
+测试批量生成模块
+"""
+import unittest
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from unittest import mock
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from document_generator.bulk import (
+    BulkInputError, BulkJobStore, BulkRenderer, init_worker, read_forms, output_name, stream_zip, run_pool
+)
+
+
+class TestBulk(unittest.TestCase):
+    """测试批量导入和流式ZIP"""
+
+    def test_read_csv_forms(self):
+        """测试CSV：空单元格忽略，JSON单元格解析为对象"""
+        text = ('applicationType,residenceConsulate,familyMembers\n'
+                'FAMILY,beijing,"[{""relation"": ""SPOUSE""}]"\n'
+                'SINGLE,shanghai,\n')
+        forms = [form for _, form in read_forms(io.StringIO(text, newline=''), 'csv')]
+        self.assertEqual(forms[0]['familyMembers'], [{'relation': 'SPOUSE'}])
+        self.assertEqual(forms[1], {'applicationType': 'SINGLE', 'residenceConsulate': 'shanghai'})
+
+    def test_read_jsonl_forms(self):
+        """测试JSONL：跳过空行，格式错误时报告行号"""
+        text = '{"applicationType": "SINGLE"}\n\n{"applicationType": "FAMILY"}\n'
+        forms = list(read_forms(io.StringIO(text), 'jsonl'))
+        self.assertEqual([line_no for line_no, _ in forms], [1, 3])
+
+        with self.assertRaisesRegex(BulkInputError, '第2行'):
+            list(read_forms(io.StringIO('{}\n[1]\n'), 'jsonl'))
+
+    def test_output_name(self):
+        """测试输出文件名去掉路径分隔符等不安全字符"""
+        self.assertEqual(output_name(3, {'applicantName': '张 三/../x'}), '0003_张_三_.._x')
+        self.assertEqual(output_name(12, {}), '0012_applicant')
+
+    def test_stream_zip(self):
+        """测试流式ZIP逐个产出数据块，拼接后是有效的压缩包"""
+        chunks = list(stream_zip([('a.pdf', b'%PDF-1'), ('summary.json', b'{}')]))
+        self.assertGreater(len(chunks), 1)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+        self.assertEqual(archive.read('a.pdf'), b'%PDF-1')
+        self.assertEqual(archive.getinfo('a.pdf').compress_type, zipfile.ZIP_STORED)
+
+    def test_run_pool_document_lists(self):
+        """测试进程池生成材料清单，无效表单返回错误"""
+        config_path = os.path.join(os.path.dirname(__file__), '..', 'static', 'js', 'document_config.json')
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        forms = [
+            (1, {'applicationType': 'SINGLE', 'identityType': 'EMPLOYED', 'residenceConsulate': 'beijing',
+                 'hukouConsulate': 'beijing', 'processType': 'TAX', 'visaType': 'SINGLE'}),
+            (2, {'applicationType': 'SINGLE', 'residenceConsulate': 'other'}),
+        ]
+        with ProcessPoolExecutor(max_workers=2, initializer=init_worker, initargs=(config, None, False)) as executor:
+            results = {result['index']: result for result in run_pool(executor, forms, max_pending=2, with_pdf=False)}
+
+        self.assertIn('基本材料', dict(results[1]['document_list']))
+        self.assertNotIn('pdf', results[1])
+        self.assertIn('error', results[2])
+
+    def _store(self, **kwargs):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        return BulkJobStore(os.path.join(tmpdir, 'jobs.sqlite3'), os.path.join(tmpdir, 'bulk'), **kwargs)
+
+    def test_job_shared_between_workers(self):
+        """测试任务创建后即在后台运行，共享任务表的其他工作进程可以查询进度并跟随下载"""
+        store = self._store()
+        owner = BulkRenderer({}, store, workers=1, poll_interval=0.01)
+        # 其他工作进程：独立的BulkRenderer和任务表连接
+        other = BulkRenderer({}, BulkJobStore(store.db_path, store.output_dir), workers=1, poll_interval=0.01)
+        release = threading.Event()
+
+        def fake_pool(executor, forms, max_pending, with_pdf=True):
+            yield {'index': 1, 'name': '0001_a', 'pdf': b'%PDF-1'}
+            release.wait(5)
+            yield {'index': 2, 'name': '0002_b', 'error': '缺少字段'}
+
+        owner._acquire_executor = lambda: None
+        owner._release_executor = lambda executor: None
+        with mock.patch('document_generator.bulk.run_pool', fake_pool):
+            job = owner.create_job(io.StringIO('{"a": 1}\n{"b": 2}\n'), 'jsonl')
+            progress = other.progress(job.id)
+            for _ in range(3):
+                if progress['completed']:
+                    break
+                progress = other.wait_for_change(job.id, progress, timeout=5)
+            self.assertEqual((progress['status'], progress['completed']), ('running', 1))
+
+            chunks = other.read_output(job.id)
+            first = next(chunks)
+            release.set()
+            data = first + b''.join(chunks)
+
+        self.assertEqual(other.progress(job.id), {'job_id': job.id, 'status': 'done', 'total': 2,
+                                                  'completed': 1, 'failed': 1})
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        self.assertEqual(archive.read('0001_a.pdf'), b'%PDF-1')
+        self.assertEqual(json.loads(archive.read('summary.json'))['failed'], 1)
+        self.assertEqual(os.listdir(store.output_dir), [f'{job.id}.zip'])
+
+    def _wait_finished(self, renderer, job_id):
+        progress = renderer.progress(job_id)
+        for _ in range(20):
+            if progress['status'] not in ('pending', 'running'):
+                break
+            progress = renderer.wait_for_change(job_id, progress, timeout=5)
+        return progress
+
+    def test_broken_pool_replaced(self):
+        """测试工作进程异常退出只导致当前任务失败，下一个任务使用新的进程池"""
+        config_path = os.path.join(os.path.dirname(__file__), '..', 'static', 'js', 'document_config.json')
+        with open(config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        renderer = BulkRenderer(config, self._store(), workers=1, render_socket='/nonexistent', poll_interval=0.01)
+        self.addCleanup(renderer.shutdown)
+        crash = [True]
+
+        def pool(executor, forms, max_pending, with_pdf=True):
+            if crash:
+                crash.pop()
+                # 模拟渲染时工作进程崩溃
+                executor.submit(os._exit, 1).result()
+            yield {'index': 1, 'name': '0001_a', 'pdf': b'%PDF-' + str(executor.submit(int, '1').result()).encode()}
+
+        with mock.patch('document_generator.bulk.run_pool', pool):
+            job = renderer.create_job(io.StringIO('{"a": 1}\n'), 'jsonl')
+            self.assertEqual(self._wait_finished(renderer, job.id)['status'], 'failed')
+            job = renderer.create_job(io.StringIO('{"a": 1}\n'), 'jsonl')
+            self.assertEqual(self._wait_finished(renderer, job.id)['status'], 'done')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(renderer.read_output(job.id))))
+        self.assertEqual(archive.read('0001_a.pdf'), b'%PDF-1')
+
+    def test_stale_job_failed(self):
+        """测试运行任务的进程退出后（超过租约时间没有进展）任务视为失败，过期任务连同文件被清理"""
+        store = self._store(lease_timeout=0)
+        store.create('abc', 3, 'gone')
+        progress = store.get('abc')
+        self.assertEqual(progress['status'], 'failed')
+        self.assertIn('error', progress)
+
+        store.update('abc', status='done')
+        with open(store.output_path('abc'), 'wb') as f:
+            f.write(b'zip')
+        self.assertEqual(store.purge(0), 1)
+        self.assertIsNone(store.get('abc'))
+        self.assertEqual(os.listdir(store.output_dir), [])
+
+    def test_update_config_retires_executor(self):
+        """测试更新配置后新任务使用新进程池，旧进程池在正在进行的任务结束后关闭"""
+        renderer = BulkRenderer({}, self._store(), workers=1)
+        try:
+            old = renderer._acquire_executor()
+            renderer.update_config({'basicMaterials': {}})
+            new = renderer._acquire_executor()
+            self.assertIsNot(old, new)
+            self.assertEqual(renderer.config, {'basicMaterials': {}})
+            renderer._release_executor(old)
+            with self.assertRaises(RuntimeError):
+                old.submit(int)
+            renderer._release_executor(new)
+            self.assertIs(renderer._acquire_executor(), new)
+        finally:
+            renderer.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+"""
+测试离线批量命令行工具
+"""
+import unittest
+import json
+import os
+import sys
+import tempfile
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from document_generator.cli import run
+
+
+class TestCli(unittest.TestCase):
+    """测试批量生成材料清单JSON"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.input_path = os.path.join(self.temp_dir.name, 'forms.jsonl')
+        self.output_dir = os.path.join(self.temp_dir.name, 'out')
+        forms = [
+            {"applicantName": "张三", "applicationType": "SINGLE", "identityType": "EMPLOYED",
+             "residenceConsulate": "beijing", "hukouConsulate": "beijing", "processType": "TAX", "visaType": "SINGLE"},
+            {"applicantName": "李四", "applicationType": "SINGLE", "residenceConsulate": "other"},
+        ]
+        with open(self.input_path, 'w', encoding='utf-8') as f:
+            for form in forms:
+                f.write(json.dumps(form, ensure_ascii=False) + '\n')
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_run_and_resume(self):
+        """测试生成JSON清单、记录失败，重复运行时跳过已生成的记录"""
+        summary = run(self.input_path, self.output_dir, ['json'], workers=2)
+        self.assertEqual((summary['total'], summary['succeeded'], summary['failed']), (2, 1, 1))
+
+        with open(os.path.join(self.output_dir, '0001_张三.json'), 'r', encoding='utf-8') as f:
+            self.assertIn('基本材料', json.load(f))
+        with open(os.path.join(self.output_dir, 'failures.jsonl'), 'r', encoding='utf-8') as f:
+            self.assertEqual(json.loads(f.readline())['name'], '0002_李四')
+
+        summary = run(self.input_path, self.output_dir, ['json'], workers=2)
+        self.assertEqual((summary['skipped'], summary['succeeded'], summary['failed']), (1, 0, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+"""
+测试客户端规则导出
+"""
+import unittest
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from document_generator.main import DocumentGenerator
+from document_generator.client_rules import ClientRules, KEY_FORMAT, evaluate, encode_value, rules_path, shared_rules
+from document_generator.config_manager import GeneratorSet
+from document_generator.decision_table import decision_key
+
+
+class TestClientRules(unittest.TestCase):
+    """测试客户端规则"""
+
+    @classmethod
+    def setUpClass(cls):
+        config_path = os.path.join(os.path.dirname(__file__), '..', 'static', 'js', 'document_config.json')
+        with open(config_path, 'r', encoding='utf-8') as f:
+            cls.config = json.load(f)
+        cls.generator = DocumentGenerator(cls.config)
+        cls.rules = ClientRules.from_table(cls.generator.decision_table)
+
+    def test_reproduces_decision_table(self):
+        """按规则文件计算的结果与决策表中的每一项相同，家庭申请不在本地计算"""
+        artifact = json.loads(self.rules.body)
+        self.assertEqual(artifact['format'], KEY_FORMAT)
+        for key, entry in self.generator.decision_table.items():
+            if key[4] == 'FAMILY':
+                self.assertIsNone(evaluate(artifact, key))
+            else:
+                self.assertEqual(list(evaluate(artifact, key).items()), list(entry), key)
+
+    def test_matches_generator(self):
+        """别名和大小写不同的原始表单也得到与生成器相同的结果"""
+        artifact = json.loads(self.rules.body)
+        form_data = {
+            'residenceConsulate': 'Shanghai', 'hukouConsulate': 'BEIJING', 'identityType': 'STUDENT',
+            'processType': 'NORMAL', 'applicationType': 'SINGLE', 'visaDuration': '三年多次',
+            'economicMaterial': 'depositThree', 'graduateStatus': '在读', 'hasFamily': 'true',
+        }
+        expected = self.generator.build_document_list(form_data)
+        self.assertEqual(list(evaluate(artifact, decision_key(form_data)).items()), list(expected.items()))
+
+    def test_version(self):
+        """同一决策表导出的版本相同，页面提交其他版本时视为过期"""
+        rules = ClientRules.from_table(self.generator.decision_table)
+        self.assertEqual(rules.version, self.rules.version)
+        self.assertEqual(rules.body, self.rules.body)
+        self.assertFalse(rules.is_stale(None))
+        self.assertFalse(rules.is_stale(rules.version))
+        self.assertTrue(rules.is_stale('0' * 12))
+        self.assertEqual(encode_value(None), json.loads(rules.body)['none'])
+        self.assertEqual(encode_value(True), 'true')
+
+    def test_shared_rules_file(self):
+        """第一个进程导出并写入规则文件，之后直接读取，不需要决策表"""
+        rules_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, rules_dir, ignore_errors=True)
+        path = rules_path(rules_dir, 'abc')
+        self.assertIsNone(shared_rules(path, None))
+        exported = shared_rules(path, self.generator.decision_table)
+        self.assertEqual(exported.body, self.rules.body)
+
+        loaded = shared_rules(path, None)
+        self.assertEqual(loaded.version, self.rules.version)
+        self.assertEqual(loaded.body, self.rules.body)
+        self.assertEqual(loaded.variants, self.rules.variants)
+
+    def test_client_rules_does_not_wait(self):
+        """其他线程正在导出时，不等待的调用立即返回None"""
+        generators = GeneratorSet(self.config, 1)
+        with generators._client_rules_lock:
+            self.assertIsNone(generators.client_rules(wait=False))
+        self.assertEqual(generators.client_rules(wait=False).version, self.rules.version)
+
+
+if __name__ == '__main__':
+    unittest.main()
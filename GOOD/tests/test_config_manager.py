@@ -0,0 +1,109 @@
+"""
+测试配置热加载
+"""
+import unittest
+import json
+import os
+import shutil
+import sys
+import tempfile
+from collections import OrderedDict
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from document_generator.config_manager import ConfigManager, ConfigError, validate_config
+from document_generator.pdf_cache import make_cache_key
+
+
+class TestConfigManager(unittest.TestCase):
+    """测试ConfigManager"""
+
+    @classmethod
+    def setUpClass(cls):
+        config_path = os.path.join(os.path.dirname(__file__), '..', 'static', 'js', 'document_config.json')
+        with open(config_path, 'r', encoding='utf-8') as f:
+            cls.config = json.load(f)
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'document_config.json')
+        self._write(self.config)
+        self.manager = ConfigManager(self.path, services={'config_keys': lambda config: sorted(config)}, interval=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _write(self, config, raw=None):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(raw if raw is not None else json.dumps(config, ensure_ascii=False))
+        # 保证修改时间变化
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    def _modified_config(self):
+        config = json.loads(json.dumps(self.config))
+        config['residenceMaterials']['options'] = ['居住证明（测试）']
+        return config
+
+    def test_reload_swaps_version(self):
+        """文件变化后切换到新版本，之前取得的生成器保持不变"""
+        old = self.manager.current()
+        self.assertFalse(self.manager.check())
+
+        self._write(self._modified_config())
+        self.assertTrue(self.manager.check())
+        new = self.manager.current()
+        self.assertNotEqual(old.version, new.version)
+        self.assertEqual(new.generation, old.generation + 1)
+        self.assertEqual(new.services['config_keys'], sorted(self.config))
+
+        form = {'residenceConsulate': 'other', 'hukouConsulate': 'beijing', 'identityType': 'EMPLOYED'}
+        self.assertIn('1. 居住证明（测试）', new.document_generator.generate_document_list(form)['居住证明材料'])
+        self.assertNotIn('1. 居住证明（测试）', old.document_generator.generate_document_list(form)['居住证明材料'])
+
+    def test_invalid_config_keeps_current(self):
+        """格式错误或结构无效的配置不会替换当前版本"""
+        version = self.manager.version
+        self._write(None, raw='{"basicMaterials": ')
+        self.assertFalse(self.manager.check())
+        self.assertEqual(self.manager.version, version)
+        self.assertIn('格式错误', self.manager.status()['last_error'])
+
+        broken = dict(self.config)
+        del broken['basicMaterials']
+        self._write(broken)
+        self.assertFalse(self.manager.check())
+        self.assertEqual(self.manager.version, version)
+
+        # 修复后恢复，内容与当前版本相同时不重新编译
+        self._write(self.config)
+        self.assertFalse(self.manager.check())
+        self.assertIsNone(self.manager.status()['last_error'])
+
+    def test_on_reload_callback(self):
+        """新版本生效后调用回调"""
+        versions = []
+        self.manager.on_reload = lambda generators: versions.append(generators.version)
+        self._write(self._modified_config())
+        self.manager.check()
+        self.assertEqual(versions, [self.manager.version])
+
+    def test_validate_config(self):
+        """配置结构校验"""
+        validate_config(self.config)
+        with self.assertRaises(ConfigError):
+            validate_config([])
+        with self.assertRaises(ConfigError):
+            validate_config(dict(self.config, basicMaterials=[]))
+
+    def test_cache_key_includes_version(self):
+        """不同配置版本的PDF缓存键不同"""
+        document_list = OrderedDict([('基本材料', ['护照原件'])])
+        form = {'identityType': 'EMPLOYED'}
+        self.assertNotEqual(make_cache_key(document_list, form, 'd', config_version='a'),
+                            make_cache_key(document_list, form, 'd', config_version='b'))
+
+
+if __name__ == '__main__':
+    unittest.main()
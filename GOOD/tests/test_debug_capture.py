@@ -0,0 +1,30 @@
+"""
+测试PDF调试捕获缓冲区
+"""
+import unittest
+import os
+import sys
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from document_generator.debug_capture import DebugCaptureBuffer
+
+
+class TestDebugCaptureBuffer(unittest.TestCase):
+    """测试DebugCaptureBuffer"""
+
+    def test_evicts_oldest(self):
+        """超过容量时丢弃最早的记录，编号继续递增，最新的在前"""
+        buffer = DebugCaptureBuffer(2)
+        ids = [buffer.add(f"<html>{index}</html>", captured_at='2024-01-01T00:00:00') for index in range(3)]
+        self.assertEqual(ids, [1, 2, 3])
+        entries = buffer.entries()
+        self.assertEqual([entry['id'] for entry in entries], [3, 2])
+        self.assertEqual(entries[0]['html'], '<html>2</html>')
+        self.assertEqual(entries[0]['size'], len('<html>2</html>'))
+        self.assertEqual(entries[1]['captured_at'], '2024-01-01T00:00:00')
+
+
+if __name__ == '__main__':
+    unittest.main()
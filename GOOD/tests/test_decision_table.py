@@ -0,0 +1,144 @@
+"""
+测试决策表与生成器逐项生成的结果一致
+"""
+import unittest
+import json
+import os
+import gc
+import random
+import shutil
+import sys
+import tempfile
+from unittest import mock
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from document_generator.main import DocumentGenerator
+from document_generator import decision_table
+from document_generator.decision_table import decision_key, enumerate_forms, get_decision_table
+
+
+class TestDecisionTable(unittest.TestCase):
+    """测试决策表"""
+
+    @classmethod
+    def setUpClass(cls):
+        config_path = os.path.join(os.path.dirname(__file__), '..', 'static', 'js', 'document_config.json')
+        with open(config_path, 'r', encoding='utf-8') as f:
+            cls.config = json.load(f)
+        cls.generator = DocumentGenerator(cls.config)
+
+    def assertSameAsGenerator(self, form_data):
+        expected = self.generator.build_document_list(dict(form_data))
+        actual = self.generator.generate_document_list(dict(form_data))
+        self.assertEqual(list(actual.items()), list(expected.items()), form_data)
+
+    def test_enumerated_forms(self):
+        """决策表覆盖的每个代表表单都与逐项生成一致"""
+        for form_data in enumerate_forms():
+            if form_data['applicationType'] == 'FAMILY':
+                continue
+            self.assertIsNotNone(self.generator.decision_table.lookup(form_data), form_data)
+            self.assertSameAsGenerator(form_data)
+
+    def test_sampled_raw_forms(self):
+        """使用别名、多余字段等原始取值的随机表单与逐项生成一致"""
+        rng = random.Random(20240501)
+        choices = {
+            'residenceConsulate': ['beijing', 'shanghai', 'other', '', 'Beijing'],
+            'hukouConsulate': ['beijing', 'shanghai', 'other', ''],
+            'identityType': ['EMPLOYED', 'STUDENT', 'RETIRED', 'FREELANCER', 'CHILD', ''],
+            'processType': ['TAX', 'STUDENT', 'NORMAL', 'SIMPLIFIED', ''],
+            'applicationType': ['SINGLE', 'FAMILY', 'BINDING', 'ECONOMIC', '', 'INDIVIDUAL'],
+            'visaType': ['SINGLE', 'three', '五年多次', '', 'unknown'],
+            'economicMaterial': ['', 'creditCard', 'deposit_three', 'salaryFive', 'bogus'],
+            'graduateStatus': ['graduate', '已毕业', 'current', '在读', 'auto'],
+            'familyRelation': ['SPOUSE', 'PARENT', 'CHILD', 'OTHER'],
+            'familyVisaType': ['THREE', 'FIVE', 'SINGLE'],
+            'hukouType': ['family', 'auto', 'collective'],
+            'hasFamily': [True, False, 'true', '0'],
+        }
+        for _ in range(3000):
+            form_data = {field: rng.choice(values) for field, values in choices.items() if rng.random() < 0.8}
+            self.assertSameAsGenerator(form_data)
+
+    def test_family_members_computed_per_request(self):
+        """家庭申请中与家庭成员有关的部分按家庭成员计算"""
+        form_data = {
+            'applicationType': 'FAMILY', 'visaType': 'FIVE', 'identityType': 'EMPLOYED',
+            'residenceConsulate': 'beijing', 'hukouConsulate': 'beijing', 'processType': 'TAX',
+            'familyMembers': [
+                {'name': '张三', 'identityType': 'RETIRED', 'residenceConsulate': 'beijing', 'hukouConsulate': 'shanghai'},
+                {'name': '李四', 'identityType': 'STUDENT', 'residenceConsulate': 'beijing', 'hukouConsulate': 'beijing'},
+            ]
+        }
+        self.assertSameAsGenerator(form_data)
+        document_list = self.generator.generate_document_list(form_data)
+        self.assertTrue(document_list['居住证明材料'][0].startswith('张三'))
+        self.assertIn('3. 李四需要提供学信网在线学籍验证报告', document_list['家属材料'])
+
+        form_data['familyMembers'] = []
+        self.assertSameAsGenerator(form_data)
+        self.assertNotIn('居住证明材料', self.generator.generate_document_list(form_data))
+
+    def test_results_share_immutable_sections(self):
+        """各部分材料是决策表中共享的元组，返回的有序字典每次新建"""
+        form_data = {'applicationType': 'SINGLE', 'visaType': 'SINGLE', 'identityType': 'EMPLOYED',
+                     'residenceConsulate': 'beijing', 'hukouConsulate': 'shanghai', 'processType': 'NORMAL',
+                     'hasFamily': True}
+        first = self.generator.generate_document_list(form_data)
+        second = self.generator.generate_document_list(form_data)
+        self.assertIsNot(first, second)
+        self.assertIs(first['基本材料'], second['基本材料'])
+        with self.assertRaises(AttributeError):
+            first['基本材料'].append('额外材料')
+        first.pop('基本材料')
+        self.assertIn('基本材料', self.generator.generate_document_list(form_data))
+
+        # 逐项生成和追踪生成的结果同样是元组，追加的材料拼接成新的元组
+        for document_list in (self.generator.build_document_list(form_data),
+                              self.generator.generate_traced(form_data).document_list):
+            self.assertTrue(all(isinstance(items, tuple) for items in document_list.values()))
+            self.assertEqual(document_list['居住证明材料'][-1], "持签人家属需提供上述居住材料之一")
+
+    def test_pruned_key(self):
+        """不影响结果的字段不计入键，无法识别的取值不查表"""
+        binding = {'applicationType': 'BINDING', 'residenceConsulate': 'beijing', 'hukouConsulate': 'beijing',
+                   'identityType': 'EMPLOYED', 'processType': 'NORMAL', 'familyRelation': 'SPOUSE'}
+        self.assertEqual(decision_key(dict(binding, visaType='THREE', economicMaterial='deposit_five')),
+                         decision_key(binding))
+        self.assertIsNone(decision_key(dict(binding, applicationType='SINGLE', economicMaterial='bogus')))
+        self.assertIsNone(decision_key(dict(binding, hukouType='collective')))
+
+    def test_shared_table_file(self):
+        """编译结果写入DECISION_TABLE_DIR，其他进程（这里清空进程内缓存模拟）直接读取，不再编译"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        config = dict(self.config, testMarker={'value': 'shared'})
+        generator = DocumentGenerator(config, precompile=False)
+        with mock.patch.dict(os.environ, {'DECISION_TABLE_DIR': directory}):
+            with mock.patch.dict(decision_table._compiled_tables, clear=True):
+                compiled = get_decision_table(config, generator._compile_entry)
+            with mock.patch.dict(decision_table._compiled_tables, clear=True):
+                loaded = get_decision_table(config, lambda form: self.fail("不应重新编译"))
+        self.assertEqual(list(loaded.items()), list(compiled.items()))
+
+    def test_cache_keeps_tables_in_use(self):
+        """进程内只保留最近取得的决策表和仍在使用的决策表"""
+        generator = DocumentGenerator(self.config, precompile=False)
+        build = generator._compile_entry
+        configs = [dict(self.config, testMarker={'value': str(index)}) for index in range(3)]
+        with mock.patch.dict(os.environ, {'DECISION_TABLE_DIR': ''}):
+            in_use = get_decision_table(configs[0], build)
+            get_decision_table(configs[1], build)
+            latest = get_decision_table(configs[2], build)
+        gc.collect()
+        cached = [decision_table._compiled_tables.get(decision_table.config_fingerprint(config)) for config in configs]
+        self.assertIs(cached[0], in_use)
+        self.assertIsNone(cached[1])
+        self.assertIs(cached[2], latest)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""
+测试PDF子集字体的字符收集
+"""
+import unittest
+import os
+import shutil
+import sys
+import tempfile
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from document_generator.font_subset import collect_characters, gb2312_level1, missing_characters, required_characters, main
+
+
+class TestFontSubset(unittest.TestCase):
+    """测试子集字体字符收集"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.characters = collect_characters()
+
+    def test_gb2312_level1(self):
+        """测试常用姓名用字为GB2312一级汉字"""
+        chars = gb2312_level1()
+        self.assertEqual(len(chars), 3755)
+        self.assertIn('张', chars)
+
+    def test_collects_config_and_generator_text(self):
+        """测试覆盖配置文件、生成器字符串和PDF模板中的字符"""
+        for text in ('护照原件', '主申请人的配偶', '申请人信息确认', '加急处理', '订单号：'):
+            for char in text:
+                self.assertIn(char, self.characters)
+
+    def test_collects_ascii(self):
+        """测试覆盖ASCII可打印字符"""
+        for char in 'GOOD System 2024-01-01':
+            self.assertIn(char, self.characters)
+
+    def _build_font(self, path, characters):
+        """生成只包含characters空字形的字体"""
+        from fontTools.fontBuilder import FontBuilder
+        from fontTools.pens.ttGlyphPen import TTGlyphPen
+
+        names = ['.notdef'] + [f'uni{ord(char):04X}' for char in sorted(characters)]
+        builder = FontBuilder(1000, isTTF=True)
+        builder.setupGlyphOrder(names)
+        builder.setupCharacterMap({ord(char): f'uni{ord(char):04X}' for char in characters})
+        empty = TTGlyphPen(None).glyph()
+        builder.setupGlyf({name: empty for name in names})
+        builder.setupHorizontalMetrics({name: (500, 0) for name in names})
+        builder.setupHorizontalHeader()
+        builder.setupNameTable({'familyName': 'Test', 'styleName': 'Regular'})
+        builder.setupOS2()
+        builder.setupPost()
+        builder.save(path)
+
+    def test_check_subset(self):
+        """测试检查子集字体：不存在或缺少固定文本字符时以非零状态退出"""
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir, ignore_errors=True)
+        path = os.path.join(tmpdir, 'subset.ttf')
+        self.assertEqual(main(['--check', '--output', path]), 1)
+
+        characters = {char for char in required_characters() if not char.isspace()}
+        self._build_font(path, characters - {'护'})
+        self.assertEqual(missing_characters(path), {'护'})
+        self.assertEqual(main(['--check', '--output', path]), 1)
+
+        self._build_font(path, characters)
+        self.assertEqual(missing_characters(path), set())
+        self.assertEqual(main(['--check', '--output', path]), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+"""
+测试申请表单解析
+"""
+import unittest
+import json
+import os
+import sys
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from document_generator.form import ApplicationForm, as_form
+from document_generator.main import DocumentGenerator
+from risk_assessment import RiskAssessmentService
+
+
+class TestApplicationForm(unittest.TestCase):
+    """测试ApplicationForm"""
+
+    @classmethod
+    def setUpClass(cls):
+        config_path = os.path.join(os.path.dirname(__file__), '..', 'static', 'js', 'document_config.json')
+        with open(config_path, 'r', encoding='utf-8') as f:
+            cls.config = json.load(f)
+
+    def test_parse_aliases(self):
+        """领区统一小写，别名字段只解析一次"""
+        form = ApplicationForm({
+            'residenceConsulate': 'Beijing', 'hukouConsulate': 'SHANGHAI', 'visaDuration': 'five',
+            'visaType': 'SINGLE', 'economicMaterial': 'depositThree', 'graduateStatus': '在读',
+            'hukouType': 'COLLECTIVE', 'has_family': 'true', 'tax': 'PAID', 'taxStamped': True,
+        })
+        self.assertEqual(form.residence_consulate, 'beijing')
+        self.assertEqual(form.hukou_consulate, 'shanghai')
+        self.assertEqual(form.visa_duration, 'FIVE')
+        self.assertEqual(form.economic_material, 'deposit_three')
+        self.assertEqual(form.graduate_status, 'current')
+        self.assertEqual(form.hukou_type, 'collective')
+        self.assertTrue(form.has_family)
+        self.assertEqual(form.tax_payment, 'PAID')
+        self.assertTrue(form.tax_stamped)
+
+    def test_defaults(self):
+        """缺少的字段使用与生成器一致的默认值"""
+        form = ApplicationForm({})
+        self.assertEqual(form.residence_consulate, '')
+        self.assertEqual(form.visa_duration, 'SINGLE')
+        self.assertEqual(form.hukou_type, 'family')
+        self.assertFalse(form.has_family)
+        self.assertEqual(form.family_members, ())
+        self.assertIsNone(form.tax_payment)
+
+    def test_family_members_json_string(self):
+        """字符串形式的家庭成员列表在解析时转换"""
+        form = ApplicationForm({'applicationType': 'FAMILY',
+                                'familyMembers': '[{"name": "张三", "identityType": "STUDENT"}]'})
+        self.assertEqual(form.family_members[0]['name'], '张三')
+        self.assertEqual(form.to_dict()['familyMembers'], [{'name': '张三', 'identityType': 'STUDENT'}])
+        json.dumps(form.to_dict(), ensure_ascii=False)
+
+    def test_immutable_and_mapping(self):
+        """属性不可修改，映射接口读取原始字段"""
+        form = ApplicationForm({'orderNumber': 'A-1', 'identityType': 'EMPLOYED'})
+        with self.assertRaises(AttributeError):
+            form.identity_type = 'STUDENT'
+        with self.assertRaises(TypeError):
+            form['orderNumber'] = 'B-2'
+        self.assertEqual(form.get('orderNumber'), 'A-1')
+        self.assertEqual(form.get('missing', 'x'), 'x')
+        self.assertIn('identityType', form)
+        self.assertIs(as_form(form), form)
+
+    def test_canonical_hash(self):
+        """含义相同的表单哈希相同，含义不同的表单哈希不同"""
+        first = ApplicationForm({'residenceConsulate': 'beijing', 'visaType': 'THREE', 'economicMaterial': 'credit_card'})
+        second = ApplicationForm({'residenceConsulate': 'BEIJING', 'visaDuration': 'three', 'economicMaterial': 'creditCard'})
+        third = ApplicationForm({'residenceConsulate': 'beijing', 'visaType': 'FIVE', 'economicMaterial': 'credit_card'})
+        self.assertEqual(first.canonical_hash(), second.canonical_hash())
+        self.assertEqual(first, second)
+        self.assertEqual(len({first, second}), 1)
+        self.assertNotEqual(first.canonical_hash(), third.canonical_hash())
+        self.assertNotEqual(first.canonical_hash(),
+                            ApplicationForm(dict(first, orderNumber='A-1')).canonical_hash())
+
+    def test_family_profile(self):
+        """家庭成员索引一次计算身份人数和需要居住证明的成员"""
+        form = ApplicationForm({'applicationType': 'FAMILY', 'familyMembers': [
+            {'name': '张三', 'identityType': 'STUDENT', 'residenceConsulate': 'Beijing', 'hukouConsulate': 'shanghai'},
+            'bad-member',
+            {'identityType': 'RETIRED', 'residenceConsulate': 'shanghai', 'hukouConsulate': 'SHANGHAI'},
+            {'name': '李四', 'identityType': 'CHILD', 'residenceConsulate': '', 'hukouConsulate': 'beijing'},
+        ]})
+        profile = form.family_profile
+        self.assertEqual(len(profile), 3)
+        self.assertEqual([member.name for member in profile.members], ['张三', '家庭成员3', '李四'])
+        self.assertEqual(profile.residence_proof_names, ('张三',))
+        self.assertEqual(profile.identity_counts['RETIRED'], 1)
+        self.assertTrue(profile.has_identity('FREELANCER', 'RETIRED'))
+        self.assertFalse(profile.has_identity('FREELANCER', 'FREELANCE'))
+        self.assertEqual([member.name for member in profile.with_identity('STUDENT', 'CHILD')], ['张三', '李四'])
+        # 索引由成员列表推导，不影响规范化哈希
+        self.assertEqual(form, ApplicationForm(form.to_dict()))
+
+    def test_large_family_generation(self):
+        """成员较多的家庭申请材料清单与逐个成员生成的结果一致"""
+        members = [{'name': f'成员{i}', 'identityType': ('STUDENT', 'CHILD', 'RETIRED', 'EMPLOYED')[i % 4],
+                    'residenceConsulate': 'beijing', 'hukouConsulate': ('beijing', 'shanghai')[i % 2]}
+                   for i in range(200)]
+        form = ApplicationForm({'applicationType': 'FAMILY', 'residenceConsulate': 'beijing',
+                                'hukouConsulate': 'beijing', 'identityType': 'EMPLOYED', 'familyMembers': members})
+        generator = DocumentGenerator(self.config, precompile=False)
+        document_list = generator.generate_document_list(form)
+        expected_names = ', '.join(member['name'] for member in members if member['hukouConsulate'] == 'shanghai')
+        self.assertTrue(document_list['居住证明材料'][0].startswith(expected_names + '需要提供'))
+        self.assertEqual(len(document_list['家属材料']), 2 + 100)
+        self.assertTrue(document_list['家属材料'][-1].startswith('102. 成员197'))
+        self.assertTrue(any('退休人员' in item for item in document_list['其他材料']))
+
+    def test_risk_assessment_aliases(self):
+        """风险评估读取解析后的别名字段"""
+        service = RiskAssessmentService({})
+        result = service.assess_risk(ApplicationForm({
+            'identityType': 'EMPLOYED', 'education': 'BACHELOR', 'tax_payment': 'PAID',
+            'insurance': 'PAID', 'passport_status': 'OLD', 'hukou': 'LOCAL',
+            'has_tax_stamp': 'true', 'job_change_frequent': True,
+        }))
+        self.assertEqual(result['risk_factors'], [])
+        self.assertIn('社保缴纳证明', result['additional_materials'])
+        self.assertTrue(result['is_high_risk'])
+
+
+if __name__ == '__main__':
+    unittest.main()
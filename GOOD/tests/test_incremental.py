@@ -0,0 +1,88 @@
+"""
+测试增量生成
+"""
+import unittest
+import json
+import os
+import sys
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from document_generator.main import DocumentGenerator
+from document_generator.form import ApplicationForm, TrackingForm
+from document_generator.decision_table import enumerate_forms
+from document_generator.incremental import IncrementalStore, apply_changes, diff_sections
+
+
+class TestIncremental(unittest.TestCase):
+    """测试字段依赖追踪和增量生成"""
+
+    @classmethod
+    def setUpClass(cls):
+        config_path = os.path.join(os.path.dirname(__file__), '..', 'static', 'js', 'document_config.json')
+        with open(config_path, 'r', encoding='utf-8') as f:
+            cls.generator = DocumentGenerator(json.load(f))
+        cls.form = ApplicationForm({
+            'residenceConsulate': 'beijing', 'hukouConsulate': 'shanghai', 'identityType': 'EMPLOYED',
+            'processType': 'NORMAL', 'applicationType': 'FAMILY', 'visaType': 'THREE', 'economicMaterial': 'creditCard',
+            'familyMembers': [{'name': '张三', 'identityType': 'STUDENT'}],
+        })
+
+    def test_tracking_form_records_reads(self):
+        """TrackingForm记录读取的属性和原始字段，不重新解析表单"""
+        tracking = TrackingForm(self.form)
+        self.assertEqual(tracking.identity_type, 'EMPLOYED')
+        tracking.get('applicantName')
+        self.assertEqual(tracking.reads, {'identity_type', 'raw:applicantName'})
+        self.assertIs(tracking.family_members, self.form.family_members)
+        self.assertEqual(tracking.canonical_hash(), self.form.canonical_hash())
+
+    def test_traced_matches_full_generation(self):
+        """追踪生成的结果与决策表查找的结果一致"""
+        for index, form_data in enumerate(enumerate_forms()):
+            if index % 97:
+                continue
+            self.assertEqual(list(self.generator.generate_traced(form_data).document_list.items()),
+                             list(self.generator.generate_document_list(form_data).items()))
+
+    def test_only_dependent_steps_recomputed(self):
+        """只重新执行读取了已修改字段的步骤"""
+        previous = self.generator.generate_traced(self.form)
+        cases = [
+            ({'visaType': 'FIVE'}, ('basic_info', 'financial')),
+            ({'economicMaterial': 'depositThree'}, ('financial',)),
+            ({'familyMembers': [{'name': '李四', 'identityType': 'RETIRED'}]}, ('residence', 'family', 'other')),
+            ({'applicantName': '王五'}, ()),
+        ]
+        for changes, expected in cases:
+            form = apply_changes(previous.form, changes)
+            traced = self.generator.generate_traced(form, previous)
+            self.assertEqual(traced.recomputed, expected, changes)
+            self.assertEqual(list(traced.document_list.items()),
+                             list(self.generator.generate_document_list(form).items()))
+
+    def test_section_diff(self):
+        """按材料部分计算差异"""
+        old = {'基本信息': ['a'], '家属材料': ['b'], '其他材料': ['c']}
+        new = {'基本信息': ['a2'], '其他材料': ['c'], '财力证明': ['d']}
+        diff = diff_sections(old, new)
+        self.assertEqual(dict(diff['changed']), {'基本信息': ['a2'], '财力证明': ['d']})
+        self.assertEqual(diff['removed'], ['家属材料'])
+        self.assertEqual(diff['order'], ['基本信息', '其他材料', '财力证明'])
+
+    def test_store_keeps_traced_result(self):
+        """保存了追踪结果的令牌不会被表单覆盖，超出上限时淘汰最久未使用的令牌"""
+        store = IncrementalStore(max_entries=2)
+        traced = self.generator.generate_traced(self.form)
+        store.put('a', traced)
+        store.put('a', self.form)
+        self.assertIs(store.get('a'), traced)
+        store.put('b', self.form)
+        store.put('c', self.form)
+        self.assertIsNone(store.get('a'))
+        self.assertEqual(len(store), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
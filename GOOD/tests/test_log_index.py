@@ -0,0 +1,171 @@
+"""
+测试日志索引
+"""
+import unittest
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from document_generator.log_index import LogIndex, parse_line, parse_time, read_record
+
+LEGACY_LINES = [
+    '2025-04-28 17:26:28,784 - app - INFO - 收到材料清单生成请求: {"residence": "shanghai", "hukou": "beijing", '
+    '"applicationType": "SINGLE", "visaType": "THREE", "processType": "NORMAL"}',
+    "2025-04-28 17:26:28,785 - document_generator.main - DEBUG - 生成的材料清单: OrderedDict({'基本信息': "
+    "['居住地领区: 上海'], '居住证明材料': ['户口本复印件'], '其他材料': ['机票预订单']})",
+    '2025-04-28 17:26:29,001 - werkzeug - INFO - 127.0.0.1 - - "POST /api/generate HTTP/1.1" 200 -',
+    "2025-04-28 17:26:35,543 - app - DEBUG - 收到PDF生成请求，原始表单数据: {'residenceConsulate': 'beijing', "
+    "'hukouConsulate': 'beijing', 'identityType': 'RETIRED', 'applicationType': 'SINGLE'}",
+]
+
+
+def json_line(ts, category, data):
+    return json.dumps({'ts': ts, 'level': 'DEBUG', 'logger': 'good.dump', 'message': '明细',
+                       'category': category, 'data': data}, ensure_ascii=False)
+
+
+def summary_line(ts, kind, summary, request_id=None, thread='Thread-1'):
+    message = {'generate': '收到材料清单生成请求: ', 'pdf': '收到PDF生成请求: '}[kind]
+    return json.dumps({'ts': ts, 'level': 'INFO', 'logger': 'app', 'message': message + json.dumps(summary),
+                       'pid': 100, 'thread': thread, 'request_id': request_id}, ensure_ascii=False)
+
+
+def detail_line(ts, category, data, request_id=None, thread='Thread-1'):
+    record = json.loads(json_line(ts, category, data))
+    record.update(pid=100, thread=thread, request_id=request_id)
+    return json.dumps(record, ensure_ascii=False)
+
+
+def family_dump(ts, identities, sections):
+    return json_line(ts, 'generate_request', {
+        'request': {'residence': 'beijing', 'hukou': 'beijing', 'applicationType': 'FAMILY',
+                    'identityType': identities[0], 'familyIdentities': identities[1:]},
+        'sections': sections,
+    })
+
+
+class TestLogIndex(unittest.TestCase):
+    """测试LogIndex"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'app_log.txt')
+        self.index = LogIndex(os.path.join(self.tmpdir, 'index.sqlite3'))
+
+    def tearDown(self):
+        self.index.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _append(self, lines, mode='a'):
+        with open(self.path, mode, encoding='utf-8') as f:
+            f.write(''.join(line + '\n' for line in lines))
+
+    def test_legacy_text_format(self):
+        """旧版文本日志：材料清单补充到前一个请求，可以按偏移量读回原始行"""
+        self._append(LEGACY_LINES)
+        self.assertEqual(self.index.update(self.path), 2)
+        events = self.index.query(section='居住证明材料', residence='Shanghai', hukou='beijing')
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['kind'], 'generate')
+        self.assertEqual(events[0]['ts'], '2025-04-28T17:26:28.784')
+        self.assertEqual(read_record(events[0]), LEGACY_LINES[0])
+        pdf = self.index.query(kind='pdf')[0]
+        self.assertEqual((pdf['residence'], pdf['identities'], pdf['sections']), ('beijing', '|RETIRED|', None))
+        self.assertIsNone(parse_line(LEGACY_LINES[2]))
+
+    def test_incremental_update(self):
+        """再次运行只读取新增的完整行"""
+        self._append([family_dump('2025-05-01T10:00:00.000', ['EMPLOYED', 'FREELANCER'], ['基本信息'])])
+        self.assertEqual(self.index.update(self.path), 1)
+        # 还没写完的行等下次运行
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(family_dump('2025-05-08T10:00:00.000', ['FREELANCER'], ['基本信息'])[:40])
+        self.assertEqual(self.index.update(self.path), 0)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(family_dump('2025-05-08T10:00:00.000', ['FREELANCER'], ['基本信息'])[40:] + '\n')
+        self._append([family_dump('2025-05-09T10:00:00.000', ['EMPLOYED', 'STUDENT'], ['基本信息'])])
+        self.assertEqual(self.index.update(self.path), 2)
+        self.assertEqual(self.index.update(self.path), 0)
+
+        # 最近一周有自由职业者的家庭申请
+        since = parse_time('7d', now=datetime.datetime(2025, 5, 10))
+        events = self.index.query(since=since, application_type='FAMILY', identity='FREELANCER')
+        self.assertEqual([event['ts'] for event in events], ['2025-05-08T10:00:00.000'])
+        self.assertEqual(len(self.index.query(identity='FREELANCER')), 2)
+        self.assertEqual(parse_time('2025-05-01 08:00'), '2025-05-01T08:00:00.000')
+
+    def test_one_event_per_request(self):
+        """抽样的明细合并到同一请求的摘要中，每个请求只计一次；找不到摘要的明细单独计入"""
+        summary = {'residence': 'beijing', 'hukou': 'beijing', 'applicationType': 'SINGLE',
+                   'identityType': 'EMPLOYED', 'sections': ['基本信息', '居住证明材料']}
+        lines = [
+            summary_line('2025-05-01T10:00:00.000', 'generate', summary, 'r1', thread='Thread-1'),
+            summary_line('2025-05-01T10:00:00.100', 'generate', summary, 'r2', thread='Thread-2'),
+            # 其他线程的请求交错写入
+            detail_line('2025-05-01T10:00:00.200', 'generate_request', {'request': summary, 'sections': ['基本信息']},
+                        'r1', thread='Thread-1'),
+            summary_line('2025-05-01T10:00:01.000', 'pdf', summary, 'r3', thread='Thread-2'),
+            detail_line('2025-05-01T10:00:01.100', 'pdf_request', {'form': {}, 'document_list': {}},
+                        'r3', thread='Thread-2'),
+        ]
+        self._append(lines)
+        self.assertEqual(self.index.update(self.path), 3)
+        events = self.index.query(section='居住证明材料')
+        self.assertEqual([(event['kind'], event['request_id']) for event in events],
+                         [('pdf', 'r3'), ('generate', 'r2'), ('generate', 'r1')])
+        self.assertEqual(read_record(events[2], detail=True), lines[2])
+        self.assertIsNone(read_record(events[1], detail=True))
+
+        # 之后一次运行读到的明细合并到已写入的摘要；没有摘要的明细单独计入
+        self._append([
+            detail_line('2025-05-01T10:00:00.300', 'generate_request', {'request': summary, 'sections': []},
+                        'r2', thread='Thread-2'),
+            detail_line('2025-05-01T10:00:02.000', 'pdf_request', {'form': {}, 'document_list': {'基本信息': []}},
+                        'r4', thread='Thread-3'),
+        ])
+        self.assertEqual(self.index.update(self.path), 1)
+        self.assertEqual(self.index.stats()['kinds'], {'generate': 2, 'pdf': 1, 'pdf_request': 1})
+        self.assertIsNotNone(self.index.query(kind='generate')[0]['detail_offset'])
+
+    def test_rotated_file_keeps_history(self):
+        """文件被轮转（改名后写新文件）后原有记录保留并指向新路径，新文件单独建立索引"""
+        self._append(LEGACY_LINES)
+        self.index.update(self.path)
+        os.rename(self.path, self.path + '.1')
+        self._append([json_line('2025-05-02T09:00:00.000', 'pdf_request', {
+            'form': {'residenceConsulate': 'shanghai', 'hukouConsulate': 'beijing', 'applicationType': 'SINGLE',
+                     'identityType': 'EMPLOYED'},
+            'document_list': {'基本信息': [], '居住证明材料': []},
+        })], mode='w')
+        self.assertEqual(self.index.update(self.path), 1)
+        events = self.index.query()
+        self.assertEqual([(event['kind'], event['sections']) for event in events],
+                         [('pdf_request', '|基本信息|居住证明材料|'), ('pdf', None),
+                          ('generate', '|基本信息|居住证明材料|其他材料|')])
+        self.assertEqual(read_record(events[2]), LEGACY_LINES[0])
+        # 轮转后的文件已经索引过，不重复计入
+        self.assertEqual(self.index.update(self.path + '.1'), 0)
+        self.assertEqual(self.index.stats()['kinds'], {'generate': 1, 'pdf': 1, 'pdf_request': 1})
+
+        # 轮转后的文件被删除后记录仍然保留，只是不能读取原文
+        os.remove(self.path + '.1')
+        os.rename(self.path, self.path + '.1')
+        self._append(LEGACY_LINES[:1], mode='w')
+        self.assertEqual(self.index.update(self.path), 1)
+        self.assertEqual(self.index.stats()['kinds'], {'generate': 2, 'pdf': 1, 'pdf_request': 1})
+        self.assertIsNone(read_record(self.index.query(kind='pdf')[0]))
+        self.assertEqual(read_record(self.index.query(kind='pdf_request')[0])[:1], '{')
+
+        # 原地截断后重写（inode不变）时原来的内容已经不存在，重新建立该文件的索引
+        self._append(LEGACY_LINES[3:], mode='w')
+        self.assertEqual(self.index.update(self.path), 1)
+        self.assertEqual(self.index.stats()['kinds'], {'generate': 1, 'pdf': 2, 'pdf_request': 1})
+
+if __name__ == '__main__':
+    unittest.main()
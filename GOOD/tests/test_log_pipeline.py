@@ -0,0 +1,126 @@
+"""
+测试日志队列和JSON日志
+"""
+import unittest
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from document_generator.log_pipeline import (
+    LogPipeline, CategorySampler, JsonFormatter, parse_sample_every, resolve_log_path, _file_handler
+)
+
+
+class TestLogPipeline(unittest.TestCase):
+    """测试LogPipeline"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'app_log.txt')
+        file_handler = _file_handler(self.path, rotate_bytes=0, rotate_when=None, backup_count=2)
+        file_handler.setFormatter(JsonFormatter())
+        self.pipeline = LogPipeline((file_handler,), CategorySampler({'pdf_request': 3}), queue_size=4)
+        self.logger = logging.getLogger('tests.log_pipeline')
+        self.logger.propagate = False
+        self.logger.setLevel(logging.DEBUG)
+        self.logger.addHandler(self.pipeline.handler)
+
+    def tearDown(self):
+        self.pipeline.stop()
+        self.logger.removeHandler(self.pipeline.handler)
+        for handler in self.pipeline.handlers:
+            handler.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _lines(self):
+        self.pipeline.stop()
+        with open(self.path, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    def test_json_lines(self):
+        """后台线程写入JSON行，extra字段和异常信息作为独立字段"""
+        self.pipeline.start()
+        items = ['护照原件']
+        self.logger.info("材料: %s", items, extra={'category': 'pdf_request'})
+        # 放入队列后修改参数不影响已记录的内容
+        items.append('额外材料')
+        try:
+            raise ValueError('测试异常')
+        except ValueError:
+            self.logger.error("出错: %s", 'x', exc_info=True)
+        lines = self._lines()
+        self.assertEqual(lines[0]['message'], "材料: ['护照原件']")
+        self.assertEqual(lines[0]['category'], 'pdf_request')
+        self.assertEqual(lines[0]['logger'], 'tests.log_pipeline')
+        self.assertEqual(lines[1]['level'], 'ERROR')
+        self.assertIn('ValueError: 测试异常', lines[1]['exc'])
+
+    def test_full_queue_drops(self):
+        """队列满时丢弃日志而不阻塞，之后补一条丢弃数量的警告"""
+        for i in range(6):
+            self.logger.info("日志%d", i)
+        self.assertEqual(self.pipeline.handler.dropped, 2)
+        self.pipeline.start()
+        self.pipeline.stop()
+        self.pipeline.start()
+        self.logger.info("恢复")
+        messages = [line['message'] for line in self._lines()]
+        self.assertEqual(messages[:4], ['日志0', '日志1', '日志2', '日志3'])
+        self.assertEqual(messages[4:], ['恢复', '日志队列已满，丢弃了2条日志'])
+
+    def test_sampler(self):
+        """按类别每N次记录一次，未配置的类别全部记录"""
+        sampler = self.pipeline.sampler
+        self.assertEqual([sampler.sample('pdf_request') for _ in range(6)], [True, False, False] * 2)
+        self.assertTrue(all(sampler.sample('generate_request') for _ in range(3)))
+        self.assertFalse(CategorySampler({'x': 0}).sample('x'))
+        self.assertEqual(parse_sample_every('pdf_request=100, generate_request=10,bad=x,,'),
+                         {'pdf_request': 100, 'generate_request': 10})
+
+    def test_rotation(self):
+        """按大小轮转"""
+        handler = _file_handler(os.path.join(self.tmpdir, 'rotate.txt'), rotate_bytes=200, rotate_when=None,
+                                backup_count=2)
+        handler.setFormatter(JsonFormatter())
+        record = logging.LogRecord('tests', logging.INFO, __file__, 0, 'x' * 100, (), None)
+        for _ in range(5):
+            handler.emit(record)
+        handler.close()
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, 'rotate.txt.2')))
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'rotate.txt.3')))
+
+    def test_resolve_log_path(self):
+        """{pid}替换为进程号；fork出的子进程在没有{pid}时也使用自己的文件"""
+        self.assertEqual(resolve_log_path('logs/app_{pid}.txt', 42), 'logs/app_42.txt')
+        self.assertEqual(resolve_log_path('logs/app_{pid}.txt', 42, own_file=True), 'logs/app_42.txt')
+        self.assertEqual(resolve_log_path('logs/app_log.txt', 42), 'logs/app_log.txt')
+        self.assertEqual(resolve_log_path('logs/app_log.txt', 42, own_file=True), 'logs/app_log.42.txt')
+
+    def test_restart_after_fork_reopens_file(self):
+        """fork后的子进程改为写入自己的文件，不再写父进程的文件"""
+        child_path = os.path.join(self.tmpdir, 'child_log.txt')
+
+        def child_handlers():
+            handler = _file_handler(child_path, rotate_bytes=0, rotate_when=None, backup_count=2)
+            handler.setFormatter(JsonFormatter())
+            return (handler,)
+
+        self.pipeline.child_handlers = child_handlers
+        parent_handler = self.pipeline.handlers[0]
+        self.pipeline.restart_after_fork()
+        self.logger.info("子进程日志")
+        self.pipeline.stop()
+        self.assertIsNone(parent_handler.stream)
+        self.assertFalse(os.path.exists(self.path))
+        with open(child_path, 'r', encoding='utf-8') as f:
+            self.assertEqual(json.loads(f.readline())['message'], "子进程日志")
+
+
+if __name__ == '__main__':
+    unittest.main()
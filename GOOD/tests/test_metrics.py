@@ -0,0 +1,105 @@
+"""
+测试运行指标
+"""
+import unittest
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from document_generator.metrics import MetricsRegistry, LATENCY_BUCKETS, EXITED_FILE
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    """测试MetricsRegistry"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.registry = MetricsRegistry()
+        self.registry.configure(self.tmpdir, interval=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _write_other_process(self, pid, counters=(), histograms=(), gauges=(), start=None):
+        path = os.path.join(self.tmpdir, f'{pid}-1.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'pid': pid, 'start': start, 'written_at': 0, 'counters': list(counters),
+                       'histograms': list(histograms), 'gauges': list(gauges)}, f)
+        return path
+
+    def test_render_prometheus_text(self):
+        """计数器、直方图和仪表值按Prometheus文本格式输出"""
+        self.registry.inc('good_http_requests_total', route='/api/generate', method='POST', status=200)
+        self.registry.observe('good_http_request_duration_seconds', 0.02, route='/api/generate')
+        self.registry.observe('good_http_request_duration_seconds', 100, route='/api/generate')
+        with self.registry.in_flight('good_pdf_renders_in_flight'):
+            text = self.registry.render()
+        self.assertIn('# TYPE good_http_requests_total counter', text)
+        self.assertIn('good_http_requests_total{method="POST",route="/api/generate",status="200"} 1', text)
+        self.assertIn('good_http_request_duration_seconds_bucket{route="/api/generate",le="0.025"} 1', text)
+        self.assertIn('good_http_request_duration_seconds_bucket{route="/api/generate",le="+Inf"} 2', text)
+        self.assertIn('good_http_request_duration_seconds_count{route="/api/generate"} 2', text)
+        self.assertIn('good_pdf_renders_in_flight 1', text)
+        self.assertIn('good_pdf_renders_in_flight 0', self.registry.render())
+
+    def test_merge_processes(self):
+        """合并其他进程的文件；已退出进程的仪表值不统计"""
+        buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        buckets[0] = 3
+        dead_pid = 2 ** 22 + 12345
+        dead_path = self._write_other_process(
+            dead_pid,
+            counters=[['good_http_requests_total', [['method', 'GET'], ['route', '/'], ['status', '200']], 4]],
+            histograms=[['good_pdf_render_duration_seconds', [['backend', 'weasyprint'], ['outcome', 'success']],
+                         buckets, 0.003, 3]],
+            gauges=[['good_pdf_renders_in_flight', [], 5]])
+        self.registry.inc('good_http_requests_total', method='GET', route='/', status=200)
+        self.registry.observe('good_pdf_render_duration_seconds', 0.5, backend='weasyprint', outcome='success')
+
+        merged = self.registry.collect()
+        self.assertEqual(merged['good_http_requests_total'][(('method', 'GET'), ('route', '/'), ('status', '200'))], 5)
+        counts, total, count = merged['good_pdf_render_duration_seconds'][(('backend', 'weasyprint'), ('outcome', 'success'))]
+        self.assertEqual(count, 4)
+        self.assertEqual(counts[0], 3)
+        self.assertAlmostEqual(total, 0.503)
+        self.assertNotIn('good_pdf_renders_in_flight', merged)
+        self.assertTrue(os.path.exists(self.registry.path))
+
+        # 已退出进程的文件合并到EXITED_FILE后删除，再次读取时计数不变
+        self.assertFalse(os.path.exists(dead_path))
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir, EXITED_FILE)))
+        merged = self.registry.collect()
+        self.assertEqual(merged['good_http_requests_total'][(('method', 'GET'), ('route', '/'), ('status', '200'))], 5)
+        self.assertEqual(merged['good_pdf_render_duration_seconds'][(('backend', 'weasyprint'), ('outcome', 'success'))][2], 4)
+
+    def test_reused_pid_is_exited(self):
+        """进程号存在但启动时间不同（进程号被新进程重用）时视为已退出"""
+        if self.registry.snapshot()['start'] is None:
+            self.skipTest('无法读取进程启动时间')
+        parent = os.getppid()
+        self._write_other_process(parent, counters=[['good_jobs_total', [], 1]],
+                                  gauges=[['good_pdf_renders_in_flight', [], 2]], start=1)
+        merged = self.registry.collect()
+        self.assertEqual(merged['good_jobs_total'][()], 1)
+        self.assertNotIn('good_pdf_renders_in_flight', merged)
+        self.assertEqual(sorted(os.listdir(self.tmpdir)),
+                         sorted([EXITED_FILE, EXITED_FILE + '.lock', os.path.basename(self.registry.path)]))
+
+    def test_cache_hit_ratio_from_collectors(self):
+        """缓存命中率由所有进程的缓存查询次数计算"""
+        stats = {'memory_hits': 2, 'disk_hits': 1, 'misses': 1}
+        self.registry.add_collector(lambda: [
+            ('good_cache_requests_total', {'cache': 'pdf', 'result': result}, stats[key])
+            for result, key in (('memory_hit', 'memory_hits'), ('disk_hit', 'disk_hits'), ('miss', 'misses'))])
+        self._write_other_process(os.getppid(), counters=[
+            ['good_cache_requests_total', [['cache', 'pdf'], ['result', 'miss']], 4]])
+        self.assertIn('good_cache_hit_ratio{cache="pdf"} 0.375', self.registry.render())
+
+
+if __name__ == '__main__':
+    unittest.main()
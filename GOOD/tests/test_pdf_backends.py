@@ -0,0 +1,128 @@
+"""
+测试PDF渲染后端注册表和熔断器
+"""
+import unittest
+import os
+import sys
+from unittest import mock
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from document_generator.pdf_backends import (
+    BackendRegistry, PDFBackend, STATE_CLOSED, STATE_OPEN, STATE_HALF_OPEN, STATE_UNAVAILABLE
+)
+
+
+class _FakeBackend(PDFBackend):
+    """测试用渲染后端"""
+
+    def __init__(self, name, probe_ok=True):
+        self.name = name
+        self.probe_ok = probe_ok
+
+    def probe(self):
+        if not self.probe_ok:
+            raise RuntimeError("probe failed")
+
+    def render(self, html_content, html_path=None):
+        return b'%PDF'
+
+
+class TestBackendRegistry(unittest.TestCase):
+    """测试渲染后端注册表"""
+
+    def setUp(self):
+        # 重新探测单独测试，其他测试中不可用的后端保持不可用
+        self.registry = BackendRegistry(failure_threshold=2, reset_timeout=10, reprobe_interval=0)
+        self.registry.register(_FakeBackend('primary'))
+        self.registry.register(_FakeBackend('secondary'))
+        self.registry.register(_FakeBackend('missing', probe_ok=False))
+        self.registry.probe_all()
+
+    def _states(self):
+        return {item['name']: item['state'] for item in self.registry.status()}
+
+    def test_probe_marks_unavailable_backend(self):
+        """测试探测失败的后端不参与路由"""
+        self.assertEqual(self._states()['missing'], STATE_UNAVAILABLE)
+        self.assertEqual([b.name for b in self.registry.available()], ['primary', 'secondary'])
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        """测试连续失败后熔断器打开，请求直接路由到健康后端"""
+        self.registry.record_failure('primary', 0.1, 'boom')
+        self.assertEqual(self._states()['primary'], STATE_CLOSED)
+        self.registry.record_failure('primary', 0.1, 'boom')
+        self.assertEqual(self._states()['primary'], STATE_OPEN)
+        self.assertEqual([b.name for b in self.registry.available()], ['secondary'])
+
+    def test_half_open_trial_closes_circuit(self):
+        """测试冷却时间后允许一次试探请求，成功后熔断器关闭"""
+        self.registry.record_failure('primary', 0.1, 'boom')
+        self.registry.record_failure('primary', 0.1, 'boom')
+
+        with mock.patch('document_generator.pdf_backends.time.monotonic', return_value=1e12):
+            backends = self.registry.available()
+            self.assertEqual([b.name for b in backends], ['primary', 'secondary'])
+            self.assertTrue(self.registry.acquire(backends[0]))
+            self.assertEqual(self._states()['primary'], STATE_HALF_OPEN)
+            # 试探请求进行中，其他请求不再路由到该后端
+            self.assertEqual([b.name for b in self.registry.available()], ['secondary'])
+            self.assertFalse(self.registry.acquire(backends[0]))
+
+        self.registry.record_success('primary', 0.05)
+        self.assertEqual(self._states()['primary'], STATE_CLOSED)
+
+    def test_listed_backend_stays_open_until_attempted(self):
+        """测试冷却后只被列出、没有被尝试的后端保持打开，之后仍然可以试探"""
+        self.registry.record_failure('secondary', 0.1, 'boom')
+        self.registry.record_failure('secondary', 0.1, 'boom')
+        with mock.patch('document_generator.pdf_backends.time.monotonic', return_value=1e12):
+            backends = self.registry.available()
+            self.assertEqual([b.name for b in backends], ['primary', 'secondary'])
+            # 优先级更高的后端成功，secondary没有被尝试
+            self.assertTrue(self.registry.acquire(backends[0]))
+            self.registry.record_success('primary', 0.05)
+            self.assertEqual(self._states()['secondary'], STATE_OPEN)
+            self.assertEqual([b.name for b in self.registry.available()], ['primary', 'secondary'])
+
+    def test_stale_half_open_trial_allows_new_trial(self):
+        """测试试探请求一直没有结果时，超过冷却时间后允许新的试探"""
+        self.registry.record_failure('primary', 0.1, 'boom')
+        self.registry.record_failure('primary', 0.1, 'boom')
+        primary = self.registry._backends[0]
+        with mock.patch('document_generator.pdf_backends.time.monotonic', return_value=1e12):
+            self.assertTrue(self.registry.acquire(primary))
+        with mock.patch('document_generator.pdf_backends.time.monotonic', return_value=1e12 + 11):
+            self.assertEqual([b.name for b in self.registry.available()], ['primary', 'secondary'])
+            self.assertTrue(self.registry.acquire(primary))
+
+    def test_unavailable_backend_is_reprobed(self):
+        """测试探测时不可用的后端到时间后重新探测，成功后恢复使用"""
+        registry = BackendRegistry(reprobe_interval=300)
+        missing = _FakeBackend('missing', probe_ok=False)
+        registry.register(missing)
+        registry.probe_all()
+        self.assertEqual(registry.available(), [])
+        with mock.patch('document_generator.pdf_backends.time.monotonic', return_value=1e12):
+            self.assertEqual(registry.available(), [missing])
+            self.assertFalse(registry.acquire(missing))
+            # 重新探测失败后，下一个间隔之前不再探测
+            self.assertEqual(registry.available(), [])
+        missing.probe_ok = True
+        with mock.patch('document_generator.pdf_backends.time.monotonic', return_value=1e12 + 301):
+            self.assertTrue(registry.acquire(missing))
+        self.assertEqual(registry.status()[0]['state'], STATE_CLOSED)
+
+    def test_status_reports_success_rate_and_latency(self):
+        """测试状态包含成功率和平均耗时"""
+        self.registry.record_success('secondary', 0.2)
+        self.registry.record_failure('secondary', 0.4, 'boom')
+        status = {item['name']: item for item in self.registry.status()}['secondary']
+        self.assertEqual(status['success_rate'], 0.5)
+        self.assertAlmostEqual(status['avg_latency_ms'], 300.0)
+        self.assertEqual(status['last_error'], 'boom')
+
+
+if __name__ == '__main__':
+    unittest.main()
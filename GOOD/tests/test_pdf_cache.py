@@ -0,0 +1,102 @@
+"""
+测试PDF两级缓存
+"""
+import unittest
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from document_generator.pdf_cache import PDFCache, make_cache_key
+
+
+class TestPDFCache(unittest.TestCase):
+    """测试PDF缓存"""
+
+    def setUp(self):
+        self.document_list = OrderedDict([('基本材料', ['护照原件', '签证申请表'])])
+        self.form_data = {
+            'visaType': 'SINGLE',
+            'identityType': 'EMPLOYED',
+            'residenceConsulate': 'beijing',
+            'applicationType': 'SINGLE'
+        }
+
+    def test_cache_key_ignores_non_display_fields(self):
+        """测试缓存键只依赖材料清单和显示字段"""
+        key = make_cache_key(self.document_list, self.form_data, '2024年01月01日')
+        form_with_extra = dict(self.form_data, economicMaterial='credit_card')
+        self.assertEqual(key, make_cache_key(self.document_list, form_with_extra, '2024年01月01日'))
+
+        form_urgent = dict(self.form_data, isUrgent=True)
+        self.assertNotEqual(key, make_cache_key(self.document_list, form_urgent, '2024年01月01日'))
+        self.assertNotEqual(key, make_cache_key(self.document_list, self.form_data, '2024年01月02日'))
+
+    def test_cache_key_parses_family_member_string(self):
+        """测试家庭成员JSON字符串和列表得到相同的缓存键"""
+        members = [{'relation': 'SPOUSE', 'identityType': 'RETIRED', 'number': 1}]
+        form_list = dict(self.form_data, applicationType='FAMILY', familyMembers=members)
+        form_str = dict(self.form_data, applicationType='FAMILY',
+                        familyMembers='[{"relation": "SPOUSE", "identityType": "RETIRED", "number": 2}]')
+        self.assertEqual(make_cache_key(self.document_list, form_list, 'd'),
+                         make_cache_key(self.document_list, form_str, 'd'))
+
+    def test_memory_lru_eviction(self):
+        """测试内存缓存按字节数淘汰最久未使用的条目"""
+        cache = PDFCache(memory_max_bytes=10, disk_dir=None)
+        cache.put('a', b'12345')
+        cache.put('b', b'12345')
+        self.assertEqual(cache.get('a'), b'12345')
+        cache.put('c', b'12345')
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'12345')
+        self.assertEqual(cache.get('c'), b'12345')
+
+    def test_disk_cache_shared_between_instances(self):
+        """测试磁盘缓存可被其他实例（工作进程）读取"""
+        disk_dir = tempfile.mkdtemp()
+        PDFCache(disk_dir=disk_dir).put('ab' * 32, b'%PDF')
+
+        other = PDFCache(disk_dir=disk_dir)
+        self.assertEqual(other.get('ab' * 32), b'%PDF')
+        self.assertEqual(other.stats()['disk_hits'], 1)
+        # 第二次读取命中内存层
+        other.get('ab' * 32)
+        self.assertEqual(other.stats()['memory_hits'], 1)
+
+    def test_disk_eviction(self):
+        """测试磁盘缓存超过上限时淘汰旧文件"""
+        disk_dir = tempfile.mkdtemp()
+        cache = PDFCache(memory_max_bytes=0, disk_dir=disk_dir, disk_max_bytes=100)
+        for i in range(5):
+            key = f"{i:02d}" + 'f' * 62
+            cache.put(key, b'x' * 40)
+            os.utime(cache._disk_path(key), (i, i))
+
+        self.assertLessEqual(cache.stats()['disk_bytes'], 100)
+        self.assertIsNotNone(cache.get('04' + 'f' * 62))
+        self.assertIsNone(cache.get('00' + 'f' * 62))
+
+    def test_disk_limit_shared_between_instances(self):
+        """测试多个实例（工作进程）写入同一目录时按目录总大小淘汰，重复写入同一个键不重复计数"""
+        disk_dir = tempfile.mkdtemp()
+        first = PDFCache(memory_max_bytes=0, disk_dir=disk_dir, disk_max_bytes=100, disk_rescan_interval=0)
+        second = PDFCache(memory_max_bytes=0, disk_dir=disk_dir, disk_max_bytes=100, disk_rescan_interval=0)
+        first.put('aa' * 32, b'x' * 40)
+        first.put('aa' * 32, b'x' * 40)
+        self.assertEqual(first.stats()['disk_bytes'], 40)
+
+        for i in range(4):
+            cache = first if i % 2 else second
+            cache.put(f"{i:02d}" + 'e' * 62, b'x' * 40)
+        total = sum(os.path.getsize(os.path.join(root, name))
+                    for root, _, files in os.walk(disk_dir) for name in files)
+        self.assertLessEqual(total, 100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,8 @@ import os
 import json
 import sys
 import tempfile
+import threading
+from unittest import mock
 
 # 添加项目根目录到Python路径
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -44,6 +46,25 @@ class TestPDFGenerator(unittest.TestCase):
         self.pdf_generator = PDFGenerator(self.config)
         self.document_generator = DocumentGenerator(self.config)
     
+    def test_warm_up_without_cjk_font_disables_weasyprint(self):
+        """测试预热时没有中文字体不抛出异常，只停用WeasyPrint后端"""
+        with mock.patch.object(PDFGenerator, '_has_cjk_font', return_value=False):
+            self.assertIsNone(self.pdf_generator.warm_up())
+        states = {item['name']: item['state'] for item in self.pdf_generator.get_backend_status()}
+        self.assertEqual(states['weasyprint'], 'unavailable')
+        self.assertEqual(states['weasyprint_file'], 'unavailable')
+        self.assertNotIn('weasyprint', [backend.name for backend in self.pdf_generator.backends.available()])
+
+    def test_render_resources_per_thread(self):
+        """测试字体配置和样式表在同一线程内复用，不同线程各用一份"""
+        resources = self.pdf_generator._render_resources()
+        self.assertIs(self.pdf_generator._render_resources(), resources)
+        other = []
+        thread = threading.Thread(target=lambda: other.append(self.pdf_generator._render_resources()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0][0], resources[0])
+
     def test_get_visa_type_display(self):
         """测试获取签证类型显示名称方法"""
         self.assertEqual(self.pdf_generator._get_visa_type_display('SINGLE'), '单次签证')
@@ -65,6 +86,28 @@ class TestPDFGenerator(unittest.TestCase):
         self.assertEqual(self.pdf_generator._get_consulate_display('shanghai'), '上海')
         self.assertEqual(self.pdf_generator._get_consulate_display('unknown'), 'unknown')  # 未知领区
     
+    def test_generate_html_from_template(self):
+        """测试PDF HTML由模板生成：用户输入被转义，表格单元格不再使用内联样式"""
+        document_list = {
+            "基本信息": ["不显示"],
+            "基本材料": ["护照原件"]
+        }
+        form_data = {
+            "applicationType": "FAMILY",
+            "orderNumber": "<A&1>",
+            "familyMembers": [{"relation": "SPOUSE", "identityType": "RETIRED",
+                               "residenceConsulate": "beijing", "hukouConsulate": "beijing"}]
+        }
+        html = self.pdf_generator._generate_enhanced_html(
+            document_list, "测试用户", "单次签证", "在职人员", "北京", "2024年01月01日", form_data)
+        
+        self.assertIn("&lt;A&amp;1&gt;", html)
+        self.assertIn("<li>护照原件</li>", html)
+        self.assertIn("家庭成员1", html)
+        self.assertIn("主申请人的配偶", html)
+        self.assertNotIn("不显示", html)
+        self.assertNotIn("style=", html)
+    
     def test_generate_pdf_simple(self):
         """测试简单的PDF生成功能"""
         # 准备测试数据
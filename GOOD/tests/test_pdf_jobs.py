@@ -0,0 +1,87 @@
+"""
+测试异步PDF任务表和后台工作线程
+"""
+import unittest
+import os
+import sys
+import tempfile
+import time
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from document_generator.pdf_jobs import (
+    PDFJobStore, PDFJobWorker, STATUS_PENDING, STATUS_RUNNING, STATUS_DONE, STATUS_FAILED
+)
+
+
+class TestPDFJobs(unittest.TestCase):
+    """测试PDF任务表"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = PDFJobStore(os.path.join(self.temp_dir.name, 'jobs.sqlite3'))
+        self.document_list = {"基本材料": ["护照原件"], "财力证明": ["银行存款证明"]}
+        self.form_data = {"applicationType": "SINGLE", "visaType": "SINGLE"}
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_claim_and_complete(self):
+        """测试领取任务后保存PDF，任务只能被领取一次"""
+        job_id = self.store.create(self.document_list, self.form_data)
+        self.assertEqual(self.store.get(job_id)['status'], STATUS_PENDING)
+
+        job = self.store.claim('worker-1')
+        self.assertEqual(job['id'], job_id)
+        self.assertEqual(list(job['document_list'].keys()), ["基本材料", "财力证明"])
+        self.assertEqual(job['form_data'], self.form_data)
+        self.assertEqual(self.store.get(job_id)['status'], STATUS_RUNNING)
+        self.assertIsNone(self.store.claim('worker-2'))
+
+        self.store.complete(job_id, b'%PDF')
+        job = self.store.get(job_id, include_pdf=True)
+        self.assertEqual(job['status'], STATUS_DONE)
+        self.assertEqual(job['pdf'], b'%PDF')
+
+    def test_expired_lease_is_reclaimed(self):
+        """测试租约过期的处理中任务可以被其他工作线程重新领取"""
+        store = PDFJobStore(self.store.db_path, lease_timeout=0, max_attempts=2)
+        job_id = store.create(self.document_list, self.form_data)
+        self.assertEqual(store.claim('worker-1')['id'], job_id)
+        time.sleep(0.01)
+        self.assertEqual(store.claim('worker-2')['id'], job_id)
+        time.sleep(0.01)
+        # 超过最大尝试次数后标记为失败
+        self.assertIsNone(store.claim('worker-3'))
+        self.assertEqual(store.get(job_id)['status'], STATUS_FAILED)
+
+    def test_worker_renders_jobs(self):
+        """测试后台工作线程渲染任务并记录失败"""
+        def render(document_list, form_data):
+            if form_data.get('fail'):
+                raise RuntimeError("render failed")
+            return b'%PDF'
+
+        worker = PDFJobWorker(self.store, render, threads=1, poll_interval=0.05)
+        worker.start()
+        try:
+            ok_id = self.store.create(self.document_list, self.form_data)
+            failed_id = self.store.create(self.document_list, {"fail": True})
+            worker.notify()
+            deadline = time.time() + 5
+            while time.time() < deadline:
+                if self.store.get(failed_id)['status'] == STATUS_FAILED:
+                    break
+                time.sleep(0.02)
+        finally:
+            worker.stop(timeout=5)
+
+        self.assertEqual(self.store.get(ok_id)['status'], STATUS_DONE)
+        failed = self.store.get(failed_id)
+        self.assertEqual(failed['status'], STATUS_FAILED)
+        self.assertEqual(failed['error'], "render failed")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+测试PDF渲染服务的消息协议和客户端
+"""
+import unittest
+import os
+import sys
+import socket
+import tempfile
+import threading
+import time
+from unittest import mock
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from document_generator.render_service import (
+    RenderServer, RenderServiceClient, RenderServiceError, send_message, recv_message
+)
+
+
+def _crash_in_worker(*args):
+    """模拟渲染时渲染进程崩溃"""
+    os._exit(1)
+
+
+class TestRenderService(unittest.TestCase):
+    """测试渲染服务"""
+
+    def test_message_round_trip(self):
+        """测试消息头和二进制负载的收发"""
+        left, right = socket.socketpair()
+        try:
+            send_message(left, {'op': 'render', 'form_data': {'name': '测试'}}, b'%PDF-1.7')
+            header, payload = recv_message(right)
+        finally:
+            left.close()
+            right.close()
+
+        self.assertEqual(header['form_data']['name'], '测试')
+        self.assertEqual(payload, b'%PDF-1.7')
+
+    def test_client_without_service(self):
+        """测试渲染服务不可用时客户端抛出RenderServiceError"""
+        client = RenderServiceClient(os.path.join(tempfile.gettempdir(), 'missing_render.sock'), timeout=1)
+        self.assertFalse(client.ping())
+        with self.assertRaises(RenderServiceError):
+            client.generate_pdf({'基本材料': ['护照原件']}, {})
+
+    def test_ping_running_service(self):
+        """测试客户端可以连接运行中的渲染服务"""
+        socket_path = os.path.join(tempfile.mkdtemp(), 'render.sock')
+        server = RenderServer(socket_path, workers=1, check_workers=False)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            self.assertTrue(RenderServiceClient(socket_path, timeout=5).ping())
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_worker_crash_returns_error(self):
+        """测试渲染进程崩溃时请求在限定时间内返回错误，服务继续可用"""
+        socket_path = os.path.join(tempfile.mkdtemp(), 'render.sock')
+        with mock.patch('document_generator.render_service._render_in_worker', _crash_in_worker):
+            server = RenderServer(socket_path, workers=1, check_workers=False, render_timeout=1)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                client = RenderServiceClient(socket_path, timeout=10)
+                start = time.monotonic()
+                with self.assertRaisesRegex(RenderServiceError, '超时'):
+                    client.generate_pdf({'基本材料': ['护照原件']}, {})
+                self.assertLess(time.monotonic() - start, 5)
+                self.assertTrue(client.ping())
+            finally:
+                server.shutdown()
+                server.server_close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+"""
+测试请求追踪
+"""
+import unittest
+import json
+import logging
+import os
+import sys
+import threading
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from document_generator.request_trace import (
+    RequestTracer, RequestIdFilter, span, collect, attach, current_request_id, current_trace
+)
+from document_generator.main import DocumentGenerator
+
+
+class TestRequestTrace(unittest.TestCase):
+    """测试RequestTracer和span"""
+
+    def setUp(self):
+        self.tracer = RequestTracer(enabled=True, slow_ms=0, recent_size=2)
+
+    def test_nested_spans_and_server_timing(self):
+        """区段按调用嵌套，同名区段在Server-Timing中累计"""
+        trace = self.tracer.begin('/api/generate_pdf', 'req-1', method='POST')
+        with span('parse_form'):
+            pass
+        with span('render_pdf'):
+            with span('pdf_html'):
+                pass
+            with span('pdf_write', backend='weasyprint'):
+                pass
+            with span('pdf_write', backend='wkhtmltopdf'):
+                pass
+        self.assertEqual(current_request_id(), 'req-1')
+        self.tracer.end(trace, 200)
+        self.assertIsNone(current_trace())
+
+        tree = trace.to_dict()['spans']
+        self.assertEqual(tree['attrs'], {'method': 'POST', 'status': 200})
+        self.assertEqual([child['name'] for child in tree['children']], ['parse_form', 'render_pdf'])
+        self.assertEqual(tree['children'][1]['children'][1]['attrs'], {'backend': 'weasyprint'})
+        header = trace.server_timing()
+        self.assertTrue(header.startswith('total;dur='))
+        self.assertEqual([entry.split(';')[0] for entry in header.split(', ')],
+                         ['total', 'parse_form', 'render_pdf', 'pdf_html', 'pdf_write'])
+
+    def test_no_trace_outside_request(self):
+        """没有正在追踪的请求时span不记录，其他线程看不到本线程的请求"""
+        with span('generate_document_list') as current:
+            self.assertIsNone(current)
+        trace = self.tracer.begin('/api/generate', 'bad id\r\n')
+        self.assertRegex(trace.request_id, r'^[0-9a-f]{16}$')
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(current_request_id()))
+        thread.start()
+        thread.join()
+        self.assertEqual(seen, [None])
+
+        # 生成器中的区段挂到当前请求下
+        with open(os.path.join(os.path.dirname(__file__), 'fixtures', 'test_config.json'), 'r', encoding='utf-8') as f:
+            generator = DocumentGenerator(json.load(f), precompile=False)
+        generator.generate_document_list({
+            'applicationType': 'SINGLE', 'visaType': 'SINGLE', 'identityType': 'EMPLOYED',
+            'residenceConsulate': 'beijing', 'hukouConsulate': 'beijing', 'processType': 'NORMAL'})
+        self.tracer.end(trace)
+        self.assertIn('generate_document_list', trace.totals())
+
+    def test_slow_requests_and_attach(self):
+        """超过阈值的请求保留完整区段树；其他进程记录的区段接到当前区段下"""
+        self.tracer.configure(True, slow_ms=0.001, recent_size=2)
+        with collect('render_worker') as spans:
+            with span('pdf_html'):
+                pass
+        for index in range(3):
+            trace = self.tracer.begin('/api/generate_pdf', f'req-{index}')
+            with span('render_service'):
+                attach(spans)
+            self.tracer.end(trace, 200)
+
+        slow = self.tracer.slow_requests()
+        self.assertEqual([entry['request_id'] for entry in slow], ['req-2', 'req-1'])
+        service = slow[0]['spans']['children'][0]
+        self.assertEqual(service['children'][0]['name'], 'render_worker')
+        self.assertEqual(service['children'][0]['children'][0]['name'], 'pdf_html')
+        self.tracer.reset()
+        self.assertEqual(self.tracer.slow_requests(), [])
+
+    def test_request_id_filter(self):
+        """日志记录带上当前请求ID"""
+        record = logging.LogRecord('tests', logging.INFO, __file__, 0, 'x', (), None)
+        trace = self.tracer.begin('/api/generate', 'req-9')
+        RequestIdFilter().filter(record)
+        self.tracer.end(trace)
+        self.assertEqual(record.request_id, 'req-9')
+
+
+if __name__ == '__main__':
+    unittest.main()
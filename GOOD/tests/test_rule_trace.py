@@ -0,0 +1,77 @@
+"""
+测试规则追踪
+"""
+import unittest
+import json
+import os
+import sys
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from document_generator.main import DocumentGenerator
+from document_generator.rule_trace import rule_tracer, HISTOGRAM_BOUNDS_NS
+
+
+class TestRuleTrace(unittest.TestCase):
+    """测试RuleTracer"""
+
+    @classmethod
+    def setUpClass(cls):
+        config_path = os.path.join(os.path.dirname(__file__), '..', 'static', 'js', 'document_config.json')
+        with open(config_path, 'r', encoding='utf-8') as f:
+            cls.config = json.load(f)
+        cls.generator = DocumentGenerator(cls.config)
+        cls.form = {'residenceConsulate': 'beijing', 'hukouConsulate': 'shanghai', 'identityType': 'EMPLOYED',
+                    'processType': 'NORMAL', 'visaType': 'THREE', 'economicMaterial': 'deposit_three', 'hasFamily': True}
+
+    def setUp(self):
+        rule_tracer.reset()
+
+    def tearDown(self):
+        rule_tracer.configure(0)
+        rule_tracer.reset()
+
+    def test_disabled_by_default(self):
+        """未开启时不追踪"""
+        self.generator.generate_document_list(self.form)
+        self.assertEqual(rule_tracer.traced, 0)
+
+    def test_traced_result_and_branches(self):
+        """追踪的结果与逐项生成一致，每一行材料都归属到分支"""
+        rule_tracer.configure(1)
+        document_list = self.generator.generate_document_list(self.form)
+        self.assertEqual(list(document_list.items()), list(self.generator.build_document_list(self.form).items()))
+
+        snapshot = rule_tracer.snapshot()
+        self.assertEqual(snapshot['traced'], 1)
+        lines = snapshot['recent'][0]['lines']
+        self.assertEqual(len(lines), sum(len(items) for items in document_list.values()))
+        branches = {line['item']: line['branch'] for line in lines}
+        self.assertEqual(branches[document_list['基本信息'][0]], 'DocumentGenerator.basic_info')
+        self.assertTrue(branches[document_list['财力证明'][0]].startswith(
+            'FinancialMaterialsGenerator._generate_normal_materials:'))
+        self.assertEqual(branches["持签人家属需提供上述居住材料之一"], 'DocumentGenerator.residence')
+
+        functions = {stats['function']: stats for stats in snapshot['functions']}
+        financial = functions['FinancialMaterialsGenerator._generate_normal_materials']
+        self.assertEqual(financial['count'], 1)
+        self.assertEqual(len(financial['histogram']), len(HISTOGRAM_BOUNDS_NS) + 1)
+        self.assertEqual(set(snapshot['steps']), {'basic_info', 'basic_materials', 'identity', 'financial',
+                                                  'residence', 'family', 'other'})
+
+    def test_sampling_and_reset(self):
+        """按采样间隔追踪，清空后重新统计"""
+        rule_tracer.configure(3, recent_size=2)
+        for _ in range(9):
+            self.generator.generate_document_list(self.form)
+        snapshot = rule_tracer.snapshot()
+        self.assertEqual(snapshot['traced'], 3)
+        self.assertEqual(len(snapshot['recent']), 2)
+        self.assertTrue(all(branch['requests'] == 3 for branch in snapshot['branches']))
+        rule_tracer.reset()
+        self.assertEqual(rule_tracer.snapshot(recent=False)['traced'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()